@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Throughput of the encrypt action for 1 MB to 100 MB attachments
+
+Measures the raw chunked AES-GCM stream (file to file) and the full MIME
+path (base64 part in, encrypted base64 part out) for each size.
+"""
+
+import sys
+import os
+import argparse
+import tempfile
+import time
+import tracemalloc
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from src.encryption import Keyring, PartEncryptor, encrypt_stream, decrypt_stream
+
+MB = 1024 * 1024
+
+
+def bench_stream(size: int, chunk_size: int, workdir: str):
+    plain = os.path.join(workdir, "plain.bin")
+    sealed = os.path.join(workdir, "sealed.bin")
+    restored = os.path.join(workdir, "restored.bin")
+    with open(plain, "wb") as f:
+        for _ in range(size // MB):
+            f.write(os.urandom(MB))
+    key = os.urandom(32)
+
+    start = time.perf_counter()
+    with open(plain, "rb") as src, open(sealed, "wb") as dst:
+        encrypt_stream(src, dst, key, chunk_size)
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(sealed, "rb") as src, open(restored, "wb") as dst:
+        decrypt_stream(src, dst, key)
+    decrypt_time = time.perf_counter() - start
+    return encrypt_time, decrypt_time
+
+
+def bench_mime(size: int, encryptor: PartEncryptor):
+    msg = MIMEMultipart()
+    msg['To'] = "alice@example.com, bob@example.com"
+    msg.attach(MIMEText("<html><body>Report attached</body></html>", "html"))
+    msg.attach(MIMEApplication(os.urandom(size), "pdf"))
+    attachment = msg.get_payload()[1]
+
+    start = time.perf_counter()
+    encrypted = encryptor.encrypt_part(attachment, ["alice@example.com", "bob@example.com"])
+    elapsed = time.perf_counter() - start
+    del encrypted
+
+    # Separate run for memory: tracemalloc itself slows allocation down
+    tracemalloc.start()
+    encryptor.encrypt_parts(msg, [attachment])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default="1,10,100", help="comma-separated sizes in MB")
+    parser.add_argument('--chunk-kb', type=int, default=64)
+    parser.add_argument('--skip-mime', action='store_true', help="only benchmark the raw stream")
+    args = parser.parse_args()
+
+    sizes = [int(s) * MB for s in args.sizes.split(",")]
+    encryptor = PartEncryptor(Keyring.generate(), chunk_size=args.chunk_kb * 1024)
+
+    print(f"Chunked AES-GCM, {args.chunk_kb} KB chunks")
+    print(f"{'size':>8} {'encrypt MB/s':>13} {'decrypt MB/s':>13} {'MIME MB/s':>10} {'MIME peak MB':>13}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            encrypt_time, decrypt_time = bench_stream(size, args.chunk_kb * 1024, workdir)
+            row = f"{size // MB:>6}MB {size / MB / encrypt_time:>13.1f} {size / MB / decrypt_time:>13.1f}"
+            if not args.skip_mime:
+                mime_time, peak = bench_mime(size, encryptor)
+                row += f" {size / MB / mime_time:>10.1f} {peak / MB:>13.1f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
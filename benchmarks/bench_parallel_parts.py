@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Enforcement latency against the number of parts in one message
+
+Builds digest-style messages with N HTML parts and times enforce_policy
+with the parts handled sequentially and on part pools of several sizes.
+Verdicts must be identical for every worker count; the run aborts if not.
+"""
+
+import sys
+import os
+import argparse
+import statistics
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from src.enforcer import PolicyEnforcer
+from src.generator import PolicyGenerator
+
+
+def build_message(parts: int, part_kb: int) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = "digest@lists.example.com"
+    msg['To'] = "alice@example.com"
+    msg['Subject'] = f"Digest with {parts} messages"
+    for n in range(parts):
+        rows = []
+        while len("".join(rows)) < part_kb * 1024:
+            i = len(rows)
+            rows.append(
+                f'<tr><td><a href="https://news{n}.example.com/item/{i}">Item {i}</a></td>'
+                f'<td><img src="https://cdn{n}.example.com/thumb{i}.png" width="64" height="64"/></td></tr>'
+            )
+        if n % 5 == 0:
+            rows.append('<tr><td><img src="https://tracker.com/open.gif" width="1" height="1"/></td></tr>')
+        html = f"<html><body><h1>Message {n}</h1><table>{''.join(rows)}</table></body></html>"
+        msg.attach(MIMEText(html, "html"))
+    return msg
+
+
+def time_enforce(enforcer: PolicyEnforcer, msg, policy_xml: str, repeat: int):
+    results = None
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = enforcer.enforce_policy(msg, policy_xml)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--parts', default="1,4,16,64", help="comma-separated part counts")
+    parser.add_argument('--part-kb', type=int, default=64, help="HTML size of each part")
+    parser.add_argument('--workers', default="1,2,4,8", help="comma-separated pool sizes (1 = sequential)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    part_counts = [int(n) for n in args.parts.split(",")]
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    policy_xml = PolicyGenerator.strict_privacy_policy("bench@example.com").to_string()
+    enforcers = {workers: PolicyEnforcer(part_workers=workers) for workers in worker_counts}
+
+    print(f"{args.part_kb} KB HTML parts, median of {args.repeat} runs (ms)")
+    print(f"{'parts':>6}" + "".join(f" {f'{w} workers':>11}" for w in worker_counts) + f" {'speedup':>8}")
+    for parts in part_counts:
+        msg = build_message(parts, args.part_kb)
+        row = f"{parts:>6}"
+        timings = []
+        reference = None
+        for workers in worker_counts:
+            elapsed, results = time_enforce(enforcers[workers], msg, policy_xml, args.repeat)
+            if reference is None:
+                reference = results
+            elif results != reference:
+                sys.exit(f"Verdicts differ with {workers} workers on {parts} parts")
+            timings.append(elapsed)
+            row += f" {elapsed * 1000:>11.1f}"
+        row += f" {timings[0] / min(timings):>7.2f}x"
+        print(row)
+
+    for enforcer in enforcers.values():
+        enforcer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Enforcement throughput with and without the literal prefilter
+
+Runs a generated corpus (see loadgen.generate_corpus) through policies
+whose rules need string literals, with the prefilter on and off. Verdicts
+must be identical; the run aborts if not.
+"""
+
+import sys
+import os
+import argparse
+import copy
+import email
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.enforcer import PolicyEnforcer
+from src.loadgen import generate_corpus
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+RULES = [
+    (".//img[contains(@src, 'tracker.com')]", "strip"),
+    (".//raw-content[contains(., 'pixel.gif')]", "warn"),
+    (".//a[starts-with(@href, 'https://ads.example')]", "strip"),
+    (".//p[contains(., 'confidential')]", "block"),
+    (".//filename[contains(., 'invoice')]", "warn"),
+]
+
+
+def build_policy(rules: int) -> str:
+    policy = PrivacyPolicy(creator="bench@example.com")
+    for n in range(rules):
+        xpath, action = RULES[n % len(RULES)]
+        if n >= len(RULES):
+            xpath = xpath.replace("')]", f"{n}')]")
+        policy.add_rule(Rule(f"rule-{n}", Condition(xpath=xpath), Action(action, f"rule {n}")))
+    return policy.to_string()
+
+
+def run(enforcer: PolicyEnforcer, corpus, policy_xml: str):
+    messages = [copy.deepcopy(msg) for msg in corpus]
+    enforcer.enforce_policy(copy.deepcopy(corpus[0]), policy_xml)  # compile and warm up
+    start = time.perf_counter()
+    results = [enforcer.enforce_policy(msg, policy_xml) for msg in messages]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rules', default="5,20,80", help="comma-separated rule counts")
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--kb', type=int, default=16, help="HTML size of each message")
+    args = parser.parse_args()
+
+    corpus = [email.message_from_bytes(raw) for raw in generate_corpus(args.messages, html_kb=args.kb)]
+
+    print(f"{args.messages} messages, {args.kb} KB HTML (ms per message)")
+    print(f"{'rules':>6} {'off':>8} {'on':>8} {'speedup':>8} {'no XML':>7}")
+    for rules in (int(n) for n in args.rules.split(",")):
+        policy_xml = build_policy(rules)
+        off_time, off_results = run(PolicyEnforcer(prefilter=False), corpus, policy_xml)
+        enforcer = PolicyEnforcer()
+        on_time, on_results = run(enforcer, corpus, policy_xml)
+        for off, on in zip(off_results, on_results):
+            # Rules ruled out by the prefilter are not reported as skipped
+            off.pop('skipped_rules', None)
+            on.pop('skipped_rules', None)
+        if on_results != off_results:
+            sys.exit(f"Verdicts differ with the prefilter with {rules} rules")
+        stats = enforcer.prefilter_stats()
+        print(f"{rules:>6} {off_time / len(corpus) * 1000:>8.2f} {on_time / len(corpus) * 1000:>8.2f} "
+              f"{off_time / on_time:>7.2f}x {stats['xml_skipped']:>7}")
+
+
+if __name__ == "__main__":
+    main()
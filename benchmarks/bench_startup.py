@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Start-up latency of the command-line entry point
+
+Runs `python -m src <command>` in fresh interpreters and reports the
+median wall time per command, next to a bare interpreter start. With
+--importtime it also lists the slowest imports of one command, from
+python -X importtime.
+"""
+
+import sys
+import os
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+
+from src.generator import PolicyGenerator
+from src.mime_handler import MIMEPrivacyHandler
+
+
+def make_fixtures(workdir: str):
+    policy = PolicyGenerator.strict_privacy_policy("bench@example.com").to_string()
+    policy_path = os.path.join(workdir, "policy.xml")
+    with open(policy_path, "w", encoding="utf-8") as f:
+        f.write(policy)
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "bench@example.com", "alice@example.com", "Startup",
+        '<html><body><img src="https://tracker.com/p.gif" width="1" height="1"/>Hello</body></html>',
+        policy
+    )
+    message_path = os.path.join(workdir, "message.eml")
+    with open(message_path, "wb") as f:
+        f.write(msg.as_bytes())
+    return policy_path, message_path
+
+
+def run(cmd, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def slowest_imports(args, top: int):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m", "src"] + args,
+                          cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = (field.strip() for field in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--importtime', metavar="COMMAND", help="show the slowest imports of one command")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        policy_path, message_path = make_fixtures(workdir)
+        commands = {
+            "python -c pass": [sys.executable, "-c", "pass"],
+            "--help": [sys.executable, "-m", "src", "--help"],
+            "generate": [sys.executable, "-m", "src", "generate", "strict", "--creator", "a@example.com"],
+            "validate": [sys.executable, "-m", "src", "validate", policy_path],
+            "extract": [sys.executable, "-m", "src", "extract", message_path],
+            "scan": [sys.executable, "-m", "src", "scan", message_path],
+            "enforce": [sys.executable, "-m", "src", "enforce", message_path],
+        }
+
+        print(f"Median wall time of {args.repeat} fresh runs")
+        print(f"{'command':>16} {'ms':>8}")
+        for name, cmd in commands.items():
+            print(f"{name:>16} {run(cmd, args.repeat) * 1000:>8.1f}")
+
+        if args.importtime:
+            cmd_args = commands[args.importtime][3:]
+            print(f"\nSlowest imports for {args.importtime} (cumulative / self, ms)")
+            for cumulative, self_time, name in slowest_imports(cmd_args, 15):
+                print(f"{cumulative / 1000:>8.1f} {self_time / 1000:>8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Enforcement latency against the number of rules, XPath loop vs one XSLT pass
+
+Builds policies with N element rules (//img[...], .//a[...], ...) and
+times enforce_policy on a large HTML message with each backend. Verdicts
+must be identical for both backends; the run aborts if not.
+"""
+
+import sys
+import os
+import argparse
+import statistics
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from src.enforcer import PolicyEnforcer
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+TAGS = ["img", "a", "p", "div", "span", "script", "iframe", "form", "table", "td", "link", "style"]
+
+
+def build_message(kb: int) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = "news@example.com"
+    msg['To'] = "alice@example.com"
+    msg['Subject'] = "Weekly newsletter"
+    rows = []
+    while len("".join(rows)) < kb * 1024:
+        i = len(rows)
+        rows.append(
+            f'<div class="row{i % 7}"><p>Story {i} <span>lorem ipsum</span></p>'
+            f'<a href="https://news.example.com/item/{i}">read</a>'
+            f'<img src="https://cdn.example.com/{i}.png" width="{i % 3}" height="64"/></div>'
+        )
+    rows.append('<img src="https://tracker.com/open.gif" width="1" height="1"/>')
+    html = f"<html><body><table><tr><td>{''.join(rows)}</td></tr></table></body></html>"
+    msg.attach(MIMEText(html, "html"))
+    return msg
+
+
+def build_policy(rules: int) -> str:
+    policy = PrivacyPolicy(creator="bench@example.com")
+    for n in range(rules):
+        tag = TAGS[n % len(TAGS)]
+        xpath = (f".//{tag}[contains(@src, 'tracker{n}.com') or contains(@href, 'ads{n}.example') "
+                 f"or @class = 'banner{n}']")
+        if n == 0:
+            xpath = ".//img[@width = '1' and @height = '1']"
+        action = "strip" if n % 2 == 0 else "warn"
+        policy.add_rule(Rule(f"rule-{n}", Condition(xpath=xpath), Action(action, f"rule {n}")))
+    return policy.to_string()
+
+
+def time_enforce(enforcer: PolicyEnforcer, msg, policy_xml: str, repeat: int):
+    results = enforcer.enforce_policy(msg, policy_xml)  # compile and warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = enforcer.enforce_policy(msg, policy_xml)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rules', default="1,5,10,20,40,80", help="comma-separated rule counts")
+    parser.add_argument('--kb', type=int, default=512, help="HTML size of the message")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    msg = build_message(args.kb)
+    enforcers = {backend: PolicyEnforcer(backend=backend) for backend in ("xpath", "xslt")}
+
+    print(f"{args.kb} KB HTML part, median of {args.repeat} runs (ms)")
+    print(f"{'rules':>6} {'xpath':>9} {'xslt':>9} {'speedup':>8}")
+    for rules in (int(n) for n in args.rules.split(",")):
+        policy_xml = build_policy(rules)
+        timings = {}
+        reference = None
+        for backend, enforcer in enforcers.items():
+            elapsed, results = time_enforce(enforcer, msg, policy_xml, args.repeat)
+            if reference is None:
+                reference = results
+            elif results != reference:
+                sys.exit(f"Verdicts differ between backends with {rules} rules")
+            timings[backend] = elapsed
+        print(f"{rules:>6} {timings['xpath'] * 1000:>9.1f} {timings['xslt'] * 1000:>9.1f} "
+              f"{timings['xpath'] / timings['xslt']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
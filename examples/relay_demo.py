@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+In-transit enforcement demo: client -> privacy relay -> sink
+"""
+
+import sys
+import os
+import smtplib
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.policy import PrivacyPolicy, Rule, Condition, Action
+from src.mime_handler import MIMEPrivacyHandler
+from src.relay import SMTPRelay, SMTPSink
+
+
+def build_policy() -> str:
+    policy = PrivacyPolicy(creator="relay-demo@company.com")
+    policy.add_rule(Rule(
+        rule_id="strip-internal-routing",
+        condition=Condition(xpath="//header[@name='X-Internal-Route']"),
+        action=Action("strip", "Internal routing header removed in transit"),
+        scope="in-transit"
+    ))
+    policy.add_rule(Rule(
+        rule_id="warn-external-cc",
+        condition=Condition(xpath="//header[@name='Cc'][not(contains(., '@company.com'))]"),
+        action=Action("warn", "External recipient on CC"),
+        scope="in-transit"
+    ))
+    policy.add_rule(Rule(
+        rule_id="block-confidential-subject",
+        condition=Condition(xpath="//header[@name='Subject'][contains(., 'CONFIDENTIAL')]"),
+        action=Action("block", "Confidential mail may not leave the relay"),
+        scope="in-transit"
+    ))
+    policy.add_rule(Rule(
+        rule_id="no-tracking-pixels",
+        condition=Condition(xpath="//url[@tracker='true']"),
+        action=Action("strip", "Tracking pixel"),
+        scope="in-transit"
+    ))
+    return policy.to_string()
+
+
+def send(port: int, subject: str, policy_xml: str) -> str:
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "alice@company.com", "bob@partner.org", subject,
+        "<html><body><p>Quarterly numbers attached.</p></body></html>", policy_xml
+    )
+    msg['Cc'] = "carol@elsewhere.net"
+    msg['X-Internal-Route'] = "mx1.corp.local -> gw2.corp.local"
+    with smtplib.SMTP("127.0.0.1", port) as smtp:
+        try:
+            smtp.send_message(msg)
+            return "accepted"
+        except smtplib.SMTPDataError as e:
+            return f"refused ({e.smtp_code} {e.smtp_error.decode()})"
+
+
+def main():
+    sink = SMTPSink()
+    sink_port = sink.start_background()
+    relay = SMTPRelay(next_hop=("127.0.0.1", sink_port), port=0)
+    relay_port = relay.start_background()
+    print(f"Sink on port {sink_port}, relay on port {relay_port}")
+
+    policy_xml = build_policy()
+    print("Sending routine mail:      ", send(relay_port, "Q3 numbers", policy_xml))
+    print("Sending confidential mail: ", send(relay_port, "CONFIDENTIAL merger plan", policy_xml))
+
+    print(f"\nRelay stats: {relay.stats}")
+    for stored in sink.messages:
+        print("\nForwarded headers at the next hop:")
+        for line in stored['data'].split(b"\r\n\r\n", 1)[0].split(b"\r\n"):
+            if not line.startswith((b"X-Privacy-Policy:", b" ", b"\t")):
+                print(f"  {line.decode()}")
+
+    relay.stop_background()
+    sink.stop_background()
+
+
+if __name__ == "__main__":
+    main()
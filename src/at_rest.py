@@ -0,0 +1,462 @@
+"""
+At-rest enforcement store with incremental re-enforcement on policy updates
+"""
+
+import email
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from lxml import etree as ET
+
+from .enforcer import PolicyEnforcer
+from .expiry import ExpiryScheduler, PolicyExpired, parse_expires, shared_scheduler
+from .mime_handler import MIMEPrivacyHandler
+
+PHASE = 'at-rest'
+
+
+def _rule_key(rule: Dict[str, Any]) -> str:
+    # Rules without an id can only be tracked by position
+    return rule['id'] or f"#{rule['index']}"
+
+
+@dataclass
+class PolicyDiff:
+    """Rule-level difference between two versions of a policy"""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # Condition or phase changed: matches must be recomputed
+    modified: List[str] = field(default_factory=list)
+    # Only the action or its message changed: stored matches are relabelled
+    relabelled: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    @property
+    def reevaluate(self) -> List[str]:
+        return self.added + self.modified
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.modified or self.relabelled)
+
+
+def diff_rules(old_rules: List[Dict[str, Any]], new_rules: List[Dict[str, Any]]) -> PolicyDiff:
+    """Compare two rule lists from PolicyEnforcer.policy_rules() by rule id"""
+    old = {_rule_key(r): r for r in old_rules}
+    new = {_rule_key(r): r for r in new_rules}
+    diff = PolicyDiff()
+    for key, rule in new.items():
+        previous = old.get(key)
+        if previous is None:
+            diff.added.append(key)
+        elif previous['condition_hash'] != rule['condition_hash']:
+            diff.modified.append(key)
+        elif (previous['action'], previous['message']) != (rule['action'], rule['message']):
+            diff.relabelled.append(key)
+        else:
+            diff.unchanged.append(key)
+    diff.removed = [key for key in old if key not in new]
+    return diff
+
+
+class AtRestStore:
+    """
+    SQLite-indexed message store holding at-rest verdicts per message
+
+    Every message is bound to a policy key and to the digest of the policy
+    version it was evaluated with. The key is given by the caller or is the
+    policy's id attribute; a message whose policy has neither is keyed by
+    the digest, so no later version replaces it.
+    Only matching verdicts are stored, so the verdict table grows with the
+    number of hits rather than messages x rules. When a new version of a
+    policy is registered with update_policy(), only the added and modified
+    rules are evaluated, and only on messages bound to that policy; all
+    other verdicts are kept as they are.
+
+    When a policy version's Metadata/Expires passes, the expiry scheduler
+    calls back and the messages bound to it are unbound in batches: their
+    verdicts are dropped, as an expired policy imposes nothing. A later
+    version registered with update_policy() evaluates them afresh.
+    """
+
+    def __init__(self, db_path: str, enforcer: Optional[PolicyEnforcer] = None,
+                 expiry: Optional[ExpiryScheduler] = None, batch_size: int = 500):
+        self.enforcer = enforcer or PolicyEnforcer()
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+        self._expiry = expiry
+        self._expiry_token = object()
+        # Digests whose messages are being or have been unbound
+        self._lapsed = set()
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS policies (
+                digest TEXT PRIMARY KEY,
+                policy_key TEXT NOT NULL,
+                xml TEXT NOT NULL,
+                registered_at REAL NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS policy_heads (
+                policy_key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                policy_key TEXT,
+                policy_digest TEXT,
+                raw BLOB NOT NULL,
+                stored_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_policy
+                ON messages (policy_key, policy_digest, message_id);
+            CREATE TABLE IF NOT EXISTS verdicts (
+                message_id TEXT NOT NULL,
+                rule_id TEXT NOT NULL,
+                action TEXT,
+                message TEXT,
+                matches TEXT NOT NULL,
+                PRIMARY KEY (message_id, rule_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_verdicts_rule ON verdicts (rule_id, action);
+            CREATE INDEX IF NOT EXISTS idx_verdicts_action ON verdicts (action);
+        """)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(policies)")]
+        if 'expires_at' not in columns:
+            self._db.execute("ALTER TABLE policies ADD COLUMN expires_at REAL")
+        self._db.commit()
+        # Expiries of policies that still have messages; past ones fire at once
+        for digest, expires_at in self._db.execute(
+            "SELECT digest, expires_at FROM policies WHERE expires_at IS NOT NULL"
+            " AND digest IN (SELECT policy_digest FROM messages)"
+        ).fetchall():
+            self._schedule_lapse(digest, expires_at)
+
+    # ---- policies ----
+
+    @staticmethod
+    def policy_key_for(policy_xml: str) -> Optional[str]:
+        """
+        Policy identity across versions: the PrivacyPolicy id attribute
+
+        None when the policy has no id. Metadata/Creator is not used: any
+        sender can name any creator, and one creator may publish several
+        unrelated policies.
+        """
+        root = ET.fromstring(policy_xml.encode('utf-8'))
+        return (root.get('id') or '').strip() or None
+
+    def _register(self, policy_xml: str, policy_key: str) -> str:
+        digest, _ = self.enforcer.policy_rules(policy_xml, PHASE)
+        expires_at = parse_expires(ET.fromstring(policy_xml.encode('utf-8')).findtext(
+            'pp:Metadata/pp:Expires', namespaces={"pp": "urn:email:privacy:1.0"}))
+        inserted = self._db.execute(
+            "INSERT OR IGNORE INTO policies VALUES (?, ?, ?, ?, ?)",
+            (digest, policy_key, policy_xml, time.time(), expires_at)
+        ).rowcount
+        self._db.execute(
+            "INSERT OR IGNORE INTO policy_heads VALUES (?, ?)", (policy_key, digest)
+        )
+        if inserted and expires_at is not None:
+            self._schedule_lapse(digest, expires_at)
+        return digest
+
+    def _scheduler(self) -> ExpiryScheduler:
+        return self._expiry if self._expiry is not None else shared_scheduler()
+
+    def _schedule_lapse(self, digest: str, expires_at: float):
+        self._scheduler().schedule((self._expiry_token, digest), expires_at, self._policy_lapsed)
+
+    def _policy_lapsed(self, key):
+        self.lapse_policy(key[1])
+
+    def _policy_xml(self, digest: str) -> str:
+        row = self._db.execute("SELECT xml FROM policies WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown policy digest {digest}")
+        return row[0]
+
+    def current_policy(self, policy_key: str) -> Optional[str]:
+        """Digest of the current version of a policy, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM policy_heads WHERE policy_key = ?", (policy_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    # ---- messages ----
+
+    def store(self, message_id: str, raw_email: bytes, policy_xml: Optional[str] = None,
+              policy_key: Optional[str] = None) -> Dict[str, List[str]]:
+        """
+        Store a message and evaluate the at-rest rules of its policy
+
+        The policy is taken from the message itself when not given. Returns
+        rule id -> described matches for the rules that matched.
+        """
+        email_msg = email.message_from_bytes(raw_email)
+        if policy_xml is None:
+            policy_xml = (MIMEPrivacyHandler.extract_header_policy(email_msg)
+                          or MIMEPrivacyHandler.extract_policy(email_msg, verbose=False))
+
+        with self._lock:
+            try:
+                return self._store(message_id, raw_email, email_msg, policy_xml, policy_key)
+            except Exception:
+                self._db.rollback()
+                raise
+
+    def _store(self, message_id: str, raw_email: bytes, email_msg: email.message.Message,
+               policy_xml: Optional[str], policy_key: Optional[str]) -> Dict[str, List[str]]:
+        self._db.execute("DELETE FROM verdicts WHERE message_id = ?", (message_id,))
+        digest, verdicts = None, {}
+        if policy_xml:
+            try:
+                policy_key = policy_key or self.policy_key_for(policy_xml)
+                if policy_key is None:
+                    policy_key, _ = self.enforcer.policy_rules(policy_xml, PHASE)
+                digest = self._register(policy_xml, policy_key)
+                _, rules = self.enforcer.policy_rules(policy_xml, PHASE)
+            except PolicyExpired:
+                digest = None
+            except (ET.ParseError, ValueError) as e:
+                # Stored unbound, like a message without a policy
+                self.logger.warning(f"Policy of message {message_id} not applied: {e}")
+                policy_key = digest = None
+            if digest is None or digest in self._lapsed:
+                # Kept unbound, as lapse_policy() leaves the messages of an expired policy
+                digest = None
+            else:
+                verdicts = self._evaluate(message_id, email_msg, rules)
+        else:
+            policy_key = None
+        self._db.execute(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+            (message_id, policy_key, digest, raw_email, time.time())
+        )
+        self._db.commit()
+        return verdicts
+
+    def _evaluate(self, message_id: str, email_msg: email.message.Message,
+                  rules: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        hits = self.enforcer.match_rules(email_msg, rules)
+        verdicts = {}
+        rows = []
+        for rule in rules:
+            matches = hits.get(rule['index'])
+            if matches:
+                key = _rule_key(rule)
+                verdicts[key] = matches
+                rows.append((message_id, key, rule['action'], rule['message'],
+                             json.dumps(matches, separators=(",", ":"))))
+        self._db.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)", rows)
+        return verdicts
+
+    def delete(self, message_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM verdicts WHERE message_id = ?", (message_id,))
+            self._db.execute("DELETE FROM messages WHERE message_id = ?", (message_id,))
+            self._db.commit()
+
+    def get_message(self, message_id: str) -> Optional[email.message.Message]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT raw FROM messages WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        return email.message_from_bytes(row[0]) if row else None
+
+    def verdicts(self, message_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT rule_id, action, message, matches FROM verdicts WHERE message_id = ?"
+                " ORDER BY rule_id", (message_id,)
+            ).fetchall()
+        return [{'rule_id': r[0], 'action': r[1], 'message': r[2], 'matches': json.loads(r[3])}
+                for r in rows]
+
+    def find(self, rule_id: Optional[str] = None, action: Optional[str] = None,
+             limit: int = 100, after: Optional[str] = None) -> List[str]:
+        """Message ids with a matching verdict, paged by message id"""
+        clauses, params = [], []
+        if rule_id is not None:
+            clauses.append("rule_id = ?")
+            params.append(rule_id)
+        if action is not None:
+            clauses.append("action = ?")
+            params.append(action)
+        if after is not None:
+            clauses.append("message_id > ?")
+            params.append(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT DISTINCT message_id FROM verdicts {where} ORDER BY message_id LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    # ---- policy updates ----
+
+    def update_policy(self, policy_xml: str, policy_key: Optional[str] = None,
+                      batch_size: int = 500) -> Dict[str, Any]:
+        """
+        Make policy_xml the current version of its policy and re-enforce
+
+        Messages bound to any older version of the same policy are migrated
+        in batches of batch_size, one transaction per batch, so an
+        interrupted update resumes where it stopped when called again.
+        Messages unbound because their policy expired are evaluated with
+        every rule of the new version.
+
+        Returns:
+            {'digest', 'diffs': {old digest: PolicyDiff}, 'messages', 'evaluations'}
+
+        Raises:
+            ValueError: no policy_key given and the policy has no id
+        """
+        policy_key = policy_key or self.policy_key_for(policy_xml)
+        if policy_key is None:
+            raise ValueError("update_policy() needs a policy_key or a policy with an id attribute")
+        new_digest, new_rules = self.enforcer.policy_rules(policy_xml, PHASE)
+        new_by_key = {_rule_key(r): r for r in new_rules}
+        report = {'digest': new_digest, 'diffs': {}, 'messages': 0, 'evaluations': 0}
+
+        with self._lock:
+            self._register(policy_xml, policy_key)
+            self._db.execute(
+                "UPDATE policy_heads SET digest = ? WHERE policy_key = ?", (new_digest, policy_key)
+            )
+            self._db.commit()
+            old_digests = [r[0] for r in self._db.execute(
+                "SELECT DISTINCT policy_digest FROM messages WHERE policy_key = ?"
+                " AND (policy_digest IS NULL OR policy_digest != ?)", (policy_key, new_digest)
+            )]
+
+        # Unbound messages (None) last, after any expired version is unbound
+        pending = sorted(old_digests, key=lambda digest: digest is None)
+        while pending:
+            old_digest = pending.pop(0)
+            old_rules = []
+            if old_digest is not None:
+                try:
+                    with self._lock:
+                        _, old_rules = self.enforcer.policy_rules(self._policy_xml(old_digest), PHASE)
+                except PolicyExpired:
+                    # Expired before its lapse ran: unbind now, the unbound
+                    # messages are evaluated below
+                    self.lapse_policy(old_digest)
+                    if None not in pending:
+                        pending.append(None)
+                    continue
+            diff = diff_rules(old_rules, new_rules)
+            report['diffs'][old_digest] = diff
+            reevaluate = [new_by_key[key] for key in diff.reevaluate]
+            relabel = [new_by_key[key] for key in diff.relabelled]
+            drop = diff.removed + diff.modified
+
+            while True:
+                with self._lock:
+                    batch = self._db.execute(
+                        "SELECT message_id, raw FROM messages"
+                        " WHERE policy_key = ? AND policy_digest IS ? LIMIT ?",
+                        (policy_key, old_digest, batch_size)
+                    ).fetchall()
+                    if not batch:
+                        break
+                    self._migrate_batch(batch, drop, relabel, reevaluate, new_digest)
+                    report['messages'] += len(batch)
+                    report['evaluations'] += len(batch) * len(reevaluate)
+        return report
+
+    def _migrate_batch(self, batch: List[Tuple[str, bytes]], drop: List[str],
+                       relabel: List[Dict[str, Any]], reevaluate: List[Dict[str, Any]],
+                       new_digest: str):
+        ids = [message_id for message_id, _ in batch]
+        try:
+            for rule_id in drop:
+                self._db.executemany(
+                    "DELETE FROM verdicts WHERE message_id = ? AND rule_id = ?",
+                    [(message_id, rule_id) for message_id in ids]
+                )
+            for rule in relabel:
+                self._db.executemany(
+                    "UPDATE verdicts SET action = ?, message = ? WHERE message_id = ? AND rule_id = ?",
+                    [(rule['action'], rule['message'], message_id, _rule_key(rule)) for message_id in ids]
+                )
+            if reevaluate:
+                for message_id, raw in batch:
+                    self._evaluate(message_id, email.message_from_bytes(raw), reevaluate)
+            self._db.executemany(
+                "UPDATE messages SET policy_digest = ? WHERE message_id = ?",
+                [(new_digest, message_id) for message_id in ids]
+            )
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+
+    def lapse_policy(self, digest: str, batch_size: Optional[int] = None) -> int:
+        """
+        Unbind the messages of an expired policy version, in batches
+
+        Their verdicts are dropped and their policy digest cleared, one
+        transaction per batch. Returns the number of messages unbound.
+        """
+        batch_size = batch_size or self.batch_size
+        unbound = 0
+        with self._lock:
+            if self._db is None:
+                return 0
+            self._lapsed.add(digest)
+            row = self._db.execute("SELECT policy_key FROM policies WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return 0
+        while True:
+            with self._lock:
+                if self._db is None:
+                    break
+                ids = [r[0] for r in self._db.execute(
+                    "SELECT message_id FROM messages WHERE policy_key = ? AND policy_digest = ? LIMIT ?",
+                    (row[0], digest, batch_size)
+                )]
+                if not ids:
+                    break
+                try:
+                    self._db.executemany("DELETE FROM verdicts WHERE message_id = ?",
+                                         [(message_id,) for message_id in ids])
+                    self._db.executemany("UPDATE messages SET policy_digest = NULL WHERE message_id = ?",
+                                         [(message_id,) for message_id in ids])
+                    self._db.commit()
+                except Exception:
+                    self._db.rollback()
+                    raise
+                unbound += len(ids)
+        if unbound:
+            self.logger.info(f"Policy {digest[:12]} expired: {unbound} stored messages unbound")
+        return unbound
+
+    # ---- housekeeping ----
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'messages': self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+                'verdicts': self._db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0],
+                'policies': self._db.execute("SELECT COUNT(*) FROM policies").fetchone()[0],
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                for (digest,) in self._db.execute(
+                        "SELECT digest FROM policies WHERE expires_at IS NOT NULL"):
+                    self._scheduler().cancel((self._expiry_token, digest))
+                self._db.close()
+                self._db = None
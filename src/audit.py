@@ -0,0 +1,397 @@
+"""
+Batched, indexed audit log of enforcement results
+"""
+
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+AUDIT_FIELDS = ('id', 'ts', 'message_id', 'sender', 'subject', 'rule_id', 'action', 'detail')
+
+
+def _expand(item) -> List[Tuple]:
+    """Turn one queued enforcement into one row per action taken"""
+    ts, message_id, sender, subject, results = item
+    if not results or not results.get('actions_taken'):
+        action = 'none' if results is not None else 'no-policy'
+        return [(ts, message_id, sender, subject, None, action, None)]
+
+    details = {}
+    for key in ('warnings', 'blocks'):
+        for entry in results.get(key, []):
+            if isinstance(entry, dict):
+                details.setdefault(entry.get('rule'), entry.get('message'))
+    rows = []
+    for taken in results['actions_taken']:
+        action, _, rule_id = taken.partition(':')
+        rows.append((ts, message_id, sender, subject, rule_id, action, details.get(rule_id)))
+    return rows
+
+
+class SQLiteAuditBackend:
+    """Stores audit rows in a WAL-mode SQLite database"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+
+    def open(self):
+        # Created on the flusher thread, which owns all writes
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS audit_log (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                message_id TEXT,
+                sender TEXT,
+                subject TEXT,
+                rule_id TEXT,
+                action TEXT NOT NULL,
+                detail TEXT
+            );
+            CREATE INDEX IF NOT EXISTS audit_sender ON audit_log (sender, id);
+            CREATE INDEX IF NOT EXISTS audit_rule ON audit_log (rule_id, id);
+            CREATE INDEX IF NOT EXISTS audit_action ON audit_log (action, id);
+            CREATE INDEX IF NOT EXISTS audit_ts ON audit_log (ts);
+        """)
+        self._conn.commit()
+
+    def write_batch(self, rows: List[Tuple]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO audit_log (ts, message_id, sender, subject, rule_id, action, detail)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def query(self, filters: Dict[str, Any], since: Optional[float], until: Optional[float],
+              limit: int, cursor: Optional[int]) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        for column, value in filters.items():
+            clauses.append(f"{column} = ?")
+            params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(limit)
+
+        # Readers get their own connection; WAL lets them run beside the flusher
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(AUDIT_FIELDS)} FROM audit_log {where} ORDER BY id DESC LIMIT ?",
+                params
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(AUDIT_FIELDS, row)) for row in rows]
+
+
+class JSONLAuditBackend:
+    """
+    Stores audit rows in rotating JSONL segments
+
+    Each closed segment gets a small sidecar summary (id and time range,
+    senders, rules and actions it contains) so queries can skip segments
+    without reading them.
+    """
+
+    SUMMARY_VALUE_LIMIT = 10000
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._file = None
+        self._segment = 0
+        self._next_id = 1
+        self._summary = None
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"audit-{number:06d}.jsonl")
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "audit-*.jsonl")))
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        if segments:
+            last = segments[-1]
+            self._segment = int(os.path.basename(last)[6:12])
+            # The last segment becomes active again, so its summary goes stale
+            if os.path.exists(last + ".idx"):
+                os.remove(last + ".idx")
+            self._summary = self._new_summary()
+            with open(last, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._summarize(json.loads(line))
+            self._next_id = (self._summary['max_id'] or 0) + 1
+            if self._next_id == 1 and len(segments) > 1:
+                previous = self._read_summary(segments[-2])
+                self._next_id = (previous or {}).get('max_id', 0) + 1
+        self._open_segment(new=not segments)
+
+    def _open_segment(self, new: bool):
+        if new:
+            self._segment += 1
+            self._summary = self._new_summary()
+        self._file = open(self._segment_path(self._segment), 'a', encoding='utf-8')
+
+    @staticmethod
+    def _new_summary() -> Dict[str, Any]:
+        return {'min_id': None, 'max_id': None, 'min_ts': None, 'max_ts': None,
+                'sender': set(), 'rule_id': set(), 'action': set()}
+
+    def _summarize(self, record: Dict[str, Any]):
+        summary = self._summary
+        if summary['min_id'] is None:
+            summary['min_id'], summary['min_ts'] = record['id'], record['ts']
+        summary['max_id'], summary['max_ts'] = record['id'], record['ts']
+        for key in ('sender', 'rule_id', 'action'):
+            values = summary[key]
+            if values is not None:
+                values.add(record[key])
+                if len(values) > self.SUMMARY_VALUE_LIMIT:
+                    summary[key] = None  # too many to be a useful filter
+
+    @staticmethod
+    def _read_summary(segment_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(segment_path + ".idx", 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for key in ('sender', 'rule_id', 'action'):
+            if summary.get(key) is not None:
+                summary[key] = set(summary[key])
+        return summary
+
+    def _write_summary(self):
+        summary = {
+            key: (sorted(v, key=str) if isinstance(v, set) else v)
+            for key, v in self._summary.items()
+        }
+        with open(self._segment_path(self._segment) + ".idx", 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+
+    def write_batch(self, rows: List[Tuple]):
+        lines = []
+        for row in rows:
+            record = dict(zip(AUDIT_FIELDS, (self._next_id,) + tuple(row)))
+            self._next_id += 1
+            self._summarize(record)
+            lines.append(json.dumps(record, separators=(',', ':')))
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        if self._file.tell() >= self.segment_bytes:
+            self._file.close()
+            self._write_summary()
+            self._open_segment(new=True)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._write_summary()
+            self._file = None
+
+    def query(self, filters: Dict[str, Any], since: Optional[float], until: Optional[float],
+              limit: int, cursor: Optional[int]) -> List[Dict[str, Any]]:
+        records = []
+        for segment in reversed(self._segments()):
+            summary = self._read_summary(segment)
+            if summary is not None and not self._may_contain(summary, filters, since, until, cursor):
+                continue
+            matched = []
+            with open(segment, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if cursor is not None and record['id'] >= cursor:
+                        continue
+                    if since is not None and record['ts'] < since:
+                        continue
+                    if until is not None and record['ts'] >= until:
+                        continue
+                    if all(record.get(k) == v for k, v in filters.items()):
+                        matched.append(record)
+            records.extend(reversed(matched))
+            if len(records) >= limit:
+                break
+        return records[:limit]
+
+    @staticmethod
+    def _may_contain(summary, filters, since, until, cursor) -> bool:
+        if summary.get('min_id') is None:
+            return False
+        if cursor is not None and summary['min_id'] >= cursor:
+            return False
+        if since is not None and summary['max_ts'] < since:
+            return False
+        if until is not None and summary['min_ts'] >= until:
+            return False
+        for key, value in filters.items():
+            values = summary.get(key)
+            if values is not None and value not in values:
+                return False
+        return True
+
+
+class AuditLog:
+    """
+    Non-blocking audit log writer
+
+    record() only enqueues; a background thread expands queued results into
+    rows and writes them in batches. If the queue is full the record is
+    dropped and counted rather than stalling enforcement.
+    """
+
+    def __init__(self, path: str, backend: str = "sqlite", batch_size: int = 1000,
+                 flush_interval: float = 0.5, max_queue: int = 100000, **backend_options):
+        self.logger = logging.getLogger(__name__)
+        if backend == "sqlite":
+            self.backend = SQLiteAuditBackend(path)
+        elif backend == "jsonl":
+            self.backend = JSONLAuditBackend(path, **backend_options)
+        else:
+            raise ValueError(f"Unknown audit backend: {backend}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        # Counters are updated by callers of record() and by the flusher
+        self._stats_lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        # The backend is opened on the flusher thread, which owns all writes;
+        # an error opening it is raised here
+        self._ready = threading.Event()
+        self._open_error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._open_error is not None:
+            self._thread.join()
+            raise self._open_error
+
+    def record(self, email_msg, results: Optional[Dict[str, Any]]):
+        """Queue an enforcement result; results=None means no policy was found"""
+        self.record_fields(
+            email_msg.get('Message-ID'), email_msg.get('From'),
+            email_msg.get('Subject'), results
+        )
+
+    def record_fields(self, message_id: Optional[str], sender: Optional[str],
+                      subject: Optional[str], results: Optional[Dict[str, Any]]):
+        try:
+            self._queue.put_nowait((time.time(), message_id, sender, subject, results))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return
+        with self._stats_lock:
+            self.recorded += 1
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been written"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def query(self, sender: Optional[str] = None, rule_id: Optional[str] = None,
+              action: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, limit: int = 100,
+              cursor: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Return newest-first records matching all given filters
+
+        Pass the returned next_cursor back in to fetch the following page.
+        """
+        filters = {k: v for k, v in (('sender', sender), ('rule_id', rule_id), ('action', action))
+                   if v is not None}
+        records = self.backend.query(filters, since, until, limit, cursor)
+        next_cursor = records[-1]['id'] if len(records) == limit else None
+        return {'records': records, 'next_cursor': next_cursor}
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {
+                'recorded': self.recorded,
+                'dropped': self.dropped,
+                'written': self.written,
+                'batches': self.batches,
+                'queued': self._queue.qsize(),
+            }
+
+    def _run(self):
+        try:
+            self.backend.open()
+        except BaseException as e:
+            self._open_error = e
+            return
+        finally:
+            self._ready.set()
+        stop = False
+        while not stop:
+            rows: List[Tuple] = []
+            waiters: List[threading.Event] = []
+            deadline = None
+            while len(rows) < self.batch_size:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                rows.extend(_expand(item))
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if rows:
+                try:
+                    self.backend.write_batch(rows)
+                    with self._stats_lock:
+                        self.written += len(rows)
+                        self.batches += 1
+                except Exception as e:
+                    self.logger.error(f"Audit batch of {len(rows)} rows lost: {e}")
+            for waiter in waiters:
+                waiter.set()
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,220 @@
+"""
+Runtime evaluation budgets for one enforcement
+
+Static cost checks (xpath_analysis.py) catch expensive rules, but a
+pathological message can still make a cheap rule slow. An EvaluationBudget
+bounds the work spent on one message:
+
+- message_ms: wall-clock time for the whole enforcement
+- rule_ms: time for one rule evaluation
+- max_nodes: XML nodes built from the message
+- max_text_bytes: header and payload text put into those nodes
+
+Limits are checked between rules and while the XML is built. lxml cannot
+be interrupted inside a single XPath evaluation, so a rule that overruns
+rule_ms is detected when it returns and nothing after it runs.
+
+    budget = EvaluationBudget(message_ms=500, rule_ms=100, on_exceeded='closed')
+    enforcer = PolicyEnforcer(budget=budget, budget_metrics=BudgetMetrics())
+
+A tripped budget ends evaluation with the matches found so far; the
+results are flagged partial and, when on_exceeded is 'closed', the
+message is blocked.
+"""
+
+import contextvars
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Set
+
+_current: "contextvars.ContextVar[Optional[BudgetMeter]]" = contextvars.ContextVar("pp_budget", default=None)
+
+KINDS = ('message_time', 'rule_time', 'nodes', 'text_bytes')
+
+
+class BudgetExceeded(Exception):
+    """An evaluation budget ran out"""
+
+    def __init__(self, kind: str, limit: float, observed: float, rule: Optional[str] = None):
+        self.kind = kind
+        self.limit = limit
+        self.observed = observed
+        self.rule = rule
+        detail = f" in rule {rule}" if rule else ""
+        super().__init__(f"{kind} budget exceeded{detail}: {observed:g} > {limit:g}")
+
+    def report(self) -> Dict[str, object]:
+        return {'kind': self.kind, 'limit': self.limit,
+                'observed': round(self.observed, 3), 'rule': self.rule}
+
+
+@dataclass(frozen=True)
+class EvaluationBudget:
+    """
+    Limits for one enforcement; None leaves that dimension unbounded
+
+    on_exceeded: 'open' keeps the partial verdict, 'closed' also blocks
+    the message
+    """
+    message_ms: Optional[float] = None
+    rule_ms: Optional[float] = None
+    max_nodes: Optional[int] = None
+    max_text_bytes: Optional[int] = None
+    on_exceeded: str = 'open'
+
+    def __post_init__(self):
+        if self.on_exceeded not in ('open', 'closed'):
+            raise ValueError("on_exceeded must be 'open' or 'closed'")
+
+    @property
+    def fail_closed(self) -> bool:
+        return self.on_exceeded == 'closed'
+
+    def meter(self) -> "BudgetMeter":
+        return BudgetMeter(self)
+
+
+class BudgetMeter:
+    """
+    What one enforcement has used so far
+
+    Shared by the part-pool threads working on the same message; once it
+    trips, every later check raises the same BudgetExceeded so the other
+    workers stop too.
+    """
+
+    def __init__(self, budget: EvaluationBudget):
+        self.budget = budget
+        self.started = time.perf_counter()
+        self.nodes = 0
+        self.text_bytes = 0
+        self.tripped: Optional[BudgetExceeded] = None
+        self._lock = threading.Lock()
+        # MIME parts whose payload has been charged, by id()
+        self._parts: Set[int] = set()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000.0
+
+    def _trip(self, error: BudgetExceeded):
+        with self._lock:
+            if self.tripped is None:
+                self.tripped = error
+            raise self.tripped
+
+    def check_time(self):
+        if self.tripped is not None:
+            raise self.tripped
+        limit = self.budget.message_ms
+        if limit is not None:
+            elapsed = self.elapsed_ms()
+            if elapsed > limit:
+                self._trip(BudgetExceeded('message_time', limit, elapsed))
+
+    def rule_done(self, rule_id: str, elapsed_ms: float):
+        """Account for one rule evaluation that took elapsed_ms"""
+        limit = self.budget.rule_ms
+        if limit is not None and elapsed_ms > limit:
+            self._trip(BudgetExceeded('rule_time', limit, elapsed_ms, rule_id))
+        self.check_time()
+
+    def charge(self, nodes: int = 0, text_bytes: int = 0):
+        """Account for XML built from the message"""
+        if self.tripped is not None:
+            raise self.tripped
+        with self._lock:
+            self.nodes += nodes
+            self.text_bytes += text_bytes
+            total_nodes, total_text = self.nodes, self.text_bytes
+        if self.budget.max_nodes is not None and total_nodes > self.budget.max_nodes:
+            self._trip(BudgetExceeded('nodes', self.budget.max_nodes, total_nodes))
+        if self.budget.max_text_bytes is not None and total_text > self.budget.max_text_bytes:
+            self._trip(BudgetExceeded('text_bytes', self.budget.max_text_bytes, total_text))
+
+    def charge_part(self, part, text_bytes: int):
+        """
+        Account for a MIME part's payload, once per enforcement
+
+        The prefilter scan and the XML build both read every payload; the
+        first to do so pays for it.
+        """
+        self.check_time()
+        with self._lock:
+            if id(part) in self._parts:
+                return
+            self._parts.add(id(part))
+        self.charge(text_bytes=text_bytes)
+
+    def usage(self) -> Dict[str, float]:
+        return {'elapsed_ms': round(self.elapsed_ms(), 3), 'nodes': self.nodes, 'text_bytes': self.text_bytes}
+
+
+class BudgetMetrics:
+    """Budget trips by kind and outcome; one instance can serve many enforcers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metered = 0
+        self.trips = {kind: 0 for kind in KINDS}
+        self.failed_open = 0
+        self.failed_closed = 0
+
+    def record(self, error: Optional[BudgetExceeded], fail_closed: bool):
+        with self._lock:
+            self.metered += 1
+            if error is None:
+                return
+            self.trips[error.kind] += 1
+            if fail_closed:
+                self.failed_closed += 1
+            else:
+                self.failed_open += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {'metered': self.metered, 'failed_open': self.failed_open,
+                     'failed_closed': self.failed_closed}
+            stats.update({f"trips_{kind}": count for kind, count in self.trips.items()})
+            return stats
+
+
+def current_meter() -> Optional[BudgetMeter]:
+    return _current.get()
+
+
+def charge(nodes: int = 0, text_bytes: int = 0):
+    """Charge the meter of the enforcement running on this thread, if any"""
+    meter = _current.get()
+    if meter is not None:
+        meter.charge(nodes, text_bytes)
+
+
+def check_time():
+    meter = _current.get()
+    if meter is not None:
+        meter.check_time()
+
+
+def activate(meter: Optional[BudgetMeter]) -> contextvars.Token:
+    return _current.set(meter)
+
+
+def deactivate(token: contextvars.Token):
+    _current.reset(token)
+
+
+def bind(func: Callable) -> Callable:
+    """Carry the current meter into func when it runs on another thread"""
+    meter = _current.get()
+    if meter is None:
+        return func
+
+    def bound(*args, **kwargs):
+        token = _current.set(meter)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return bound
@@ -0,0 +1,287 @@
+"""
+Bulk campaign sending from one pre-built MIME skeleton
+
+send_email() builds every message from scratch: policy.to_string(),
+create_email_with_policy(), base64 of the policy and a validation pass
+that decodes and parses it again. For a campaign nearly all of that is
+identical across recipients. CampaignTemplate does it once:
+
+    template = CampaignTemplate("news@example.com", "Hello {{name}}",
+                                "<p>Dear {{name}}, ...</p>", policy)
+    sender = BulkSender(lambda: SMTPTransport("localhost", 587), workers=8)
+    report = sender.send(template, [Recipient("alice@example.com", "Alice"), ...])
+
+The skeleton is serialized once and split into byte segments around a few
+slots (To, Message-ID, and Subject and the HTML body when they use
+{{field}} placeholders). Rendering a recipient joins the static segments
+with that recipient's header values and, only for a personalized body,
+re-encodes the HTML part. The policy part and header are never touched.
+
+Rendered messages are streamed through a bounded queue to sender threads,
+each with its own transport (one SMTP connection per thread).
+"""
+
+import base64
+import html
+import queue
+import re
+import smtplib
+import threading
+import time
+from email.header import Header
+from email.policy import compat32
+from email.utils import formataddr, formatdate, make_msgid
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from .mime_handler import MIMEPrivacyHandler
+from .policy import PrivacyPolicy
+
+_FIELD_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+_SLOT_RE = re.compile(rb"@@PP-(TO|SUBJECT|MSGID|BODY)@@")
+# Built from the recipient itself; every other field comes from its fields
+_BUILTIN_FIELDS = ("email", "name")
+_WIRE_POLICY = compat32.clone(linesep="\r\n")
+
+
+class CampaignError(ValueError):
+    """The campaign skeleton or a recipient cannot produce a valid message"""
+
+
+class Recipient(NamedTuple):
+    address: str
+    name: Optional[str] = None
+    fields: Optional[Dict[str, str]] = None
+
+    def value(self, field: str) -> str:
+        if field == "email":
+            return self.address
+        if field == "name":
+            return self.name or ""
+        if self.fields is None or field not in self.fields:
+            raise CampaignError(f"{self.address}: no value for field {field!r}")
+        return str(self.fields[field])
+
+
+def _split_fields(text: str) -> List[str]:
+    """Alternating literal text and field names: [text, field, text, ...]"""
+    return _FIELD_RE.split(text)
+
+
+def _header_safe(value: str, what: str) -> str:
+    if "\r" in value or "\n" in value:
+        raise CampaignError(f"line break in {what}")
+    return value
+
+
+class CampaignTemplate:
+    """
+    A campaign message built, validated and serialized once
+
+    Args:
+        from_addr: Sender address
+        subject: Subject line; may use {{field}} placeholders
+        body_html: HTML body; may use {{field}} placeholders, whose values
+            are HTML-escaped
+        policy: PrivacyPolicy or policy XML attached to every message
+        msgid_domain: Domain of the per-recipient Message-IDs
+    """
+
+    def __init__(self, from_addr: str, subject: str, body_html: str,
+                 policy: Union[PrivacyPolicy, str], msgid_domain: Optional[str] = None):
+        self.from_addr = from_addr
+        self.policy_xml = policy if isinstance(policy, str) else policy.to_string()
+        self.msgid_domain = msgid_domain or from_addr.rpartition("@")[2] or None
+        self._subject = _split_fields(subject)
+        self._body = _split_fields(body_html)
+        self.fields = sorted(set(self._subject[1::2] + self._body[1::2]) - set(_BUILTIN_FIELDS))
+
+        personal_subject = len(self._subject) > 1
+        personal_body = len(self._body) > 1
+        email_msg = MIMEPrivacyHandler.create_email_with_policy(
+            from_addr, "@@PP-TO@@", "@@PP-SUBJECT@@" if personal_subject else subject,
+            body_html, self.policy_xml,
+        )
+        self.validation = MIMEPrivacyHandler.validate_policy_integrity(email_msg)
+        if not self.validation['policy_extractable']:
+            raise CampaignError(f"policy attachment failed: {self.validation['errors']}")
+        email_msg['Message-ID'] = "@@PP-MSGID@@"
+        email_msg['Date'] = formatdate(localtime=True)
+
+        self._charset = "utf-8"
+        if personal_body:
+            html_part = next(part for part in email_msg.walk() if part.get_content_type() == "text/html")
+            del html_part['Content-Transfer-Encoding']
+            html_part.set_param('charset', self._charset)
+            html_part['Content-Transfer-Encoding'] = 'base64'
+            html_part.set_payload("@@PP-BODY@@")
+
+        # CRLF line endings, as SMTP puts them on the wire; slot values are
+        # rendered with CRLF too. email.policy.SMTP itself would refold the
+        # long X-Privacy-Policy header into encoded words, so keep compat32
+        self._segments = self._split(email_msg.as_bytes(policy=_WIRE_POLICY))
+        if not personal_body:
+            self._body = None
+        if not personal_subject:
+            self._subject = None
+
+    @staticmethod
+    def _split(data: bytes) -> List[Union[bytes, str]]:
+        """Static byte segments with slot names (str) between them"""
+        segments: List[Union[bytes, str]] = []
+        at = 0
+        for match in _SLOT_RE.finditer(data):
+            segments.append(data[at:match.start()])
+            segments.append(match.group(1).decode("ascii"))
+            at = match.end()
+        segments.append(data[at:])
+        return segments
+
+    def _fill(self, parts: List[str], recipient: Recipient, escape: bool) -> str:
+        out = list(parts)
+        for i in range(1, len(out), 2):
+            value = recipient.value(out[i])
+            out[i] = html.escape(value) if escape else value
+        return "".join(out)
+
+    def _slot(self, name: str, recipient: Recipient) -> bytes:
+        if name == "TO":
+            address = _header_safe(recipient.address, "recipient address")
+            value = formataddr((_header_safe(recipient.name, "recipient name"), address)) \
+                if recipient.name else address
+            return value.encode("ascii")
+        if name == "MSGID":
+            return make_msgid(domain=self.msgid_domain).encode("ascii")
+        if name == "SUBJECT":
+            subject = _header_safe(self._fill(self._subject, recipient, escape=False), "subject")
+            if subject.isascii():
+                return subject.encode("ascii")
+            return Header(subject, "utf-8").encode(linesep="\r\n").encode("ascii")
+        body = self._fill(self._body, recipient, escape=True).encode(self._charset)
+        return base64.encodebytes(body).rstrip(b"\n").replace(b"\n", b"\r\n")
+
+    def render(self, recipient: Recipient) -> bytes:
+        """The serialized message for one recipient"""
+        try:
+            return b"".join(
+                segment if isinstance(segment, bytes) else self._slot(segment, recipient)
+                for segment in self._segments
+            )
+        except UnicodeEncodeError:
+            raise CampaignError(f"{recipient.address}: address is not ASCII")
+
+
+class SMTPTransport:
+    """One SMTP connection, opened on first use and reopened once if dropped"""
+
+    def __init__(self, host: str = "localhost", port: int = 587, starttls: bool = False,
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        return smtp
+
+    def send(self, from_addr: str, to_addrs: List[str], data: bytes):
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.sendmail(from_addr, to_addrs, data)
+        except smtplib.SMTPServerDisconnected:
+            self._smtp = self._connect()
+            self._smtp.sendmail(from_addr, to_addrs, data)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                self._smtp.close()
+            self._smtp = None
+
+
+class BulkSender:
+    """
+    Streams rendered campaign messages to a pool of sender threads
+
+    Args:
+        transport_factory: Returns a transport (send(from_addr, to_addrs,
+            data) and close()); called once per sender thread
+        workers: Sender threads
+        max_queue: Rendered messages waiting for a sender
+        max_errors: Failures kept in the report (all are counted)
+    """
+
+    def __init__(self, transport_factory: Callable[[], Any], workers: int = 4,
+                 max_queue: int = 256, max_errors: int = 100):
+        self.transport_factory = transport_factory
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_errors = max_errors
+
+    def send(self, template: CampaignTemplate, recipients: Iterable[Recipient]) -> Dict[str, Any]:
+        """Send to every recipient; returns counts, failures and throughput"""
+        pending: "queue.Queue" = queue.Queue(maxsize=self.max_queue)
+        lock = threading.Lock()
+        report: Dict[str, Any] = {'sent': 0, 'failed': 0, 'bytes': 0, 'errors': []}
+
+        def fail(address: str, error: Exception):
+            with lock:
+                report['failed'] += 1
+                if len(report['errors']) < self.max_errors:
+                    report['errors'].append({'recipient': address, 'error': f"{type(error).__name__}: {error}"})
+
+        def run():
+            transport = None
+            try:
+                while True:
+                    item = pending.get()
+                    if item is None:
+                        return
+                    address, data = item
+                    try:
+                        if transport is None:
+                            transport = self.transport_factory()
+                        transport.send(template.from_addr, [address], data)
+                    except Exception as e:
+                        fail(address, e)
+                        continue
+                    with lock:
+                        report['sent'] += 1
+                        report['bytes'] += len(data)
+            finally:
+                if transport is not None:
+                    transport.close()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=run, name=f"bulk-send-{i}", daemon=True)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for recipient in recipients:
+                try:
+                    data = template.render(recipient)
+                except CampaignError as e:
+                    fail(recipient.address, e)
+                    continue
+                pending.put((recipient.address, data))
+        finally:
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        report['elapsed_s'] = round(elapsed, 3)
+        report['rate'] = round(report['sent'] / elapsed, 1) if elapsed > 0 else 0.0
+        return report
@@ -0,0 +1,322 @@
+"""
+Command-line entry point: python -m src <command> ...
+
+    enforce   Enforce the embedded (or a given) policy on .eml files
+    scan      List the URLs in a message's HTML parts and flag trackers
+    extract   Print the policy (or compiled bundle) embedded in a message
+    generate  Write a policy from one of the built-in templates
+    validate  Check policy files against the XSD
+    bench     Run one of the scripts in benchmarks/
+    load      Replay messages at a fixed rate and report latency percentiles
+    report    Enforce a mailbox into columnar results and print fleet-wide figures
+
+Shell hooks call this once per message, so start-up time matters: only
+argparse is imported here, and each command imports what it needs when
+it runs. benchmarks/bench_startup.py keeps track of the cost.
+"""
+
+import argparse
+import sys
+
+# Template name on the command line -> PolicyGenerator method
+TEMPLATES = {
+    "no-forwarding": "no_forwarding_policy",
+    "tracking-protection": "tracking_protection_policy",
+    "attachment-control": "attachment_control_policy",
+    "strict": "strict_privacy_policy",
+    "tracker-blocklist": "tracker_blocklist_policy",
+}
+
+
+def _read_bytes(path: str) -> bytes:
+    if path == "-":
+        return sys.stdin.buffer.read()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _read_message(path: str):
+    import email
+    return email.message_from_bytes(_read_bytes(path))
+
+
+def _quiet(args):
+    """Keep the library's progress prints off stdout unless --verbose"""
+    import contextlib
+    import io
+    return contextlib.redirect_stdout(sys.stderr if args.verbose else io.StringIO())
+
+
+def _print_json(data):
+    import json
+    json.dump(data, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+
+
+def cmd_enforce(args) -> int:
+    from .enforcer import PolicyEnforcer
+    from .mime_handler import MIMEPrivacyHandler
+
+    policy_override = None
+    if args.policy:
+        with open(args.policy, "r", encoding="utf-8") as f:
+            policy_override = f.read()
+    enforcer = PolicyEnforcer(early_exit=not args.no_early_exit, max_rule_cost=args.max_cost,
+                              backend=args.backend, prefilter=not args.no_prefilter)
+
+    status = 0
+    report = {}
+    with _quiet(args):
+        for path in args.messages:
+            email_msg = _read_message(path)
+            policy_xml = policy_override or MIMEPrivacyHandler.extract_policy(email_msg)
+            if not policy_xml:
+                report[path] = None
+                continue
+            results = enforcer.enforce_policy(email_msg, policy_xml, args.phase)
+            report[path] = results
+            if results['blocks']:
+                status = 2
+            if args.output:
+                with open(args.output, "wb") as f:
+                    f.write(email_msg.as_bytes())
+    _print_json(report if len(args.messages) > 1 else report[args.messages[0]])
+    return status
+
+
+def cmd_scan(args) -> int:
+    from .trackers import TrackerClassifier
+
+    classifier = TrackerClassifier.from_file(args.blocklist) if args.blocklist else TrackerClassifier()
+    found = 0
+    for path in args.messages:
+        email_msg = _read_message(path)
+        for part in email_msg.walk():
+            if part.get_content_type() != "text/html":
+                continue
+            payload = part.get_payload(decode=True) or b""
+            for ref in classifier.classify(payload.decode("utf-8", errors="ignore")):
+                if args.trackers_only and not ref.tracker:
+                    continue
+                flags = [name for name in ("tracker", "pixel", "hidden") if getattr(ref, name)]
+                found += ref.tracker
+                print(f"{path}\t{ref.tag}@{ref.attr}\t{','.join(flags) or '-'}\t{ref.url}")
+    return 1 if found else 0
+
+
+def cmd_extract(args) -> int:
+    from .mime_handler import MIMEPrivacyHandler
+
+    email_msg = _read_message(args.message)
+    if args.bundle:
+        bundle = MIMEPrivacyHandler.extract_bundle(email_msg)
+        if bundle is None:
+            print("No verifiable policy bundle found", file=sys.stderr)
+            return 1
+        _print_json(bundle)
+        return 0
+    with _quiet(args):
+        policy_xml = MIMEPrivacyHandler.extract_policy(email_msg)
+    if not policy_xml:
+        print("No privacy policy found", file=sys.stderr)
+        return 1
+    sys.stdout.write(policy_xml if policy_xml.endswith("\n") else policy_xml + "\n")
+    return 0
+
+
+def cmd_generate(args) -> int:
+    from .generator import PolicyGenerator
+
+    policy = getattr(PolicyGenerator, TEMPLATES[args.template])(args.creator)
+    if args.bundle:
+        from .compiler import compile_policy, dump_bundle
+        text = dump_bundle(compile_policy(policy)) + "\n"
+    else:
+        text = policy.to_string()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+def cmd_validate(args) -> int:
+    from .schema import load_policy_schema, validate_policy
+
+    schema = load_policy_schema()
+    status = 0
+    for path in args.policies:
+        policy_xml = _read_bytes(path).decode("utf-8")
+        errors = validate_policy(policy_xml, schema)
+        if not errors and args.max_cost:
+            from .compiler import PolicyCompileError, compile_policy
+            try:
+                compile_policy(policy_xml, validate=False, max_cost=args.max_cost)
+            except PolicyCompileError as e:
+                errors = e.errors or [str(e)]
+        if errors:
+            status = 1
+            for error in errors:
+                print(f"{path}: {error}")
+        elif args.verbose:
+            print(f"{path}: valid")
+    return status
+
+
+def cmd_bench(args) -> int:
+    import os
+    import runpy
+
+    bench_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+    available = sorted(
+        name[len("bench_"):-len(".py")] for name in os.listdir(bench_dir)
+        if name.startswith("bench_") and name.endswith(".py")
+    )
+    if args.name not in available:
+        print(f"Unknown benchmark {args.name!r}; available: {', '.join(available)}", file=sys.stderr)
+        return 2
+    script = os.path.join(bench_dir, f"bench_{args.name}.py")
+    sys.argv = [script] + args.bench_args
+    runpy.run_path(script, run_name="__main__")
+    return 0
+
+
+def cmd_load(args) -> int:
+    from . import loadgen
+
+    if args.compare:
+        base, new = (loadgen.read_report(path) for path in args.compare)
+        print(loadgen.format_comparison(loadgen.compare_reports(base, new)))
+        return 0
+    if args.target == "client":
+        target = loadgen.ClientTarget()
+    elif args.target.startswith("socket:"):
+        target = loadgen.SocketTarget(args.target[len("socket:"):])
+    elif args.target.startswith(("http:", "https:")):
+        target = loadgen.HttpTarget(args.target)
+    else:
+        print(f"Unknown target {args.target!r}", file=sys.stderr)
+        return 2
+    corpus = loadgen.read_corpus(args.mbox, args.eml_dir, args.generate, args.seed)
+    with _quiet(args):
+        report = loadgen.run_load(target, corpus, args.rate, duration=args.duration, count=args.count,
+                                  concurrency=args.concurrency, warmup=args.warmup,
+                                  max_outstanding=args.max_outstanding, label=args.label)
+    print(loadgen.format_report(report))
+    if args.report:
+        loadgen.write_report(report, args.report)
+    return 1 if report['errors'] else 0
+
+
+def cmd_report(args) -> int:
+    from . import columnar, loadgen
+
+    if args.table:
+        table = columnar.ResultTable.load(args.table)
+    else:
+        policy_xml = None
+        if args.policy:
+            with open(args.policy, "r", encoding="utf-8") as f:
+                policy_xml = f.read()
+        corpus = loadgen.read_corpus(args.mbox, args.eml_dir, args.generate, args.seed)
+        with _quiet(args):
+            collector = columnar.scan_messages(corpus, policy_xml=policy_xml, phase=args.phase)
+        table = collector.table()
+        if args.save:
+            table.save(args.save)
+    print(columnar.format_summary(table, args.top))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src", description="Email privacy policy tools")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show progress messages on stderr")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    enforce = commands.add_parser('enforce', help="enforce policies on messages")
+    enforce.add_argument('messages', nargs='+', help=".eml files, or - for stdin")
+    enforce.add_argument('--policy', help="policy XML to use instead of the embedded one")
+    enforce.add_argument('--phase', default="at-use", choices=("at-use", "in-transit", "at-rest"))
+    enforce.add_argument('--no-early-exit', action='store_true', help="evaluate every rule after a block")
+    enforce.add_argument('--no-prefilter', action='store_true',
+                         help="evaluate every rule even when the message lacks the strings it needs")
+    enforce.add_argument('--max-cost', choices=("bounded", "linear", "quadratic", "cubic"),
+                         help="skip rules whose XPath is estimated above this cost")
+    enforce.add_argument('--backend', default="xpath", choices=("xpath", "xslt", "auto"),
+                         help="evaluate each stage's rules one XPath at a time or as one stylesheet")
+    enforce.add_argument('-o', '--output', help="write the processed message here (single message)")
+    enforce.set_defaults(func=cmd_enforce)
+
+    scan = commands.add_parser('scan', help="list URLs in HTML parts and flag trackers")
+    scan.add_argument('messages', nargs='+')
+    scan.add_argument('--blocklist', help="tracker blocklist file")
+    scan.add_argument('--trackers-only', action='store_true')
+    scan.set_defaults(func=cmd_scan)
+
+    extract = commands.add_parser('extract', help="print the policy embedded in a message")
+    extract.add_argument('message')
+    extract.add_argument('--bundle', action='store_true', help="print the compiled bundle instead")
+    extract.set_defaults(func=cmd_extract)
+
+    generate = commands.add_parser('generate', help="write a policy from a template")
+    generate.add_argument('template', choices=sorted(TEMPLATES))
+    generate.add_argument('--creator', required=True)
+    generate.add_argument('--bundle', action='store_true', help="write the compiled JSON bundle")
+    generate.add_argument('-o', '--output')
+    generate.set_defaults(func=cmd_generate)
+
+    validate = commands.add_parser('validate', help="validate policy files against the XSD")
+    validate.add_argument('policies', nargs='+')
+    validate.add_argument('--max-cost', choices=("bounded", "linear", "quadratic", "cubic"),
+                          help="also reject rules whose XPath is estimated above this cost")
+    validate.set_defaults(func=cmd_validate)
+
+    bench = commands.add_parser('bench', help="run a benchmark from benchmarks/")
+    bench.add_argument('name', help="e.g. startup, encryption, parallel_parts, xslt_backend")
+    bench.add_argument('bench_args', nargs=argparse.REMAINDER)
+    bench.set_defaults(func=cmd_bench)
+
+    load = commands.add_parser('load', help="replay messages at a fixed rate, report latency percentiles")
+    load.add_argument('--target', default="client",
+                      help="client (receive_email in-process), socket:PATH or http://HOST:PORT of a daemon")
+    load.add_argument('--mbox', help="replay the messages of an mbox file")
+    load.add_argument('--eml-dir', help="replay the .eml files of a directory")
+    load.add_argument('--generate', type=int, help="add N synthetic messages (default when no corpus)")
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--rate', type=float, default=50.0, help="arrivals per second")
+    load.add_argument('--duration', type=float, default=10.0, help="seconds of arrivals")
+    load.add_argument('--count', type=int, help="send this many messages instead of --duration")
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--warmup', type=int, default=20, help="unmeasured messages sent first")
+    load.add_argument('--max-outstanding', type=int, help="drop arrivals beyond this many unanswered")
+    load.add_argument('--label', help="name for the run in the report")
+    load.add_argument('--report', help="write the JSON report here")
+    load.add_argument('--compare', nargs=2, metavar=("BASE", "NEW"), help="compare two JSON reports")
+    load.set_defaults(func=cmd_load)
+
+    report = commands.add_parser('report', help="scan messages into columnar results, print aggregates")
+    report.add_argument('--mbox', help="scan the messages of an mbox file")
+    report.add_argument('--eml-dir', help="scan the .eml files of a directory")
+    report.add_argument('--generate', type=int, help="add N synthetic messages (default when no corpus)")
+    report.add_argument('--seed', type=int, default=0)
+    report.add_argument('--policy', help="policy XML to use instead of each message's own")
+    report.add_argument('--phase', default="at-use", choices=("at-use", "in-transit", "at-rest"))
+    report.add_argument('--save', metavar="DIR", help="write the columns here")
+    report.add_argument('--table', metavar="DIR", help="report on saved columns instead of scanning")
+    report.add_argument('--top', type=int, default=10, help="rules and senders listed")
+    report.set_defaults(func=cmd_report)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'enforce' and args.output and len(args.messages) > 1:
+        print("--output needs a single message", file=sys.stderr)
+        return 2
+    try:
+        return args.func(args)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
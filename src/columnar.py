@@ -0,0 +1,400 @@
+"""
+Columnar storage and aggregation of enforcement results
+
+The results dict enforce_policy() returns is a nested mix of strings,
+lists and dicts: fine for one message, slow to aggregate over millions.
+ResultCollector flattens each verdict into typed NumPy columns as it
+arrives:
+
+    collector = ResultCollector()
+    for raw in load_mbox("archive.mbox"):
+        ...
+        collector.append(results, sender=msg['From'], size=len(raw), latency_ms=elapsed)
+    table = collector.table()
+    table.rule_match_rates()            # per rule: messages matched / all messages
+    table.top_senders(action="block")   # senders with the most blocked messages
+    table.save("scan.cols")             # and later ResultTable.load("scan.cols")
+
+There are two tables. messages has one row per message: sender, size,
+enforcement latency, tracker count and flags. hits has one row per rule
+action taken on a message: message row, rule, action and match count.
+Senders, rule ids and actions are dictionary-encoded: each distinct
+string is stored once and the columns hold small integer codes. Group-bys
+are then np.bincount over the codes.
+
+On disk a table is a directory with one .npy file per column and a JSON
+manifest holding the dictionaries. load() memory-maps the columns by
+default, so opening a table with millions of rows only reads the pages
+a query touches.
+
+scan_messages() enforces a corpus (see loadgen.load_mbox) into a
+collector; python -m src report does the same from the command line.
+"""
+
+import json
+import os
+import time
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+MESSAGE_COLUMNS = {
+    'sender': np.int32,
+    'size': np.int64,
+    'latency_ms': np.float32,
+    'trackers': np.int32,
+    'rules_hit': np.int16,
+    'blocked': np.bool_,
+    'partial': np.bool_,
+    'has_policy': np.bool_,
+}
+HIT_COLUMNS = {
+    'message': np.uint32,
+    'rule': np.int32,
+    'action': np.uint8,
+    'matches': np.int32,
+}
+# Dictionary-encoded column -> its dictionary
+ENCODED = {'sender': 'senders', 'rule': 'rules', 'action': 'actions'}
+
+
+class _Column:
+    """An append-only NumPy array that doubles its capacity as it fills"""
+
+    def __init__(self, dtype, capacity: int = 1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.empty(2 * len(self.data), dtype=self.data.dtype)
+            grown[:self.size] = self.data
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self.data[:self.size]
+
+
+class _Dictionary:
+    """String <-> integer code, codes in order of first appearance"""
+
+    def __init__(self, values: Sequence[str] = ()):
+        self.values: List[str] = list(values)
+        self.codes: Dict[str, int] = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _sender(value: Optional[str]) -> str:
+    """The bare, lowercased address of a From header"""
+    if not value:
+        return ""
+    return parseaddr(str(value))[1].lower() or str(value).strip().lower()
+
+
+def _hits(results: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+    """(action, rule, matches) for every action in a results dict"""
+    warned = {w['rule']: w.get('matches', 1) for w in results.get('warnings', []) if isinstance(w, dict)}
+    hits = []
+    for taken in results.get('actions_taken', []):
+        action, _, rule = taken.partition(":")
+        if action == 'warn':
+            matches = warned.get(rule, 1)
+        elif action == 'strip':
+            matches = sum(1 for s in results.get('stripped_elements', []) if s.startswith(rule + ":"))
+        elif action == 'encrypt':
+            matches = sum(1 for s in results.get('encrypted_parts', []) if s.startswith(rule + ":"))
+        else:
+            matches = 1
+        hits.append((action, rule, matches))
+    return hits
+
+
+class ResultTable:
+    """
+    The columns of a set of results, with vectorized queries
+
+    messages and hits map column names to arrays; senders, rules and
+    actions are the dictionaries behind the encoded columns.
+    """
+
+    def __init__(self, messages: Dict[str, np.ndarray], hits: Dict[str, np.ndarray],
+                 senders: Sequence[str], rules: Sequence[str], actions: Sequence[str]):
+        self.messages = messages
+        self.hits = hits
+        self.senders = list(senders)
+        self.rules = list(rules)
+        self.actions = list(actions)
+
+    def __len__(self) -> int:
+        return len(self.messages['sender'])
+
+    def _action_code(self, action: str) -> Optional[int]:
+        return self.actions.index(action) if action in self.actions else None
+
+    def _hit_mask(self, action: Optional[str]) -> np.ndarray:
+        if action is None:
+            return np.ones(len(self.hits['rule']), dtype=bool)
+        code = self._action_code(action)
+        if code is None:
+            return np.zeros(len(self.hits['rule']), dtype=bool)
+        return self.hits['action'] == code
+
+    # ---- queries ----
+
+    def group_by(self, key: str, value: Optional[str] = None, agg: str = 'count',
+                 mask: Optional[np.ndarray] = None) -> Dict[Any, float]:
+        """
+        Aggregate a messages column per distinct value of another
+
+        key is a messages column (decoded when dictionary-encoded); agg is
+        'count', 'sum' or 'mean' of value. mask selects the rows included.
+        """
+        if agg not in ('count', 'sum', 'mean'):
+            raise ValueError("agg must be 'count', 'sum' or 'mean'")
+        if agg != 'count' and value is None:
+            raise ValueError(f"agg {agg!r} needs a value column")
+        keys = self.messages[key]
+        values = None if value is None else self.messages[value]
+        if mask is not None:
+            keys = keys[mask]
+            values = None if values is None else values[mask]
+        if key in ENCODED:
+            codes, labels = keys, getattr(self, ENCODED[key])
+        else:
+            labels, codes = np.unique(keys, return_inverse=True)
+            labels = labels.tolist()
+        counts = np.bincount(codes, minlength=len(labels))
+        if agg == 'count':
+            totals = counts
+        else:
+            totals = np.bincount(codes, weights=values.astype(np.float64), minlength=len(labels))
+            if agg == 'mean':
+                totals = np.divide(totals, counts, out=np.zeros(len(labels)), where=counts > 0)
+        return {labels[i]: totals[i].item() for i in np.flatnonzero(counts)}
+
+    def histogram(self, column: str, bins: Any = 10, mask: Optional[np.ndarray] = None
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+        """(counts, bin edges) of a messages column, as np.histogram"""
+        values = self.messages[column]
+        if mask is not None:
+            values = values[mask]
+        return np.histogram(values, bins=bins)
+
+    def rule_match_rates(self, action: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """Per rule: messages it acted on (with action, if given), that share of all messages, and matches"""
+        mask = self._hit_mask(action)
+        rules = self.hits['rule'][mask]
+        # A rule is counted once per message even with several actions
+        pairs = np.unique(self.hits['message'][mask].astype(np.int64) * len(self.rules) + rules)
+        messages = np.bincount(pairs % max(len(self.rules), 1), minlength=len(self.rules))
+        matches = np.bincount(rules, weights=self.hits['matches'][mask], minlength=len(self.rules))
+        total = len(self)
+        return {
+            self.rules[code]: {'messages': int(messages[code]),
+                               'rate': float(messages[code]) / total if total else 0.0,
+                               'matches': int(matches[code])}
+            for code in np.flatnonzero(messages)
+        }
+
+    def top_senders(self, n: int = 10, action: Optional[str] = 'block') -> List[Tuple[str, int]]:
+        """Senders with the most messages acted on (any action when action is None)"""
+        mask = self._hit_mask(action)
+        message_rows = np.unique(self.hits['message'][mask])
+        counts = np.bincount(self.messages['sender'][message_rows], minlength=len(self.senders))
+        top = np.argsort(counts, kind='stable')[::-1][:n]
+        return [(self.senders[code], int(counts[code])) for code in top if counts[code]]
+
+    def latency_by_size(self, edges: Sequence[int] = (4096, 16384, 65536, 262144, 1048576),
+                        percentiles: Sequence[float] = (50.0, 95.0, 99.0)) -> List[Dict[str, Any]]:
+        """
+        Latency count, mean and percentiles per message size bucket (edges
+        in bytes), over the messages that had a policy to enforce
+        """
+        enforced = self.messages['has_policy']
+        buckets = np.digitize(self.messages['size'][enforced], edges)
+        latency = self.messages['latency_ms'][enforced]
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.searchsorted(buckets[order], np.arange(len(edges) + 2))
+        rows = []
+        for bucket in range(len(edges) + 1):
+            values = latency[order[bounds[bucket]:bounds[bucket + 1]]]
+            low = edges[bucket - 1] if bucket else 0
+            high = edges[bucket] if bucket < len(edges) else None
+            row = {'min_bytes': low, 'max_bytes': high, 'messages': len(values)}
+            if len(values):
+                row['mean_ms'] = round(float(values.mean()), 3)
+                for p, v in zip(percentiles, np.percentile(values, percentiles)):
+                    row[f"p{p:g}_ms"] = round(float(v), 3)
+            rows.append(row)
+        return rows
+
+    def summary(self) -> Dict[str, Any]:
+        """The fleet-wide figures the report command prints"""
+        trackers = self.messages['trackers']
+        return {
+            'messages': len(self),
+            'with_policy': int(np.count_nonzero(self.messages['has_policy'])),
+            'blocked': int(np.count_nonzero(self.messages['blocked'])),
+            'partial': int(np.count_nonzero(self.messages['partial'])),
+            'actions': {self.actions[code]: int(count)
+                        for code, count in enumerate(np.bincount(self.hits['action'],
+                                                                 minlength=len(self.actions)))},
+            'trackers_mean': round(float(trackers.mean()), 3) if len(self) else 0.0,
+            'messages_with_trackers': int(np.count_nonzero(trackers)),
+        }
+
+    # ---- storage ----
+
+    def save(self, path: str):
+        """Write the table as a directory of .npy columns and a manifest"""
+        os.makedirs(path, exist_ok=True)
+        for table, columns in (('messages', self.messages), ('hits', self.hits)):
+            for name, array in columns.items():
+                np.save(os.path.join(path, f"{table}.{name}.npy"), np.ascontiguousarray(array))
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'messages': len(self),
+            'hits': len(self.hits['rule']),
+            'senders': self.senders,
+            'rules': self.rules,
+            'actions': self.actions,
+        }
+        with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "ResultTable":
+        """Open a saved table; columns are memory-mapped unless mmap is False"""
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported format version {manifest.get('format_version')!r}")
+        mode = 'r' if mmap else None
+        columns = {}
+        for table, names in (('messages', MESSAGE_COLUMNS), ('hits', HIT_COLUMNS)):
+            columns[table] = {name: np.load(os.path.join(path, f"{table}.{name}.npy"), mmap_mode=mode)
+                              for name in names}
+        return cls(columns['messages'], columns['hits'],
+                   manifest['senders'], manifest['rules'], manifest['actions'])
+
+
+class ResultCollector:
+    """Appends enforce_policy() results into growing columns"""
+
+    def __init__(self):
+        self._messages = {name: _Column(dtype) for name, dtype in MESSAGE_COLUMNS.items()}
+        self._hits = {name: _Column(dtype) for name, dtype in HIT_COLUMNS.items()}
+        self._senders = _Dictionary()
+        self._rules = _Dictionary()
+        self._actions = _Dictionary()
+
+    def __len__(self) -> int:
+        return self._messages['sender'].size
+
+    def append(self, results: Optional[Dict[str, Any]], sender: Optional[str] = None,
+               size: int = 0, latency_ms: float = 0.0, trackers: int = 0):
+        """Record one message; results is None for a message without a policy"""
+        row = len(self)
+        hits = _hits(results) if results else []
+        for action, rule, matches in hits:
+            self._hits['message'].append(row)
+            self._hits['rule'].append(self._rules.encode(rule))
+            self._hits['action'].append(self._actions.encode(action))
+            self._hits['matches'].append(matches)
+        columns = self._messages
+        columns['sender'].append(self._senders.encode(_sender(sender)))
+        columns['size'].append(size)
+        columns['latency_ms'].append(latency_ms)
+        columns['trackers'].append(trackers)
+        columns['rules_hit'].append(len({rule for _, rule, _ in hits}))
+        columns['blocked'].append(bool(results and results.get('blocks')))
+        columns['partial'].append(bool(results and results.get('partial')))
+        columns['has_policy'].append(results is not None)
+
+    def table(self) -> ResultTable:
+        """The rows so far; the arrays are views, valid until the next append"""
+        return ResultTable(
+            {name: column.view() for name, column in self._messages.items()},
+            {name: column.view() for name, column in self._hits.items()},
+            self._senders.values, self._rules.values, self._actions.values,
+        )
+
+    def save(self, path: str):
+        self.table().save(path)
+
+
+def scan_messages(corpus: Iterable[bytes], enforcer=None, policy_xml: Optional[str] = None,
+                  phase: str = 'at-use', collector: Optional[ResultCollector] = None,
+                  count_trackers: bool = True) -> ResultCollector:
+    """
+    Enforce each raw message and collect the verdicts
+
+    Each message's embedded policy is used unless policy_xml is given.
+    With count_trackers, tracker URLs in HTML parts are counted with the
+    enforcer's classifier.
+    """
+    import email
+    from .enforcer import PolicyEnforcer
+    from .mime_handler import MIMEPrivacyHandler
+
+    enforcer = enforcer or PolicyEnforcer()
+    collector = collector if collector is not None else ResultCollector()
+    for raw in corpus:
+        email_msg = email.message_from_bytes(raw)
+        trackers = 0
+        if count_trackers:
+            for part in email_msg.walk():
+                if part.get_content_type() == 'text/html':
+                    payload = part.get_payload(decode=True) or b""
+                    trackers += sum(ref.tracker for ref in
+                                    enforcer.classifier.classify(payload.decode('utf-8', errors='ignore')))
+        policy = policy_xml or MIMEPrivacyHandler.extract_policy(email_msg, verbose=False)
+        results = None
+        start = time.perf_counter()
+        if policy:
+            results = enforcer.enforce_policy(email_msg, policy, phase)
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        collector.append(results, sender=email_msg.get('From'), size=len(raw),
+                         latency_ms=latency_ms, trackers=trackers)
+    return collector
+
+
+def format_summary(table: ResultTable, top: int = 10) -> str:
+    summary = table.summary()
+    lines = [
+        f"messages {summary['messages']}  with policy {summary['with_policy']}"
+        f"  blocked {summary['blocked']}  partial {summary['partial']}",
+        "actions  " + ("  ".join(f"{a} {n}" for a, n in summary['actions'].items()) or "-"),
+        f"trackers mean {summary['trackers_mean']:.2f} per message,"
+        f" {summary['messages_with_trackers']} messages with any",
+        "",
+        f"{'rule':<32} {'messages':>9} {'rate':>7} {'matches':>8}",
+    ]
+    rates = sorted(table.rule_match_rates().items(), key=lambda item: -item[1]['messages'])
+    for rule, row in rates[:top]:
+        lines.append(f"{rule:<32} {row['messages']:>9} {row['rate'] * 100:>6.2f}% {row['matches']:>8}")
+    senders = table.top_senders(top)
+    if senders:
+        lines += ["", f"{'sender (blocked)':<40} {'messages':>9}"]
+        lines += [f"{sender or '-':<40} {count:>9}" for sender, count in senders]
+    lines += ["", f"{'size':<16} {'messages':>9} {'mean ms':>8} {'p50':>8} {'p95':>8} {'p99':>8}"]
+    for row in table.latency_by_size():
+        high = f"{row['max_bytes'] // 1024}K" if row['max_bytes'] is not None else "+"
+        label = f"{row['min_bytes'] // 1024}K-{high}"
+        if row['messages']:
+            lines.append(f"{label:<16} {row['messages']:>9} {row['mean_ms']:>8.2f} {row['p50_ms']:>8.2f}"
+                         f" {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+        else:
+            lines.append(f"{label:<16} {0:>9}")
+    return "\n".join(lines)
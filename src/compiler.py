@@ -0,0 +1,250 @@
+"""
+Policy compiler: validated policy XML -> compact, versioned JSON bundle
+
+The bundle lets lightweight clients (the Thunderbird extension) apply a
+policy without an XML parser. Rules are pre-sorted by priority, conditions
+are normalized into a small boolean tree, and each rule lists the literals
+any match must contain so clients can skip rules cheaply: each occurs,
+compared case-insensitively, in the decoded text of the message (see
+prefilter.py, which derives them). The digest covers the canonical JSON
+of everything else, so clients can cache by digest.
+
+Bundle layout (version 1):
+
+    {"format": "pp-bundle", "v": 1, "digest": "sha256:...",
+     "policy": {"version", "creator", "created", "expires"},
+     "rules": [{"id", "priority", "scope", "locality", "description",
+                "action": {"type", "message"}, "cond": <condition>,
+                "literals": [...]}]}
+
+    condition := {"xpath": str} | {"mime": str}
+               | {"all": [condition, ...]} | {"any": [condition, ...]}
+               | {"not": condition}
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Union
+
+from lxml import etree as ET
+
+from .policy import PrivacyPolicy
+from .prefilter import condition_requirement
+from .schema import validate_policy
+from .xpath_analysis import (XPathSyntaxError, cost_degree, estimate_cost, join_tokens, optimize_xpath,
+                             rule_locality, tokenize)
+
+BUNDLE_FORMAT = "pp-bundle"
+BUNDLE_VERSION = 1
+
+_NS = {"pp": "urn:email:privacy:1.0"}
+
+
+class PolicyCompileError(ValueError):
+    def __init__(self, message: str, errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class PolicyCostError(PolicyCompileError):
+    """A rule's XPath is estimated to cost more than the allowed ceiling"""
+
+
+def normalize_xpath(expr: str) -> str:
+    """Canonical spacing for an XPath expression; raises XPathSyntaxError"""
+    return join_tokens(tokenize(expr))
+
+
+def _compile_condition(elem) -> Dict[str, Any]:
+    xpath = elem.find("pp:XPath", _NS)
+    if xpath is not None:
+        try:
+            return {"xpath": normalize_xpath((xpath.text or "").strip())}
+        except XPathSyntaxError as e:
+            raise PolicyCompileError(f"Invalid XPath: {e}") from e
+
+    pattern = elem.find("pp:MIMEPattern", _NS)
+    if pattern is not None:
+        return {"mime": (pattern.text or "").strip().lower()}
+
+    composite = elem.find("pp:Composite", _NS)
+    if composite is None:
+        raise PolicyCompileError("Condition has no XPath, MIMEPattern or Composite")
+
+    all_of, any_of = [], []
+    for child in composite:
+        if not isinstance(child.tag, str):
+            continue
+        tag = ET.QName(child).localname
+        if tag == "Condition":
+            # PrivacyPolicy.to_xml nests plain Conditions; treat them as And
+            all_of.append(_compile_condition(child))
+        elif tag == "And":
+            all_of.append(_compile_condition(child))
+        elif tag == "Or":
+            any_of.append(_compile_condition(child))
+        elif tag == "Not":
+            all_of.append(_negate(_compile_condition(child)))
+    if any_of:
+        all_of.append(_combine("any", any_of))
+    return _combine("all", all_of)
+
+
+def _negate(cond: Dict[str, Any]) -> Dict[str, Any]:
+    return cond["not"] if "not" in cond else {"not": cond}
+
+
+def _combine(op: str, conds: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Flatten nested nodes of the same operator and collapse single children"""
+    flat = []
+    for cond in conds:
+        flat.extend(cond[op] if op in cond else [cond])
+    if not flat:
+        raise PolicyCompileError("Empty composite condition")
+    return flat[0] if len(flat) == 1 else {op: flat}
+
+
+def _condition_literals(cond: Dict[str, Any]) -> List[str]:
+    """
+    Literals every match of cond must contain
+
+    The clauses of its prefilter requirement that hold a single literal;
+    clauses satisfied by any of several literals do not fit the flat list.
+    """
+    return list(dict.fromkeys(next(iter(clause)) for clause in condition_requirement(cond)
+                              if len(clause) == 1))
+
+
+def _condition_locality(cond: Dict[str, Any]) -> str:
+    if "xpath" in cond:
+        return rule_locality(cond["xpath"])
+    if "mime" in cond:
+        return "part"
+    children = cond.get("all") or cond.get("any") or [cond["not"]]
+    localities = {_condition_locality(child) for child in children}
+    for locality in ("message", "part", "header"):
+        if locality in localities:
+            return locality
+    return "message"
+
+
+def _condition_xpaths(cond: Dict[str, Any]) -> List[str]:
+    if "xpath" in cond:
+        return [cond["xpath"]]
+    if "mime" in cond:
+        return []
+    children = cond.get("all") or cond.get("any") or [cond["not"]]
+    return [xpath for child in children for xpath in _condition_xpaths(child)]
+
+
+def rule_cost_errors(rule_id: str, xpath: str, max_cost: str) -> List[str]:
+    """
+    Why one rule's XPath exceeds max_cost, after the enforcer's rewrites
+
+    Returns an empty list when it does not.
+    """
+    optimized, _ = optimize_xpath(xpath)
+    cost = estimate_cost(optimized)
+    if cost.degree <= cost_degree(max_cost):
+        return []
+    reasons = "; ".join(cost.reasons) or "unbounded scans"
+    return [f"Rule {rule_id}: {cost.cost_class} XPath exceeds the {max_cost} ceiling ({reasons}): {xpath}"]
+
+
+def _digest(bundle: Dict[str, Any]) -> str:
+    body = {k: v for k, v in bundle.items() if k != "digest"}
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return "sha256:" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def compile_policy(policy: Union[PrivacyPolicy, str], validate: bool = True,
+                   max_cost: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Compile a policy into the bundle IR
+
+    Args:
+        policy: A PrivacyPolicy or its XML
+        validate: Check the XML against the policy XSD first
+        max_cost: Reject rules whose XPath is estimated above this cost
+            class (see xpath_analysis.COST_CLASSES)
+
+    Raises:
+        PolicyCompileError: the policy is invalid
+        PolicyCostError: a rule exceeds max_cost
+    """
+    policy_xml = policy.to_string() if isinstance(policy, PrivacyPolicy) else policy
+    if validate:
+        errors = validate_policy(policy_xml)
+        if errors:
+            raise PolicyCompileError("Policy failed schema validation", errors)
+    try:
+        root = ET.fromstring(policy_xml.encode("utf-8"))
+    except ET.ParseError as e:
+        raise PolicyCompileError(f"Policy XML parsing error: {e}") from e
+
+    rules = []
+    for position, rule_elem in enumerate(root.findall(".//pp:Rule", _NS)):
+        condition_elem = rule_elem.find("pp:Condition", _NS)
+        action_elem = rule_elem.find("pp:Action", _NS)
+        if condition_elem is None or action_elem is None:
+            raise PolicyCompileError(f"Rule {rule_elem.get('id')} lacks a Condition or Action")
+        scope_elem = rule_elem.find("pp:Scope", _NS)
+        cond = _compile_condition(condition_elem)
+        rules.append((position, {
+            "id": rule_elem.get("id"),
+            "priority": int(rule_elem.get("priority", "1")),
+            "scope": scope_elem.get("phase") if scope_elem is not None else None,
+            "locality": _condition_locality(cond),
+            "description": rule_elem.findtext("pp:Description", None, _NS),
+            "action": {"type": action_elem.get("type"), "message": action_elem.get("message", "")},
+            "cond": cond,
+            "literals": _condition_literals(cond),
+        }))
+
+    if max_cost is not None:
+        errors = [error for _, rule in rules for xpath in _condition_xpaths(rule["cond"])
+                  for error in rule_cost_errors(rule["id"], xpath, max_cost)]
+        if errors:
+            raise PolicyCostError("Policy exceeds the XPath cost ceiling", errors)
+
+    # Higher priority first; document order breaks ties
+    rules.sort(key=lambda item: (-item[1]["priority"], item[0]))
+
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "v": BUNDLE_VERSION,
+        "policy": {
+            "version": root.get("version"),
+            "creator": root.findtext("pp:Metadata/pp:Creator", None, _NS),
+            "created": root.findtext("pp:Metadata/pp:Created", None, _NS),
+            "expires": root.findtext("pp:Metadata/pp:Expires", None, _NS),
+        },
+        "rules": [rule for _, rule in rules],
+    }
+    bundle["digest"] = _digest(bundle)
+    return bundle
+
+
+def dump_bundle(bundle: Dict[str, Any]) -> str:
+    """Compact JSON serialization of a bundle"""
+    return json.dumps(bundle, separators=(",", ":"), ensure_ascii=False)
+
+
+def load_bundle(data: Union[str, bytes], verify: bool = True) -> Dict[str, Any]:
+    """
+    Parse a serialized bundle
+
+    Raises:
+        PolicyCompileError: unknown format or version, or digest mismatch
+    """
+    try:
+        bundle = json.loads(data)
+    except ValueError as e:
+        raise PolicyCompileError(f"Bundle is not valid JSON: {e}") from e
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        raise PolicyCompileError("Not a policy bundle")
+    if bundle.get("v") != BUNDLE_VERSION:
+        raise PolicyCompileError(f"Unsupported bundle version {bundle.get('v')}")
+    if verify and bundle.get("digest") != _digest(bundle):
+        raise PolicyCompileError("Bundle digest mismatch")
+    return bundle
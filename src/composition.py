@@ -0,0 +1,318 @@
+"""
+Composition of several policies into one merged plan
+
+A received message can be subject to the sender's embedded policy, the
+organization default for the sender (directory.py) and the recipient's
+own preferences at once. PolicyComposer merges them into one policy:
+
+- rules with equivalent conditions (same scope, same normalized
+  condition, see compiler.py) are merged into one rule
+- when merged rules disagree on the action, the higher priority wins,
+  and between equal priorities the stricter action wins
+  (block > encrypt > strip > warn > log > allow)
+- the sender's policy is untrusted: its priorities do not count against
+  the organization's and user's rules, and its rule only wins over an
+  equivalent one from them when its action is stricter
+- inputs whose Metadata/Expires has passed are left out; the expiry
+  scheduler marks each input expired when its time comes (see
+  expiry.py), so compose() never reads the clock. The merged plan has
+  no Expires of its own, so one input expiring never disables the rules
+  of the others
+- the merged plan is cached by the tuple of input digests, so a
+  combination of policies is merged once, not once per message
+"""
+
+import copy
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from lxml import etree as ET
+
+from .compiler import PolicyCompileError, compile_policy
+from .expiry import ExpiryScheduler, PolicyExpired, parse_expires, shared_scheduler
+from .policy import PrivacyPolicy
+
+_NS = {"pp": "urn:email:privacy:1.0"}
+_PP = "{urn:email:privacy:1.0}"
+
+# Higher is stricter
+STRICTNESS = {"allow": 0, "log": 1, "warn": 2, "strip": 3, "encrypt": 4, "block": 5}
+
+
+@dataclass
+class MergedRule:
+    id: str
+    source: int
+    priority: int
+    scope: Optional[str]
+    action: str
+    message: str
+    # (input index, rule id) of every rule merged into this one
+    merged_from: List[Tuple[int, str]] = field(default_factory=list)
+
+
+@dataclass
+class Conflict:
+    """Equivalent rules from different places that disagreed on the action"""
+    rule: str
+    chosen: Tuple[int, str, str]
+    overridden: List[Tuple[int, str, str]]
+
+
+@dataclass
+class ComposedPolicy:
+    key: Tuple[str, ...]
+    policy_xml: str
+    bundle: Dict[str, Any]
+    rules: List[MergedRule]
+    duplicates: int
+    conflicts: List[Conflict]
+
+    @property
+    def digest(self) -> str:
+        return self.bundle["digest"]
+
+
+@dataclass
+class _Input:
+    digest: str
+    root: Any
+    bundle: Dict[str, Any]
+    # Metadata/Expires in epoch seconds
+    deadline: Optional[float] = None
+    # Set by the expiry scheduler once the deadline has passed
+    expired: bool = False
+
+
+def _canonical(cond: Dict[str, Any]) -> Any:
+    """Order-insensitive form of a compiled condition, for equivalence"""
+    if "all" in cond or "any" in cond:
+        op = "all" if "all" in cond else "any"
+        children = sorted(json.dumps(_canonical(c), sort_keys=True) for c in cond[op])
+        return {op: children}
+    if "not" in cond:
+        return {"not": _canonical(cond["not"])}
+    return cond
+
+
+def _strictness(rule: Dict[str, Any]) -> int:
+    return STRICTNESS.get(rule["action"]["type"], 0)
+
+
+def _condition_key(rule: Dict[str, Any]) -> str:
+    return json.dumps([rule["scope"], _canonical(rule["cond"])], sort_keys=True)
+
+
+class PolicyComposer:
+    """
+    Merge policies into one plan, caching plans by their inputs
+
+    Args:
+        max_plans: Merged plans kept (LRU)
+        max_inputs: Compiled input policies kept, keyed by their XML text
+        validate: Check each input against the policy XSD
+        expiry: Scheduler that expires inputs at their Metadata/Expires
+            (default: shared_scheduler())
+    """
+
+    def __init__(self, max_plans: int = 256, max_inputs: int = 1024, validate: bool = True,
+                 expiry: Optional[ExpiryScheduler] = None):
+        self.max_plans = max_plans
+        self.max_inputs = max_inputs
+        self.validate = validate
+        self._expiry = expiry
+        self._expiry_token = object()
+        self._inputs: "OrderedDict[str, _Input]" = OrderedDict()
+        self._plans: "OrderedDict[Tuple[str, ...], ComposedPolicy]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compose(self, *policies: Union[str, PrivacyPolicy, None],
+                sender: Union[str, PrivacyPolicy, None] = None) -> ComposedPolicy:
+        """
+        Merged plan for the given policies, most authoritative first
+
+        None entries are ignored, so optional sources can be passed as-is.
+        Input order only matters as the last tiebreak, after priority and
+        strictness. sender is the policy the message came with, which may
+        only make the other policies' rules stricter.
+
+        Raises:
+            PolicyCompileError: an input policy is invalid
+            PolicyExpired: every input policy has expired
+        """
+        inputs = [self._input(p) for p in policies if p is not None]
+        sender_index = None
+        if sender is not None:
+            sender_index = len(inputs)
+            inputs.append(self._input(sender))
+        if not inputs:
+            raise PolicyCompileError("No policies to compose")
+        current = [n for n, i in enumerate(inputs) if not i.expired]
+        if not current:
+            latest = max(inputs, key=lambda i: i.deadline)
+            raise PolicyExpired(latest.bundle["policy"]["expires"], latest.digest)
+        if len(current) < len(inputs):
+            # The sender's policy is last, if it is still current
+            sender_index = len(current) - 1 if sender_index in current else None
+            inputs = [inputs[n] for n in current]
+        key = tuple(i.digest for i in inputs)
+        if sender_index is not None:
+            key = key[:-1] + (f"sender:{key[-1]}",)
+
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = self._merge(key, inputs, sender_index)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _input(self, policy: Union[str, PrivacyPolicy]) -> _Input:
+        policy_xml = policy.to_string() if isinstance(policy, PrivacyPolicy) else policy
+        with self._lock:
+            cached = self._inputs.get(policy_xml)
+            if cached is not None:
+                self._inputs.move_to_end(policy_xml)
+                return cached
+
+        bundle = compile_policy(policy_xml, validate=self.validate)
+        deadline = parse_expires(bundle["policy"]["expires"])
+        loaded = _Input(digest=bundle["digest"], root=ET.fromstring(policy_xml.encode("utf-8")),
+                        bundle=bundle, deadline=deadline)
+        scheduler = self._scheduler() if deadline is not None else None
+        if scheduler is not None and deadline <= scheduler.clock():
+            loaded.expired = True
+        with self._lock:
+            self._inputs[policy_xml] = loaded
+            if scheduler is not None and not loaded.expired:
+                scheduler.schedule((self._expiry_token, loaded.digest), deadline, self._input_expired)
+            while len(self._inputs) > self.max_inputs:
+                _, evicted = self._inputs.popitem(last=False)
+                if (evicted.deadline is not None and not evicted.expired
+                        and all(i.digest != evicted.digest for i in self._inputs.values())):
+                    self._scheduler().cancel((self._expiry_token, evicted.digest))
+        return loaded
+
+    def _scheduler(self) -> ExpiryScheduler:
+        return self._expiry if self._expiry is not None else shared_scheduler()
+
+    def _input_expired(self, key):
+        """Expiry callback: mark the input expired and drop the plans merged from it"""
+        digest = key[1]
+        with self._lock:
+            for inp in self._inputs.values():
+                if inp.digest == digest:
+                    inp.expired = True
+            for plan_key in [k for k in self._plans if digest in k or f"sender:{digest}" in k]:
+                del self._plans[plan_key]
+
+    def _merge(self, key: Tuple[str, ...], inputs: Sequence[_Input],
+               sender: Optional[int] = None) -> ComposedPolicy:
+        # Equivalent rules grouped in first-seen order
+        groups: "OrderedDict[str, List[Tuple[int, int, Dict[str, Any], Any]]]" = OrderedDict()
+        for source, inp in enumerate(inputs):
+            # Rule elements in the bundle's order (ids need not be unique)
+            elements = sorted(inp.root.iterfind(".//pp:Rule", _NS),
+                              key=lambda elem: -int(elem.get("priority", "1")))
+            for position, (rule, element) in enumerate(zip(inp.bundle["rules"], elements)):
+                groups.setdefault(_condition_key(rule), []).append((source, position, rule, element))
+
+        merged: List[Tuple[MergedRule, Any]] = []
+        conflicts: List[Conflict] = []
+        duplicates = 0
+        used_ids = set()
+        for members in groups.values():
+            trusted = [m for m in members if m[0] != sender] or members
+            source, _, winner, element = max(
+                trusted,
+                key=lambda m: (m[2]["priority"], _strictness(m[2]), -m[0], -m[1])
+            )
+            # A sender rule only overrides the others by being stricter
+            stricter = [m for m in members if m[0] == sender and _strictness(m[2]) > _strictness(winner)]
+            if stricter:
+                source, _, winner, element = max(stricter, key=lambda m: (_strictness(m[2]), -m[1]))
+            duplicates += len(members) - 1
+            actions = {m[2]["action"]["type"] for m in members}
+            if len(actions) > 1:
+                conflicts.append(Conflict(
+                    rule=winner["id"],
+                    chosen=(source, winner["id"], winner["action"]["type"]),
+                    overridden=[(s, r["id"], r["action"]["type"]) for s, _, r, _ in members
+                                if r is not winner and r["action"]["type"] != winner["action"]["type"]],
+                ))
+
+            rule_id = winner["id"]
+            if rule_id in used_ids:
+                # Rule ids are xs:ID: unique, and "." is allowed where "@" is not
+                rule_id = f"{rule_id}.{source}"
+            used_ids.add(rule_id)
+            merged.append((MergedRule(
+                id=rule_id,
+                source=source,
+                priority=max(m[2]["priority"] for m in trusted),
+                scope=winner["scope"],
+                action=winner["action"]["type"],
+                message=winner["action"]["message"],
+                merged_from=[(s, r["id"]) for s, _, r, _ in members],
+            ), element))
+
+        # Same order the compiled bundle uses: priority, then input order
+        merged.sort(key=lambda item: -item[0].priority)
+        policy_xml = self._policy_xml(inputs, merged)
+        bundle = compile_policy(policy_xml, validate=False)
+        return ComposedPolicy(
+            key=key,
+            policy_xml=policy_xml,
+            bundle=bundle,
+            rules=[rule for rule, _ in merged],
+            duplicates=duplicates,
+            conflicts=conflicts,
+        )
+
+    @staticmethod
+    def _policy_xml(inputs: Sequence[_Input], merged: List[Tuple[MergedRule, Any]]) -> str:
+        metas = [i.bundle["policy"] for i in inputs]
+        creators = list(dict.fromkeys(m["creator"] for m in metas if m["creator"]))
+        created = [m["created"] for m in metas if m["created"]]
+
+        root = ET.Element(f"{_PP}PrivacyPolicy", version="1.0", nsmap={None: _NS["pp"]})
+        metadata = ET.SubElement(root, f"{_PP}Metadata")
+        ET.SubElement(metadata, f"{_PP}Creator").text = " + ".join(creators) or "composed"
+        # Deterministic, so the same inputs always give the same digest
+        ET.SubElement(metadata, f"{_PP}Created").text = max(created) if created else "1970-01-01T00:00:00"
+        # No Expires: compose() leaves out inputs once they expire, which
+        # gives another plan
+
+        rules_elem = ET.SubElement(root, f"{_PP}Rules")
+        for rule, element in merged:
+            rule_elem = copy.deepcopy(element)
+            rule_elem.set("id", rule.id)
+            rule_elem.set("priority", str(rule.priority))
+            rules_elem.append(rule_elem)
+        return ET.tostring(root, encoding="unicode", pretty_print=True)
+
+    def clear(self):
+        with self._lock:
+            self._inputs.clear()
+            self._plans.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'plans': len(self._plans),
+                'inputs': len(self._inputs),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Long-running enforcement daemon
+
+Keeps compiled policies, the policy XSD and the tracker trie warm and
+serves enforcement verdicts as JSON over a Unix domain socket and a local
+HTTP endpoint.
+
+Unix socket protocol: the client writes the raw RFC 822 message, shuts
+down its write side, and reads one JSON verdict until EOF.
+
+HTTP endpoints:
+    POST /enforce   raw message as the request body
+    GET  /health    liveness and queue depth
+    GET  /metrics   request counters, latency and cache statistics
+
+With processes > 0, messages are enforced in worker processes instead of
+threads, routed by policy so each policy stays compiled in one of them
+(routing.AffinityDispatcher).
+"""
+
+import argparse
+import email
+import functools
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from email.parser import BytesHeaderParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .audit import AuditLog
+from .budgets import BudgetMetrics, EvaluationBudget
+from .enforcer import PolicyEnforcer
+from .mime_handler import MIMEPrivacyHandler
+from .routing import AffinityDispatcher, PoolBusy
+from .schema import load_policy_schema, validate_policy
+from .trackers import TrackerClassifier
+from .verdict_cache import PartVerdictCache
+
+DEFAULT_HTTP_ADDRESS = ("127.0.0.1", 8765)
+MAX_MESSAGE_BYTES = 50 * 1024 * 1024
+
+
+class WorkerPool:
+    """Fixed set of worker threads fed from a bounded queue"""
+
+    def __init__(self, handler: Callable[[Any], Any], workers: int = 4, max_queue: int = 256):
+        self.handler = handler
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"enforcer-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, payload) -> Future:
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((payload, future))
+        except queue.Full:
+            raise PoolBusy("enforcement queue is full")
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            payload, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.handler(payload))
+            except Exception as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def handle_message(raw_email: bytes, enforcer: PolicyEnforcer, validate: Callable[[str], Tuple],
+                   require_valid_policy: bool = False) -> Tuple[Any, Dict[str, Any]]:
+    """Parse, extract, validate and enforce one message; returns (message, verdict)"""
+    start = time.perf_counter()
+    email_msg = email.message_from_bytes(raw_email)
+    policy_xml = MIMEPrivacyHandler.extract_policy(email_msg, verbose=False)
+    verdict: Dict[str, Any] = {
+        'success': True,
+        'policy_found': policy_xml is not None,
+        'enforcement_results': None,
+    }
+    if policy_xml is not None:
+        errors = validate(policy_xml)
+        verdict['policy_valid'] = not errors
+        if errors:
+            verdict['validation_errors'] = list(errors)
+        if not errors or not require_valid_policy:
+            verdict['enforcement_results'] = enforcer.enforce_policy(email_msg, policy_xml)
+    verdict['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    return email_msg, verdict
+
+
+def _process_handler(blocklist: Optional[str] = None, verdict_db: Optional[str] = None,
+                     require_valid_policy: bool = False,
+                     budget: Optional[EvaluationBudget] = None) -> Callable[[bytes], Dict[str, Any]]:
+    """Runs once in each worker process: builds its warm state and handler"""
+    classifier = TrackerClassifier.from_file(blocklist) if blocklist else TrackerClassifier()
+    enforcer = PolicyEnforcer(classifier=classifier, verdict_cache=PartVerdictCache(db_path=verdict_db),
+                              budget=budget)
+    schema = load_policy_schema()
+    validate = functools.lru_cache(maxsize=1024)(lambda policy_xml: tuple(validate_policy(policy_xml, schema)))
+
+    def handle(raw_email: bytes) -> Dict[str, Any]:
+        return handle_message(raw_email, enforcer, validate, require_valid_policy)[1]
+
+    return handle
+
+
+class EnforcementDaemon:
+    """Serves enforcement verdicts from warm, per-worker enforcers"""
+
+    def __init__(self, socket_path: Optional[str] = None,
+                 http_address: Optional[Tuple[str, int]] = DEFAULT_HTTP_ADDRESS,
+                 workers: int = 4, max_queue: int = 256, request_timeout: float = 30.0,
+                 classifier: Optional[TrackerClassifier] = None,
+                 verdict_cache: Optional[PartVerdictCache] = None,
+                 audit_log: Optional[AuditLog] = None,
+                 require_valid_policy: bool = False,
+                 budget: Optional[EvaluationBudget] = None,
+                 processes: int = 0, blocklist: Optional[str] = None,
+                 verdict_db: Optional[str] = None):
+        """
+        processes: enforce in this many worker processes rather than in
+        `workers` threads; each process loads the blocklist file and opens
+        the verdict_db SQLite file itself, since the classifier and
+        verdict_cache objects cannot be shared with it
+        """
+        self.logger = logging.getLogger(__name__)
+        self.socket_path = socket_path
+        self.http_address = http_address
+        self.request_timeout = request_timeout
+        self.require_valid_policy = require_valid_policy
+        self.audit_log = audit_log
+        # Bounds the time one message can hold a worker; trips from every
+        # worker's enforcer are counted together
+        self.budget = budget
+        self.budget_metrics = BudgetMetrics()
+
+        # Shared warm state: tracker trie, part verdicts and the XSD
+        self.classifier = classifier or TrackerClassifier()
+        self.verdict_cache = verdict_cache or PartVerdictCache()
+        self.schema = load_policy_schema()
+        self._schema_lock = threading.Lock()
+        self._validation_cache: Dict[str, Tuple] = {}
+
+        # Compiled XPath objects stay per worker thread, or per process
+        self._local = threading.local()
+        self.processes = processes
+        if processes > 0:
+            handler_factory = functools.partial(
+                _process_handler, blocklist=blocklist, verdict_db=verdict_db,
+                require_valid_policy=require_valid_policy, budget=budget,
+            )
+            self.pool = AffinityDispatcher(handler_factory, workers=processes, max_queue=max_queue)
+        else:
+            self.pool = WorkerPool(self._handle, workers=workers, max_queue=max_queue)
+
+        self._metrics_lock = threading.Lock()
+        self.started = time.time()
+        self.metrics = {
+            'requests': 0,
+            'errors': 0,
+            'rejected': 0,
+            'policies_found': 0,
+            'latency_ms_total': 0.0,
+            'latency_ms_max': 0.0,
+        }
+        self._servers = []
+        self._threads = []
+
+    # ---- enforcement ----
+
+    def _enforcer(self) -> PolicyEnforcer:
+        enforcer = getattr(self._local, 'enforcer', None)
+        if enforcer is None:
+            enforcer = PolicyEnforcer(classifier=self.classifier, verdict_cache=self.verdict_cache,
+                                      budget=self.budget, budget_metrics=self.budget_metrics)
+            self._local.enforcer = enforcer
+        return enforcer
+
+    def _validate(self, policy_xml: str) -> Tuple:
+        key = hashlib.sha256(policy_xml.encode('utf-8')).hexdigest()
+        cached = self._validation_cache.get(key)
+        if cached is None:
+            with self._schema_lock:
+                cached = tuple(validate_policy(policy_xml, self.schema))
+            if len(self._validation_cache) >= 1024:
+                self._validation_cache.clear()
+            self._validation_cache[key] = cached
+        return cached
+
+    def _handle(self, raw_email: bytes) -> Dict[str, Any]:
+        """Runs on a worker thread: parse, extract, validate and enforce"""
+        email_msg, verdict = handle_message(raw_email, self._enforcer(), self._validate,
+                                            self.require_valid_policy)
+        if self.audit_log is not None:
+            self.audit_log.record(email_msg, verdict['enforcement_results'])
+        return verdict
+
+    def enforce(self, raw_email: bytes) -> Tuple[int, Dict[str, Any]]:
+        """Queue a message and wait for its verdict; returns (HTTP status, body)"""
+        start = time.perf_counter()
+        try:
+            future = self.pool.submit(raw_email)
+        except PoolBusy as e:
+            self._count('rejected')
+            return 503, {'success': False, 'error': str(e)}
+        try:
+            verdict = future.result(timeout=self.request_timeout)
+            status = 200
+            if self.processes and self.audit_log is not None:
+                # Worker processes cannot reach the audit log's writer thread
+                headers = BytesHeaderParser().parsebytes(raw_email)
+                self.audit_log.record(headers, verdict['enforcement_results'])
+        except Exception as e:
+            self._count('errors')
+            verdict, status = {'success': False, 'error': str(e)}, 500
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            self.metrics['requests'] += 1
+            self.metrics['latency_ms_total'] += elapsed
+            self.metrics['latency_ms_max'] = max(self.metrics['latency_ms_max'], elapsed)
+            if verdict.get('policy_found'):
+                self.metrics['policies_found'] += 1
+        return status, verdict
+
+    def _count(self, key: str):
+        with self._metrics_lock:
+            self.metrics[key] += 1
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            'status': 'ok',
+            'uptime_s': round(time.time() - self.started, 3),
+            'queued': self.pool.qsize(),
+        }
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            snapshot = dict(self.metrics)
+        requests = snapshot['requests']
+        snapshot['latency_ms_avg'] = round(snapshot['latency_ms_total'] / requests, 3) if requests else 0.0
+        snapshot['queued'] = self.pool.qsize()
+        if self.processes:
+            # Caches and budget trips live in the worker processes
+            snapshot['routing'] = self.pool.stats()
+        else:
+            snapshot['verdict_cache'] = self.verdict_cache.stats()
+            snapshot['tracker_domains'] = len(self.classifier.trie)
+        if self.audit_log is not None:
+            snapshot['audit'] = self.audit_log.stats()
+        if self.budget is not None and not self.processes:
+            snapshot['budget'] = self.budget_metrics.stats()
+        return snapshot
+
+    # ---- servers ----
+
+    def start(self):
+        """Start the configured listeners on background threads"""
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            unix_server = _UnixServer(self.socket_path, _UnixHandler)
+            unix_server.daemon_ref = self
+            self._serve(unix_server, "unix-listener")
+        if self.http_address:
+            http_server = _HTTPServer(self.http_address, _HTTPHandler)
+            http_server.daemon_ref = self
+            self.http_address = http_server.server_address[:2]
+            self._serve(http_server, "http-listener")
+
+    def _serve(self, server, name: str):
+        thread = threading.Thread(target=server.serve_forever, name=name, daemon=True)
+        thread.start()
+        self._servers.append(server)
+        self._threads.append(thread)
+
+    def serve_forever(self):
+        if not self._servers:
+            self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers.clear()
+        self.pool.shutdown()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.audit_log is not None:
+            self.audit_log.close()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+    daemon_ref: EnforcementDaemon
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        chunks, size = [], 0
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_MESSAGE_BYTES:
+                self._reply({'success': False, 'error': 'message too large'})
+                return
+            chunks.append(chunk)
+        _, verdict = self.server.daemon_ref.enforce(b"".join(chunks))
+        self._reply(verdict)
+
+    def _reply(self, body: Dict[str, Any]):
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    daemon_ref: EnforcementDaemon
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    server_version = "PrivacyEnforcer/1.0"
+
+    def do_GET(self):
+        daemon = self.server.daemon_ref
+        if self.path == "/health":
+            self._reply(200, daemon.health())
+        elif self.path == "/metrics":
+            self._reply(200, daemon.metrics_snapshot())
+        else:
+            self._reply(404, {'success': False, 'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != "/enforce":
+            self._reply(404, {'success': False, 'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_MESSAGE_BYTES:
+            self._reply(413 if length else 411, {'success': False, 'error': 'bad message length'})
+            return
+        status, verdict = self.server.daemon_ref.enforce(self.rfile.read(length))
+        self._reply(status, verdict)
+
+    def _reply(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+def enforce_via_socket(socket_path: str, raw_email: bytes, timeout: float = 30.0) -> Dict[str, Any]:
+    """Client helper: send one message to a daemon's Unix socket"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(raw_email)
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+def enforce_via_http(url: str, raw_email: bytes, timeout: float = 30.0) -> Dict[str, Any]:
+    """Client helper: POST one message to a daemon's /enforce endpoint"""
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(
+        url.rstrip('/') + '/enforce', data=raw_email, method='POST',
+        headers={'Content-Type': 'message/rfc822'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Email privacy enforcement daemon")
+    parser.add_argument('--socket', help="Unix domain socket path")
+    parser.add_argument('--http', default="127.0.0.1:8765",
+                        help="HTTP listen address (host:port), or 'off'")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=0,
+                        help="Enforce in this many worker processes, routed by policy, "
+                             "instead of --workers threads")
+    parser.add_argument('--queue', type=int, default=256, help="Maximum queued messages")
+    parser.add_argument('--blocklist', help="Tracker blocklist file")
+    parser.add_argument('--verdict-db', help="SQLite file for the part verdict cache")
+    parser.add_argument('--audit', help="Audit log path (SQLite file)")
+    parser.add_argument('--require-valid', action='store_true',
+                        help="Skip enforcement of policies that fail XSD validation")
+    parser.add_argument('--message-budget-ms', type=float, help="Wall-clock limit per message")
+    parser.add_argument('--rule-budget-ms', type=float, help="Time limit per rule evaluation")
+    parser.add_argument('--max-nodes', type=int, help="XML nodes built per message")
+    parser.add_argument('--max-text-bytes', type=int, help="Text materialized per message")
+    parser.add_argument('--fail-closed', action='store_true',
+                        help="Block messages whose evaluation runs out of budget")
+    args = parser.parse_args(argv)
+
+    http_address = None
+    if args.http != 'off':
+        host, _, port = args.http.rpartition(':')
+        http_address = (host or "127.0.0.1", int(port))
+
+    budget = None
+    limits = (args.message_budget_ms, args.rule_budget_ms, args.max_nodes, args.max_text_bytes)
+    if any(limit is not None for limit in limits):
+        budget = EvaluationBudget(*limits, on_exceeded='closed' if args.fail_closed else 'open')
+
+    daemon = EnforcementDaemon(
+        socket_path=args.socket,
+        http_address=http_address,
+        workers=args.workers,
+        max_queue=args.queue,
+        classifier=TrackerClassifier.from_file(args.blocklist) if args.blocklist else None,
+        verdict_cache=PartVerdictCache(db_path=args.verdict_db),
+        audit_log=AuditLog(args.audit) if args.audit else None,
+        require_valid_policy=args.require_valid,
+        budget=budget,
+        processes=args.processes,
+        blocklist=args.blocklist,
+        verdict_db=args.verdict_db,
+    )
+    daemon.start()
+    if args.socket:
+        print(f"Enforcement daemon listening on unix:{args.socket}")
+    if http_address:
+        print(f"Enforcement daemon listening on http://{daemon.http_address[0]}:{daemon.http_address[1]}")
+    daemon.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
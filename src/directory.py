@@ -0,0 +1,272 @@
+"""
+Organization-managed default policies per sender address and domain
+"""
+
+import email.message
+import email.utils
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .compiler import compile_policy
+from .expiry import ExpiryScheduler, parse_expires, shared_scheduler
+from .trackers import DomainSuffixTrie
+
+
+@dataclass(frozen=True)
+class _Source:
+    """Where an entry's policy comes from: a file on disk or inline XML"""
+    path: Optional[str] = None
+    xml: Optional[str] = None
+
+
+@dataclass
+class DirectoryMatch:
+    pattern: str
+    policy_xml: str
+    bundle: Dict[str, Any]
+
+
+class _Snapshot:
+    """One immutable-by-convention view of the directory; swapped on reload"""
+
+    def __init__(self):
+        self.addresses: Dict[str, Tuple[str, _Source]] = {}
+        self.domains = DomainSuffixTrie()
+        self.index_mtime: Optional[int] = None
+
+    def add(self, pattern: str, source: _Source):
+        key = pattern.strip().lower()
+        if "@" in key:
+            self.addresses[key] = (key, source)
+        else:
+            domain = _normalize_domain(key[2:] if key.startswith("*.") else key)
+            self.domains.add(domain, (pattern, source))
+
+    def __len__(self) -> int:
+        return len(self.addresses) + len(self.domains)
+
+
+def _normalize_domain(domain: str) -> str:
+    domain = domain.strip().strip(".").lower()
+    if not domain.isascii():
+        domain = domain.encode("idna").decode("ascii")
+    return domain
+
+
+class PolicyDirectory:
+    """
+    Default policies keyed by sender address, domain or parent domain
+
+    Lookup order is exact address, then the longest registered suffix of
+    the sender's domain, so "hr.company.com" (or "*.hr.company.com") wins
+    over "company.com" for alice@eu.hr.company.com. Lookup walks one trie
+    node per domain label and is independent of the number of entries.
+
+    Entries come from an index file:
+
+        {"entries": {"ceo@company.com": "ceo.xml",
+                     "*.hr.company.com": "hr.xml",
+                     "company.com": "default.xml"}}
+
+    with paths relative to the index. Policy files are read and compiled on
+    first use and cached by (path, mtime, size). reload() builds a new
+    snapshot off to the side and swaps it in with one assignment, so
+    lookups already running keep using the old one.
+
+    A policy whose Metadata/Expires has passed no longer applies: lookup()
+    returns None for its entries. The cached policy is replaced by an
+    expired marker when the expiry scheduler calls back.
+    """
+
+    def __init__(self, index_path: Optional[str] = None, max_loaded: int = 1024,
+                 validate: bool = True, expiry: Optional[ExpiryScheduler] = None):
+        self.index_path = index_path
+        self.max_loaded = max_loaded
+        self.validate = validate
+        self.logger = logging.getLogger(__name__)
+        self._snapshot = _Snapshot()
+        # Bundle None marks an expired policy
+        self._loaded: "OrderedDict[Tuple, Tuple[str, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._loaded_lock = threading.Lock()
+        self._expiry = expiry
+        self._expiry_token = object()
+        self._expiring = set()
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        if index_path:
+            self.reload()
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    # ---- entries ----
+
+    def add(self, pattern: str, policy_xml: Optional[str] = None, path: Optional[str] = None):
+        """Register an entry in the live snapshot (not persisted to the index)"""
+        if (policy_xml is None) == (path is None):
+            raise ValueError("Give exactly one of policy_xml or path")
+        self._snapshot.add(pattern, _Source(path=path, xml=policy_xml))
+
+    def reload(self) -> bool:
+        """
+        Re-read the index file and swap in the new entries
+
+        Returns:
+            True if a new snapshot was installed; False if the index is
+            unchanged or could not be read (the old entries stay active)
+        """
+        if not self.index_path:
+            return False
+        with self._reload_lock:
+            try:
+                mtime = os.stat(self.index_path).st_mtime_ns
+                if mtime == self._snapshot.index_mtime:
+                    return False
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)["entries"]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.logger.error(f"Policy directory index could not be loaded: {e}")
+                return False
+
+            base = os.path.dirname(os.path.abspath(self.index_path))
+            snapshot = _Snapshot()
+            snapshot.index_mtime = mtime
+            for pattern, path in entries.items():
+                try:
+                    snapshot.add(pattern, _Source(path=os.path.join(base, path)))
+                except UnicodeError:
+                    self.logger.warning(f"Skipping invalid directory pattern {pattern!r}")
+            self._snapshot = snapshot
+            self.logger.info(f"Policy directory loaded: {len(snapshot)} entries")
+            return True
+
+    def start_watching(self, interval: float = 2.0):
+        """Poll the index file and hot-reload it when it changes"""
+        if self._watcher is not None or not self.index_path:
+            return
+        self._stop_watching.clear()
+
+        def watch():
+            while not self._stop_watching.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="policy-directory-watch", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    # ---- lookup ----
+
+    def resolve(self, sender: str) -> Optional[Tuple[str, _Source]]:
+        """Return (pattern, source) of the most specific entry for a sender"""
+        if "<" in sender or " " in sender.strip():
+            _, sender = email.utils.parseaddr(sender)
+        address = sender.strip().lower()
+        if "@" not in address:
+            return None
+        snapshot = self._snapshot
+        exact = snapshot.addresses.get(address)
+        if exact is not None:
+            return exact
+        try:
+            domain = _normalize_domain(address.rsplit("@", 1)[1])
+        except UnicodeError:
+            return None
+        match = snapshot.domains.longest_match(domain)
+        return match[1] if match else None
+
+    def lookup(self, sender: str) -> Optional[DirectoryMatch]:
+        """Compiled default policy for a sender, or None"""
+        resolved = self.resolve(sender)
+        if resolved is None:
+            return None
+        pattern, source = resolved
+        try:
+            policy_xml, bundle = self._load(source)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Directory policy for {pattern} could not be loaded: {e}")
+            return None
+        if bundle is None:
+            return None
+        return DirectoryMatch(pattern=pattern, policy_xml=policy_xml, bundle=bundle)
+
+    def policy_for_message(self, email_msg: email.message.Message) -> Optional[str]:
+        """Default policy XML for a message's From address, or None"""
+        sender = email_msg.get('From')
+        if not sender:
+            return None
+        match = self.lookup(str(sender))
+        return match.policy_xml if match else None
+
+    def _load(self, source: _Source) -> Tuple[str, Optional[Dict[str, Any]]]:
+        if source.path is not None:
+            stat = os.stat(source.path)
+            key = (source.path, stat.st_mtime_ns, stat.st_size)
+        else:
+            key = (None, source.xml)
+
+        with self._loaded_lock:
+            cached = self._loaded.get(key)
+            if cached is not None:
+                self._loaded.move_to_end(key)
+                return cached
+
+        # Read and compile outside the lock; a duplicate load is harmless
+        if source.path is not None:
+            with open(source.path, "r", encoding="utf-8") as f:
+                policy_xml = f.read()
+        else:
+            policy_xml = source.xml
+        bundle = compile_policy(policy_xml, validate=self.validate)
+        expires = bundle["policy"]["expires"]
+        deadline = parse_expires(expires)
+        scheduler = self._scheduler() if deadline is not None else None
+        if scheduler is not None and deadline <= scheduler.clock():
+            self.logger.info(f"Directory policy {source.path or 'inline'} expired at {expires}")
+            bundle = None
+        loaded = (policy_xml, bundle)
+
+        with self._loaded_lock:
+            self._loaded[key] = loaded
+            if bundle is not None and scheduler is not None:
+                self._expiring.add(key)
+                scheduler.schedule((self._expiry_token, key), deadline, self._policy_expired)
+            while len(self._loaded) > self.max_loaded:
+                evicted, _ = self._loaded.popitem(last=False)
+                if evicted in self._expiring:
+                    self._expiring.discard(evicted)
+                    self._scheduler().cancel((self._expiry_token, evicted))
+        return loaded
+
+    def _scheduler(self) -> ExpiryScheduler:
+        return self._expiry if self._expiry is not None else shared_scheduler()
+
+    def _policy_expired(self, token_key):
+        """Expiry callback: replace the cached policy with the expired marker"""
+        key = token_key[1]
+        with self._loaded_lock:
+            if key not in self._expiring:
+                return
+            self._expiring.discard(key)
+            policy_xml, _ = self._loaded[key]
+            self._loaded[key] = (policy_xml, None)
+        self.logger.info(f"Directory policy {key[0] or 'inline'} expired")
+
+    def stats(self) -> Dict[str, int]:
+        snapshot = self._snapshot
+        return {
+            'addresses': len(snapshot.addresses),
+            'domains': len(snapshot.domains),
+            'loaded_policies': len(self._loaded),
+            'expiring_policies': len(self._expiring),
+        }
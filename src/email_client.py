@@ -7,19 +7,40 @@ import smtplib
 import imaplib
 import email
 from email.mime.multipart import MIMEMultipart
-from typing import List, Dict, Any
+from typing import BinaryIO, Iterable, List, Dict, Any, Optional
 from .mime_handler import MIMEPrivacyHandler
 from .enforcer import PolicyEnforcer
 from .policy import PrivacyPolicy
+from .audit import AuditLog
+from .directory import PolicyDirectory
+from .ingest import ingest_stream
+from .tracing import Tracer, span
+from .composition import PolicyComposer
+from .compiler import PolicyCompileError
+from .expiry import PolicyExpired
+from .bulk_send import BulkSender, CampaignError, CampaignTemplate, Recipient, SMTPTransport
 
 class PrivacyAwareEmailClient:
     """
     Enhanced email client with privacy policy support
     """
     
-    def __init__(self):
-        self.enforcer = PolicyEnforcer()
+    def __init__(self, enforcer: Optional[PolicyEnforcer] = None,
+                 audit_log: Optional[AuditLog] = None,
+                 policy_directory: Optional[PolicyDirectory] = None,
+                 tracer: Optional[Tracer] = None,
+                 composer: Optional[PolicyComposer] = None,
+                 user_policy: Optional[str] = None):
+        self.enforcer = enforcer or PolicyEnforcer()
         self.mime_handler = MIMEPrivacyHandler()
+        self.audit_log = audit_log
+        self.policy_directory = policy_directory
+        # Also handed to the enforcer's spans through the active trace
+        self.tracer = tracer or Tracer()
+        # With a composer, the message policy, the directory default and
+        # the user's own policy all apply, merged into one plan
+        self.composer = composer
+        self.user_policy = user_policy
     
     def send_email(self, from_addr: str, to_addr: str, subject: str,
                   body_html: str, policy: PrivacyPolicy, 
@@ -63,7 +84,8 @@ class PrivacyAwareEmailClient:
                 'success': True,
                 'message_id': f"<{id(email_msg)}@privacy-system>",
                 'validation': validation,
-                'policy_size': len(policy_xml)
+                'policy_size': len(policy_xml),
+                'sent_email': email_msg
             }
             
         except Exception as e:
@@ -72,43 +94,138 @@ class PrivacyAwareEmailClient:
                 'error': str(e)
             }
     
+    def send_campaign(self, from_addr: str, subject: str, body_html: str,
+                      policy: PrivacyPolicy, recipients: Iterable[Recipient],
+                      smtp_server: str = "localhost", smtp_port: int = 587,
+                      username: str = None, password: str = None,
+                      workers: int = 4) -> Dict[str, Any]:
+        """
+        Send one policy-carrying message to many recipients
+
+        The message is built and its policy validated once; subject and
+        body may personalize with {{name}}, {{email}} or any key of a
+        recipient's fields (see bulk_send.CampaignTemplate).
+        """
+        try:
+            template = CampaignTemplate(from_addr, subject, body_html, policy)
+        except CampaignError as e:
+            return {'success': False, 'error': str(e)}
+        sender = BulkSender(
+            lambda: SMTPTransport(smtp_server, smtp_port, starttls=bool(username),
+                                  username=username, password=password),
+            workers=workers,
+        )
+        report = sender.send(template, recipients)
+        report['success'] = report['failed'] == 0
+        report['policy_size'] = len(template.policy_xml)
+        return report
+    
     def receive_email(self, raw_email: bytes) -> Dict[str, Any]:
         """
         Process incoming email with policy enforcement
         """
         try:
-            # Parse email
-            email_msg = email.message_from_bytes(raw_email)
-            
-            # Extract privacy policy
-            policy_xml = self.mime_handler.extract_policy(email_msg)
-            
-            if policy_xml:
-                print("✓ Privacy policy found, enforcing rules...")
-                
-                # Enforce policy
-                enforcement_results = self.enforcer.enforce_policy(email_msg, policy_xml)
-                
-                return {
-                    'success': True,
-                    'policy_found': True,
-                    'enforcement_results': enforcement_results,
-                    'processed_email': email_msg
-                }
-            else:
-                print("ℹ️  No privacy policy found, processing as normal email")
-                return {
-                    'success': True,
-                    'policy_found': False,
-                    'enforcement_results': None,
-                    'processed_email': email_msg
-                }
-                
+            with self.tracer.trace("receive_email", bytes=len(raw_email)):
+                # Parse email
+                with span("parse"):
+                    email_msg = email.message_from_bytes(raw_email)
+                return self._process_received(email_msg)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def receive_stream(self, source: BinaryIO, **ingest_options) -> Dict[str, Any]:
+        """
+        Process incoming email read in chunks from a file or socket
+        
+        Large part payloads are spooled to temporary files while parsing
+        (see ingest.StreamingIngestor for the options). The spool files are
+        removed once enforcement is done, so the payloads of spooled parts
+        in 'processed_email' are no longer readable afterwards.
+        """
+        ingestor = None
+        try:
+            with self.tracer.trace("receive_stream"):
+                with span("parse", streaming=True):
+                    email_msg, ingestor = ingest_stream(source, **ingest_options)
+                return self._process_received(email_msg)
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
+        finally:
+            if ingestor is not None:
+                ingestor.cleanup()
+    
+    def _process_received(self, email_msg: email.message.Message) -> Dict[str, Any]:
+        """Enforce the message's own policy, or the directory default for its sender"""
+        # Extract privacy policy
+        with span("extract_policy"):
+            policy_xml = self.mime_handler.extract_policy(email_msg)
+        policy_source = 'message'
+        
+        if self.composer is not None:
+            policy_xml, policy_source = self._compose_policies(email_msg, policy_xml)
+        # Fall back to the organization's default for the sender
+        elif not policy_xml and self.policy_directory is not None:
+            with span("directory_lookup"):
+                policy_xml = self.policy_directory.policy_for_message(email_msg)
+            policy_source = 'directory'
+        
+        if policy_xml:
+            print("✓ Privacy policy found, enforcing rules...")
+            
+            # Enforce policy
+            enforcement_results = self.enforcer.enforce_policy(email_msg, policy_xml)
+            if self.audit_log is not None:
+                self.audit_log.record(email_msg, enforcement_results)
+            
+            return {
+                'success': True,
+                'policy_found': True,
+                'policy_source': policy_source,
+                'enforcement_results': enforcement_results,
+                'processed_email': email_msg
+            }
+        else:
+            print("ℹ️  No privacy policy found, processing as normal email")
+            if self.audit_log is not None:
+                self.audit_log.record(email_msg, None)
+            return {
+                'success': True,
+                'policy_found': False,
+                'enforcement_results': None,
+                'processed_email': email_msg
+            }
+    
+    def _compose_policies(self, email_msg: email.message.Message, message_policy: Optional[str]):
+        """Merged plan of every policy that applies, and the sources it came from"""
+        # By authority: the organization's default, the user's own policy,
+        # then the sender's, which can only make their rules stricter
+        sources = {'directory': None, 'user': self.user_policy, 'message': message_policy}
+        if self.policy_directory is not None:
+            with span("directory_lookup"):
+                sources['directory'] = self.policy_directory.policy_for_message(email_msg)
+        present = [name for name, policy in sources.items() if policy]
+        if len(present) < 2:
+            return (sources[present[0]], present[0]) if present else (None, None)
+        try:
+            with span("compose", sources=len(present)):
+                plan = self.composer.compose(sources['directory'], sources['user'],
+                                             sender=sources['message'])
+        except PolicyCompileError as e:
+            if not message_policy:
+                raise
+            # An invalid sender policy must not disable our own ones
+            print(f"✗ Sender policy not composed: {e}")
+            return self._compose_policies(email_msg, None)
+        except PolicyExpired:
+            # Every policy has expired; enforcing any one reports that
+            return sources[present[0]], present[0]
+        return plan.policy_xml, '+'.join(present)
     
     def simulate_email_flow(self, from_addr: str, to_addr: str, 
                            subject: str, body_html: str, policy: PrivacyPolicy) -> Dict[str, Any]:
@@ -128,10 +245,7 @@ class PrivacyAwareEmailClient:
         
         # Step 2: Simulate transmission (convert to bytes and back)
         print("\n2. TRANSMITTING EMAIL")
-        email_msg = self.mime_handler.create_email_with_policy(
-            from_addr, to_addr, subject, body_html, policy.to_string()
-        )
-        raw_email = email_msg.as_bytes()
+        raw_email = send_result['sent_email'].as_bytes()
         print(f"✓ Email transmitted: {len(raw_email)} bytes")
         
         # Step 3: Receive and process email
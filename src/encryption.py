@@ -0,0 +1,383 @@
+"""
+Chunked AES-GCM encryption of MIME parts for the "encrypt" action
+
+Stream format (all integers big-endian):
+
+    header  = MAGIC (4) | chunk size (4) | nonce prefix (8)
+    chunk_i = AES-GCM(key, nonce = prefix | i (4), aad = header | final flag (1))
+
+Every chunk except the last holds exactly `chunk size` plaintext bytes.
+The final flag is authenticated, so truncating or reordering chunks is
+detected on decryption. Each part gets a random content key, wrapped
+(RFC 3394) for every visible (To and Cc) recipient with a key derived
+from the keyring. Wrapped keys are headers of the part, so Bcc recipients
+get theirs only in their own copy of the message (see envelope_copies).
+
+Encryption streams the plaintext through a spool, but the encrypted part
+holds its base64 ciphertext as one str payload, about 1.37 times the
+plaintext, because the email package serializes parts from their payload
+strings. as_bytes() then holds a copy of the whole serialized message. A
+64 MB part raises peak RSS by about 175 MB to encrypt and 340 MB once
+serialized; larger parts should be refused before the encrypt action.
+"""
+
+import base64
+import binascii
+import copy
+import email
+import email.utils
+import io
+import mmap
+import os
+import struct
+import tempfile
+from email.mime.base import MIMEBase
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap, aes_key_wrap
+
+MAGIC = b"PPG1"
+HEADER = struct.Struct(">4sI8s")
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_CHUNKS = 2 ** 32
+
+ENCRYPTED_SUBTYPE = "vnd.privacy-encrypted"
+ORIGINAL_TYPE_HEADER = "X-Privacy-Encrypted-Content-Type"
+WRAPPED_KEY_HEADER = "X-Privacy-Wrapped-Key"
+
+# Base64 works in 3-byte groups; 57 input bytes make one 76 character line
+_B64_LINE_BYTES = 57
+# Encoded parts larger than this are spooled to disk while encrypting
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class DecryptionError(ValueError):
+    pass
+
+
+class Keyring:
+    """
+    Derives per-recipient key-encryption keys from a master secret
+
+    Derivations are cached per recipient, so bulk mail to the same
+    addresses pays for HKDF once.
+    """
+
+    def __init__(self, master_key: bytes, cache_size: int = 4096):
+        if len(master_key) < 16:
+            raise ValueError("Master key must be at least 16 bytes")
+        self._master_key = master_key
+        self.key_for = lru_cache(maxsize=cache_size)(self._derive)
+
+    @classmethod
+    def generate(cls, **kwargs) -> "Keyring":
+        return cls(AESGCM.generate_key(bit_length=256), **kwargs)
+
+    def _derive(self, recipient: str) -> bytes:
+        return HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None,
+            info=b"email-privacy-recipient:" + recipient.strip().lower().encode('utf-8')
+        ).derive(self._master_key)
+
+    def wrap(self, recipient: str, content_key: bytes) -> bytes:
+        return aes_key_wrap(self.key_for(recipient), content_key)
+
+    def unwrap(self, recipient: str, wrapped: bytes) -> bytes:
+        return aes_key_unwrap(self.key_for(recipient), wrapped)
+
+
+def _read_full(src: BinaryIO, size: int) -> bytes:
+    """read() that only returns short at end of stream"""
+    data = src.read(size)
+    if not data or len(data) == size:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        more = src.read(remaining)
+        if not more:
+            break
+        parts.append(more)
+        remaining -= len(more)
+    return b"".join(parts)
+
+
+def iter_encrypt(src: BinaryIO, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the header and then one ciphertext chunk at a time"""
+    aead = AESGCM(key)
+    header = HEADER.pack(MAGIC, chunk_size, os.urandom(8))
+    yield header
+    prefix = header[8:]
+    counter = 0
+    chunk = _read_full(src, chunk_size)
+    while True:
+        following = _read_full(src, chunk_size) if len(chunk) == chunk_size else b""
+        final = not following
+        if counter >= MAX_CHUNKS:
+            raise ValueError("Stream too long for the chunk counter")
+        nonce = prefix + struct.pack(">I", counter)
+        yield aead.encrypt(nonce, chunk, header + (b"\x01" if final else b"\x00"))
+        if final:
+            return
+        chunk = following
+        counter += 1
+
+
+def iter_decrypt(src: BinaryIO, key: bytes) -> Iterator[bytes]:
+    """Yield plaintext chunks; raises DecryptionError on any tampering"""
+    header = _read_full(src, HEADER.size)
+    if len(header) != HEADER.size:
+        raise DecryptionError("Truncated header")
+    magic, chunk_size, prefix = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise DecryptionError("Not an encrypted part")
+    aead = AESGCM(key)
+    sealed_size = chunk_size + TAG_SIZE
+    counter = 0
+    chunk = _read_full(src, sealed_size)
+    while True:
+        following = _read_full(src, sealed_size) if len(chunk) == sealed_size else b""
+        final = not following
+        nonce = prefix + struct.pack(">I", counter)
+        try:
+            yield aead.decrypt(nonce, chunk, header + (b"\x01" if final else b"\x00"))
+        except Exception as e:
+            raise DecryptionError(f"Chunk {counter} failed authentication") from e
+        if final:
+            return
+        chunk = following
+        counter += 1
+
+
+def encrypt_stream(src: BinaryIO, dst: BinaryIO, key: bytes,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Encrypt src into dst; returns the number of bytes written"""
+    written = 0
+    for block in iter_encrypt(src, key, chunk_size):
+        dst.write(block)
+        written += len(block)
+    return written
+
+
+def decrypt_stream(src: BinaryIO, dst: BinaryIO, key: bytes) -> int:
+    written = 0
+    for block in iter_decrypt(src, key):
+        dst.write(block)
+        written += len(block)
+    return written
+
+
+class _Base64Reader(io.RawIOBase):
+    """Decodes a base64 transfer-encoded payload string incrementally"""
+
+    def __init__(self, encoded: str, window: int = 64 * 1024):
+        self._encoded = encoded
+        self._pos = 0
+        self._window = window
+        self._carry = ""
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, out) -> int:
+        while len(self._buffer) < len(out) and (self._pos < len(self._encoded) or self._carry):
+            text = self._carry + "".join(self._encoded[self._pos:self._pos + self._window].split())
+            self._pos += self._window
+            usable = len(text) - len(text) % 4 if self._pos < len(self._encoded) else len(text)
+            self._carry = text[usable:]
+            try:
+                self._buffer += base64.b64decode(text[:usable])
+            except binascii.Error:
+                # Same leniency as Message.get_payload(decode=True)
+                self._buffer += base64.b64decode(text[:usable] + "==", validate=False)
+        n = min(len(out), len(self._buffer))
+        out[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _payload_reader(part: email.message.Message) -> BinaryIO:
+    """Readable stream over a leaf part's decoded content"""
+    spooled = getattr(part, 'spooled_payload', None)
+    if spooled is not None:
+        return open(spooled, 'rb')
+    payload = part.get_payload()
+    if isinstance(payload, str) and part.get('Content-Transfer-Encoding', '').strip().lower() == 'base64':
+        return io.BufferedReader(_Base64Reader(payload), buffer_size=DEFAULT_CHUNK_SIZE)
+    return io.BytesIO(part.get_payload(decode=True) or b"")
+
+
+def _encode_lines(blocks: Iterable[bytes], dst: BinaryIO) -> int:
+    """Base64-encode a stream of blocks into 76 character lines written to dst"""
+    written = 0
+    carry = b""
+    for block in blocks:
+        data = carry + block if carry else block
+        usable = len(data) - len(data) % _B64_LINE_BYTES
+        written += dst.write(base64.encodebytes(data[:usable]))
+        carry = data[usable:]
+    if carry:
+        written += dst.write(base64.encodebytes(carry))
+    return written
+
+
+def _spooled_text(spool: "tempfile.SpooledTemporaryFile", size: int) -> str:
+    """The ASCII content of a spool, decoded straight from disk when it rolled over"""
+    if size <= SPOOL_MAX_MEMORY:
+        spool.seek(0)
+        return spool.read().decode('ascii')
+    spool.flush()
+    # Decoding the mapped file skips the bytes copy a read() would make
+    with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        return str(view, 'ascii')
+
+
+class PartEncryptor:
+    """Replaces leaf MIME parts with chunked AES-GCM encrypted parts"""
+
+    def __init__(self, keyring: Keyring, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.keyring = keyring
+        self.chunk_size = chunk_size
+
+    def encrypt_part(self, part: email.message.Message, recipients: List[str]) -> MIMEBase:
+        """Build the encrypted replacement for one leaf part"""
+        content_key = AESGCM.generate_key(bit_length=256)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as spool:
+            reader = _payload_reader(part)
+            try:
+                size = _encode_lines(iter_encrypt(reader, content_key, self.chunk_size), spool)
+            finally:
+                reader.close()
+            encoded = _spooled_text(spool, size)
+
+        new_part = MIMEBase('application', ENCRYPTED_SUBTYPE)
+        new_part[ORIGINAL_TYPE_HEADER] = part.get('Content-Type', 'text/plain')
+        disposition = part.get('Content-Disposition')
+        if disposition:
+            new_part['Content-Disposition'] = disposition
+        for recipient in recipients:
+            wrapped = base64.b64encode(self.keyring.wrap(recipient, content_key)).decode('ascii')
+            new_part[WRAPPED_KEY_HEADER] = f"{recipient}; {wrapped}"
+        new_part['Content-Transfer-Encoding'] = 'base64'
+        new_part.set_payload(encoded)
+        # Kept in memory only, for wrapping to Bcc recipients per copy
+        new_part.content_key = content_key
+        return new_part
+
+    def encrypt_parts(self, email_msg: email.message.Message, parts: List[email.message.Message],
+                      recipients: Optional[List[str]] = None) -> int:
+        """
+        Encrypt the given leaf parts of email_msg in place
+
+        Each encrypted part is swapped into its parent's payload list; other
+        parts keep their original objects and serialized form. Keys are
+        wrapped for the To and Cc recipients; envelope_copies() gives the
+        copies to send to Bcc recipients.
+
+        Returns:
+            Number of parts encrypted
+        """
+        recipients = recipients or message_recipients(email_msg)
+        if not recipients and not bcc_recipients(email_msg):
+            raise ValueError("Message has no recipients to encrypt for")
+        parents: Dict[int, email.message.Message] = {}
+        for container in email_msg.walk():
+            if container.is_multipart():
+                for child in container.get_payload():
+                    parents[id(child)] = container
+
+        count = 0
+        for part in parts:
+            if part.get_content_subtype() == ENCRYPTED_SUBTYPE:
+                continue
+            parent = parents.get(id(part))
+            if parent is None and part is not email_msg:
+                continue  # no longer in the tree, e.g. already replaced
+            new_part = self.encrypt_part(part, recipients)
+            if parent is None:
+                # Single-part message: the root itself becomes the encrypted part
+                for header in ('Content-Type', 'Content-Transfer-Encoding', 'Content-Disposition'):
+                    del part[header]
+                for header, value in new_part.items():
+                    part[header] = value
+                part.set_payload(new_part.get_payload())
+            else:
+                children = parent.get_payload()
+                children[next(i for i, child in enumerate(children) if child is part)] = new_part
+            count += 1
+        return count
+
+    def envelope_copies(self, email_msg: email.message.Message) -> List[Tuple[List[str], email.message.Message]]:
+        """
+        The messages to deliver after encrypt_parts(), as (envelope recipients, message)
+
+        To and Cc recipients share one copy. Each Bcc recipient gets a copy
+        whose encrypted parts hold only their own wrapped key. No copy has
+        a Bcc header.
+        """
+        visible = message_recipients(email_msg)
+        copies = []
+        if visible:
+            shared = copy.deepcopy(email_msg)
+            del shared['Bcc']
+            copies.append((visible, shared))
+        for recipient in bcc_recipients(email_msg):
+            if recipient in visible:
+                continue
+            private = copy.deepcopy(email_msg)
+            del private['Bcc']
+            for original, part in zip(email_msg.walk(), private.walk()):
+                content_key = getattr(original, 'content_key', None)
+                if content_key is None:
+                    continue
+                del part[WRAPPED_KEY_HEADER]
+                wrapped = base64.b64encode(self.keyring.wrap(recipient, content_key)).decode('ascii')
+                part[WRAPPED_KEY_HEADER] = f"{recipient}; {wrapped}"
+            copies.append(([recipient], private))
+        return copies
+
+    def decrypt_part(self, part: email.message.Message, recipient: str, dst: BinaryIO) -> str:
+        """
+        Stream the plaintext of an encrypted part into dst
+
+        Returns:
+            The original Content-Type of the part
+        """
+        content_key = None
+        for value in part.get_all(WRAPPED_KEY_HEADER, []):
+            addr, _, wrapped = str(value).rpartition(';')
+            if addr.strip().lower() == recipient.strip().lower():
+                content_key = self.keyring.unwrap(recipient, base64.b64decode(wrapped.strip()))
+                break
+        if content_key is None:
+            raise DecryptionError(f"Part was not encrypted for {recipient}")
+        decrypt_stream(_payload_reader(part), dst, content_key)
+        return part.get(ORIGINAL_TYPE_HEADER, 'application/octet-stream')
+
+
+def message_recipients(email_msg: email.message.Message) -> List[str]:
+    """Lowercased addresses from To and Cc, in order, without duplicates"""
+    return _addresses(email_msg, ('To', 'Cc'))
+
+
+def bcc_recipients(email_msg: email.message.Message) -> List[str]:
+    """Lowercased addresses from Bcc, in order, without duplicates"""
+    return _addresses(email_msg, ('Bcc',))
+
+
+def _addresses(email_msg: email.message.Message, headers: Tuple[str, ...]) -> List[str]:
+    values = []
+    for header in headers:
+        values.extend(str(v) for v in email_msg.get_all(header, []))
+    seen = []
+    for _, addr in email.utils.getaddresses(values):
+        addr = addr.strip().lower()
+        if addr and addr not in seen:
+            seen.append(addr)
+    return seen
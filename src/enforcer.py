@@ -1,80 +1,349 @@
 import email
-from email import policy
-from email.parser import BytesParser
+import email.message
+import hashlib
 from lxml import etree as ET
 import logging
-from typing import List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+from .trackers import TrackerClassifier
+from .verdict_cache import PartVerdictCache
+from .xpath_analysis import (XPathSyntaxError, cost_degree, optimize_xpath, reads_part_text,
+                             rule_locality, rule_stage)
+from .compiler import PolicyCostError, rule_cost_errors
+from .expiry import ExpiryScheduler, PolicyExpired, parse_expires, shared_scheduler
+from .prefilter import LiteralPrefilter, message_texts, spooled_windows, xpath_requirement
+from . import budgets, tracing, xpath_functions
+from .budgets import BudgetExceeded, BudgetMetrics, EvaluationBudget
+from .tracing import Tracer, span
+from .xpath_functions import MessageSources, compile_xpath, pattern_errors, rewrite_raw_content
+from . import xslt_backend
+from .xslt_backend import XsltPlan
+
+if TYPE_CHECKING:
+    # cryptography is only imported once a policy actually encrypts
+    from .encryption import PartEncryptor
 
 class PolicyEnforcer:
     """Enforces privacy policies on email messages"""
     
-    def __init__(self):
+    MAX_CACHED_POLICIES = 256
+    STAGES = ('header', 'structure', 'content')
+    # Fewer leaf parts than this are not worth handing to the part pool
+    PARALLEL_MIN_PARTS = 2
+    # Spooled parts (see ingest.py) are evaluated on this much of their
+    # payload; a content rule that does not match the preview but whose
+    # literals occur further on blocks the message (see _fail_closed)
+    SPOOLED_PREVIEW_BYTES = 1024 * 1024
+    
+    def __init__(self, classifier: Optional[TrackerClassifier] = None,
+                 verdict_cache: Optional[PartVerdictCache] = None,
+                 encryptor: Optional['PartEncryptor'] = None,
+                 early_exit: bool = True, part_workers: int = 0,
+                 tracer: Optional[Tracer] = None, optimize: bool = True,
+                 max_rule_cost: Optional[str] = None, cost_action: str = 'skip',
+                 budget: Optional[EvaluationBudget] = None,
+                 budget_metrics: Optional[BudgetMetrics] = None,
+                 raw_content: str = 'rewrite', backend: str = 'xpath',
+                 prefilter: bool = True, expiry: Optional[ExpiryScheduler] = None):
         self.logger = logging.getLogger(__name__)
         self.ns = {"pp": "urn:email:privacy:1.0"}
+        self.classifier = classifier or TrackerClassifier()
+        self.verdict_cache = verdict_cache
+        self.encryptor = encryptor
+        self.early_exit = early_exit
+        self.tracer = tracer
+        # Threads for building and evaluating the parts of one message;
+        # lxml releases the GIL while parsing, so large parts overlap
+        self.part_workers = part_workers
+        self._part_pool: Optional[ThreadPoolExecutor] = None
+        self._part_pool_lock = threading.Lock()
+        self._stage_evaluators = {
+            'header': self._evaluate_header_stage,
+            'structure': self._evaluate_structure_stage,
+            'content': self._evaluate_content_stage,
+        }
+        self._policies: Dict[str, Tuple[str, List[Dict[str, Any]]]] = {}
+        # Sender policies are untrusted: rewrite rule XPath into cheaper
+        # equivalents and, with max_rule_cost, skip the rules (or reject
+        # the whole policy, cost_action='reject') still estimated above it
+        if max_rule_cost is not None:
+            cost_degree(max_rule_cost)
+        if cost_action not in ('skip', 'reject'):
+            raise ValueError("cost_action must be 'skip' or 'reject'")
+        self.optimize = optimize
+        self.max_rule_cost = max_rule_cost
+        self.cost_action = cost_action
+        self._skipped_for_cost: Dict[str, List[Dict[str, Any]]] = {}
+        self._rejected: Dict[str, ValueError] = {}
+        # Runtime limits per message (see budgets.py); trips are counted
+        # in budget_metrics, which may be shared between enforcers
+        self.budget = budget
+        self.budget_metrics = budget_metrics
+        # HTML parts are searched through pp:raw-contains and friends (see
+        # xpath_functions.py) instead of a <raw-content> copy in the tree.
+        # 'rewrite' turns raw-content rules into those calls and only builds
+        # the copy for rules it cannot rewrite; 'materialize' always builds it
+        if raw_content not in ('rewrite', 'materialize'):
+            raise ValueError("raw_content must be 'rewrite' or 'materialize'")
+        self.raw_content = raw_content
+        # 'xpath' runs one compiled XPath per rule; 'xslt' runs the rules of
+        # each stage as one stylesheet (see xslt_backend.py); 'auto' does so
+        # for stages with at least xslt_backend.MIN_RULES rules.
+        # set_backend() overrides the choice for one policy.
+        self._check_backend(backend)
+        self.backend = backend
+        self._backends: Dict[str, str] = {}
+        self._plans: "OrderedDict[str, XsltPlan]" = OrderedDict()
+        self._plans_lock = threading.Lock()
+        # Rules needing string literals the message does not contain are
+        # not evaluated, and a message left with header rules only is never
+        # turned into XML (see prefilter.py)
+        self.prefilter = prefilter
+        self._prefilters: Dict[str, LiteralPrefilter] = {}
+        self._prefilter_lock = threading.Lock()
+        self._prefilter_counts = {'messages': 0, 'rules_skipped': 0, 'xml_skipped': 0}
+        # A policy past its Metadata/Expires is not enforced. Its cache
+        # entry is replaced by an expired marker when the scheduler calls
+        # back (see expiry.py), so lookups never check the time
+        self._expiry = expiry
+        self._expiry_token = object()
+        self._expires: Dict[str, str] = {}
+    
+    @staticmethod
+    def _check_backend(backend: str):
+        if backend not in ('xpath', 'xslt', 'auto'):
+            raise ValueError("backend must be 'xpath', 'xslt' or 'auto'")
+    
+    def set_backend(self, policy_xml: str, backend: Optional[str]):
+        """Evaluate one policy with the given backend (None: the default again)"""
+        digest, _ = self._load_policy(policy_xml)
+        if backend is None:
+            self._backends.pop(digest, None)
+            return
+        self._check_backend(backend)
+        self._backends[digest] = backend
     
     def parse_email_to_xml(self, email_msg):
         """Convert MIME email to XML representation for XPath processing"""
+        return self._build_email_xml(email_msg)[0]
+    
+    def _build_email_xml(self, email_msg, raw_content: bool = True):
+        """Build the email XML; also returns the MIME part behind each body child"""
         root = ET.Element("email")
         
         # Headers
-        headers_elem = ET.SubElement(root, "headers")
-        for key, value in email_msg.items():
-            header_elem = ET.SubElement(headers_elem, "header", name=key)
-            header_elem.text = value
+        self._add_header_elements(root, email_msg)
         
-        # Body parts - FIXED VERSION
+        # Body parts, built independently (possibly on the part pool) and
+        # appended in MIME order
         body_elem = ET.SubElement(root, "body")
+        xml_parts = []
+        leaves = [part for part in email_msg.walk() if not part.is_multipart()]
+        with span("build_xml", parts=len(leaves)):
+            built = self._map_parts(lambda part: self._build_part_element(part, raw_content), leaves)
+            for part, part_elem in zip(leaves, built):
+                if part_elem is not None:
+                    body_elem.append(part_elem)
+                    xml_parts.append(part)
+        
+        return root, xml_parts
+    
+    def _build_part_element(self, part, raw_content: bool = True):
+        """The XML for one part, detached from any tree"""
+        holder = ET.Element("body")
+        with span("xml_part", type=part.get_content_type()):
+            part_elem = self._add_part_element(holder, part, raw_content=raw_content)
+        if part_elem is not None:
+            holder.remove(part_elem)
+        return part_elem
+    
+    def _map_parts(self, func, parts: List) -> List:
+        """func over parts, on the part pool when it is enabled and worth it"""
+        if self.part_workers < 2 or len(parts) < self.PARALLEL_MIN_PARTS:
+            return [func(part) for part in parts]
+        func = budgets.bind(tracing.bind(func))
+        if self._part_pool is None:
+            with self._part_pool_lock:
+                if self._part_pool is None:
+                    self._part_pool = ThreadPoolExecutor(
+                        max_workers=self.part_workers, thread_name_prefix="enforce-part"
+                    )
+        return list(self._part_pool.map(func, parts))
+    
+    def close(self):
+        """Shut down the part pool, if one was started"""
+        if self._part_pool is not None:
+            self._part_pool.shutdown()
+            self._part_pool = None
+    
+    def _build_structure_xml(self, email_msg):
+        """Headers plus one element per part with its type and filename, no payloads"""
+        root = ET.Element("email")
+        self._add_header_elements(root, email_msg)
+        body_elem = ET.SubElement(root, "body")
+        xml_parts = []
         for part in email_msg.walk():
             if part.is_multipart():
                 continue
+            # Same parts _build_email_xml keeps, without decoding them
+            raw = part.get_payload()
+            if isinstance(raw, str) and part.get('Content-Transfer-Encoding', '').strip().lower() == 'base64':
+                raw = raw.strip()
+            if not raw and getattr(part, 'spooled_payload', None) is None:
+                continue
+            tag = "html-part" if part.get_content_type() == 'text/html' else "part"
+            self._add_part_skeleton(body_elem, tag, part)
+            xml_parts.append(part)
+        return root, xml_parts
+    
+    @staticmethod
+    def _add_part_skeleton(body_elem, tag: str, part):
+        part_elem = ET.SubElement(body_elem, tag)
+        ET.SubElement(part_elem, "content-type").text = part.get_content_type()
+        filename = part.get_filename()
+        if filename:
+            try:
+                ET.SubElement(part_elem, "filename").text = filename
+            except ValueError:
+                pass
+        return part_elem
+    
+    def _add_header_elements(self, root, email_msg):
+        headers_elem = ET.SubElement(root, "headers")
+        items = email_msg.items()
+        budgets.charge(nodes=len(items), text_bytes=sum(len(value) for _, value in items))
+        for key, value in items:
+            header_elem = ET.SubElement(headers_elem, "header", name=key)
+            header_elem.text = value
+        return headers_elem
+    
+    def _add_part_element(self, body_elem, part, payload=None, raw_content: bool = True):
+        """Append the XML for one leaf MIME part; returns the element or None"""
+        content_type = part.get_content_type()
+        if payload is None:
+            payload = self._part_payload(part)
+        part_elem = None
+        meter = budgets.current_meter()
+        if meter is not None and payload:
+            # Charged before decoding, so an oversized part is never parsed
+            meter.charge_part(part, len(payload))
+        
+        if payload and content_type == 'text/html':
+            try:
+                html_content = payload.decode('utf-8', errors='ignore')
+                part_elem = self._add_part_skeleton(body_elem, "html-part", part)
                 
-            content_type = part.get_content_type()
-            payload = part.get_payload(decode=True)
-            
-            if payload and content_type == 'text/html':
-                try:
-                    html_content = payload.decode('utf-8', errors='ignore')
-                    part_elem = ET.SubElement(body_elem, "html-part")
-                    ET.SubElement(part_elem, "content-type").text = content_type
-                    
-                    # Add the RAW HTML as text for text-based searching
+                if raw_content:
+                    # The raw HTML as text, for rules that search it with
+                    # contains(., ...) rather than pp:raw-contains
                     raw_content_elem = ET.SubElement(part_elem, "raw-content")
                     raw_content_elem.text = html_content
+                
+                # Every URL in the part, classified against the tracker blocklist
+                self._add_url_elements(part_elem, html_content)
+                
+                # Also try to parse HTML and create actual XML elements
+                try:
+                    # Wrap in root element and parse
+                    wrapped_html = f"<html-wrapper>{html_content}</html-wrapper>"
+                    html_wrapper = ET.fromstring(wrapped_html)
                     
-                    # Also try to parse HTML and create actual XML elements
-                    try:
-                        # Wrap in root element and parse
-                        wrapped_html = f"<html-wrapper>{html_content}</html-wrapper>"
-                        html_wrapper = ET.fromstring(wrapped_html)
-                        
-                        # Add all child elements as actual XML
-                        for child in html_wrapper:
-                            part_elem.append(child)
-                            
-                    except ET.ParseError as e:
-                        # If HTML parsing fails, we'll rely on text searching
-                        ET.SubElement(part_elem, "parse-error").text = str(e)
+                    if meter is not None and meter.budget.max_nodes is not None:
+                        meter.charge(nodes=sum(1 for _ in html_wrapper.iter()))
+                    
+                    # Add all child elements as actual XML
+                    for child in html_wrapper:
+                        part_elem.append(child)
                         
-                except Exception as e:
-                    part_elem = ET.SubElement(body_elem, "part", error=str(e))
-            
-            elif payload:
-                # Handle other content types
-                part_elem = ET.SubElement(body_elem, "part")
-                ET.SubElement(part_elem, "content-type").text = content_type
-                try:
-                    text_content = payload.decode('utf-8', errors='ignore')
-                    content_elem = ET.SubElement(part_elem, "content")
-                    content_elem.text = text_content
-                except:
-                    content_elem = ET.SubElement(part_elem, "content")
-                    content_elem.text = "[binary data]"
+                except ET.ParseError as e:
+                    # If HTML parsing fails, we'll rely on text searching
+                    ET.SubElement(part_elem, "parse-error").text = str(e)
+                    
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                part_elem = ET.SubElement(body_elem, "part", error=str(e))
+        
+        elif payload:
+            # Handle other content types
+            part_elem = self._add_part_skeleton(body_elem, "part", part)
+            try:
+                text_content = payload.decode('utf-8', errors='ignore')
+                content_elem = ET.SubElement(part_elem, "content")
+                content_elem.text = text_content
+            except:
+                content_elem = ET.SubElement(part_elem, "content")
+                content_elem.text = "[binary data]"
+        
+        if part_elem is not None and getattr(part, 'spooled_payload', None) is not None:
+            # Rules only saw the first SPOOLED_PREVIEW_BYTES of this part
+            part_elem.set("spooled", "true")
+            part_elem.set("size", str(part.spooled_size))
         
-        return root
+        return part_elem
+    
+    def _add_url_elements(self, part_elem, html_content: str):
+        """Expose extracted URLs to rules as <urls><url .../></urls> nodes"""
+        urls_elem = ET.SubElement(part_elem, "urls")
+        for ref in self.classifier.classify(html_content):
+            attrib = {
+                "href": ref.url,
+                "tag": ref.tag,
+                "attr": ref.attr,
+                "tracker": "true" if ref.tracker else "false",
+                "pixel": "true" if ref.pixel else "false",
+                "hidden": "true" if ref.hidden else "false",
+            }
+            if ref.host:
+                attrib["host"] = ref.host
+            try:
+                ET.SubElement(urls_elem, "url", attrib)
+            except ValueError:
+                # URL contains characters that are not allowed in XML
+                continue
     
     def enforce_policy(self, email_msg: email.message.Message, 
-                      policy_xml: str) -> Dict[str, Any]:
-        """Enforce privacy policy on email message"""
+                      policy_xml: str, phase: str = 'at-use') -> Dict[str, Any]:
+        """
+        Enforce privacy policy on email message
+        
+        Rules run in stages, each building only the XML it needs: headers,
+        then structure (part types and filenames), then content. When a
+        stage ends in a block and early_exit is set, the later stages and
+        the parsing they need are skipped. Rules needing strings the message
+        does not contain are not evaluated at all (see prefilter.py).
+        
+        With a budget, running out of it ends evaluation early: the matches
+        found so far are applied and the results are flagged 'partial'.
+        
+        Parts spooled to disk by the streaming ingestor are evaluated on a
+        preview. Content rules the preview cannot decide block the message
+        and are listed in 'undecided_rules'.
+        """
+        if self.tracer is None:
+            return self._enforce_policy(email_msg, policy_xml, phase)
+        with self.tracer.trace("enforce_policy", phase=phase):
+            return self._enforce_policy(email_msg, policy_xml, phase)
+    
+    def _enforce_policy(self, email_msg: email.message.Message,
+                        policy_xml: str, phase: str) -> Dict[str, Any]:
+        if self.budget is None:
+            return self._enforce_stages(email_msg, policy_xml, phase)
+        meter = self.budget.meter()
+        token = budgets.activate(meter)
+        try:
+            results = self._enforce_stages(email_msg, policy_xml, phase)
+        finally:
+            budgets.deactivate(token)
+        if self.budget_metrics is not None:
+            self.budget_metrics.record(meter.tripped, self.budget.fail_closed)
+        return results
+    
+    def _enforce_stages(self, email_msg: email.message.Message,
+                        policy_xml: str, phase: str) -> Dict[str, Any]:
         results = {
             'actions_taken': [],
             'warnings': [],
@@ -83,62 +352,627 @@ class PolicyEnforcer:
         }
         
         try:
-            # Parse policy
-            policy_root = ET.fromstring(policy_xml.encode('utf-8'))
-            
-            # Convert email to XML for XPath processing
-            email_xml = self.parse_email_to_xml(email_msg)
-            
-            # DEBUG: Print the XML structure to see what we're working with
-            print("DEBUG - Email XML Structure:")
-            print(ET.tostring(email_xml, encoding='unicode', pretty_print=True))
-            print("=" * 50)
-            
-            # Process each rule
-            for rule_elem in policy_root.findall(".//pp:Rule", self.ns):
-                rule_id = rule_elem.get('id')
-                scope = rule_elem.find('./pp:Scope', self.ns)
-                
-                if scope is not None and scope.get('phase') != 'at-use':
-                    continue  # Skip rules not for current phase
-                
-                condition_elem = rule_elem.find('./pp:Condition', self.ns)
-                action_elem = rule_elem.find('./pp:Action', self.ns)
-                
-                if condition_elem is None or action_elem is None:
-                    continue
-                
-                # Evaluate XPath condition
-                xpath_elem = condition_elem.find('./pp:XPath', self.ns)
-                if xpath_elem is not None and xpath_elem.text:
-                    xpath_expr = xpath_elem.text.strip()
-                    try:
-                        print(f"DEBUG - Testing rule {rule_id} with XPath: {xpath_expr}")
-                        matches = email_xml.xpath(xpath_expr)
-                        print(f"DEBUG - Found {len(matches)} matches")
-                        
-                        if matches:
-                            action_type = action_elem.get('type')
-                            action_msg = action_elem.get('message', '')
-                            
-                            self._execute_action(
-                                action_type, rule_id, action_msg, 
-                                matches, results, email_msg
-                            )
-                    except ET.XPathError as e:
-                        print(f"DEBUG - XPath error in rule {rule_id}: {e}")
-                        self.logger.warning(f"XPath error in rule {rule_id}: {e}")
-            
+            with span("load_policy"):
+                digest, rules = self._load_policy(policy_xml)
         except ET.ParseError as e:
-            print(f"DEBUG - Policy XML parsing error: {e}")
             self.logger.error(f"Policy XML parsing error: {e}")
             results['warnings'].append("Invalid policy format")
+            return results
+        except PolicyCostError as e:
+            self.logger.warning(f"Policy rejected: {'; '.join(e.errors)}")
+            results['warnings'].append("Policy rejected: XPath cost ceiling exceeded")
+            results['cost_errors'] = e.errors
+            return results
+        except PolicyExpired as e:
+            self.logger.info(f"Policy not enforced: {e}")
+            results['warnings'].append("Policy expired")
+            results['policy_expired'] = e.expires
+            return results
+        
+        for skipped in self._skipped_for_cost.get(digest, ()):
+            if skipped['phase'] in (None, phase):
+                results['warnings'].append({'rule': skipped['id'], 'message': skipped['error'], 'matches': 0})
+        rules = [r for r in rules if r['phase'] in (None, phase)]
+        hits = {rule['index']: [] for rule in rules}
+        # MIME parts behind the matches, for actions that rewrite parts
+        targets: Dict[str, Optional[List]] = {}
+        evaluated = set()
+        backend = self._backends.get(digest, self.backend)
+        
+        runnable = rules
+        cache_prefix = f"{digest}:{phase}"
+        truncated = self._truncated_parts(email_msg)
+        # Literals found in the whole of each truncated part
+        present = None
+        if truncated and any(r['stage'] == 'content' for r in rules):
+            with span("scan_spooled", parts=len(truncated)):
+                present = self._spooled_literals(digest, truncated)
+        if self.prefilter:
+            try:
+                live = self._live_rules(digest, rules, email_msg, present)
+            except BudgetExceeded as e:
+                self._budget_exceeded(e, "prefilter", rules, evaluated, results)
+                return results
+            if live is not None and len(live) < len(rules):
+                runnable = [r for r in rules if r['index'] in live]
+                # Ruled out without evaluation: they cannot match
+                evaluated.update(r['index'] for r in rules if r['index'] not in live)
+                # XSLT plans and cached part verdicts are per rule set
+                cache_prefix += ":" + hashlib.sha256(
+                    ",".join(r['index'] for r in runnable).encode('ascii')).hexdigest()[:16]
+        
+        for stage in self.STAGES:
+            stage_rules = [r for r in runnable if r['stage'] == stage]
+            if not stage_rules:
+                continue
+            try:
+                with span(f"stage:{stage}", rules=len(stage_rules)):
+                    self._stage_evaluators[stage](email_msg, stage_rules, hits, targets,
+                                                  cache_prefix, backend)
+            except BudgetExceeded as e:
+                self._budget_exceeded(e, stage, rules, evaluated, results)
+                break
+            evaluated.update(rule['index'] for rule in stage_rules)
+            
+            if self.early_exit and any(r['action'] == 'block' and hits[r['index']] for r in stage_rules):
+                skipped = [r['id'] for r in rules if r['index'] not in evaluated]
+                if skipped:
+                    results['terminated_at'] = stage
+                    results['skipped_rules'] = skipped
+                break
         
+        # A tripped budget already flags the verdict partial
+        if truncated and 'budget_exceeded' not in results:
+            try:
+                self._fail_closed(digest, [r for r in runnable if r['stage'] == 'content' and r['index'] in evaluated],
+                                  hits, email_msg, truncated, present, results)
+            except BudgetExceeded as e:
+                self._budget_exceeded(e, 'content', rules, evaluated, results)
+        
+        # Apply actions in policy order
+        for rule in rules:
+            matches = hits[rule['index']]
+            if matches:
+                with span("action", type=rule['action'], rule=rule['id']):
+                    self._execute_action(
+                        rule['action'], rule['id'], rule['message'],
+                        matches, results, email_msg, targets.get(rule['index'])
+                    )
         return results
     
+    def _live_rules(self, digest: str, rules: List[Dict[str, Any]], email_msg,
+                    present: Optional[set] = None) -> Optional[set]:
+        """
+        Indices of rules the prefilter cannot rule out; None when it does not apply
+        
+        present: literals found beyond the preview of spooled parts
+        """
+        prefilter = self._prefilters.get(digest)
+        # The scan pays off when it can spare a stage its XML; when every
+        # stage past the headers has a rule that always runs, it would only
+        # save a few XPath calls
+        if not prefilter or not any(
+            stage_rules and all(r['requires'] for r in stage_rules)
+            for stage_rules in ([r for r in rules if r['stage'] == stage] for stage in ('structure', 'content'))
+        ):
+            return None
+        with span("prefilter"):
+            live = prefilter.live(message_texts(email_msg, self._metered_payload), [r['index'] for r in rules],
+                                  present)
+        with self._prefilter_lock:
+            self._prefilter_counts['messages'] += 1
+            self._prefilter_counts['rules_skipped'] += len(rules) - len(live)
+            if not any(r['stage'] != 'header' and r['index'] in live for r in rules):
+                self._prefilter_counts['xml_skipped'] += 1
+        return live
+    
+    def _truncated_parts(self, email_msg) -> List:
+        """Spooled parts larger than the preview rules are evaluated on"""
+        return [part for part in email_msg.walk()
+                if getattr(part, 'spooled_payload', None) is not None
+                and part.spooled_size > self.SPOOLED_PREVIEW_BYTES]
+    
+    def _spooled_literals(self, digest: str, parts: List) -> set:
+        """The policy's literals occurring anywhere in the given spooled parts"""
+        prefilter = self._prefilters.get(digest)
+        present = set()
+        for part in parts:
+            present |= prefilter.present_in(
+                spooled_windows(part.spooled_payload, part.get_content_type() == 'text/html'))
+        return present
+    
+    def _fail_closed(self, digest: str, rules: List[Dict[str, Any]], hits: Dict[str, List],
+                     email_msg, truncated: List, present: Optional[set], results: Dict[str, Any]):
+        """
+        Block on content rules the preview of a spooled part cannot decide
+        
+        A rule that did not match may still match text past the preview,
+        unless that text cannot be read by the rule (a plain part, for rules
+        looking at HTML elements only) or lacks the literals it needs.
+        """
+        html = any(part.get_content_type() == 'text/html' for part in truncated)
+        candidates = [r for r in rules if not hits[r['index']] and (html or reads_part_text(r['xpath']))]
+        if not candidates:
+            return
+        live = self._prefilters[digest].live(message_texts(email_msg, self._metered_payload),
+                                             [r['index'] for r in candidates], present)
+        undecided = [r for r in candidates if r['index'] in live]
+        for rule in undecided:
+            self.logger.warning(f"Rule {rule['id']} undecided on the preview of a spooled part")
+            results['blocks'].append({
+                'rule': rule['id'],
+                'message': rule['message'],
+                'reason': 'Content past the spooled preview could not be evaluated'
+            })
+            results['actions_taken'].append(f"block:{rule['id']}")
+        if undecided:
+            results['undecided_rules'] = [r['id'] for r in undecided]
+    
+    def prefilter_stats(self) -> Dict[str, int]:
+        """Messages prefiltered, rules ruled out, and messages never built as XML"""
+        with self._prefilter_lock:
+            return dict(self._prefilter_counts)
+    
+    def _budget_exceeded(self, error: BudgetExceeded, stage: str, rules: List[Dict[str, Any]],
+                         evaluated: set, results: Dict[str, Any]):
+        """Flag a verdict cut short by the budget; matches found so far still apply"""
+        self.logger.warning(f"Evaluation stopped in the {stage} stage: {error}")
+        meter = budgets.current_meter()
+        results['partial'] = True
+        results['budget_exceeded'] = dict(error.report(), stage=stage,
+                                          usage=meter.usage() if meter is not None else None)
+        results['terminated_at'] = stage
+        # Rules in the interrupted stage may have partial matches; they count as evaluated
+        results['skipped_rules'] = [r['id'] for r in rules
+                                    if r['index'] not in evaluated and r['stage'] != stage]
+        if self.budget.fail_closed:
+            results['blocks'].append({
+                'rule': 'budget',
+                'message': str(error),
+                'reason': 'Evaluation budget exceeded'
+            })
+            results['actions_taken'].append("block:budget")
+        else:
+            results['warnings'].append({'rule': 'budget', 'message': str(error), 'matches': 0})
+    
+    def _load_policy(self, policy_xml: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """Parse a policy once and keep its compiled rules keyed by the XML text"""
+        cached = self._policies.get(policy_xml)
+        if cached is not None:
+            if cached[1] is None:
+                raise self._rejected[cached[0]]
+            return cached
+        
+        policy_root = ET.fromstring(policy_xml.encode('utf-8'))
+        digest = hashlib.sha256(ET.tostring(policy_root, method='c14n')).hexdigest()
+        
+        expires = policy_root.findtext('pp:Metadata/pp:Expires', None, self.ns)
+        deadline = parse_expires(expires)
+        if deadline is not None and deadline <= self._scheduler().clock():
+            self._make_room()
+            self._rejected[digest] = PolicyExpired(expires, digest)
+            self._policies[policy_xml] = (digest, None)
+            raise self._rejected[digest]
+        
+        rules = []
+        skipped = []
+        for rule_elem in policy_root.findall(".//pp:Rule", self.ns):
+            rule_id = rule_elem.get('id')
+            scope = rule_elem.find('./pp:Scope', self.ns)
+            condition_elem = rule_elem.find('./pp:Condition', self.ns)
+            action_elem = rule_elem.find('./pp:Action', self.ns)
+            if condition_elem is None or action_elem is None:
+                continue
+            
+            xpath_elem = condition_elem.find('./pp:XPath', self.ns)
+            if xpath_elem is None or not xpath_elem.text:
+                continue
+            xpath_expr = xpath_elem.text.strip()
+            phase = scope.get('phase') if scope is not None else None
+            evaluated_expr = xpath_expr
+            needs_raw_content = self.raw_content == 'materialize'
+            if not needs_raw_content:
+                rewritten = rewrite_raw_content(xpath_expr)
+                if rewritten is None:
+                    needs_raw_content = True
+                else:
+                    evaluated_expr = rewritten
+            try:
+                errors = pattern_errors(evaluated_expr)
+                if errors:
+                    self.logger.warning(f"XPath error in rule {rule_id}: {'; '.join(errors)}")
+                    continue
+                if self.optimize:
+                    evaluated_expr, _ = optimize_xpath(evaluated_expr)
+                if self.max_rule_cost is not None:
+                    errors = rule_cost_errors(rule_id, xpath_expr, self.max_rule_cost)
+                    if errors:
+                        skipped.append({'id': rule_id, 'phase': phase, 'error': errors[0]})
+                        continue
+            except XPathSyntaxError:
+                pass  # left for ET.XPath to report
+            try:
+                compiled = compile_xpath(evaluated_expr)
+            except ET.XPathError as e:
+                self.logger.warning(f"XPath error in rule {rule_id}: {e}")
+                continue
+            
+            rules.append({
+                'index': str(len(rules)),
+                'id': rule_id,
+                'phase': phase,
+                'xpath': xpath_expr,
+                'condition_hash': hashlib.sha256(f"{phase}\0{xpath_expr}".encode('utf-8')).hexdigest(),
+                'compiled': compiled,
+                'locality': rule_locality(xpath_expr),
+                'stage': rule_stage(xpath_expr),
+                'raw_content': needs_raw_content,
+                'expr': evaluated_expr,
+                'requires': xpath_requirement(evaluated_expr),
+                'action': action_elem.get('type'),
+                'message': action_elem.get('message', ''),
+            })
+        
+        self._make_room()
+        
+        if skipped and self.cost_action == 'reject':
+            self._rejected[digest] = PolicyCostError(
+                "Policy exceeds the XPath cost ceiling", [entry['error'] for entry in skipped]
+            )
+            self._policies[policy_xml] = (digest, None)
+            raise self._rejected[digest]
+        if skipped:
+            for entry in skipped:
+                self.logger.warning(f"Skipping rule: {entry['error']}")
+            self._skipped_for_cost[digest] = skipped
+        self._prefilters[digest] = LiteralPrefilter({r['index']: r['requires'] for r in rules})
+        self._policies[policy_xml] = (digest, rules)
+        if deadline is not None:
+            self._expires[digest] = expires
+            self._scheduler().schedule((self._expiry_token, digest), deadline, self._policy_expired)
+        return digest, rules
+    
+    def _make_room(self):
+        if len(self._policies) >= self.MAX_CACHED_POLICIES:
+            evicted_digest, _ = self._policies.pop(next(iter(self._policies)))
+            self._skipped_for_cost.pop(evicted_digest, None)
+            self._rejected.pop(evicted_digest, None)
+            self._backends.pop(evicted_digest, None)
+            self._prefilters.pop(evicted_digest, None)
+            if self._expires.pop(evicted_digest, None) is not None:
+                self._scheduler().cancel((self._expiry_token, evicted_digest))
+    
+    def _scheduler(self) -> ExpiryScheduler:
+        return self._expiry if self._expiry is not None else shared_scheduler()
+    
+    def _policy_expired(self, key):
+        """Expiry callback: mark the policy's cache entries expired and drop its state"""
+        digest = key[1]
+        expires = self._expires.pop(digest, None)
+        if expires is None:
+            return
+        self._rejected[digest] = PolicyExpired(expires, digest)
+        for policy_xml, (cached_digest, _) in list(self._policies.items()):
+            if cached_digest == digest:
+                self._policies[policy_xml] = (digest, None)
+        self._skipped_for_cost.pop(digest, None)
+        self._prefilters.pop(digest, None)
+        with self._plans_lock:
+            for plan_key in [k for k in self._plans if k.startswith(digest)]:
+                del self._plans[plan_key]
+        self.logger.info(f"Policy {digest[:12]} expired at {expires}")
+    
+    def _evaluate_header_stage(self, email_msg, rules, hits, targets, cache_prefix, backend):
+        header_xml = ET.Element("email")
+        self._add_header_elements(header_xml, email_msg)
+        ET.SubElement(header_xml, "body")
+        self._run_rules(rules, header_xml, hits, self._sources(email_msg, []),
+                        backend, f"{cache_prefix}:header")
+    
+    def _evaluate_structure_stage(self, email_msg, rules, hits, targets, cache_prefix, backend):
+        structure_xml, xml_parts = self._build_structure_xml(email_msg)
+        self._run_rules(rules, structure_xml, hits, self._sources(email_msg, xml_parts),
+                        backend, f"{cache_prefix}:structure", targets, xml_parts)
+    
+    def _evaluate_content_stage(self, email_msg, rules, hits, targets, cache_prefix, backend):
+        message_rules = rules
+        
+        if self.verdict_cache is not None or self.part_workers > 1:
+            # Part-local rules run once per part, on a tree holding just
+            # that part, so parts can be evaluated independently; with a
+            # verdict cache only unseen parts are evaluated at all
+            part_rules = [r for r in rules if r['locality'] == 'part']
+            message_rules = [r for r in rules if r['locality'] != 'part']
+            if part_rules:
+                cache_digest = f"{cache_prefix}:{self.classifier.fingerprint}"
+                leaves = [part for part in email_msg.walk() if not part.is_multipart()]
+                plan_key = f"{cache_prefix}:part" if self._use_xslt(backend, part_rules) else None
+                all_verdicts = self._map_parts(
+                    lambda part: self._part_verdicts(part, part_rules, cache_digest, plan_key), leaves
+                )
+                # Merged in MIME order whichever worker finished first
+                for part, verdicts in zip(leaves, all_verdicts):
+                    for index, matches in (verdicts or {}).items():
+                        hits[index].extend(matches)
+                        targets.setdefault(index, []).append(part)
+        
+        if message_rules:
+            email_xml, xml_parts = self._build_email_xml(
+                email_msg, raw_content=any(r['raw_content'] for r in message_rules)
+            )
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Email XML structure:\n%s",
+                                  ET.tostring(email_xml, encoding='unicode', pretty_print=True))
+            self._run_rules(message_rules, email_xml, hits, self._sources(email_msg, xml_parts),
+                            backend, f"{cache_prefix}:content", targets, xml_parts)
+    
+    def _part_verdicts(self, part, rules: List[Dict[str, Any]], cache_digest: str,
+                       plan_key: Optional[str] = None) -> Optional[Dict[str, List[str]]]:
+        payload = self._part_payload(part)
+        if not payload:
+            return None
+        if self.verdict_cache is None:
+            return self._evaluate_part(part, payload, rules, plan_key)
+        spooled_sha256 = getattr(part, 'spooled_sha256', None)
+        part_hash = self._part_hash(
+            part.get_content_type(),
+            b"spooled:" + spooled_sha256.encode('ascii') if spooled_sha256 else payload
+        )
+        verdicts = self.verdict_cache.get(cache_digest, part_hash)
+        if verdicts is None:
+            verdicts = self._evaluate_part(part, payload, rules, plan_key)
+            self.verdict_cache.put(cache_digest, part_hash, verdicts)
+        return verdicts
+    
+    def _use_xslt(self, backend: str, rules: List[Dict[str, Any]]) -> bool:
+        if backend == 'xslt':
+            return bool(rules)
+        return backend == 'auto' and len(rules) >= xslt_backend.MIN_RULES
+    
+    def _plan(self, plan_key: str, rules: List[Dict[str, Any]], describe_all: bool = False) -> XsltPlan:
+        """The stylesheet for a policy's rules in one stage, compiled once per digest"""
+        with self._plans_lock:
+            plan = self._plans.get(plan_key)
+            if plan is not None:
+                self._plans.move_to_end(plan_key)
+                return plan
+        try:
+            plan = xslt_backend.compile_plan(rules, describe_all)
+        except ET.XSLTParseError as e:
+            self.logger.warning(f"XSLT compilation failed, using XPath: {e}")
+            plan = XsltPlan(None, [], list(rules), 0)
+        with self._plans_lock:
+            self._plans[plan_key] = plan
+            while len(self._plans) > 4 * self.MAX_CACHED_POLICIES:
+                self._plans.popitem(last=False)
+        return plan
+    
+    def _run_rules(self, rules: List[Dict[str, Any]], xml, hits: Dict[str, List],
+                   sources: MessageSources, backend: str, plan_key: str,
+                   targets: Optional[Dict[str, Optional[List]]] = None, xml_parts: Optional[List] = None,
+                   describe_all: bool = False):
+        """
+        Evaluate rules with the policy's backend, recording encrypt targets
+        when targets and xml_parts are given
+        """
+        remaining = rules
+        if self._use_xslt(backend, rules):
+            plan = self._plan(plan_key, rules, describe_all)
+            meter = budgets.current_meter()
+            if meter is not None:
+                meter.check_time()
+            try:
+                with xpath_functions.sources(sources), span("xslt", rules=len(plan.rules)):
+                    plan_hits, plan_parts = plan.evaluate(xml)
+                remaining = plan.fallback
+            except ET.XSLTApplyError as e:
+                self.logger.warning(f"XSLT evaluation failed, using XPath: {e}")
+                plan_hits, plan_parts = {}, {}
+            if meter is not None:
+                meter.check_time()
+            for index, matches in plan_hits.items():
+                if isinstance(matches, list):
+                    hits[index].extend(matches)
+                else:
+                    hits[index] = matches
+            if targets is not None:
+                for index, positions in plan_parts.items():
+                    targets[index] = None if positions is None else [xml_parts[p] for p in positions]
+        
+        self._evaluate_into(remaining, xml, hits, sources)
+        if targets is not None:
+            self._collect_targets(remaining, hits, targets, xml_parts)
+    
+    def _collect_targets(self, rules, hits, targets, xml_parts):
+        for rule in rules:
+            if rule['action'] == 'encrypt' and hits[rule['index']]:
+                targets[rule['index']] = self._match_parts(hits[rule['index']], xml_parts)
+    
+    def policy_rules(self, policy_xml: str, phase: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Return the policy digest and its parsed rules, optionally limited to one phase
+        
+        Raises PolicyExpired once the policy's Metadata/Expires has passed.
+        """
+        digest, rules = self._load_policy(policy_xml)
+        if phase is not None:
+            rules = [r for r in rules if r['phase'] in (None, phase)]
+        return digest, rules
+    
+    def match_rules(self, email_msg: email.message.Message,
+                    rules: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """
+        Evaluate a subset of rules from policy_rules() on the whole message
+        
+        Returns:
+            Rule index -> described matches, for matching rules only
+        """
+        hits = {rule['index']: [] for rule in rules}
+        if rules:
+            email_xml, xml_parts = self._build_email_xml(
+                email_msg, raw_content=any(r['raw_content'] for r in rules)
+            )
+            self._evaluate_into(rules, email_xml, hits, self._sources(email_msg, xml_parts))
+        return {
+            index: [self._describe_match(m) for m in (matches if isinstance(matches, list) else [matches])]
+            for index, matches in hits.items() if matches
+        }
+    
+    def match_header_rules(self, email_msg: email.message.Message, policy_xml: str,
+                           phase: str = 'in-transit') -> Tuple[List[Tuple[Dict[str, Any], List]], List[str]]:
+        """
+        Evaluate the header-only rules of one phase
+        
+        Used where only the header block is available, e.g. by the relay
+        before the body has arrived. Only rules whose Scope names the phase
+        are included; rules without a Scope are not acted on here.
+        
+        Returns:
+            ([(rule, matches), ...] for matching header rules in policy order,
+             ids of rules in this phase that need the body and were not evaluated)
+        """
+        try:
+            _, rules = self._load_policy(policy_xml)
+        except PolicyExpired:
+            return [], []
+        rules = [r for r in rules if r['phase'] == phase]
+        header_rules = [r for r in rules if r['locality'] == 'header']
+        deferred = [r['id'] for r in rules if r['locality'] != 'header']
+        
+        hits = {rule['index']: [] for rule in header_rules}
+        if header_rules:
+            header_xml = ET.Element("email")
+            self._add_header_elements(header_xml, email_msg)
+            ET.SubElement(header_xml, "body")
+            self._evaluate_into(header_rules, header_xml, hits, self._sources(email_msg, []))
+        matched = [(rule, hits[rule['index']]) for rule in header_rules if hits[rule['index']]]
+        return matched, deferred
+    
+    def _sources(self, email_msg, xml_parts: List) -> MessageSources:
+        return MessageSources(email_msg, xml_parts, self._part_payload)
+    
+    def _evaluate_into(self, rules: List[Dict[str, Any]], email_xml, hits: Dict[str, List],
+                       sources: Optional[MessageSources] = None, **span_args):
+        if not rules:
+            return
+        if sources is None:
+            sources = MessageSources(None, [], self._part_payload)
+        with xpath_functions.sources(sources):
+            self._evaluate_rules_into(rules, email_xml, hits, **span_args)
+    
+    def _evaluate_rules_into(self, rules: List[Dict[str, Any]], email_xml, hits: Dict[str, List], **span_args):
+        meter = budgets.current_meter()
+        for rule in rules:
+            try:
+                matches = self._evaluate_rule(rule, email_xml, meter, **span_args)
+            except ET.XPathError as e:
+                self.logger.warning(f"XPath error in rule {rule['id']}: {e}")
+                continue
+            if matches:
+                if isinstance(matches, list):
+                    hits[rule['index']].extend(matches)
+                else:
+                    hits[rule['index']] = matches
+    
+    @staticmethod
+    def _evaluate_rule(rule: Dict[str, Any], xml, meter, **span_args):
+        """One compiled rule against one tree, timed against the budget if any"""
+        if meter is None:
+            with span("rule", id=rule['id'], **span_args) as rule_span:
+                matches = rule['compiled'](xml)
+                rule_span.set(matched=bool(matches))
+            return matches
+        meter.check_time()
+        start = time.perf_counter()
+        with span("rule", id=rule['id'], **span_args) as rule_span:
+            matches = rule['compiled'](xml)
+            rule_span.set(matched=bool(matches))
+        meter.rule_done(rule['id'], (time.perf_counter() - start) * 1000.0)
+        return matches
+    
+    def _evaluate_part(self, part, payload: bytes, rules: List[Dict[str, Any]],
+                       plan_key: Optional[str] = None) -> Dict[str, List[str]]:
+        """Evaluate part-local rules against a tree holding only this part"""
+        part_xml = ET.Element("email")
+        ET.SubElement(part_xml, "headers")
+        body_elem = ET.SubElement(part_xml, "body")
+        with span("xml_part", type=part.get_content_type()):
+            self._add_part_element(body_elem, part, payload,
+                                   raw_content=any(r['raw_content'] for r in rules))
+        
+        hits = {rule['index']: [] for rule in rules}
+        # Part-local rules never read headers, so there is no message here
+        sources = MessageSources(None, [part], lambda _: payload)
+        if plan_key is not None:
+            self._run_rules(rules, part_xml, hits, sources, 'xslt', plan_key, describe_all=True)
+        else:
+            self._evaluate_into(rules, part_xml, hits, sources, part=True)
+        return {
+            index: [self._describe_match(m) for m in (matches if isinstance(matches, list) else [matches])]
+            for index, matches in hits.items() if matches
+        }
+    
+    def _part_payload(self, part) -> Optional[bytes]:
+        """Decoded payload; a bounded prefix for parts spooled to disk"""
+        path = getattr(part, 'spooled_payload', None)
+        if path is None:
+            return part.get_payload(decode=True)
+        with open(path, 'rb') as f:
+            return f.read(self.SPOOLED_PREVIEW_BYTES)
+    
+    def _metered_payload(self, part) -> Optional[bytes]:
+        """_part_payload(), charged to the running budget before anyone decodes it"""
+        payload = self._part_payload(part)
+        meter = budgets.current_meter()
+        if meter is not None and payload:
+            meter.charge_part(part, len(payload))
+        return payload
+    
+    @staticmethod
+    def _part_hash(content_type: str, payload: bytes) -> str:
+        digest = hashlib.sha256(content_type.encode('ascii', 'replace'))
+        digest.update(b'\0')
+        digest.update(payload)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _describe_match(match) -> str:
+        """Short serialized form of a match, as recorded for strip actions"""
+        if not ET.iselement(match):
+            return str(match)[:100]
+        return ET.tostring(match, encoding='unicode')[:100]
+    
+    @staticmethod
+    def _match_parts(matches, xml_parts: List) -> Optional[List]:
+        """
+        Map matched XML nodes back to the MIME parts they came from
+        
+        Returns None when a match lies outside every part (a header, the
+        whole body), meaning the action applies to all parts.
+        """
+        if not isinstance(matches, list):
+            return None
+        parts = []
+        for match in matches:
+            node = match if ET.iselement(match) else getattr(match, 'getparent', lambda: None)()
+            # Climb to the child of the top-level <body>; parsed HTML has its own <body>
+            while node is not None:
+                parent = node.getparent()
+                if parent is not None and parent.tag == 'body' and parent.getparent() is not None \
+                        and parent.getparent().getparent() is None:
+                    break
+                node = parent
+            if node is None:
+                return None
+            part_elem = node
+            part = xml_parts[part_elem.getparent().index(part_elem)]
+            if not any(p is part for p in parts):
+                parts.append(part)
+        return parts
+    
     def _execute_action(self, action_type: str, rule_id: str, message: str,
                        matches: List, results: Dict[str, Any],
-                       email_msg: email.message.Message):
+                       email_msg: email.message.Message, targets: Optional[List] = None):
         """Execute the appropriate action based on policy"""
         
         if action_type == 'warn':
@@ -152,7 +986,7 @@ class PolicyEnforcer:
         elif action_type == 'strip':
             # In a real implementation, this would modify the email
             results['stripped_elements'].extend([
-                f"{rule_id}:{ET.tostring(match, encoding='unicode')[:100]}"
+                f"{rule_id}:{self._describe_match(match)}"
                 for match in matches
             ])
             results['actions_taken'].append(f"strip:{rule_id}")
@@ -166,4 +1000,38 @@ class PolicyEnforcer:
             results['actions_taken'].append(f"block:{rule_id}")
             
         elif action_type == 'allow':
-            results['actions_taken'].append(f"allow:{rule_id}")
\ No newline at end of file
+            results['actions_taken'].append(f"allow:{rule_id}")
+            
+        elif action_type == 'encrypt':
+            self._encrypt_parts(rule_id, message, matches, results, email_msg, targets)
+    
+    def _encrypt_parts(self, rule_id: str, message: str, matches: List, results: Dict[str, Any],
+                       email_msg: email.message.Message, targets: Optional[List]):
+        """Replace the matched parts (all body parts for header matches) with encrypted ones"""
+        if self.encryptor is None:
+            results['warnings'].append({
+                'rule': rule_id,
+                'message': f"{message} (no encryption keyring configured, not encrypted)",
+                'matches': len(matches) if isinstance(matches, list) else 1
+            })
+            return
+        from .encryption import ENCRYPTED_SUBTYPE
+        
+        eligible = [
+            part for part in email_msg.walk()
+            if not part.is_multipart()
+            and part.get_content_type() != 'application/xml+privacy-policy'
+            and part.get_content_subtype() != ENCRYPTED_SUBTYPE
+        ]
+        if targets is not None:
+            eligible = [part for part in eligible if any(part is t for t in targets)]
+        try:
+            self.encryptor.encrypt_parts(email_msg, eligible)
+        except ValueError as e:
+            self.logger.warning(f"Encryption for rule {rule_id} failed: {e}")
+            results['warnings'].append({'rule': rule_id, 'message': str(e), 'matches': len(eligible)})
+            return
+        results.setdefault('encrypted_parts', []).extend(
+            f"{rule_id}:{part.get_content_type()}" for part in eligible
+        )
+        results['actions_taken'].append(f"encrypt:{rule_id}")
@@ -0,0 +1,188 @@
+"""
+Policy expiry: Metadata/Expires and a scheduler that acts on it
+
+PrivacyPolicy.expires is written to Metadata/Expires. Caches of compiled
+policies (PolicyEnforcer, PolicyDirectory) and the at-rest store register
+each policy's expiry with an ExpiryScheduler when they load it. When the
+time comes the scheduler calls them back and they replace the entry with
+an expired marker, or for the at-rest store drop the verdicts of the
+messages bound to it. Lookups never compare timestamps: a cached policy
+is valid exactly until its callback has run.
+
+    scheduler = ExpiryScheduler()
+    scheduler.schedule(key, deadline, callback)   # callback(key) at deadline
+    scheduler.start()                             # or call run_due() yourself
+
+Upcoming expirations are kept in a heap ordered by deadline. The timer
+thread sleeps until the earliest one and is woken when an earlier one is
+scheduled. Rescheduled and cancelled keys leave their old heap entries
+behind; they are skipped when they surface.
+
+Components use shared_scheduler(), started on first use, unless given one.
+"""
+
+import datetime
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Upper bound on one sleep of the timer thread, so a wall clock that jumps
+# forward is noticed
+MAX_SLEEP = 60.0
+
+
+class PolicyExpired(ValueError):
+    """The policy's Metadata/Expires time has passed"""
+
+    def __init__(self, expires: str, digest: Optional[str] = None):
+        super().__init__(f"Policy expired at {expires}")
+        self.expires = expires
+        self.digest = digest
+
+
+def parse_expires(text: Optional[str]) -> Optional[float]:
+    """
+    Epoch seconds of a Metadata/Expires value, or None
+
+    Times without a UTC offset are local, as PrivacyPolicy writes them. A
+    value that cannot be parsed is treated as no expiry.
+    """
+    if not text:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(text.strip()).timestamp()
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+class ExpiryScheduler:
+    """
+    Calls callback(key) once each scheduled deadline has passed
+
+    Bound methods are held weakly, so a cache that is garbage collected
+    does not stay alive for the sake of its pending expirations.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._entries: Dict[Hashable, Tuple[float, int, Callable]] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callable[[Hashable], None]):
+        """Call callback(key) at deadline (epoch seconds), replacing any schedule for key"""
+        ref = weakref.WeakMethod(callback) if inspect.ismethod(callback) else (lambda: callback)
+        with self._cond:
+            seq = next(self._seq)
+            self._entries[key] = (deadline, seq, ref)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            self._compact()
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+
+    def cancel(self, key: Hashable):
+        with self._cond:
+            if self._entries.pop(key, None) is not None:
+                self._compact()
+
+    def _compact(self):
+        # Rebuild once stale entries outnumber live ones
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [(deadline, seq, key) for key, (deadline, seq, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap:
+            deadline, seq, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == seq:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Run the callbacks of every deadline up to now; returns how many ran"""
+        now = self.clock() if now is None else now
+        due = []
+        with self._cond:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, key = heapq.heappop(self._heap)
+                due.append((key, self._entries.pop(key)[2]))
+        ran = 0
+        for key, ref in due:
+            callback = ref()
+            if callback is None:
+                continue
+            try:
+                callback(key)
+            except Exception:
+                self.logger.exception(f"Expiry callback for {key!r} failed")
+            ran += 1
+        with self._cond:
+            self.fired += ran
+        return ran
+
+    def start(self):
+        """Run due callbacks on a background thread until stop()"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="policy-expiry", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                self._drop_stale()
+                wait = MAX_SLEEP
+                if self._heap:
+                    wait = min(self._heap[0][0] - self.clock(), MAX_SLEEP)
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            self.run_due()
+
+    def stop(self):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+
+
+_shared: Optional[ExpiryScheduler] = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler() -> ExpiryScheduler:
+    """The process-wide scheduler, started on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ExpiryScheduler()
+            _shared.start()
+        return _shared
@@ -1,6 +1,14 @@
 from .policy import PrivacyPolicy, Rule, Condition, Action
+from typing import Dict, Optional
 import datetime
 
+# Mirrors DEFAULT_SETTINGS in thunderbird-extension/background.js
+USER_DEFAULT_SETTINGS = {
+    'stripTracking': True,
+    'warnExternal': True,
+    'blockExecutables': True,
+}
+
 class PolicyGenerator:
     """Pre-built policy templates for common use cases"""
     
@@ -99,4 +107,81 @@ class PolicyGenerator:
         for rule in attachment_policy.rules:
             policy.add_rule(rule)
             
-        return policy
\ No newline at end of file
+        return policy
+    
+    @staticmethod
+    def tracker_blocklist_policy(creator: str) -> PrivacyPolicy:
+        """Policy driven by the tracker blocklist instead of substring checks"""
+        policy = PrivacyPolicy(creator=creator)
+        
+        rule1 = Rule(
+            rule_id="strip-tracker-urls-1",
+            condition=Condition(
+                xpath=".//url[@tracker='true' and @tag='img']"
+            ),
+            action=Action("strip", "Known tracker image removed"),
+            description="Strip images served from blocklisted tracker domains",
+            scope="at-use"
+        )
+        
+        rule2 = Rule(
+            rule_id="strip-pixels-2",
+            condition=Condition(
+                xpath=".//url[@tag='img' and (@pixel='true' or @hidden='true')]"
+            ),
+            action=Action("strip", "Hidden or 1x1 image removed"),
+            description="Strip 1x1 and hidden images regardless of host",
+            scope="at-use"
+        )
+        
+        rule3 = Rule(
+            rule_id="warn-tracker-links-3",
+            condition=Condition(
+                xpath=".//url[@tracker='true' and @tag!='img']"
+            ),
+            action=Action("warn", "Links or styles reference tracker domains"),
+            description="Warn about tracked links and stylesheet beacons",
+            scope="at-use"
+        )
+        
+        policy.add_rule(rule1)
+        policy.add_rule(rule2)
+        policy.add_rule(rule3)
+        return policy
+    
+    @staticmethod
+    def user_preferences_policy(creator: str, settings: Optional[Dict[str, bool]] = None) -> PrivacyPolicy:
+        """
+        Recipient preferences, keyed like DEFAULT_SETTINGS in the extension
+        
+        Conditions are the ones the other templates use, so composing this
+        with a sender or organization policy merges the overlapping rules.
+        """
+        settings = {**USER_DEFAULT_SETTINGS, **(settings or {})}
+        policy = PrivacyPolicy(creator=creator)
+        
+        if settings['stripTracking']:
+            policy.add_rule(Rule(
+                rule_id="user-strip-tracking",
+                condition=Condition(xpath=".//url[@tracker='true' and @tag='img']"),
+                action=Action("strip", "Known tracker image removed"),
+                description="Recipient preference: strip tracking images",
+                scope="at-use"
+            ))
+        if settings['warnExternal']:
+            policy.add_rule(Rule(
+                rule_id="user-warn-external",
+                condition=Condition(xpath=".//raw-content[contains(., 'src=\"http')]"),
+                action=Action("warn", "External image detected - privacy risk"),
+                description="Recipient preference: warn about external images",
+                scope="at-use"
+            ))
+        if settings['blockExecutables']:
+            policy.add_rule(Rule(
+                rule_id="user-block-executables",
+                condition=Condition(mime_pattern="application/x-msdownload|application/x-msdos-program"),
+                action=Action("block", "Executable attachments are not allowed"),
+                description="Recipient preference: block executable attachments",
+                scope="at-use"
+            ))
+        return policy
@@ -0,0 +1,353 @@
+"""
+Memory-bounded streaming message ingestion
+
+Raw message bytes are fed in chunks (from a socket or file) through a
+line scanner that tracks MIME structure. Leaf part bodies up to the spool
+threshold go to email.feedparser.BytesFeedParser unchanged; larger ones
+are decoded incrementally into temporary files and the parser only sees
+a one-line placeholder. After parsing, spooled parts carry:
+
+    part.spooled_payload  path of the decoded payload
+    part.spooled_size     decoded size in bytes
+    part.spooled_sha256   digest of the decoded payload
+
+so peak memory per message stays close to the threshold rather than a
+multiple of the message size.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import secrets
+import tempfile
+from email.feedparser import BytesFeedParser
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import BinaryIO, List, Optional, Tuple
+
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_EOL_RE = re.compile(rb"\r?\n\Z")
+
+# Scanner states
+_HEADERS = "headers"
+_BODY = "body"          # leaf part body
+_CONTAINER = "container"  # preamble/epilogue text of a multipart
+
+
+class IngestLimitError(ValueError):
+    pass
+
+
+def _split_eol(line: bytes):
+    m = _EOL_RE.search(line)
+    return (line[:m.start()], m.group()) if m else (line, b"")
+
+
+class _SpoolWriter:
+    """Decodes one leaf body line by line into a temporary file"""
+
+    def __init__(self, encoding: str, spool_dir: Optional[str]):
+        self.encoding = encoding
+        fd, self.path = tempfile.mkstemp(prefix="ingest-", suffix=".part", dir=spool_dir)
+        self.file = os.fdopen(fd, "wb")
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._b64_carry = b""
+        self._pending_eol = b""
+
+    def _write(self, data: bytes):
+        if data:
+            self.file.write(data)
+            self.size += len(data)
+            self.sha256.update(data)
+
+    def write_line(self, line: bytes):
+        if self.encoding == "base64":
+            data = self._b64_carry + b"".join(line.split())
+            usable = len(data) - len(data) % 4
+            self._b64_carry = data[usable:]
+            self._write(binascii.a2b_base64(data[:usable]) if usable else b"")
+            return
+
+        content, eol = _split_eol(line)
+        # The line break before a boundary belongs to the boundary, so a
+        # line's own break is only written once another line follows
+        self._write(self._pending_eol)
+        if self.encoding == "quoted-printable":
+            if content.endswith(b"="):
+                self._write(binascii.a2b_qp(content[:-1]))
+                self._pending_eol = b""
+                return
+            content = binascii.a2b_qp(content)
+        self._write(content)
+        self._pending_eol = eol
+
+    def close(self):
+        if self._b64_carry:
+            try:
+                self._write(base64.b64decode(self._b64_carry + b"=" * (-len(self._b64_carry) % 4)))
+            except binascii.Error:
+                pass
+        self.file.close()
+
+
+class StreamingIngestor:
+    """
+    Incremental MIME parser with payload spooling and resource limits
+
+    Usage:
+        ingestor = StreamingIngestor()
+        for chunk in source:
+            ingestor.feed(chunk)
+        message = ingestor.close()
+        ...
+        ingestor.cleanup()   # removes the spool files
+    """
+
+    def __init__(self, spool_threshold: int = DEFAULT_SPOOL_THRESHOLD,
+                 spool_dir: Optional[str] = None,
+                 max_message_bytes: int = 100 * 1024 * 1024,
+                 max_header_bytes: int = 256 * 1024,
+                 max_depth: int = 20, max_parts: int = 1000):
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.max_message_bytes = max_message_bytes
+        self.max_header_bytes = max_header_bytes
+        self.max_depth = max_depth
+        self.max_parts = max_parts
+
+        self._parser = BytesFeedParser()
+        self._marker = f"X-Spooled-Payload-{secrets.token_hex(8)}-".encode("ascii")
+        self._carry = b""
+        self._total = 0
+        self._parts = 0
+        self._state = _HEADERS
+        self._boundaries: List[bytes] = []
+        self._nested_messages = 0
+        self._header_lines: List[bytes] = []
+        self._header_bytes = 0
+        self._body_lines: List[bytes] = []
+        self._body_bytes = 0
+        self._body_encoding = "7bit"
+        self._spool: Optional[_SpoolWriter] = None
+        self._spooled: List[_SpoolWriter] = []
+        self._closed = False
+
+    # ---- input ----
+
+    def feed(self, chunk: bytes):
+        if self._closed:
+            raise ValueError("Ingestor is closed")
+        self._total += len(chunk)
+        if self._total > self.max_message_bytes:
+            raise IngestLimitError(f"Message exceeds {self.max_message_bytes} bytes")
+        data = self._carry + chunk
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            self._line(data[start:end + 1])
+            start = end + 1
+        self._carry = data[start:]
+        if len(self._carry) > DEFAULT_CHUNK_SIZE:
+            if self._state != _BODY:
+                raise IngestLimitError("Line too long")
+            # Binary body without newlines; far longer than any boundary line
+            self._line(self._carry)
+            self._carry = b""
+
+    def close(self) -> Message:
+        """Finish parsing and return the message with spooled parts attached"""
+        if self._carry:
+            self._line(self._carry)
+            self._carry = b""
+        if self._state == _HEADERS and self._header_lines:
+            self._end_headers(partial=True)
+        self._end_body()
+        self._closed = True
+        message = self._parser.close()
+        self._attach_spooled(message)
+        return message
+
+    def cleanup(self):
+        """Remove the spool files created for this message"""
+        for spool in self._spooled:
+            if not spool.file.closed:
+                spool.file.close()
+            try:
+                os.unlink(spool.path)
+            except OSError:
+                pass
+        self._spooled = []
+
+    # ---- scanner ----
+
+    def _emit(self, line: bytes):
+        self._parser.feed(line)
+
+    def _match_boundary(self, line: bytes):
+        """Return (depth index, is_close) if line is a boundary of an open multipart"""
+        if not line.startswith(b"--") or not self._boundaries:
+            return None
+        stripped = line.rstrip()
+        for index in range(len(self._boundaries) - 1, -1, -1):
+            delimiter = b"--" + self._boundaries[index]
+            if stripped == delimiter:
+                return index, False
+            if stripped == delimiter + b"--":
+                return index, True
+        return None
+
+    def _line(self, line: bytes):
+        if self._state == _HEADERS:
+            if line in (b"\r\n", b"\n"):
+                self._header_lines.append(line)
+                self._end_headers()
+                return
+            self._header_bytes += len(line)
+            if self._header_bytes > self.max_header_bytes:
+                raise IngestLimitError(f"Header block exceeds {self.max_header_bytes} bytes")
+            self._header_lines.append(line)
+            return
+
+        boundary = self._match_boundary(line)
+        if boundary is not None:
+            index, is_close = boundary
+            self._end_body()
+            # A boundary of an outer multipart implicitly closes inner ones
+            del self._boundaries[index + 1:]
+            self._emit(line)
+            if is_close:
+                self._boundaries.pop()
+                self._state = _CONTAINER
+            else:
+                self._start_headers()
+            return
+
+        if self._state == _CONTAINER:
+            self._emit(line)
+            return
+
+        # Leaf body
+        if self._spool is not None:
+            self._spool.write_line(line)
+            return
+        self._body_lines.append(line)
+        self._body_bytes += len(line)
+        if self._body_bytes > self.spool_threshold:
+            self._spool = _SpoolWriter(self._body_encoding, self.spool_dir)
+            self._spooled.append(self._spool)
+            for buffered in self._body_lines:
+                self._spool.write_line(buffered)
+            self._body_lines = []
+            self._body_bytes = 0
+
+    def _start_headers(self):
+        self._state = _HEADERS
+        self._header_lines = []
+        self._header_bytes = 0
+
+    def _end_headers(self, partial: bool = False):
+        raw = b"".join(self._header_lines)
+        for line in self._header_lines:
+            self._emit(line)
+        self._header_lines = []
+        self._parts += 1
+        if self._parts > self.max_parts:
+            raise IngestLimitError(f"Message has more than {self.max_parts} parts")
+        if partial:
+            return
+
+        headers = BytesHeaderParser().parsebytes(raw)
+        maintype = headers.get_content_maintype()
+        if maintype == "multipart":
+            boundary = headers.get_boundary()
+            if boundary:
+                self._push_depth()
+                self._boundaries.append(boundary.encode("utf-8", "surrogateescape"))
+                self._state = _CONTAINER
+                return
+        elif headers.get_content_type() == "message/rfc822":
+            # The body is itself a message: its header block comes next
+            self._push_depth()
+            self._nested_messages += 1
+            self._start_headers()
+            return
+
+        self._state = _BODY
+        self._body_encoding = str(headers.get("Content-Transfer-Encoding", "7bit")).strip().lower()
+        self._body_lines = []
+        self._body_bytes = 0
+        self._spool = None
+
+    def _push_depth(self):
+        # Nested messages are never popped, so this overcounts, never under
+        if len(self._boundaries) + self._nested_messages + 1 > self.max_depth:
+            raise IngestLimitError(f"MIME nesting deeper than {self.max_depth}")
+
+    def _end_body(self):
+        if self._state != _BODY:
+            return
+        if self._spool is not None:
+            self._spool.close()
+            self._emit(self._marker + str(len(self._spooled) - 1).encode("ascii") + b"\n")
+            self._spool = None
+        else:
+            for line in self._body_lines:
+                self._emit(line)
+        self._body_lines = []
+        self._body_bytes = 0
+        self._state = _CONTAINER
+
+    def _attach_spooled(self, message: Message):
+        if not self._spooled:
+            return
+        marker = self._marker.decode("ascii")
+        for part in message.walk():
+            if part.is_multipart():
+                continue
+            payload = part.get_payload()
+            if not isinstance(payload, str) or not payload.startswith(marker):
+                continue
+            spool = self._spooled[int(payload[len(marker):].strip())]
+            part.set_payload("")
+            part.spooled_payload = spool.path
+            part.spooled_size = spool.size
+            part.spooled_sha256 = spool.sha256.hexdigest()
+
+
+def ingest_stream(source: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  **kwargs) -> Tuple[Message, "StreamingIngestor"]:
+    """
+    Ingest a message from a file-like object or socket file
+
+    Returns:
+        (message, ingestor); call ingestor.cleanup() when done with it
+    """
+    ingestor = StreamingIngestor(**kwargs)
+    read = getattr(source, "recv", None) or source.read
+    try:
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            ingestor.feed(chunk)
+        return ingestor.close(), ingestor
+    except Exception:
+        ingestor.cleanup()
+        raise
+
+
+def read_spooled(part: Message, limit: Optional[int] = None) -> bytes:
+    """Decoded payload of a part, reading at most limit bytes of a spooled one"""
+    path = getattr(part, "spooled_payload", None)
+    if path is None:
+        payload = part.get_payload(decode=True) or b""
+        return payload if limit is None else payload[:limit]
+    with open(path, "rb") as f:
+        return f.read() if limit is None else f.read(limit)
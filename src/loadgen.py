@@ -0,0 +1,436 @@
+"""
+Open-loop load generation and traffic replay
+
+Microbenchmarks time one enforcement at a time. This module checks how
+enforcement behaves at a target arrival rate:
+
+    corpus = load_mbox("traffic.mbox")          # or load_directory / generate_corpus
+    target = SocketTarget("/run/enforcer.sock") # or ClientTarget() / HttpTarget(url)
+    report = run_load(target, corpus, rate=200, duration=30, concurrency=16)
+    write_report(report, "enforce-v2.json")
+
+Messages are sent at fixed intervals whether or not earlier ones have been
+answered (open loop), so a slow target builds a backlog rather than
+slowing the sender down. Latency is measured from each message's intended
+send time: time spent waiting for a free sender is included, which
+closed-loop tools leave out (coordinated omission). Service time, from the
+actual start of the call, is recorded separately.
+
+Reports are JSON with the run settings, counts, throughput, percentiles
+and the full histograms, so two runs can be compared with
+compare_reports() (python -m src load --compare base.json new.json).
+"""
+
+import json
+import mailbox
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+REPORT_VERSION = 1
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds
+
+    Values are bucketed by power of two, each power split into
+    2**sub_bucket_bits linear sub-buckets, so any recorded value is
+    reported within 1 / 2**sub_bucket_bits of its true value at a fixed
+    memory cost whatever the range.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value: int) -> int:
+        magnitude = max(value.bit_length() - self.sub_bucket_bits, 0)
+        return (magnitude << self.sub_bucket_bits) + (value >> magnitude)
+
+    def _value(self, index: int) -> int:
+        """Highest value that falls in bucket index"""
+        magnitude = index >> self.sub_bucket_bits
+        sub = index - (magnitude << self.sub_bucket_bits)
+        return ((sub + 1) << magnitude) - 1
+
+    def record(self, seconds: float):
+        value = max(int(seconds * 1_000_000), 0)
+        index = self._index(value)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.total += 1
+            self._sum += value
+            self.max = max(self.max, value)
+            self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("histograms have different precision")
+        with self._lock:
+            for index, count in other.counts.items():
+                self.counts[index] = self.counts.get(index, 0) + count
+            self.total += other.total
+            self._sum += other._sum
+            self.max = max(self.max, other.max)
+            if other.min is not None:
+                self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, p: float) -> float:
+        """Latency in milliseconds below which p percent of the values fall"""
+        with self._lock:
+            if not self.total:
+                return 0.0
+            rank = max(math.ceil(self.total * p / 100.0), 1)
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return min(self._value(index), self.max) / 1000.0
+            return self.max / 1000.0
+
+    def mean(self) -> float:
+        return self._sum / self.total / 1000.0 if self.total else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        summary = {f"p{p:g}": round(self.percentile(p), 3) for p in PERCENTILES}
+        summary['min'] = round((self.min or 0) / 1000.0, 3)
+        summary['mean'] = round(self.mean(), 3)
+        summary['max'] = round(self.max / 1000.0, 3)
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'sub_bucket_bits': self.sub_bucket_bits, 'total': self.total,
+                    'min_us': self.min, 'max_us': self.max, 'sum_us': self._sum,
+                    'counts': {str(index): count for index, count in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls(data['sub_bucket_bits'])
+        histogram.counts = {int(index): count for index, count in data['counts'].items()}
+        histogram.total = data['total']
+        histogram.min = data['min_us']
+        histogram.max = data['max_us']
+        histogram._sum = data['sum_us']
+        return histogram
+
+
+# ---- corpora ----
+
+def load_mbox(path: str) -> List[bytes]:
+    """Raw messages of an mbox file"""
+    box = mailbox.mbox(path, create=False)
+    try:
+        return [box.get_bytes(key) for key in box.keys()]
+    finally:
+        box.close()
+
+
+def load_directory(path: str) -> List[bytes]:
+    """Raw messages of the .eml files in a directory, by name"""
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".eml"):
+            with open(os.path.join(path, name), "rb") as f:
+                corpus.append(f.read())
+    return corpus
+
+
+def generate_corpus(count: int = 100, seed: int = 0, html_kb: int = 16) -> List[bytes]:
+    """
+    Synthetic newsletters carrying the built-in policy templates
+
+    A quarter have no policy, and some carry tracking pixels, so the mix
+    exercises both the enforcement and the pass-through paths.
+    """
+    from .generator import PolicyGenerator
+    from .mime_handler import MIMEPrivacyHandler
+
+    templates = [PolicyGenerator.tracking_protection_policy, PolicyGenerator.tracker_blocklist_policy,
+                 PolicyGenerator.strict_privacy_policy, PolicyGenerator.attachment_control_policy]
+    # A handful of senders, each always sending the same policy
+    policies = [templates[n % len(templates)](f"sender{n}@example.com").to_string() for n in range(8)]
+    rng = random.Random(seed)
+    corpus = []
+    for n in range(count):
+        rows = []
+        while len("".join(rows)) < html_kb * 1024:
+            i = len(rows)
+            rows.append(f'<p>Story {i} <a href="https://news.example.com/{n}/{i}">read more</a>'
+                        f'<img src="https://cdn.example.com/{i}.png" width="120" height="80"/></p>')
+        if rng.random() < 0.3:
+            rows.append('<img src="https://tracker.com/open.gif" width="1" height="1"/>')
+        html = f"<html><body>{''.join(rows)}</body></html>"
+        sender = rng.randrange(len(policies))
+        from_addr = f"sender{sender}@example.com"
+        if rng.random() < 0.25:
+            msg = MIMEText(html, "html")
+            msg['From'] = from_addr
+            msg['To'] = "alice@example.com"
+            msg['Subject'] = f"Newsletter {n}"
+        else:
+            msg = MIMEPrivacyHandler.create_email_with_policy(
+                from_addr, "alice@example.com", f"Newsletter {n}", html, policies[sender])
+        corpus.append(msg.as_bytes())
+    return corpus
+
+
+# ---- targets ----
+
+class LoadTargetError(RuntimeError):
+    """The target answered, but with a failure verdict"""
+
+
+class ClientTarget:
+    """PrivacyAwareEmailClient.receive_email in this process, one client per sender thread"""
+
+    name = "client"
+
+    def __init__(self, client_factory: Optional[Callable[[], Any]] = None):
+        if client_factory is None:
+            from .email_client import PrivacyAwareEmailClient
+            client_factory = PrivacyAwareEmailClient
+        self.client_factory = client_factory
+        self._local = threading.local()
+
+    def __call__(self, raw_email: bytes):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.client_factory()
+        result = client.receive_email(raw_email)
+        if not result.get('success'):
+            raise LoadTargetError(result.get('error') or "receive_email failed")
+
+
+class SocketTarget:
+    """An enforcement daemon's Unix socket"""
+
+    name = "socket"
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def __call__(self, raw_email: bytes):
+        from .daemon import enforce_via_socket
+        verdict = enforce_via_socket(self.socket_path, raw_email, self.timeout)
+        if not verdict.get('success'):
+            raise LoadTargetError(verdict.get('error') or "daemon reported a failure")
+
+
+class HttpTarget:
+    """An enforcement daemon's POST /enforce endpoint"""
+
+    name = "http"
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, raw_email: bytes):
+        from .daemon import enforce_via_http
+        verdict = enforce_via_http(self.url, raw_email, self.timeout)
+        if not verdict.get('success'):
+            raise LoadTargetError(verdict.get('error') or "daemon reported a failure")
+
+
+# ---- running ----
+
+def run_load(target: Callable[[bytes], Any], corpus: List[bytes], rate: float,
+             duration: Optional[float] = None, count: Optional[int] = None,
+             concurrency: int = 8, warmup: int = 0, max_outstanding: Optional[int] = None,
+             label: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Send corpus messages round-robin to target at a fixed arrival rate
+
+    Args:
+        target: Called with each raw message; raising counts as an error
+        rate: Messages per second
+        duration / count: When to stop sending (count wins when both given)
+        concurrency: Sender threads; arrivals beyond them wait for one
+        warmup: Messages sent, one at a time, before the measured run
+        max_outstanding: Arrivals finding this many messages unanswered are
+            dropped and counted instead of queued (default: never)
+    """
+    if not corpus:
+        raise ValueError("corpus is empty")
+    if rate <= 0:
+        raise ValueError("rate must be positive")
+    if count is None:
+        if duration is None:
+            raise ValueError("give a duration or a message count")
+        count = max(int(rate * duration), 1)
+    for n in range(warmup):
+        try:
+            target(corpus[n % len(corpus)])
+        except Exception:
+            pass
+
+    latency = LatencyHistogram()
+    service = LatencyHistogram()
+    errors: Dict[str, int] = {}
+    state = {'outstanding': 0, 'dropped': 0, 'max_outstanding': 0, 'last_done': 0.0}
+    lock = threading.Lock()
+
+    def send(raw_email: bytes, intended: float):
+        started = time.perf_counter()
+        error = None
+        try:
+            target(raw_email)
+        except Exception as e:
+            error = type(e).__name__
+        done = time.perf_counter()
+        with lock:
+            state['outstanding'] -= 1
+            state['last_done'] = max(state['last_done'], done)
+            if error is not None:
+                errors[error] = errors.get(error, 0) + 1
+                return
+        latency.record(done - intended)
+        service.record(done - started)
+
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadgen") as executor:
+        for n in range(count):
+            intended = start + n * interval
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                if max_outstanding is not None and state['outstanding'] >= max_outstanding:
+                    state['dropped'] += 1
+                    continue
+                state['outstanding'] += 1
+                state['max_outstanding'] = max(state['max_outstanding'], state['outstanding'])
+            executor.submit(send, corpus[n % len(corpus)], intended)
+        sent_until = time.perf_counter()
+    elapsed = max(state['last_done'], sent_until) - start
+
+    completed = latency.total
+    failed = sum(errors.values())
+    return {
+        'report_version': REPORT_VERSION,
+        'label': label,
+        'environment': environment(),
+        'target': getattr(target, 'name', type(target).__name__),
+        'settings': {'rate': rate, 'count': count, 'concurrency': concurrency,
+                     'warmup': warmup, 'max_outstanding': max_outstanding,
+                     'corpus_size': len(corpus)},
+        'sent': count - state['dropped'],
+        'completed': completed,
+        'errors': failed,
+        'errors_by_type': errors,
+        'dropped': state['dropped'],
+        'peak_outstanding': state['max_outstanding'],
+        'elapsed_s': round(elapsed, 3),
+        'offered_rate': rate,
+        'throughput': round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+        'latency_ms': latency.summary(),
+        'service_ms': service.summary(),
+        'histograms': {'latency': latency.to_dict(), 'service': service.to_dict()},
+    }
+
+
+def environment() -> Dict[str, Optional[str]]:
+    """What produced a report: source revision, Python and host"""
+    revision = None
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return {'revision': revision, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': str(os.cpu_count())}
+
+
+# ---- reports ----
+
+def write_report(report: Dict[str, Any], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+def read_report(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if report.get('report_version') != REPORT_VERSION:
+        raise ValueError(f"{path}: unsupported report version {report.get('report_version')!r}")
+    return report
+
+
+def compare_reports(base: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Metric-by-metric differences between two reports
+
+    Each row has the metric, both values and the relative change; for
+    latencies and errors a positive change is a regression, for
+    throughput a negative one.
+    """
+    rows = []
+
+    def row(metric: str, old: float, value: float):
+        change = (value - old) / old if old else (0.0 if value == old else math.inf)
+        rows.append({'metric': metric, 'base': old, 'new': value, 'change': round(change, 4)})
+
+    row('throughput', base['throughput'], new['throughput'])
+    for name in ('latency_ms', 'service_ms'):
+        for key in [f"p{p:g}" for p in PERCENTILES] + ['max']:
+            row(f"{name}.{key}", base[name][key], new[name][key])
+    row('errors', base['errors'], new['errors'])
+    row('dropped', base['dropped'], new['dropped'])
+    return rows
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    settings = report['settings']
+    lines = [
+        f"target {report['target']}  rate {settings['rate']:g}/s  concurrency {settings['concurrency']}"
+        f"  revision {report['environment'].get('revision') or '-'}",
+        f"sent {report['sent']}  completed {report['completed']}  errors {report['errors']}"
+        f"  dropped {report['dropped']}  peak outstanding {report['peak_outstanding']}",
+        f"throughput {report['throughput']:.1f}/s over {report['elapsed_s']:.1f}s",
+    ]
+    for name, title in (('latency_ms', 'latency'), ('service_ms', 'service')):
+        values = "  ".join(f"{key} {value:.2f}" for key, value in report[name].items())
+        lines.append(f"{title:>8} ms  {values}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows: Iterable[Dict[str, Any]]) -> str:
+    lines = [f"{'metric':<20} {'base':>10} {'new':>10} {'change':>8}"]
+    for r in rows:
+        change = "n/a" if math.isinf(r['change']) else f"{r['change'] * 100:+.1f}%"
+        lines.append(f"{r['metric']:<20} {r['base']:>10.3f} {r['new']:>10.3f} {change:>8}")
+    return "\n".join(lines)
+
+
+def read_corpus(mbox: Optional[str] = None, directory: Optional[str] = None,
+                generate: Optional[int] = None, seed: int = 0) -> List[bytes]:
+    """The corpus the load command's options describe"""
+    corpus: List[bytes] = []
+    if mbox:
+        corpus.extend(load_mbox(mbox))
+    if directory:
+        corpus.extend(load_directory(directory))
+    if generate or not corpus:
+        corpus.extend(generate_corpus(generate or 100, seed))
+    return corpus
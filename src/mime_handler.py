@@ -7,16 +7,20 @@ from email import encoders
 import base64
 import quopri
 from lxml import etree as ET
+from .compiler import compile_policy, dump_bundle, load_bundle, PolicyCompileError
 
 class MIMEPrivacyHandler:
     """Handles attaching and extracting privacy policies from emails"""
     
     PRIVACY_HEADER = "X-Privacy-Policy"
+    BUNDLE_HEADER = "X-Privacy-Policy-Bundle"
+    BUNDLE_DIGEST_HEADER = "X-Privacy-Policy-Digest"
     PRIVACY_MIME_TYPE = "application/xml+privacy-policy"
     PRIVACY_NAMESPACE = "urn:email:privacy:1.0"
     
     @staticmethod
-    def attach_policy(email_msg: MIMEMultipart, policy_xml: str, method: str = "both") -> MIMEMultipart:
+    def attach_policy(email_msg: MIMEMultipart, policy_xml: str, method: str = "both",
+                      bundle: bool = False) -> MIMEMultipart:
         """
         Attach privacy policy to email using specified method
         
@@ -24,8 +28,17 @@ class MIMEPrivacyHandler:
             email_msg: The email message
             policy_xml: The privacy policy XML as string
             method: "header", "mime", or "both"
+            bundle: Also attach the compiled JSON bundle and its digest as
+                    headers, so clients can skip XML parsing
         """
         
+        if bundle:
+            compiled = compile_policy(policy_xml)
+            email_msg[MIMEPrivacyHandler.BUNDLE_DIGEST_HEADER] = compiled['digest']
+            email_msg[MIMEPrivacyHandler.BUNDLE_HEADER] = base64.b64encode(
+                dump_bundle(compiled).encode('utf-8')
+            ).decode('ascii')
+        
         if method in ["header", "both"]:
             # Method A: Add as X-Header (base64 encoded)
             encoded_policy = base64.b64encode(policy_xml.encode('utf-8')).decode('ascii')
@@ -56,13 +69,18 @@ class MIMEPrivacyHandler:
         return email_msg
     
     @staticmethod
-    def extract_policy(email_msg: email.message.Message) -> str:
+    def extract_policy(email_msg: email.message.Message, verbose: bool = True) -> str:
         """
         Extract privacy policy from email, trying multiple methods
         
+        Args:
+            email_msg: Message to search
+            verbose: Print where the policy was found; servers pass False
+        
         Returns:
             Policy XML as string, or None if not found
         """
+        report = print if verbose else (lambda *args: None)
         policy_xml = None
         
         # Method 1: Try X-Header first (fastest)
@@ -70,10 +88,10 @@ class MIMEPrivacyHandler:
             try:
                 encoded_policy = email_msg[MIMEPrivacyHandler.PRIVACY_HEADER]
                 policy_xml = base64.b64decode(encoded_policy).decode('utf-8')
-                print("✓ Extracted policy from X-Header")
+                report("✓ Extracted policy from X-Header")
                 return policy_xml
             except Exception as e:
-                print(f"✗ Failed to decode header policy: {e}")
+                report(f"✗ Failed to decode header policy: {e}")
         
         # Method 2: Try MIME parts
         for part in email_msg.walk():
@@ -91,20 +109,55 @@ class MIMEPrivacyHandler:
                     payload = part.get_payload(decode=True)
                     if payload:
                         policy_xml = payload.decode('utf-8')
-                        print("✓ Extracted policy from MIME part")
+                        report("✓ Extracted policy from MIME part")
                         return policy_xml
                 except Exception as e:
-                    print(f"✗ Failed to decode MIME policy: {e}")
+                    report(f"✗ Failed to decode MIME policy: {e}")
         
         # Method 3: Try embedded in body (fallback)
         policy_xml = MIMEPrivacyHandler._extract_from_body(email_msg)
         if policy_xml:
-            print("✓ Extracted policy from email body")
+            report("✓ Extracted policy from email body")
             return policy_xml
         
-        print("✗ No privacy policy found in email")
+        report("✗ No privacy policy found in email")
         return None
     
+    @staticmethod
+    def extract_header_policy(email_msg: email.message.Message) -> str:
+        """
+        Extract the policy from the X-Header only, without touching the body
+        
+        Returns:
+            Policy XML as string, or None if the header is missing or invalid
+        """
+        encoded_policy = email_msg.get(MIMEPrivacyHandler.PRIVACY_HEADER)
+        if not encoded_policy:
+            return None
+        try:
+            return base64.b64decode(str(encoded_policy)).decode('utf-8')
+        except Exception:
+            return None
+    
+    @staticmethod
+    def extract_bundle(email_msg: email.message.Message) -> dict:
+        """
+        Extract and verify the compiled policy bundle, if one is attached
+        
+        Returns:
+            The bundle dict, or None if it is missing or does not verify
+        """
+        encoded = email_msg.get(MIMEPrivacyHandler.BUNDLE_HEADER)
+        if not encoded:
+            return None
+        try:
+            compiled = load_bundle(base64.b64decode(str(encoded)))
+        except (ValueError, PolicyCompileError):
+            return None
+        if compiled['digest'] != str(email_msg.get(MIMEPrivacyHandler.BUNDLE_DIGEST_HEADER, compiled['digest'])).strip():
+            return None
+        return compiled
+    
     @staticmethod
     def _extract_from_body(email_msg: email.message.Message) -> str:
         """Extract policy from email body comments or hidden elements"""
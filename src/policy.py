@@ -1,4 +1,3 @@
-import uuid
 import datetime
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
@@ -60,7 +59,8 @@ class Rule:
 
 @dataclass
 class PrivacyPolicy:
-    policy_id: str = field(default_factory=lambda: f"policy-{uuid.uuid4()}")
+    # Stable across versions of the same policy; written as the id attribute
+    policy_id: Optional[str] = None
     version: str = "1.0"
     creator: str = "unknown"
     created: datetime.datetime = field(default_factory=datetime.datetime.now)
@@ -73,6 +73,8 @@ class PrivacyPolicy:
     def to_xml(self) -> ET.Element:
         nsmap = {None: "urn:email:privacy:1.0"}
         root = ET.Element("PrivacyPolicy", version=self.version, nsmap=nsmap)
+        if self.policy_id:
+            root.set("id", self.policy_id)
         
         # Metadata
         metadata_elem = ET.SubElement(root, "Metadata")
@@ -0,0 +1,528 @@
+"""
+Literal prefilter: skip rules, and the XML they need, when a message
+cannot match them
+
+Most rules only match when the message contains some string literal:
+contains(@src, 'tracker.com'), @name = 'Received', pp:raw-contains('pixel.gif').
+xpath_requirement() derives, when it can, what every match of an
+expression needs as clauses of literals: each clause has at least one
+literal occurring in the message. LiteralPrefilter searches a message
+for the literals of all rules of a policy, case-insensitively, and returns the rules that may still match; when no structure or
+content rule is left the message is never turned into XML.
+
+The search covers the text the XML would be built from, not the raw
+bytes, since base64 or quoted-printable bodies hide literals from a raw
+scan: header names and values, each part's content type, filename and
+decoded text, and for HTML parts also the text with entities decoded and
+with markup removed (an element's string value can be split by tags or
+comments in the source). Parts the streaming ingestor spooled to disk
+are read in windows (spooled_windows), so a literal anywhere in them is
+found without holding the whole part in memory.
+
+Only tests whose subject holds text from one place are used: a literal
+compared against <email>, <body> or a part element could span the
+boundary between headers or parts, and attributes the enforcer computes
+(tracker, pixel, host, ...) are not message text. Anything not
+understood yields no clause, so the rule is always evaluated.
+"""
+
+import codecs
+import html
+import re
+import threading
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .xpath_analysis import NODE_TYPES, XPathSyntaxError, tokenize
+
+# Every clause must be satisfied; a clause is satisfied by any of its literals
+Requirement = Tuple[FrozenSet[str], ...]
+
+# Literals this short occur in nearly every message; clauses holding one
+# are dropped
+MIN_LITERAL_LENGTH = 3
+
+# Elements whose string value joins text from several headers or parts,
+# or holds text the enforcer generates
+UNSAFE_ELEMENTS = frozenset({"email", "headers", "body", "part", "html-part", "parse-error"})
+# Attributes set by the enforcer rather than copied from the message
+SYNTHETIC_ATTRIBUTES = frozenset({"tracker", "pixel", "hidden", "host", "spooled", "size", "error"})
+
+_STRING_FUNCTIONS = frozenset({
+    "string", "concat", "substring", "substring-before", "substring-after", "normalize-space",
+    "translate", "local-name", "name", "namespace-uri", "pp:header",
+})
+_NUMBER_FUNCTIONS = frozenset({
+    "count", "sum", "position", "last", "string-length", "number", "floor", "ceiling", "round",
+})
+_BOOLEAN_FUNCTIONS = frozenset({"not", "true", "false", "lang", "pp:raw-matches"})
+
+# Bytes of a spooled part decoded per window
+SPOOL_WINDOW = 1024 * 1024
+# Longest entity reference held back at the end of a window
+_MAX_ENTITY = 32
+
+_MARKUP_RE = re.compile(r"<!\[CDATA\[(.*?)\]\]>|<!--.*?-->|<\?.*?\?>|<[^>]*>", re.DOTALL)
+
+
+# ---- requirements ----
+
+def _all(*requirements: Requirement) -> Requirement:
+    clauses = []
+    for requirement in requirements:
+        for clause in requirement:
+            if clause not in clauses:
+                clauses.append(clause)
+    return tuple(clauses)
+
+
+def _any(requirements: List[Requirement]) -> Requirement:
+    """Any one of several requirements: one clause joining a clause of each"""
+    if not requirements or any(not r for r in requirements):
+        return ()
+    return (frozenset().union(*(min(r, key=len) for r in requirements)),)
+
+
+def _clause(*literals: str) -> Requirement:
+    if any(len(literal) < MIN_LITERAL_LENGTH for literal in literals):
+        return ()
+    return (frozenset(literals),)
+
+
+class _Step(NamedTuple):
+    """The node a step selects: whether its string value is text from one place"""
+    safe: bool
+    element: bool = False
+
+
+_UNSAFE = _Step(False)
+
+
+class _Value(NamedTuple):
+    req: Requirement = ()     # for the value to be true as a boolean
+    kind: str = "other"       # nodes, string, number, boolean or other
+    safe: bool = False        # nodes: each string value is text from one place
+    literal: Optional[str] = None
+
+
+class _Parser:
+    """Recursive descent over XPath 1.0 tokens, computing requirements"""
+
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.i = 0
+
+    def peek(self, ahead: int = 0) -> Optional[str]:
+        at = self.i + ahead
+        return self.tokens[at][1] if at < len(self.tokens) else None
+
+    def kind(self, ahead: int = 0) -> Optional[str]:
+        at = self.i + ahead
+        return self.tokens[at][0] if at < len(self.tokens) else None
+
+    def take(self, expected: Optional[str] = None) -> str:
+        text = self.peek()
+        if text is None or (expected is not None and text != expected):
+            raise XPathSyntaxError(f"expected {expected or 'a token'} at token {self.i}")
+        self.i += 1
+        return text
+
+    def parse(self) -> _Value:
+        # Rules are evaluated on the <email> root
+        value = self.or_expr(_UNSAFE)
+        if self.i != len(self.tokens):
+            raise XPathSyntaxError(f"unexpected {self.peek()!r} at token {self.i}")
+        return value
+
+    def or_expr(self, ctx: _Step) -> _Value:
+        values = [self.and_expr(ctx)]
+        while self.peek() == "or":
+            self.take()
+            values.append(self.and_expr(ctx))
+        if len(values) == 1:
+            return values[0]
+        return _Value(_any([v.req for v in values]), "boolean")
+
+    def and_expr(self, ctx: _Step) -> _Value:
+        values = [self.equality(ctx)]
+        while self.peek() == "and":
+            self.take()
+            values.append(self.equality(ctx))
+        if len(values) == 1:
+            return values[0]
+        return _Value(_all(*(v.req for v in values)), "boolean")
+
+    def equality(self, ctx: _Step) -> _Value:
+        value = self.relational(ctx)
+        while self.peek() in ("=", "!="):
+            op = self.take()
+            value = self._compare(op, value, self.relational(ctx))
+        return value
+
+    def relational(self, ctx: _Step) -> _Value:
+        value = self.additive(ctx)
+        while self.peek() in ("<", ">", "<=", ">="):
+            op = self.take()
+            value = self._compare(op, value, self.additive(ctx))
+        return value
+
+    @staticmethod
+    def _compare(op: str, left: _Value, right: _Value) -> _Value:
+        """A comparison involving a node-set is false when that node-set is empty"""
+        req: Requirement = ()
+        for nodes, other in ((left, right), (right, left)):
+            if nodes.kind != "nodes" or other.kind not in ("nodes", "string", "number"):
+                continue
+            req = _all(req, nodes.req)
+            if op == "=" and nodes.safe and other.kind == "string" and other.literal:
+                req = _all(req, _clause(other.literal))
+        return _Value(req, "boolean")
+
+    def additive(self, ctx: _Step) -> _Value:
+        value = self.multiplicative(ctx)
+        while self.peek() in ("+", "-"):
+            self.take()
+            self.multiplicative(ctx)
+            value = _Value(kind="number")
+        return value
+
+    def multiplicative(self, ctx: _Step) -> _Value:
+        value = self.unary(ctx)
+        while self.peek() in ("*", "div", "mod"):
+            self.take()
+            self.unary(ctx)
+            value = _Value(kind="number")
+        return value
+
+    def unary(self, ctx: _Step) -> _Value:
+        if self.peek() == "-":
+            self.take()
+            self.unary(ctx)
+            return _Value(kind="number")
+        return self.union(ctx)
+
+    def union(self, ctx: _Step) -> _Value:
+        values = [self.path(ctx)]
+        while self.peek() == "|":
+            self.take()
+            values.append(self.path(ctx))
+        if len(values) == 1:
+            return values[0]
+        return _Value(_any([v.req for v in values]), "nodes", all(v.safe for v in values))
+
+    # ---- paths ----
+
+    def _at_step(self) -> bool:
+        text, kind = self.peek(), self.kind()
+        if text in ("@", ".", "..", "*"):
+            return True
+        if kind != "name":
+            return False
+        return self.peek(1) != "(" or text in NODE_TYPES
+
+    def path(self, ctx: _Step) -> _Value:
+        if self.peek() in ("/", "//"):
+            if self.take() == "/" and not self._at_step():
+                return _Value(kind="nodes")  # the root node: every text of the message
+            return self._steps(_UNSAFE, ())
+        if self._at_step():
+            return self._steps(ctx, ())
+        value = self.primary(ctx)
+        req = value.req
+        if self.peek() == "[":
+            req = _all(req, self._predicates(_UNSAFE))
+            value = _Value(req, value.kind)
+        if self.peek() in ("/", "//"):
+            self.take()
+            return self._steps(_UNSAFE, req)
+        return value
+
+    def _steps(self, prev: _Step, req: Requirement) -> _Value:
+        while True:
+            prev, step_req = self._step(prev)
+            req = _all(req, step_req)
+            if self.peek() not in ("/", "//"):
+                return _Value(req, "nodes", prev.safe)
+            self.take()
+
+    def _step(self, prev: _Step) -> Tuple[_Step, Requirement]:
+        text = self.take()
+        if text == ".":
+            return prev, ()
+        if text == "..":
+            return _UNSAFE, ()
+        axis = "child"
+        if text == "@":
+            axis, text = "attribute", self.take()
+        elif self.peek() == "::":
+            self.take()
+            axis, text = text, self.take()
+        if self.peek() == "(" and text in NODE_TYPES:
+            self.take()
+            if self.peek() != ")":
+                self.take()
+            self.take(")")
+            if text == "text":
+                step = _Step(prev.element and prev.safe)
+            elif text == "node" and axis == "self":
+                step = prev
+            else:
+                step = _UNSAFE
+        elif text == "*" or axis == "namespace":
+            step = _UNSAFE
+        elif axis == "attribute":
+            step = _Step(text not in SYNTHETIC_ATTRIBUTES)
+        else:
+            step = _Step(text not in UNSAFE_ELEMENTS, element=True)
+        return step, self._predicates(step)
+
+    def _predicates(self, owner: _Step) -> Requirement:
+        req: Requirement = ()
+        while self.peek() == "[":
+            self.take()
+            value = self.or_expr(owner)
+            self.take("]")
+            # A number selects by position; anything else is a condition
+            if value.kind != "number":
+                req = _all(req, value.req)
+        return req
+
+    # ---- primaries ----
+
+    def primary(self, ctx: _Step) -> _Value:
+        text, kind = self.peek(), self.kind()
+        if text == "(":
+            self.take()
+            value = self.or_expr(ctx)
+            self.take(")")
+            return value
+        if kind == "literal":
+            self.take()
+            return _Value(kind="string", literal=text[1:-1])
+        if kind == "number":
+            self.take()
+            return _Value(kind="number")
+        if text == "$":
+            self.take()
+            self.take()
+            return _Value()
+        if kind == "name" and self.peek(1) == "(":
+            return self.call(ctx)
+        raise XPathSyntaxError(f"unexpected {text!r} at token {self.i}")
+
+    def call(self, ctx: _Step) -> _Value:
+        name = self.take()
+        self.take("(")
+        args: List[_Value] = []
+        while self.peek() != ")":
+            args.append(self.or_expr(ctx))
+            if self.peek() == ",":
+                self.take()
+        self.take(")")
+        if name in ("contains", "starts-with") and len(args) == 2:
+            subject, needle = args
+            req = subject.req if subject.kind == "nodes" else ()
+            if subject.kind == "nodes" and subject.safe and needle.kind == "string" and needle.literal:
+                req = _all(req, _clause(needle.literal))
+            return _Value(req, "boolean")
+        if name == "pp:raw-contains" and len(args) == 1:
+            needle = args[0]
+            if needle.kind == "string" and needle.literal:
+                return _Value(_clause(needle.literal), "boolean")
+            return _Value(kind="boolean")
+        if name == "boolean" and len(args) == 1:
+            return _Value(args[0].req if args[0].kind in ("nodes", "boolean") else (), "boolean")
+        if name in _NUMBER_FUNCTIONS:
+            return _Value(kind="number")
+        if name in _STRING_FUNCTIONS:
+            return _Value(kind="string")
+        if name in _BOOLEAN_FUNCTIONS:
+            return _Value(kind="boolean")
+        if name == "id":
+            return _Value(kind="nodes")
+        return _Value()
+
+
+def xpath_requirement(expr: str) -> Requirement:
+    """Clauses of literals every match of expr needs; () when none are known"""
+    try:
+        value = _Parser(tokenize(expr)).parse()
+    except (XPathSyntaxError, IndexError):
+        return ()
+    return value.req if value.kind in ("nodes", "boolean") else ()
+
+
+def mime_requirement(pattern: str) -> Requirement:
+    """For a MIMEPattern condition: the content type up to its first wildcard"""
+    prefix = pattern.strip().lower().split("*", 1)[0]
+    return _clause(prefix) if prefix else ()
+
+
+def condition_requirement(cond: Dict) -> Requirement:
+    """For a compiled bundle condition (see compiler.py)"""
+    if "xpath" in cond:
+        return xpath_requirement(cond["xpath"])
+    if "mime" in cond:
+        return mime_requirement(cond["mime"])
+    if "all" in cond:
+        return _all(*(condition_requirement(child) for child in cond["all"]))
+    if "any" in cond:
+        return _any([condition_requirement(child) for child in cond["any"]])
+    return ()
+
+
+# ---- matching ----
+
+def _strip_markup(text: str) -> str:
+    return _MARKUP_RE.sub(lambda m: m.group(1) or "", text)
+
+
+def message_texts(email_msg, load: Callable[[object], Optional[bytes]]) -> List[str]:
+    """
+    The text the email XML would hold, as separate pieces
+
+    load decodes a part's payload, as the enforcer does when it builds
+    the part's element.
+    """
+    texts = []
+    for name, value in email_msg.items():
+        texts.append(name)
+        texts.append(str(value))
+    for part in email_msg.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        texts.append(content_type)
+        filename = part.get_filename()
+        if filename:
+            texts.append(filename)
+        payload = load(part)
+        if not payload:
+            continue
+        text = payload.decode('utf-8', errors='ignore')
+        texts.append(text)
+        if content_type == 'text/html':
+            if "&" in text:
+                texts.append(html.unescape(text))
+            texts.append(html.unescape(_strip_markup(text)))
+    return texts
+
+
+def spooled_windows(path: str, html_part: bool = False,
+                    window: int = SPOOL_WINDOW) -> Iterator[List[str]]:
+    """
+    The text of a part spooled to disk, one window at a time
+
+    Each window lists the variants message_texts() would hold for that
+    stretch of text: the decoded text and, for HTML, the text with
+    entities decoded and with markup removed. A tag or entity cut by the
+    end of a window is carried over to the next one.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    carry = ""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(window)
+            text = carry + decoder.decode(chunk, final=not chunk)
+            carry = ""
+            if html_part and chunk:
+                cut = len(text)
+                tag = text.rfind("<")
+                if tag > text.rfind(">") and len(text) - tag < 4 * window:
+                    cut = tag
+                entity = text.rfind("&", 0, cut)
+                if entity > text.rfind(";", 0, cut) and cut - entity < _MAX_ENTITY:
+                    cut = entity
+                text, carry = text[:cut], text[cut:]
+            if text:
+                if html_part:
+                    yield [text, html.unescape(text), html.unescape(_strip_markup(text))]
+                else:
+                    yield [text]
+            if not chunk:
+                return
+
+
+def _needle(literal: str):
+    """A case-folded literal, or a pattern when it holds whitespace"""
+    folded = literal.casefold()
+    if not re.search(r"\s", folded):
+        return folded
+    # XML parsing normalizes line ends and attribute whitespace
+    return re.compile(r"\s+".join(re.escape(word) for word in re.split(r"\s+", folded)))
+
+
+class LiteralPrefilter:
+    """
+    The literals of a set of requirements, searched case-insensitively
+
+    requirements: key (e.g. rule index) -> Requirement; keys with an empty
+    requirement are always live
+    """
+
+    def __init__(self, requirements: Dict[str, Requirement]):
+        self.requirements = {key: req for key, req in requirements.items() if req}
+        self.always = {key for key, req in requirements.items() if not req}
+        self.literals: Set[str] = set()
+        for req in self.requirements.values():
+            for clause in req:
+                self.literals.update(clause)
+        self._needles = {literal: _needle(literal) for literal in self.literals}
+        self._lock = threading.Lock()
+        self.scanned = 0
+        self.skipped = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.requirements)
+
+    def present_in(self, windows: Iterable[List[str]]) -> Set[str]:
+        """
+        The literals occurring in a stream of windows, e.g. spooled_windows()
+
+        The end of each variant is kept with the next window, so a literal
+        split between windows is found. Literals holding whitespace match
+        runs of any length, which no overlap covers; they count as present.
+        """
+        present = {literal for literal, needle in self._needles.items() if not isinstance(needle, str)}
+        wanted = [literal for literal in self.literals if literal not in present]
+        overlap = max((len(self._needles[literal]) for literal in wanted), default=1) - 1
+        tails: Dict[int, str] = {}
+        for window in windows:
+            if not wanted:
+                break
+            for n, text in enumerate(window):
+                haystack = tails.get(n, "") + text.casefold()
+                present.update(literal for literal in wanted if self._needles[literal] in haystack)
+                tails[n] = haystack[-overlap:] if overlap else ""
+            wanted = [literal for literal in wanted if literal not in present]
+        return present
+
+    def live(self, texts: Iterable[str], keys: Optional[Iterable[str]] = None,
+             present: Optional[Set[str]] = None) -> Set[str]:
+        """
+        The keys (all, or those given) whose requirement the texts satisfy
+
+        present: literals known to occur elsewhere in the message, e.g.
+        found by present_in() in a spooled part
+        """
+        keys = set(self.requirements) | self.always if keys is None else set(keys)
+        live = keys & self.always
+        pending = [key for key in keys if key in self.requirements]
+        if pending:
+            # Substring search on one folded string beats a regex alternation
+            # by an order of magnitude; no literal holds the separator
+            haystack = "\0".join(texts).casefold()
+            seen: Dict[str, bool] = {}
+
+            def found(literal: str) -> bool:
+                if literal not in seen:
+                    needle = self._needles[literal]
+                    seen[literal] = (literal in (present or ()) or (
+                        needle in haystack if isinstance(needle, str) else needle.search(haystack) is not None))
+                return seen[literal]
+
+            live.update(key for key in pending
+                        if all(any(found(lit) for lit in clause) for clause in self.requirements[key]))
+        with self._lock:
+            self.scanned += 1
+            self.skipped += len(keys) - len(live)
+        return live
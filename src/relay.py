@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+"""
+In-transit enforcement as a streaming local SMTP relay
+
+The relay accepts mail over SMTP, reads the header block of each DATA
+stream, extracts the privacy policy from the X-Privacy-Policy header and
+applies the policy's in-transit rules before any body bytes arrive:
+
+    block  - the message is refused with 550 and never forwarded
+    strip  - matching header fields are dropped from the forwarded copy
+    warn   - an X-Privacy-Warning header is added
+
+The body is then piped line by line to the next hop, so memory per
+message is bounded by the header limit regardless of message size.
+In-transit rules whose conditions need the body cannot be decided in a
+stream; they are reported in an X-Privacy-Deferred header and left to
+at-use enforcement.
+
+Only the X-Privacy-Policy header is consulted: a policy carried only as
+a MIME part arrives with the body, so such messages are forwarded as
+they are. Only rules whose Scope names in-transit are applied; a rule
+without a Scope is left to the other phases. The policy is evaluated on
+the default executor so the event loop keeps serving other sessions.
+"""
+
+import abc
+import argparse
+import asyncio
+import logging
+import threading
+from email.parser import BytesHeaderParser
+from typing import Dict, List, Optional, Tuple
+
+from .enforcer import PolicyEnforcer
+from .mime_handler import MIMEPrivacyHandler
+
+CRLF = b"\r\n"
+MAX_LINE_BYTES = 64 * 1024
+
+
+class SMTPError(Exception):
+    def __init__(self, code: int, text: str):
+        super().__init__(f"{code} {text}")
+        self.code = code
+        self.text = text
+
+
+class _LineTooLong(Exception):
+    """A line longer than MAX_LINE_BYTES; it has been read and discarded"""
+
+
+class _AsyncSMTPServer(abc.ABC):
+    """Minimal SMTP server session loop shared by the relay and the sink"""
+
+    banner = "ESMTP"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, hostname: str = "localhost",
+                 max_message_bytes: int = 50 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.hostname = hostname
+        self.max_message_bytes = max_message_bytes
+        self.logger = logging.getLogger(__name__)
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    # ---- lifecycle ----
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, self.host, self.port,
+                                                  limit=MAX_LINE_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start_background(self) -> int:
+        """Run the server on its own event loop thread; returns the bound port"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.port
+
+    def stop_background(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    # ---- protocol ----
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        envelope = {'mail_from': None, 'rcpt_to': []}
+        try:
+            await self._reply(writer, 220, f"{self.hostname} {self.banner}")
+            while True:
+                try:
+                    line = await _read_line(reader)
+                except _LineTooLong:
+                    await self._reply(writer, 500, "Line too long")
+                    continue
+                if not line:
+                    break
+                command, _, arg = line.decode('ascii', 'replace').strip().partition(' ')
+                command = command.upper()
+                if command == 'EHLO':
+                    await self._reply_lines(writer, 250, [
+                        self.hostname, "8BITMIME", f"SIZE {self.max_message_bytes}"
+                    ])
+                elif command == 'HELO':
+                    await self._reply(writer, 250, self.hostname)
+                elif command == 'MAIL':
+                    envelope = {'mail_from': _address(arg), 'rcpt_to': []}
+                    await self._reply(writer, 250, "OK")
+                elif command == 'RCPT':
+                    if envelope['mail_from'] is None:
+                        await self._reply(writer, 503, "Need MAIL first")
+                        continue
+                    envelope['rcpt_to'].append(_address(arg))
+                    await self._reply(writer, 250, "OK")
+                elif command == 'DATA':
+                    if not envelope['rcpt_to']:
+                        await self._reply(writer, 503, "Need RCPT first")
+                        continue
+                    await self._reply(writer, 354, "End data with <CR><LF>.<CR><LF>")
+                    try:
+                        code, text = await self.handle_data(envelope, reader)
+                    except _LineTooLong:
+                        await self._drain_data(reader)
+                        code, text = 552, "Line too long"
+                    await self._reply(writer, code, text)
+                    envelope = {'mail_from': None, 'rcpt_to': []}
+                elif command == 'RSET':
+                    envelope = {'mail_from': None, 'rcpt_to': []}
+                    await self._reply(writer, 250, "OK")
+                elif command == 'NOOP':
+                    await self._reply(writer, 250, "OK")
+                elif command == 'QUIT':
+                    await self._reply(writer, 221, "Bye")
+                    break
+                else:
+                    await self._reply(writer, 502, "Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            self.logger.debug(f"SMTP session ended: {e}")
+        finally:
+            writer.close()
+
+    @abc.abstractmethod
+    async def handle_data(self, envelope: Dict, reader: asyncio.StreamReader) -> Tuple[int, str]:
+        """Consume one DATA stream up to the terminating dot; returns the reply"""
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, code: int, text: str):
+        writer.write(f"{code} {text}\r\n".encode('ascii', 'replace'))
+        await writer.drain()
+
+    @staticmethod
+    async def _reply_lines(writer: asyncio.StreamWriter, code: int, lines: List[str]):
+        for line in lines[:-1]:
+            writer.write(f"{code}-{line}\r\n".encode('ascii', 'replace'))
+        await _AsyncSMTPServer._reply(writer, code, lines[-1])
+
+    @staticmethod
+    async def _drain_data(reader: asyncio.StreamReader):
+        """Consume the rest of a DATA stream up to the terminating dot"""
+        while True:
+            try:
+                line = await _read_line(reader)
+            except _LineTooLong:
+                continue
+            if not line or line in (b".\r\n", b".\n"):
+                return
+
+
+def _address(arg: str) -> str:
+    _, _, value = arg.partition(':')
+    value = value.strip().split(' ', 1)[0]
+    return value.strip('<>')
+
+
+def _is_terminator(line: bytes) -> bool:
+    return line in (b".\r\n", b".\n")
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    """
+    Like readline(), but a line over the reader's limit is skipped to its
+    end and reported with _LineTooLong instead of a ValueError that leaves
+    the rest of the line in the stream
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+            continue
+        raise _LineTooLong()
+
+
+class _NextHop:
+    """Streaming SMTP client for the downstream server"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int, helo: str, mail_from: str,
+                      rcpt_to: List[str], timeout: float) -> "_NextHop":
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, limit=MAX_LINE_BYTES), timeout
+        )
+        hop = cls(reader, writer)
+        await hop.expect(220)
+        await hop.command(f"EHLO {helo}", 250)
+        await hop.command(f"MAIL FROM:<{mail_from or ''}>", 250)
+        for rcpt in rcpt_to:
+            await hop.command(f"RCPT TO:<{rcpt}>", 250, 251)
+        await hop.command("DATA", 354)
+        return hop
+
+    async def expect(self, *codes: int) -> Tuple[int, str]:
+        lines = []
+        while True:
+            try:
+                line = await _read_line(self.reader)
+            except _LineTooLong:
+                raise SMTPError(451, "Next hop reply too long")
+            if not line:
+                raise SMTPError(421, "Next hop closed the connection")
+            text = line.decode('ascii', 'replace').rstrip()
+            lines.append(text[4:])
+            if len(text) < 4 or text[3] != '-':
+                break
+        code = int(text[:3])
+        if code not in codes:
+            raise SMTPError(code, " ".join(lines))
+        return code, " ".join(lines)
+
+    async def command(self, line: str, *codes: int) -> Tuple[int, str]:
+        self.writer.write(line.encode('utf-8') + CRLF)
+        await self.writer.drain()
+        return await self.expect(*codes)
+
+    async def write(self, data: bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def finish(self) -> Tuple[int, str]:
+        await self.write(b".\r\n")
+        reply = await self.expect(250)
+        await self.close()
+        return reply
+
+    async def close(self):
+        try:
+            self.writer.write(b"QUIT\r\n")
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+def _split_fields(header_lines: List[bytes]) -> List[List[bytes]]:
+    """Group raw header lines into fields, keeping continuation lines"""
+    fields: List[List[bytes]] = []
+    for line in header_lines:
+        if line[:1] in (b" ", b"\t") and fields:
+            fields[-1].append(line)
+        else:
+            fields.append([line])
+    return fields
+
+
+def _normalize(value: str) -> str:
+    return " ".join(value.split())
+
+
+class SMTPRelay(_AsyncSMTPServer):
+    """Applies in-transit policy rules while streaming mail to the next hop"""
+
+    banner = "ESMTP privacy relay"
+
+    def __init__(self, next_hop: Tuple[str, int], host: str = "127.0.0.1", port: int = 10025,
+                 enforcer: Optional[PolicyEnforcer] = None, max_header_bytes: int = 256 * 1024,
+                 next_hop_timeout: float = 30.0, **kwargs):
+        super().__init__(host=host, port=port, **kwargs)
+        self.next_hop = next_hop
+        self.enforcer = enforcer or PolicyEnforcer()
+        self.max_header_bytes = max_header_bytes
+        self.next_hop_timeout = next_hop_timeout
+        self.stats = {'relayed': 0, 'blocked': 0, 'rejected': 0, 'failed': 0}
+
+    async def handle_data(self, envelope: Dict, reader: asyncio.StreamReader) -> Tuple[int, str]:
+        # 1. Header block, bounded
+        header_lines: List[bytes] = []
+        header_bytes = 0
+        first_body_line = None
+        while True:
+            try:
+                line = await _read_line(reader)
+            except _LineTooLong:
+                self.stats['rejected'] += 1
+                raise
+            if not line:
+                raise ConnectionError("Client closed during DATA")
+            if _is_terminator(line):
+                first_body_line = line
+                break
+            if line in (b"\r\n", b"\n"):
+                first_body_line = line
+                break
+            header_bytes += len(line)
+            if header_bytes > self.max_header_bytes:
+                await self._drain_data(reader)
+                self.stats['rejected'] += 1
+                return 552, "Header block exceeds relay limit"
+            header_lines.append(line)
+
+        # 2. Policy decision before the body arrives, off the event loop
+        decision = await asyncio.get_running_loop().run_in_executor(None, self.decide, header_lines)
+        if decision['block']:
+            if not _is_terminator(first_body_line):
+                await self._drain_data(reader)
+            self.stats['blocked'] += 1
+            return 550, decision['block']
+
+        # 3. Stream headers and body to the next hop
+        try:
+            hop = await _NextHop.connect(
+                self.next_hop[0], self.next_hop[1], self.hostname,
+                envelope['mail_from'], envelope['rcpt_to'], self.next_hop_timeout
+            )
+        except (SMTPError, OSError, asyncio.TimeoutError) as e:
+            if not _is_terminator(first_body_line):
+                await self._drain_data(reader)
+            self.stats['failed'] += 1
+            code = e.code if isinstance(e, SMTPError) and 400 <= e.code < 600 else 451
+            return code, f"Next hop unavailable: {e}"
+
+        try:
+            total = header_bytes
+            await hop.write(b"".join(decision['headers']))
+            line = first_body_line
+            while not _is_terminator(line):
+                total += len(line)
+                if total > self.max_message_bytes:
+                    await self._drain_data(reader)
+                    await hop.close()
+                    self.stats['rejected'] += 1
+                    return 552, "Message exceeds relay size limit"
+                await hop.write(line)
+                try:
+                    line = await _read_line(reader)
+                except _LineTooLong:
+                    await hop.close()
+                    self.stats['rejected'] += 1
+                    raise
+                if not line:
+                    await hop.close()
+                    raise ConnectionError("Client closed during DATA")
+            code, text = await hop.finish()
+        except SMTPError as e:
+            self.stats['failed'] += 1
+            return e.code, e.text
+        except OSError as e:
+            self.stats['failed'] += 1
+            return 451, f"Next hop failed: {e}"
+
+        self.stats['relayed'] += 1
+        return code, text
+
+    def decide(self, header_lines: List[bytes]) -> Dict:
+        """
+        Evaluate in-transit header rules for one header block
+
+        Returns:
+            {'block': refusal text or None, 'headers': header lines to forward}
+        """
+        raw_headers = b"".join(
+            line[1:] if line.startswith(b"..") else line for line in header_lines
+        )
+        email_msg = BytesHeaderParser().parsebytes(raw_headers + CRLF)
+        policy_xml = MIMEPrivacyHandler.extract_header_policy(email_msg)
+        if not policy_xml:
+            return {'block': None, 'headers': header_lines}
+
+        try:
+            matched, deferred = self.enforcer.match_header_rules(email_msg, policy_xml, 'in-transit')
+        except Exception as e:
+            self.logger.warning(f"In-transit policy could not be evaluated: {e}")
+            return {'block': None, 'headers': header_lines + [
+                b"X-Privacy-Relay: policy-error" + CRLF
+            ]}
+
+        stripped = set()
+        warnings = []
+        for rule, matches in matched:
+            action = rule['action']
+            if action == 'block':
+                return {'block': f"Blocked by privacy policy rule {rule['id']}: {rule['message']}",
+                        'headers': []}
+            if action == 'strip':
+                for match in matches:
+                    if getattr(match, 'tag', None) == 'header':
+                        stripped.add((match.get('name', '').lower(), _normalize(match.text or '')))
+            elif action == 'warn':
+                warnings.append(f"{rule['id']}: {rule['message']}")
+
+        fields = _split_fields(header_lines)
+        forwarded = []
+        dropped = 0
+        for field in fields:
+            name, _, value = b"".join(field).decode('utf-8', 'replace').partition(':')
+            if (name.strip().lower(), _normalize(value)) in stripped:
+                dropped += 1
+                continue
+            forwarded.extend(field)
+        for warning in warnings:
+            forwarded.append(f"X-Privacy-Warning: {warning}".encode('utf-8') + CRLF)
+        if deferred:
+            forwarded.append(f"X-Privacy-Deferred: {' '.join(deferred)}".encode('utf-8') + CRLF)
+        forwarded.append(
+            f"X-Privacy-Relay: enforced; matched={len(matched)}; stripped={dropped}".encode('utf-8') + CRLF
+        )
+        return {'block': None, 'headers': forwarded}
+
+
+class SMTPSink(_AsyncSMTPServer):
+    """
+    Stand-in next hop that stores every message it receives
+
+    Used to exercise the relay end-to-end without a real MTA.
+    """
+
+    banner = "ESMTP sink"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages: List[Dict] = []
+
+    async def handle_data(self, envelope: Dict, reader: asyncio.StreamReader) -> Tuple[int, str]:
+        lines = []
+        while True:
+            line = await _read_line(reader)
+            if not line:
+                raise ConnectionError("Client closed during DATA")
+            if _is_terminator(line):
+                break
+            lines.append(line[1:] if line.startswith(b"..") else line)
+        self.messages.append({
+            'mail_from': envelope['mail_from'],
+            'rcpt_to': list(envelope['rcpt_to']),
+            'data': b"".join(lines),
+        })
+        return 250, f"Queued as {len(self.messages)}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-transit privacy enforcement SMTP relay")
+    parser.add_argument('--listen', default="127.0.0.1:10025", help="host:port to accept mail on")
+    parser.add_argument('--next-hop', required=True, help="host:port of the downstream MTA")
+    parser.add_argument('--max-header-bytes', type=int, default=256 * 1024)
+    parser.add_argument('--max-message-bytes', type=int, default=50 * 1024 * 1024)
+    args = parser.parse_args(argv)
+
+    host, _, port = args.listen.rpartition(':')
+    hop_host, _, hop_port = args.next_hop.rpartition(':')
+    relay = SMTPRelay(
+        next_hop=(hop_host, int(hop_port)), host=host, port=int(port),
+        max_header_bytes=args.max_header_bytes, max_message_bytes=args.max_message_bytes
+    )
+
+    async def serve():
+        await relay.start()
+        print(f"Privacy relay listening on {host}:{relay.port}, forwarding to {args.next_hop}")
+        await relay._server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Policy-affinity dispatch of messages to enforcement worker processes
+
+Compiled XPath objects and XSLT stylesheets cannot be pickled, so with a
+plain process pool every worker compiles every policy and keeps its own
+copy: memory and warm-up grow with workers x policies. AffinityDispatcher
+routes each message by consistent hashing of its policy digest, so a
+policy is compiled in one worker and stays warm there.
+
+- Workers pull at most `prefetch` messages at a time; the rest wait in a
+  per-worker backlog in the dispatcher.
+- A worker whose own backlog is empty steals the oldest message from the
+  longest backlog once that holds at least `steal_min` messages, so one
+  policy dominating the traffic spreads over idle workers instead of
+  queueing behind one.
+- add_worker() and remove_worker() move only the backlog whose policies
+  change owner; a removed worker finishes the messages it already has.
+- A worker process that dies fails its in-flight messages and is replaced.
+
+Messages without a routable policy header go to the least loaded worker.
+"""
+
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from email.parser import BytesHeaderParser
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .mime_handler import MIMEPrivacyHandler
+
+logger = logging.getLogger(__name__)
+
+# Seconds between liveness checks of the worker processes
+CHECK_INTERVAL = 0.5
+# Put on the results queue behind a dead worker's last results
+_REAP = "reap"
+
+
+class PoolBusy(Exception):
+    """Raised when the worker pool queue is full"""
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process handling a message exited before answering"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), replicas: int = 64):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: Dict[int, Any] = {}
+        self.nodes: List[Any] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            if point in self._owners:
+                continue
+            bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def node_for(self, key: str):
+        if not self._points:
+            raise LookupError("hash ring is empty")
+        at = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[at]]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+def routing_key(raw_email: bytes) -> Optional[str]:
+    """
+    Policy identity from the header block alone, or None
+
+    The bundle digest header when present, otherwise a hash of the
+    X-Privacy-Policy header. Policies carried only in a MIME part are not
+    routed by affinity, since finding them means parsing the body.
+    """
+    end = raw_email.find(b"\r\n\r\n")
+    if end < 0:
+        end = raw_email.find(b"\n\n")
+    headers = BytesHeaderParser().parsebytes(raw_email[:end] if end >= 0 else raw_email)
+    digest = headers.get(MIMEPrivacyHandler.BUNDLE_DIGEST_HEADER)
+    if digest:
+        return str(digest).strip()
+    policy = headers.get(MIMEPrivacyHandler.PRIVACY_HEADER)
+    if policy:
+        return hashlib.sha256("".join(str(policy).split()).encode("ascii", "replace")).hexdigest()
+    return None
+
+
+def _worker_main(worker_id: int, handler_factory: Callable[[], Callable[[Any], Any]],
+                 tasks, results):
+    handler = handler_factory()
+    while True:
+        item = tasks.get()
+        if item is None:
+            return
+        task_id, payload = item
+        try:
+            # Pickled here, so an unpicklable result fails this message
+            # instead of silently in the queue's feeder thread
+            results.put((worker_id, task_id, True, pickle.dumps(handler(payload))))
+        except Exception as e:
+            results.put((worker_id, task_id, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, worker_id: int, process, tasks):
+        self.id = worker_id
+        self.process = process
+        self.tasks = tasks
+        self.backlog: Deque[Tuple[int, Optional[str], Any, Future]] = deque()
+        self.running: Dict[int, Future] = {}
+        self.retiring = False
+        # Found dead; reaped once the results it sent before exiting are in
+        self.exited = False
+
+    def load(self) -> int:
+        return len(self.backlog) + len(self.running)
+
+
+class AffinityDispatcher:
+    """
+    Routes payloads to worker processes by policy, with work stealing
+
+    Args:
+        handler_factory: Picklable callable run once in each worker process;
+            returns the handler called with each payload
+        workers: Worker processes to start
+        max_queue: Messages waiting in the dispatcher before PoolBusy
+        prefetch: Messages handed to a worker at a time
+        steal_min: Backlog length at which idle workers steal from it
+        replicas: Virtual nodes per worker on the hash ring
+        key: payload -> routing key, or None for no affinity
+        start_method: multiprocessing start method
+    """
+
+    def __init__(self, handler_factory: Callable[[], Callable[[Any], Any]], workers: int = 4,
+                 max_queue: int = 256, prefetch: int = 2, steal_min: int = 8, replicas: int = 64,
+                 key: Callable[[Any], Optional[str]] = routing_key, start_method: str = "spawn",
+                 respawn: bool = True):
+        self.handler_factory = handler_factory
+        self.max_queue = max_queue
+        self.prefetch = prefetch
+        self.steal_min = steal_min
+        self.key = key
+        self.respawn = respawn
+        self._ctx = multiprocessing.get_context(start_method)
+        self._results = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._ring = HashRing(replicas=replicas)
+        self._workers: Dict[int, _Worker] = {}
+        self._retired: Dict[int, _Worker] = {}
+        self._next_worker = 0
+        self._next_task = 0
+        self._queued = 0
+        self._closed = False
+        self.counters = {'routed': 0, 'unkeyed': 0, 'stolen': 0, 'moved': 0, 'crashed': 0}
+        for _ in range(workers):
+            self.add_worker()
+        self._collector = threading.Thread(target=self._collect, name="dispatch-results", daemon=True)
+        self._collector.start()
+
+    # ---- submission ----
+
+    def submit(self, payload) -> Future:
+        key = self.key(payload)
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise PoolBusy("dispatcher is shut down")
+            if self._queued >= self.max_queue:
+                raise PoolBusy("enforcement queue is full")
+            if not self._workers:
+                raise PoolBusy("no enforcement workers")
+            owner = self._owner(key)
+            self.counters['unkeyed' if key is None else 'routed'] += 1
+            owner.backlog.append((self._next_task, key, payload, future))
+            self._next_task += 1
+            self._queued += 1
+            self._schedule()
+        return future
+
+    def qsize(self) -> int:
+        return self._queued
+
+    def _schedule(self):
+        """Hand out backlog to workers with free prefetch slots; holds the lock"""
+        for worker in self._workers.values():
+            while len(worker.running) < self.prefetch:
+                item = worker.backlog.popleft() if worker.backlog else self._steal(worker)
+                if item is None:
+                    break
+                self._queued -= 1
+                task_id, _, payload, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                worker.running[task_id] = future
+                worker.tasks.put((task_id, payload))
+
+    def _steal(self, thief: _Worker):
+        victim = max(self._workers.values(), key=lambda w: len(w.backlog))
+        if victim is thief or len(victim.backlog) < self.steal_min:
+            return None
+        self.counters['stolen'] += 1
+        return victim.backlog.popleft()
+
+    # ---- results ----
+
+    def _collect(self):
+        next_check = time.monotonic() + CHECK_INTERVAL
+        while True:
+            try:
+                message = self._results.get(timeout=max(0.0, next_check - time.monotonic()))
+            except queue.Empty:
+                message = ()
+            # On a timer rather than when results stop coming, so a dead
+            # worker is noticed while the others keep answering
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + CHECK_INTERVAL
+            if message is None:
+                return
+            if not message:
+                continue
+            if message[0] == _REAP:
+                self._reap(message[1])
+                continue
+            worker_id, task_id, ok, value = message
+            with self._lock:
+                worker = self._workers.get(worker_id) or self._retired.get(worker_id)
+                future = worker.running.pop(task_id, None) if worker is not None else None
+                self._schedule()
+            if future is None:
+                continue
+            if ok:
+                future.set_result(pickle.loads(value))
+            else:
+                future.set_exception(RuntimeError(value))
+
+    def _check_workers(self):
+        """Queue a reap behind the last results of every worker that exited"""
+        with self._lock:
+            for worker in list(self._retired.values()) + list(self._workers.values()):
+                if worker.exited or worker.process.is_alive():
+                    continue
+                worker.exited = True
+                # Whatever the worker sent is already in the pipe, ahead of this
+                self._results.put((_REAP, worker.id))
+
+    def _reap(self, worker_id: int):
+        """Fail what an exited worker left unanswered, and replace it unless it was retired"""
+        failed: List[Future] = []
+        with self._lock:
+            worker = self._workers.get(worker_id) or self._retired.get(worker_id)
+            if worker is None:
+                return
+            failed.extend(worker.running.values())
+            worker.running.clear()
+            worker.process.join()
+            if worker_id in self._retired:
+                del self._retired[worker_id]
+            else:
+                logger.warning(f"Worker {worker_id} exited with code {worker.process.exitcode}")
+                self.counters['crashed'] += 1
+                if self.respawn and not self._closed:
+                    self._spawn()
+                failed.extend(self._drop(worker))
+            self._schedule()
+        for future in failed:
+            # Backlog futures are still pending, in-flight ones running
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(WorkerCrashed("worker process exited before answering"))
+
+    # ---- membership ----
+
+    def add_worker(self) -> int:
+        """Start a worker; it takes over its share of the ring and backlog"""
+        with self._lock:
+            worker_id = self._spawn()
+            self._schedule()
+        return worker_id
+
+    def remove_worker(self, worker_id: Optional[int] = None) -> int:
+        """Retire a worker (the newest by default) after its in-flight messages"""
+        with self._lock:
+            active = [w for w in self._workers if not self._workers[w].retiring]
+            if len(active) <= 1:
+                raise ValueError("cannot remove the last worker")
+            worker = self._workers[worker_id if worker_id is not None else max(active)]
+            self._drop(worker)
+            # Joined by _reap once it has answered and exited
+            self._retired[worker.id] = worker
+            worker.tasks.put(None)
+            self._schedule()
+        return worker.id
+
+    def _spawn(self) -> int:
+        worker_id = self._next_worker
+        self._next_worker += 1
+        tasks = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main, args=(worker_id, self.handler_factory, tasks, self._results),
+            name=f"enforcer-{worker_id}", daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = _Worker(worker_id, process, tasks)
+        self._ring.add(worker_id)
+        self._rebalance()
+        return worker_id
+
+    def _drop(self, worker: _Worker) -> List[Future]:
+        """
+        Take a worker off the ring and hand its backlog to the new owners
+
+        Returns the futures of backlog nobody is left to take.
+        """
+        worker.retiring = True
+        self._ring.remove(worker.id)
+        del self._workers[worker.id]
+        backlog, worker.backlog = worker.backlog, deque()
+        if not self._workers:
+            self._queued -= len(backlog)
+            return [item[3] for item in backlog]
+        for item in backlog:
+            self._owner(item[1]).backlog.append(item)
+            self.counters['moved'] += 1
+        return []
+
+    def _rebalance(self):
+        """Move backlog whose policy now hashes to a different worker"""
+        for worker in list(self._workers.values()):
+            keep = deque()
+            for item in worker.backlog:
+                owner = self._owner(item[1]) if item[1] is not None else worker
+                if owner is worker:
+                    keep.append(item)
+                else:
+                    owner.backlog.append(item)
+                    self.counters['moved'] += 1
+            worker.backlog = keep
+
+    def _owner(self, key: Optional[str]) -> _Worker:
+        if key is None:
+            return min(self._workers.values(), key=_Worker.load)
+        return self._workers[self._ring.node_for(key)]
+
+    # ---- lifecycle ----
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.counters)
+            stats['queued'] = self._queued
+            stats['workers'] = {
+                worker.id: {'backlog': len(worker.backlog), 'running': len(worker.running)}
+                for worker in self._workers.values()
+            }
+            return stats
+
+    def shutdown(self):
+        """Finish in-flight messages, fail the backlog and stop the workers"""
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers.values())
+            abandoned = [item[3] for w in workers for item in w.backlog]
+            for worker in workers:
+                worker.backlog.clear()
+                worker.tasks.put(None)
+            self._queued = 0
+        for future in abandoned:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(PoolBusy("dispatcher shut down"))
+        for worker in workers + list(self._retired.values()):
+            worker.process.join()
+        self._results.put(None)
+        self._collector.join()
@@ -0,0 +1,34 @@
+"""
+XSD validation of privacy policies
+"""
+
+import os
+from functools import lru_cache
+from typing import List, Optional
+from lxml import etree as ET
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "schemas", "privacy-policy.xsd")
+
+
+@lru_cache(maxsize=4)
+def load_policy_schema(path: str = SCHEMA_PATH) -> ET.XMLSchema:
+    """Parse the policy XSD once per process"""
+    return ET.XMLSchema(ET.parse(path))
+
+
+def validate_policy(policy_xml: str, schema: Optional[ET.XMLSchema] = None) -> List[str]:
+    """
+    Validate a policy document against the XSD
+
+    Returns:
+        List of error strings, empty when the policy is valid
+    """
+    schema = schema or load_policy_schema()
+    try:
+        root = ET.fromstring(policy_xml.encode('utf-8'))
+    except ET.ParseError as e:
+        return [f"Policy XML parsing error: {e}"]
+    if schema.validate(root):
+        return []
+    return [f"line {err.line}: {err.message}" for err in schema.error_log]
@@ -0,0 +1,240 @@
+"""
+Opt-in per-message tracing with Chrome trace-event export
+
+A Tracer decides per message whether to record (sample_rate, or force for
+one message). While a message is traced, span() calls anywhere below it
+record nested timings; when it is not, span() returns a shared no-op
+object, so instrumented code pays one context variable lookup per span.
+
+    tracer = Tracer(sample_rate=0.01, min_duration_ms=200)
+    client = PrivacyAwareEmailClient(tracer=tracer)
+    ...
+    tracer.export("slow-messages.json")   # open in chrome://tracing or Perfetto
+
+Each kept trace becomes one process row in the viewer, with one track
+per thread that did work for it.
+"""
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Union
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("pp_trace", default=None)
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1000.0
+
+
+class _NullSpan:
+    """Returned by span() when nothing is being traced"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "args", "start")
+
+    def __init__(self, trace: "Trace", name: str, args: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = _now_us()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.trace.add_event(self.name, self.start, end - self.start, self.args)
+        return False
+
+    def set(self, **args):
+        """Attach values known only once the span's work is done"""
+        self.args.update(args)
+
+
+class Trace:
+    """The spans recorded for one message"""
+
+    def __init__(self, name: str, args: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.args = args or {}
+        self.events: List[Dict[str, Any]] = []
+        self.threads: Dict[int, str] = {}
+        self.start = _now_us()
+        self.duration = 0.0
+
+    def span(self, name: str, **args) -> _Span:
+        return _Span(self, name, args)
+
+    def add_event(self, name: str, start: float, duration: float, args: Dict[str, Any]):
+        thread = threading.current_thread()
+        self.threads.setdefault(thread.ident, thread.name)
+        # list.append is atomic, so part-pool threads can record concurrently
+        self.events.append({"name": name, "ts": start, "dur": duration,
+                            "tid": thread.ident, "args": args})
+
+    def finish(self):
+        self.duration = _now_us() - self.start
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration / 1000.0
+
+    def chrome_events(self, pid: int) -> List[Dict[str, Any]]:
+        """This trace as Chrome trace events under the given process id"""
+        label = self.name
+        if self.args:
+            label += " " + " ".join(f"{k}={v}" for k, v in self.args.items())
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                   "args": {"name": label}}]
+        for tid, thread_name in self.threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": thread_name}})
+        for event in self.events:
+            events.append({"name": event["name"], "cat": "pp", "ph": "X", "pid": pid,
+                           "tid": event["tid"], "ts": round(event["ts"], 3),
+                           "dur": round(event["dur"], 3),
+                           "args": {k: _json_safe(v) for k, v in event["args"].items()}})
+        return events
+
+
+def _json_safe(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def span(name: str, **args):
+    """A span in the message being traced on this thread, or a no-op"""
+    trace = _current.get()
+    if trace is None:
+        return NULL_SPAN
+    return _Span(trace, name, args)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def bind(func: Callable) -> Callable:
+    """
+    Carry the current trace into func when it runs on another thread
+
+    Thread pools do not copy context variables, so spans recorded by
+    workers would otherwise be lost. Returns func unchanged when nothing
+    is being traced.
+    """
+    trace = _current.get()
+    if trace is None:
+        return func
+
+    def bound(*args, **kwargs):
+        token = _current.set(trace)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return bound
+
+
+class Tracer:
+    """
+    Samples messages for tracing and keeps the most recent traces
+
+    Args:
+        sample_rate: Fraction of messages to trace (0 disables sampling;
+            force=True still traces a single message)
+        min_duration_ms: Only keep traces at least this slow
+        max_traces: How many finished traces to keep
+        on_trace: Called with each kept Trace, e.g. to ship it elsewhere
+    """
+
+    def __init__(self, sample_rate: float = 0.0, min_duration_ms: float = 0.0,
+                 max_traces: int = 100, on_trace: Optional[Callable[[Trace], None]] = None):
+        self.sample_rate = sample_rate
+        self.min_duration_ms = min_duration_ms
+        self.on_trace = on_trace
+        self._traces: "deque[Trace]" = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, name: str, force: bool = False, **args) -> Iterator[Optional[Trace]]:
+        """
+        Trace the enclosed work if this message is sampled
+
+        Nested calls join the trace already in progress. Yields the Trace,
+        or None when the message is not traced.
+        """
+        active = _current.get()
+        if active is not None:
+            yield active
+            return
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            yield None
+            return
+
+        trace = Trace(name, args)
+        token = _current.set(trace)
+        try:
+            with trace.span(name, **args):
+                yield trace
+        finally:
+            _current.reset(token)
+            trace.finish()
+            self._keep(trace)
+
+    def _keep(self, trace: Trace):
+        if trace.duration_ms < self.min_duration_ms:
+            return
+        with self._lock:
+            self._traces.append(trace)
+        if self.on_trace is not None:
+            self.on_trace(trace)
+
+    def traces(self) -> List[Trace]:
+        with self._lock:
+            return list(self._traces)
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def to_chrome(self, traces: Optional[List[Trace]] = None) -> Dict[str, Any]:
+        """Chrome trace-event JSON object for the kept (or given) traces"""
+        events = []
+        for number, trace in enumerate(traces if traces is not None else self.traces(), 1):
+            events.extend(trace.chrome_events(pid=number))
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"producer": "privacy-policy", "pid": os.getpid()}}
+
+    def export(self, target: Union[str, TextIO], traces: Optional[List[Trace]] = None):
+        """Write Chrome trace-event JSON to a path or open text file"""
+        data = self.to_chrome(traces)
+        if isinstance(target, str):
+            with open(target, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        else:
+            json.dump(data, target)
@@ -0,0 +1,265 @@
+"""
+URL extraction and tracker classification for HTML parts
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Small built-in list so the enforcer works without an external blocklist
+DEFAULT_TRACKER_DOMAINS = (
+    "tracker.com",
+    "analytics.com",
+    "google-analytics.com",
+    "doubleclick.net",
+    "list-manage.com",
+)
+
+# One scan per part: a start tag, a CSS url(...) or a CSS @import. A tag
+# never runs past the next "<" and a url( never past the next "(", so an
+# unclosed one fails at once instead of rescanning the rest of the part
+_SCAN_RE = re.compile(
+    r"<(?P<tag>[a-zA-Z][\w:-]*)(?P<attrs>(?:[^<>\"']|\"[^<\"]*\"|'[^<']*')*)>"
+    r"|url\(\s*(?P<q>[\"']?)(?P<css>[^\"'()\s]+)(?P=q)\s*\)"
+    r"|@import\s+(?P<iq>[\"'])(?P<imp>[^\"']+)(?P=iq)",
+    re.IGNORECASE,
+)
+_ATTR_RE = re.compile(
+    r"(?P<name>[^\s=/>\"']+)(?:\s*=\s*(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<bare>[^\s>]+)))?"
+)
+_CSS_URL_RE = re.compile(r"url\(\s*([\"']?)([^\"'()\s]+)\1\s*\)", re.IGNORECASE)
+
+URL_ATTRIBUTES = frozenset({
+    "src", "href", "background", "poster", "action", "cite",
+    "data", "lowsrc", "dynsrc", "longdesc", "formaction", "srcset",
+})
+
+
+@dataclass
+class URLRef:
+    url: str
+    host: Optional[str]
+    tag: str
+    attr: str
+    tracker: bool = False
+    pixel: bool = False
+    hidden: bool = False
+
+
+class DomainSuffixTrie:
+    """Reverse-label trie answering longest-suffix domain lookups"""
+
+    _VALUE = ""  # labels are never empty, so this key marks a terminal node
+
+    def __init__(self):
+        self._root: Dict[str, dict] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, domain: str, value=True) -> bool:
+        """Register a domain; every subdomain of it matches too"""
+        node = self._root
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+        is_new = self._VALUE not in node
+        if is_new:
+            self._size += 1
+        node[self._VALUE] = value
+        return is_new
+
+    def remove(self, domain: str) -> bool:
+        path = [self._root]
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = path[-1].get(label)
+            if node is None:
+                return False
+            path.append(node)
+        if self._VALUE not in path[-1]:
+            return False
+        del path[-1][self._VALUE]
+        self._size -= 1
+        return True
+
+    def longest_match(self, host: str) -> Optional[Tuple[str, object]]:
+        """Return (matched suffix, value) for the longest registered suffix"""
+        node = self._root
+        match = None
+        labels = host.split(".")
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if self._VALUE in node:
+                match = (".".join(labels[-depth:]), node[self._VALUE])
+        return match
+
+    def __contains__(self, host: str) -> bool:
+        return self.longest_match(host) is not None
+
+
+def normalize_host(url: str) -> Optional[str]:
+    """Extract a lowercase, IDNA-encoded host from a URL, or None"""
+    url = url.strip()
+    if url.startswith("//"):
+        url = "http:" + url
+    if "://" not in url[:16]:
+        return None
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip(".")
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    return host
+
+
+def _parse_attrs(attr_text: str) -> Dict[str, str]:
+    attrs = {}
+    for m in _ATTR_RE.finditer(attr_text):
+        value = m.group("dq")
+        if value is None:
+            value = m.group("sq")
+        if value is None:
+            value = m.group("bare") or ""
+        attrs.setdefault(m.group("name").lower(), value)
+    return attrs
+
+
+def _css_declarations(style: str) -> Dict[str, str]:
+    decls = {}
+    for decl in style.split(";"):
+        name, _, value = decl.partition(":")
+        if value:
+            decls[name.strip().lower()] = value.strip().lower()
+    return decls
+
+
+def _is_tiny(value: Optional[str]) -> bool:
+    if value is None:
+        return False
+    value = value.strip().lower()
+    if value.endswith("px"):
+        value = value[:-2]
+    try:
+        return float(value) <= 1
+    except ValueError:
+        return False
+
+
+def _image_flags(attrs: Dict[str, str]) -> Tuple[bool, bool]:
+    """Return (pixel, hidden) flags for an img tag"""
+    style = _css_declarations(attrs.get("style", ""))
+    width = attrs.get("width", style.get("width"))
+    height = attrs.get("height", style.get("height"))
+    pixel = _is_tiny(width) and _is_tiny(height)
+    hidden = (
+        "hidden" in attrs
+        or style.get("display") == "none"
+        or style.get("visibility") == "hidden"
+        or style.get("opacity") in ("0", "0.0")
+    )
+    return pixel, hidden
+
+
+def extract_urls(html: str) -> List[URLRef]:
+    """Pull every URL out of HTML attributes and CSS in a single pass"""
+    refs = []
+    for m in _SCAN_RE.finditer(html):
+        tag = m.group("tag")
+        if tag is None:
+            url = m.group("css") or m.group("imp")
+            refs.append(URLRef(url=url, host=normalize_host(url), tag="style", attr="url"))
+            continue
+
+        tag = tag.lower()
+        attrs = _parse_attrs(m.group("attrs"))
+        pixel = hidden = False
+        if tag == "img":
+            pixel, hidden = _image_flags(attrs)
+
+        for name, value in attrs.items():
+            if name == "style":
+                urls = [u for _, u in _CSS_URL_RE.findall(value)]
+            elif name == "srcset":
+                urls = [c.split()[0] for c in value.split(",") if c.strip()]
+            elif name in URL_ATTRIBUTES:
+                urls = [value] if value else []
+            else:
+                continue
+            for url in urls:
+                refs.append(URLRef(
+                    url=url, host=normalize_host(url), tag=tag, attr=name,
+                    pixel=pixel, hidden=hidden
+                ))
+    return refs
+
+
+class TrackerClassifier:
+    """Classifies URLs against a compiled tracker domain blocklist"""
+
+    def __init__(self, domains: Optional[Iterable[str]] = None, cache_size: int = 65536):
+        self.trie = DomainSuffixTrie()
+        self._fingerprint = 0
+        # Per-host verdicts; newsletters reuse a handful of hosts heavily
+        self.is_tracker_host = lru_cache(maxsize=cache_size)(self._lookup)
+        self.add_domains(DEFAULT_TRACKER_DOMAINS if domains is None else domains)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "TrackerClassifier":
+        """
+        Load a blocklist file
+
+        Accepts one domain per line, hosts-file lines ("0.0.0.0 domain")
+        and adblock-style "||domain^" entries. Lines starting with '#' or
+        '!' are comments.
+        """
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return cls(domains=cls._parse_blocklist(f), **kwargs)
+
+    @staticmethod
+    def _parse_blocklist(lines: Iterable[str]) -> Iterable[str]:
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] in "#!":
+                continue
+            if line.startswith("||"):
+                line = line[2:].split("^", 1)[0]
+            else:
+                fields = line.split()
+                line = fields[-1] if len(fields) > 1 else fields[0]
+            if "." in line and "/" not in line:
+                yield line.lower().strip(".")
+
+    def _lookup(self, host: str) -> bool:
+        return self.trie.longest_match(host) is not None
+
+    def add_domains(self, domains: Iterable[str]):
+        for domain in domains:
+            if self.trie.add(domain):
+                digest = hashlib.blake2b(domain.lower().strip(".").encode(), digest_size=8).digest()
+                self._fingerprint ^= int.from_bytes(digest, "big")
+        self.is_tracker_host.cache_clear()
+
+    @property
+    def fingerprint(self) -> str:
+        """Order-independent digest of the blocklist, for cache keys"""
+        return f"{self._fingerprint:016x}"
+
+    def classify(self, html: str) -> List[URLRef]:
+        """Extract URLs from an HTML part and flag tracker hosts"""
+        refs = extract_urls(html)
+        for ref in refs:
+            if ref.host:
+                ref.tracker = self.is_tracker_host(ref.host)
+        return refs
@@ -0,0 +1,125 @@
+"""
+Content-addressed cache of per-part rule verdicts
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# rule index (as a string, JSON keys) -> serialized matches
+PartVerdicts = Dict[str, List[str]]
+
+
+class PartVerdictCache:
+    """
+    LRU cache of rule matches keyed by (policy digest, part content hash)
+
+    Byte-identical parts (newsletter bodies, shared attachments) are only
+    evaluated once per policy. An optional SQLite file adds a second tier
+    that survives restarts and can be shared between worker processes.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[PartVerdicts, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS part_verdicts ("
+                " policy_digest TEXT NOT NULL,"
+                " part_hash TEXT NOT NULL,"
+                " verdicts TEXT NOT NULL,"
+                " PRIMARY KEY (policy_digest, part_hash)) WITHOUT ROWID"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _size(verdicts: PartVerdicts) -> int:
+        # Rough accounting: key strings plus serialized matches
+        return 128 + sum(len(k) + sum(len(m) for m in v) for k, v in verdicts.items())
+
+    def get(self, policy_digest: str, part_hash: str) -> Optional[PartVerdicts]:
+        key = (policy_digest, part_hash)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT verdicts FROM part_verdicts WHERE policy_digest = ? AND part_hash = ?",
+                    key
+                ).fetchone()
+                if row is not None:
+                    verdicts = json.loads(row[0])
+                    self._store(key, verdicts)
+                    self.disk_hits += 1
+                    return verdicts
+
+            self.misses += 1
+            return None
+
+    def put(self, policy_digest: str, part_hash: str, verdicts: PartVerdicts):
+        key = (policy_digest, part_hash)
+        with self._lock:
+            self._store(key, verdicts)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO part_verdicts VALUES (?, ?, ?)",
+                    (policy_digest, part_hash, json.dumps(verdicts, separators=(",", ":")))
+                )
+                self._db.commit()
+
+    def _store(self, key, verdicts: PartVerdicts):
+        size = self._size(verdicts)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (verdicts, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM part_verdicts")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
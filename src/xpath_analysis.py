@@ -0,0 +1,572 @@
+"""
+Static analysis of rule XPath expressions
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Set, Tuple
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<literal>"[^"]*"|'[^']*')
+      | (?P<number>\d+(?:\.\d*)?|\.\d+)
+      | (?P<op>//|::|\.\.|!=|<=|>=|[/()\[\],|@=<>+*$.-])
+      | (?P<name>[A-Za-z_][\w.-]*(?::[A-Za-z_][\w.-]*)?)
+    )""", re.VERBOSE)
+
+OPERATOR_NAMES = frozenset({"and", "or", "div", "mod"})
+NODE_TYPES = frozenset({"node", "text", "comment", "processing-instruction"})
+# Tokens after which '*' is a name test rather than multiplication
+_WILDCARD_CONTEXT = frozenset({
+    None, "/", "//", "::", "(", "[", ",", "|", "@",
+    "=", "!=", "<", ">", "<=", ">=", "+", "-", "and", "or", "div", "mod",
+})
+# Aggregates whose value changes when a message is split into parts
+POSITIONAL_FUNCTIONS = frozenset({"count", "sum", "last", "position"})
+
+HEADER_NAMES = frozenset({"email", "headers", "header"})
+MESSAGE_NAMES = HEADER_NAMES | {"body"}
+LOCAL_AXES = frozenset({"child", "descendant", "descendant-or-self", "self", "attribute"})
+
+# Known from part headers alone, before any payload is decoded
+STRUCTURE_NAMES = MESSAGE_NAMES | {"part", "html-part", "content-type", "filename"}
+# Elements whose string value includes decoded content
+CONTENT_CONTAINERS = frozenset({"email", "body", "part", "html-part"})
+# Functions that only test for existence or count, never read string values
+EXISTENCE_FUNCTIONS = frozenset({"count", "boolean", "not"})
+# Extension functions (xpath_functions.py) reading part text outside the tree
+RAW_TEXT_FUNCTIONS = frozenset({"pp:raw-contains", "pp:raw-matches"})
+# ... and reading the message headers from anywhere in it
+HEADER_FUNCTIONS = frozenset({"pp:header"})
+# Steps whose string values hold header text only
+HEADER_STEPS = frozenset({"headers", "header"})
+# Functions that read the string value of the context node when called
+# without arguments
+_CONTEXT_STRING_FUNCTIONS = frozenset({"string", "normalize-space", "string-length"})
+
+
+class XPathSyntaxError(ValueError):
+    pass
+
+
+@dataclass
+class XPathInfo:
+    """Names, functions and literals referenced by an XPath expression"""
+    tokens: List[Tuple[str, str]] = field(default_factory=list)
+    element_names: Set[str] = field(default_factory=set)
+    attribute_names: Set[str] = field(default_factory=set)
+    functions: Set[str] = field(default_factory=set)
+    node_types: Set[str] = field(default_factory=set)
+    axes: Set[str] = field(default_factory=set)
+    literals: List[str] = field(default_factory=list)
+    wildcard: bool = False
+    context_string: bool = False  # '.' used as a value, e.g. contains(., 'x')
+    positional_predicate: bool = False
+    relative_descendant: bool = True  # every union branch starts with .// or //
+
+
+def tokenize(expr: str) -> List[Tuple[str, str]]:
+    """Split an XPath 1.0 expression into (kind, text) tokens"""
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = _TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise XPathSyntaxError(f"Unexpected character at {pos}: {expr[pos:pos + 10]!r}")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+_WORDY = ("name", "number", "literal")
+# Tokens after which and/or/div/mod are element names, not operators
+_OPERAND_CONTEXT = frozenset({None, "/", "//", "@", "::", "(", "[", ",", "|"})
+
+
+def join_tokens(tokens: List[Tuple[str, str]]) -> str:
+    """Expression text for a token list, with canonical spacing"""
+    out = []
+    prev_kind = prev_text = None
+    for kind, text in tokens:
+        if kind == "name" and text in OPERATOR_NAMES and prev_text not in _OPERAND_CONTEXT:
+            out.append(f" {text} ")
+            kind = "op"
+        else:
+            if prev_kind in _WORDY and kind in _WORDY:
+                out.append(" ")
+            out.append(text)
+        prev_kind, prev_text = kind, text
+    return "".join(out)
+
+
+def analyze(expr: str) -> XPathInfo:
+    """Classify every token of an expression"""
+    info = XPathInfo(tokens=tokenize(expr))
+    tokens = info.tokens
+    prev = None
+    branch_start = True
+    depth = 0
+
+    for i, (kind, text) in enumerate(tokens):
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+
+        if branch_start and depth == 0:
+            if not (text == "//" or (text == "." and nxt == "//")):
+                info.relative_descendant = False
+            branch_start = False
+
+        if kind == "literal":
+            info.literals.append(text[1:-1])
+        elif kind == "number":
+            if prev == "[" and nxt == "]":
+                info.positional_predicate = True
+        elif kind == "op":
+            if text in "([":
+                depth += 1
+            elif text in ")]":
+                depth -= 1
+            elif text == "|" and depth == 0:
+                branch_start = True
+            elif text == "*" and prev in _WILDCARD_CONTEXT:
+                info.wildcard = True
+            elif text == "." and nxt not in ("/", "//"):
+                info.context_string = True
+        elif kind == "name":
+            if text in OPERATOR_NAMES and prev not in _WILDCARD_CONTEXT:
+                pass
+            elif nxt == "::":
+                info.axes.add(text)
+            elif prev == "$":
+                pass
+            elif nxt == "(":
+                if text in NODE_TYPES:
+                    info.node_types.add(text)
+                else:
+                    info.functions.add(text)
+            elif prev == "@" or (prev == "::" and tokens[i - 2][1] == "attribute"):
+                info.attribute_names.add(text)
+            else:
+                info.element_names.add(text)
+        prev = text if kind in ("op", "name") else kind
+
+    if ".." in (t for _, t in tokens):
+        info.axes.add("parent")
+    return info
+
+
+def _step_before(tokens: List[Tuple[str, str]], i: int) -> str:
+    """The element step a '/' or '//' at tokens[i] continues from, or ''"""
+    j = i - 1
+    depth = 0
+    # Skip the predicates of that step
+    while j >= 0 and (tokens[j][1] == "]" or depth):
+        if tokens[j][1] == "]":
+            depth += 1
+        elif tokens[j][1] == "[":
+            depth -= 1
+        j -= 1
+    if j >= 0 and tokens[j][0] == "name":
+        return tokens[j][1]
+    return ""
+
+
+def _string_reads(info: XPathInfo) -> Set[str]:
+    """
+    The steps whose string values an expression reads through the context
+
+    The context node of a rule is the document, whose string value is the
+    whole message: a bare '.', string() and friends without arguments,
+    and text() or node() steps read it ('') unless they sit under another
+    step. <email> used as a value, e.g. contains(/email, 'x'), reads it too.
+    """
+    reads = set()
+    tokens = info.tokens
+    # Stack entries are ('[' or '(', the step a predicate filters)
+    stack = []
+    step = ""
+    for i, (kind, text) in enumerate(tokens):
+        prev = tokens[i - 1][1] if i else None
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if text == "[":
+            stack.append(("[", step))
+        elif text == "(":
+            stack.append(("(", step))
+        elif text in ("]", ")") and stack:
+            stack.pop()
+        elif kind == "name" and nxt == "(" and (
+                text in NODE_TYPES
+                or (text in _CONTEXT_STRING_FUNCTIONS and i + 2 < len(tokens) and tokens[i + 2][1] == ")")):
+            if text in NODE_TYPES:
+                owner = _step_before(tokens, i - 1) if prev in ("/", "//") else ""
+            else:
+                owner = next((entry[1] for entry in reversed(stack) if entry[0] == "["), "")
+            reads.add(owner)
+        elif text == "." and nxt not in ("/", "//"):
+            reads.add(next((entry[1] for entry in reversed(stack) if entry[0] == "["), ""))
+        elif kind == "name" and text in info.element_names and nxt != "::" and prev != "@":
+            step = text
+            if text == "email" and nxt not in ("/", "//", "["):
+                reads.add("")
+    return reads
+
+
+def reads_part_text(expr: str) -> bool:
+    """
+    Whether an expression may read the decoded text of a non-HTML part
+
+    Conservative: True for anything it cannot rule out. Rules that only
+    look at headers, part types and filenames or HTML elements are False.
+    """
+    try:
+        info = analyze(expr)
+    except XPathSyntaxError:
+        return True
+    if info.wildcard or info.node_types or info.functions & RAW_TEXT_FUNCTIONS:
+        return True
+    if info.element_names & {"body", "part", "content"}:
+        return True
+    return bool(_string_reads(info) & {"", "email"})
+
+
+def rule_locality(expr: str) -> str:
+    """
+    Decide which slice of the email XML a rule needs
+
+    Returns 'header' when the expression only touches headers, 'part' when
+    its matches inside one body part never depend on any other part, and
+    'message' when it must see the whole tree.
+    """
+    try:
+        info = analyze(expr)
+    except XPathSyntaxError:
+        return "message"
+
+    if info.wildcard or "node" in info.node_types or not info.axes <= LOCAL_AXES:
+        return "message"
+
+    if info.element_names <= HEADER_NAMES:
+        if _string_reads(info) - HEADER_STEPS or info.functions & RAW_TEXT_FUNCTIONS:
+            return "message"
+        return "header"
+
+    if (info.relative_descendant
+            and not info.functions & HEADER_FUNCTIONS
+            and not info.element_names & MESSAGE_NAMES
+            and not info.functions & POSITIONAL_FUNCTIONS
+            and not info.positional_predicate):
+        return "part"
+    return "message"
+
+
+def rule_stage(expr: str) -> str:
+    """
+    Earliest enforcement stage that can answer a rule
+
+    Returns 'header' for header-only rules, 'structure' when the rule only
+    needs part types and filenames, and 'content' otherwise.
+    """
+    if rule_locality(expr) == "header":
+        return "header"
+    try:
+        info = analyze(expr)
+    except XPathSyntaxError:
+        return "content"
+    if (info.wildcard or info.node_types or "parent" in info.axes
+            or info.functions & RAW_TEXT_FUNCTIONS
+            or not info.element_names <= STRUCTURE_NAMES):
+        return "content"
+
+    # A container used as a value (e.g. contains(//part, 'x')) reads its
+    # content; only path steps, predicates and existence tests are allowed.
+    # Stack entries are (function name or '(' or '[', step the predicate filters)
+    tokens = info.tokens
+    stack = []
+    step = None
+    for i, (kind, text) in enumerate(tokens):
+        prev = tokens[i - 1] if i else None
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if text == "(":
+            stack.append((prev[1] if prev and prev[0] == "name" else "(", step))
+        elif text == "[":
+            stack.append(("[", step))
+        elif text in (")", "]") and stack:
+            _, step = stack.pop()
+        elif (text == "." and nxt not in ("/", "//")) or (
+                text in _CONTEXT_STRING_FUNCTIONS and nxt == "(" and i + 2 < len(tokens)
+                and tokens[i + 2][1] == ")"):
+            # '.' as a value, or string() and friends without arguments,
+            # read the string value of the predicate's step
+            owner = next((entry[1] for entry in reversed(stack) if entry[0] == "["), None)
+            if owner is None or owner in CONTENT_CONTAINERS:
+                return "content"
+        elif kind == "name" and text in info.element_names and nxt not in ("(", "::") \
+                and not (prev and prev[1] == "@"):
+            step = text
+            if text not in CONTENT_CONTAINERS or nxt in ("/", "//", "["):
+                continue
+            top = stack[-1][0] if stack else None
+            if nxt in (None, "]", ")", "|", "and", "or") and (top in (None, "[") or top in EXISTENCE_FUNCTIONS):
+                continue
+            return "content"
+    return "structure"
+
+
+# ---- evaluation cost ----
+
+COST_CLASSES = ("bounded", "linear", "quadratic", "cubic")
+
+# Elements the enforcer generates; none of them nest inside themselves,
+# so reading their string values costs at most one pass over the message
+FRAMEWORK_NAMES = frozenset({
+    "email", "headers", "header", "body", "part", "html-part", "content-type",
+    "filename", "raw-content", "content", "urls", "url", "parse-error",
+})
+# Axes that may visit every node of the tree from each context node
+_SCAN_AXES = frozenset({
+    "descendant", "descendant-or-self", "ancestor", "ancestor-or-self",
+    "following", "preceding", "following-sibling", "preceding-sibling",
+})
+# Tokens that end one location path; the next path starts afresh
+_PATH_BREAKS = frozenset({
+    "|", ",", "=", "!=", "<", ">", "<=", ">=", "+", "-", "and", "or", "div", "mod",
+})
+
+
+@dataclass
+class XPathCost:
+    """
+    Estimated evaluation cost as a polynomial degree in the message size
+
+    0 means the work is bounded by the matched nodes themselves, 1 one pass
+    over the message, 2 a pass per node, and so on.
+    """
+    degree: int = 0
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def cost_class(self) -> str:
+        return COST_CLASSES[min(self.degree, len(COST_CLASSES) - 1)]
+
+
+def cost_degree(cost_class: str) -> int:
+    """Degree for a cost class name; raises ValueError for unknown names"""
+    try:
+        return COST_CLASSES.index(cost_class)
+    except ValueError:
+        raise ValueError(f"Unknown cost class {cost_class!r}; expected one of {', '.join(COST_CLASSES)}")
+
+
+@dataclass
+class _Frame:
+    kind: str            # '[' predicate, '(' call or group, or '' for the whole expression
+    base: int            # degree at which each evaluation of this frame happens
+    owner: Tuple[str, bool] = ("", False)  # (step, may nest) a predicate filters
+    function: str = ""
+
+
+def _walk_cost(tokens: List[Tuple[str, str]]):
+    """
+    Yield (index, token, frames, degree of the current path, last step)
+
+    last step is (name, nestable): whether elements matched by the step can
+    contain other elements matched by it.
+    """
+    frames = [_Frame("", 0)]
+    degree = 0
+    step = ("", False)
+    prev = None
+    for i, (kind, text) in enumerate(tokens):
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if kind == "op":
+            if text == "//":
+                degree += 1
+            elif text == "[":
+                frames.append(_Frame("[", degree, step))
+            elif text == "(":
+                function = prev if prev and tokens[i - 1][0] == "name" else ""
+                frames.append(_Frame("(", frames[-1].base, function=function))
+                degree = frames[-1].base
+            elif text in ")]" and len(frames) > 1:
+                frame = frames.pop()
+                degree = frame.base if text == "]" else frames[-1].base
+            elif text in _PATH_BREAKS:
+                degree = frames[-1].base
+            elif text == "*" and prev in _WILDCARD_CONTEXT:
+                step = ("*", True)
+        elif kind == "name":
+            if text in OPERATOR_NAMES and prev not in _WILDCARD_CONTEXT:
+                degree = frames[-1].base
+            elif nxt == "::":
+                if text in _SCAN_AXES:
+                    degree += 1
+            elif nxt == "(":
+                if text in NODE_TYPES:
+                    # node() and comment() may match nested or non-text nodes
+                    step = (f"{text}()", text != "text")
+            elif prev == "@" or (prev == "::" and tokens[i - 2][1] == "attribute"):
+                step = (f"@{text}", False)
+            elif prev != "$":
+                step = (text, text not in FRAMEWORK_NAMES)
+        yield i, text, frames, degree, step
+        prev = text if kind in ("op", "name") else kind
+
+
+def estimate_cost(expr: str) -> XPathCost:
+    """
+    Estimate how evaluation time grows with message size
+
+    Each descendant scan (//, descendant:: and the other unbounded axes)
+    started once per node of an enclosing scan adds a degree, and so does
+    reading the string value (., string()) of elements that can nest, such
+    as * or HTML tags, once per node of a scan.
+    """
+    tokens = tokenize(expr)
+    cost = XPathCost()
+    for i, text, frames, degree, step in _walk_cost(tokens):
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        # The raw functions read the context node's whole part each call
+        reads = (text == "." and nxt not in ("/", "//")) or \
+                (text in _CONTEXT_STRING_FUNCTIONS and nxt == "(" and tokens[i + 2][1] == ")") or \
+                (text in RAW_TEXT_FUNCTIONS and nxt == "(")
+        if reads:
+            predicate = next((f for f in reversed(frames) if f.kind == "["), None)
+            if predicate is not None:
+                owner, nestable = predicate.owner
+                read_degree = max(predicate.base, 1) + (1 if nestable and predicate.base else 0)
+                if read_degree > cost.degree:
+                    cost.degree = read_degree
+                    if nestable and predicate.base:
+                        cost.reasons.append(f"string value of nested {owner} elements read for every scanned node")
+                continue
+            degree = max(degree, 1)
+        if degree > cost.degree:
+            cost.degree = degree
+            if degree >= 2:
+                cost.reasons.append(f"descendant scan nested {degree} deep at token {i} ({text!r})")
+    return cost
+
+
+# ---- rewriting ----
+
+# Where the enforcer puts each of its own elements; a descendant search for
+# them from the root can go straight there instead of scanning the parsed
+# HTML as well. Names that are also HTML elements (body, header, content)
+# are left out: the parsed HTML carries them too, so //body must keep
+# matching <body> inside an html-part
+ANCHORS = {
+    "headers": "/email/headers",
+    "part": "/email/body/part",
+    "html-part": "/email/body/html-part",
+    "content-type": "/email/body/*/content-type",
+    "filename": "/email/body/*/filename",
+    "raw-content": "/email/body/html-part/raw-content",
+    "urls": "/email/body/html-part/urls",
+    "url": "/email/body/html-part/urls/url",
+}
+_LITERAL_TESTS = frozenset({"contains", "starts-with"})
+
+
+def _anchor(tokens: List[Tuple[str, str]], applied: List[str]) -> List[Tuple[str, str]]:
+    """Replace //name and .//name at the start of top-level union branches"""
+    out = []
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        text = tokens[i][1]
+        at_branch_start = depth == 0 and (not out or out[-1][1] == "|")
+        if at_branch_start:
+            start = i + 1 if text == "." and i + 1 < len(tokens) and tokens[i + 1][1] == "//" else i
+            name_at = start + 1
+            if (tokens[start][1] == "//" and name_at < len(tokens)
+                    and tokens[name_at][0] == "name" and tokens[name_at][1] in ANCHORS
+                    and (name_at + 1 == len(tokens) or tokens[name_at + 1][1] not in ("(", "::"))):
+                name = tokens[name_at][1]
+                out.extend(tokenize(ANCHORS[name]))
+                applied.append(f"anchored //{name} to {ANCHORS[name]}")
+                i = name_at + 1
+                continue
+        if text in "([":
+            depth += 1
+        elif text in ")]":
+            depth -= 1
+        out.append(tokens[i])
+        i += 1
+    return out
+
+
+def _required_text_literals(tokens: List[Tuple[str, str]]) -> List[str]:
+    """
+    Literals that must occur in the root's string value for any match
+
+    Only contains(., 'x') and starts-with(., 'x') (or text() in place of
+    '.') that are plain conjuncts of predicates on elements count, and only
+    when the expression has no union, or, not(), or inequality that could
+    turn a missing literal into a match.
+    """
+    texts = [t for _, t in tokens]
+    if {"|", "or", "not", "!="} & set(texts):
+        return []
+    literals = []
+    for i, text, frames, _, _ in _walk_cost(tokens):
+        if text not in _LITERAL_TESTS or i + 5 >= len(tokens) or texts[i + 1] != "(":
+            continue
+        if texts[i - 1] not in ("[", "and"):
+            continue
+        if texts[i + 2:i + 4] == [".", ","] and tokens[i + 4][0] == "literal" and texts[i + 5] == ")":
+            after = texts[i + 6] if i + 6 < len(texts) else None
+        elif texts[i + 2:i + 6] == ["text", "(", ")", ","] and i + 7 < len(texts) \
+                and tokens[i + 6][0] == "literal" and texts[i + 7] == ")":
+            after = texts[i + 8] if i + 8 < len(texts) else None
+        else:
+            continue
+        if after not in ("]", "and"):
+            continue
+        # Every enclosing frame must be a predicate on an element
+        if any(f.kind == "(" for f in frames[1:]) or any(
+                f.owner[0].startswith("@") or f.owner[0] in ("node()", "comment()")
+                for f in frames[1:]):
+            continue
+        literal = next(t for kind, t in tokens[i + 2:] if kind == "literal")
+        literals.append(literal)
+    return list(dict.fromkeys(literals))
+
+
+def _hoist_literals(tokens: List[Tuple[str, str]], applied: List[str]) -> List[Tuple[str, str]]:
+    """
+    Check required literals once against the whole document first
+
+    .//x[...] becomes self::node()[contains(., 'lit')]//x[...], which
+    selects the same nodes but skips the expensive scan when the literal
+    is absent, as it is for most messages.
+    """
+    if not tokens or tokens[0][1] not in (".", "//"):
+        return tokens
+    if tokens[0][1] == "." and (len(tokens) < 2 or tokens[1][1] != "//"):
+        return tokens
+    literals = _required_text_literals(tokens)
+    if not literals:
+        return tokens
+    guard = " and ".join(f"contains(., {literal})" for literal in literals)
+    prefix = "self::node()" if tokens[0][1] == "." else "/self::node()"
+    rest = tokens[1:] if tokens[0][1] == "." else tokens
+    applied.append(f"hoisted {', '.join(literals)} into a document-level check")
+    return tokenize(f"{prefix}[{guard}]") + rest
+
+
+def optimize_xpath(expr: str) -> Tuple[str, List[str]]:
+    """
+    Cheaper equivalent of a rule expression for the enforcer's email XML
+
+    Returns the rewritten expression and a description of each rewrite
+    applied (empty when the expression is returned unchanged).
+    """
+    tokens = tokenize(expr)
+    applied: List[str] = []
+    tokens = _anchor(tokens, applied)
+    if estimate_cost(join_tokens(tokens)).degree >= 2:
+        tokens = _hoist_literals(tokens, applied)
+    if not applied:
+        return expr, applied
+    return join_tokens(tokens), applied
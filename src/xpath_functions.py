@@ -0,0 +1,305 @@
+"""
+XPath extension functions over the original message text
+
+Rules used to search HTML through a <raw-content> copy of every part,
+which kept each part in the tree twice and made contains(., ...) scan
+that copy. These functions read the decoded part text held outside the
+tree instead:
+
+    pp:raw-contains(string)         the part's decoded text contains string
+    pp:raw-matches(pattern[, flags]) a regular expression search of that text
+                                     (flags: any of i, m, s, x), run by RE2
+    pp:header(name)                  the message's first header called name
+                                     (case-insensitive), or ''
+
+The part is the one holding the context node; outside every part (the
+root, <headers>, <body>) the raw functions test all parts of the message.
+pp is urn:email:privacy:1.0, the policy namespace.
+
+Patterns come from untrusted policies, so pp:raw-matches uses RE2, whose
+matching time is linear in the text whatever the pattern; backreferences
+and lookaround, which need backtracking, are refused as invalid.
+
+rewrite_raw_content() turns the usual <raw-content> expressions into
+calls to these functions, e.g.
+
+    .//raw-content[contains(., 'pixel.gif')]
+    -> .//html-part[pp:raw-contains('pixel.gif')]
+"""
+
+import contextvars
+import re
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+import re2
+from lxml import etree as ET
+
+from .xpath_analysis import XPathSyntaxError, analyze, join_tokens, tokenize
+
+FUNCTION_NS = "urn:email:privacy:1.0"
+NAMESPACES = {"pp": FUNCTION_NS}
+
+# Patterns come from untrusted policies; keep them short, which also
+# bounds the memory RE2 spends on them
+MAX_PATTERN_LENGTH = 256
+# RE2 takes i, m and s inline; x is applied by _strip_verbose
+_FLAGS = frozenset("imsx")
+# Whitespace and comments of a verbose pattern, outside classes and escapes
+_VERBOSE_RE = re.compile(r"(\\.|\[(?:\\.|[^\]])*\])|\s+|#[^\n]*")
+
+_current: "contextvars.ContextVar[Optional[MessageSources]]" = contextvars.ContextVar("pp_sources", default=None)
+
+
+class MessageSources:
+    """
+    The message behind the tree being evaluated
+
+    parts lists the MIME part behind each child of /email/body, in order;
+    their text is decoded on first use by load (MIME part -> bytes).
+    """
+
+    def __init__(self, email_msg, parts: List, load: Callable[[object], Optional[bytes]],
+                 texts: Optional[Dict[int, str]] = None):
+        self.email_msg = email_msg
+        self.parts = parts
+        self.load = load
+        self._texts: Dict[int, str] = dict(texts or {})
+
+    def text(self, index: int) -> str:
+        text = self._texts.get(index)
+        if text is None:
+            payload = self.load(self.parts[index]) if index < len(self.parts) else None
+            text = payload.decode('utf-8', errors='ignore') if payload else ""
+            self._texts[index] = text
+        return text
+
+    def texts_for(self, node) -> List[str]:
+        index = _part_index(node)
+        if index is None:
+            return [self.text(i) for i in range(len(self.parts))]
+        return [self.text(index)]
+
+
+@contextmanager
+def sources(message_sources: MessageSources):
+    """Make message_sources visible to the extension functions on this thread"""
+    token = _current.set(message_sources)
+    try:
+        yield message_sources
+    finally:
+        _current.reset(token)
+
+
+def _part_index(node) -> Optional[int]:
+    """Position under /email/body of the part holding node, or None"""
+    if not ET.iselement(node):
+        node = getattr(node, "getparent", lambda: None)()
+        if node is None:
+            return None
+    chain = [node]
+    chain.extend(node.iterancestors())
+    # chain[-1] is <email>, chain[-2] <headers> or <body>, chain[-3] the part
+    if len(chain) < 3 or chain[-2].tag != "body":
+        return None
+    return chain[-2].index(chain[-3])
+
+
+def _string(value) -> str:
+    """XPath string() of a function argument"""
+    if isinstance(value, list):
+        if not value:
+            return ""
+        value = value[0]
+        if ET.iselement(value):
+            return "".join(value.itertext())
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else str(value)
+    return str(value)
+
+
+def _texts(context) -> List[str]:
+    message_sources = _current.get()
+    if message_sources is None:
+        return []
+    return message_sources.texts_for(context.context_node)
+
+
+def check_pattern(pattern: str, flags: str = "") -> Optional[str]:
+    """Why a pp:raw-matches pattern is refused, or None when it is usable"""
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        return f"pattern longer than {MAX_PATTERN_LENGTH} characters"
+    unknown = set(flags) - _FLAGS
+    if unknown:
+        return f"unknown flags {''.join(sorted(unknown))!r}"
+    try:
+        _compile(pattern, flags)
+    except re2.error as e:
+        message = e.args[0] if e.args else e
+        return f"invalid pattern: {message.decode('utf-8', 'replace') if isinstance(message, bytes) else message}"
+    return None
+
+
+def _strip_verbose(pattern: str) -> str:
+    return _VERBOSE_RE.sub(lambda m: m.group(1) or "", pattern)
+
+
+def _compile(pattern: str, flags: str):
+    if "x" in flags:
+        pattern = _strip_verbose(pattern)
+    inline = "".join(flag for flag in "ims" if flag in flags)
+    options = re2.Options()
+    options.log_errors = False
+    return re2.compile(f"(?{inline}){pattern}" if inline else pattern, options)
+
+
+@lru_cache(maxsize=512)
+def _compiled_pattern(pattern: str, flags: str):
+    problem = check_pattern(pattern, flags)
+    if problem is not None:
+        raise ValueError(f"pp:raw-matches: {problem}")
+    return _compile(pattern, flags)
+
+
+def raw_contains(context, needle) -> bool:
+    needle = _string(needle)
+    return any(needle in text for text in _texts(context))
+
+
+def raw_matches(context, pattern, flags="") -> bool:
+    regex = _compiled_pattern(_string(pattern), _string(flags))
+    return any(regex.search(text) is not None for text in _texts(context))
+
+
+def header(context, name) -> str:
+    message_sources = _current.get()
+    if message_sources is None or message_sources.email_msg is None:
+        return ""
+    value = message_sources.email_msg.get(_string(name))
+    return str(value) if value is not None else ""
+
+
+EXTENSIONS = {
+    (FUNCTION_NS, "raw-contains"): raw_contains,
+    (FUNCTION_NS, "raw-matches"): raw_matches,
+    (FUNCTION_NS, "header"): header,
+}
+
+
+def compile_xpath(expr: str) -> ET.XPath:
+    """ET.XPath with the pp prefix and extension functions available"""
+    return ET.XPath(expr, namespaces=NAMESPACES, extensions=EXTENSIONS)
+
+
+def pattern_errors(expr: str) -> List[str]:
+    """Problems with the literal patterns passed to pp:raw-matches in expr"""
+    tokens = tokenize(expr)
+    errors = []
+    for i, (kind, text) in enumerate(tokens):
+        if text != "pp:raw-matches" or i + 2 >= len(tokens) or tokens[i + 1][1] != "(":
+            continue
+        if tokens[i + 2][0] != "literal":
+            errors.append("pp:raw-matches needs a literal pattern")
+            continue
+        flags = ""
+        if i + 4 < len(tokens) and tokens[i + 3][1] == "," and tokens[i + 4][0] == "literal":
+            flags = tokens[i + 4][1][1:-1]
+        problem = check_pattern(tokens[i + 2][1][1:-1], flags)
+        if problem is not None:
+            errors.append(f"pp:raw-matches: {problem}")
+    return errors
+
+
+# ---- raw-content compatibility ----
+
+def rewrite_raw_content(expr: str) -> Optional[str]:
+    """
+    Equivalent of expr that does not need <raw-content> elements
+
+    Handles raw-content steps reached as //raw-content, .//raw-content or
+    html-part/raw-content whose predicates only read the text through
+    contains(., 'x') or contains(text(), 'x'); the step becomes the
+    html-part itself. Returns expr unchanged when it does not use
+    raw-content, and None when it cannot be rewritten.
+    """
+    try:
+        info = analyze(expr)
+    except XPathSyntaxError:
+        return None
+    if "raw-content" not in info.element_names:
+        return expr
+    tokens = info.tokens
+    texts = [t for _, t in tokens]
+    out = []
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        if texts[i] != "raw-content":
+            if texts[i] in ("(", "["):
+                depth += 1
+            elif texts[i] in (")", "]"):
+                depth -= 1
+            out.append(tokens[i])
+            i += 1
+            continue
+        if i + 1 < len(tokens) and texts[i + 1] in ("(", "::"):
+            return None
+        prev = texts[i - 1] if i else None
+        if prev == "/" and i >= 2 and texts[i - 2] == "html-part":
+            out.pop()  # html-part/raw-content -> html-part
+        elif prev == "//" and depth == 0 and _branch_start(texts, i - 1):
+            out.append(("name", "html-part"))
+        else:
+            return None
+        i += 1
+        # The step's predicates, with the context string read by the raw functions
+        while i < len(tokens) and texts[i] == "[":
+            depth = 0
+            start = i
+            while i < len(tokens):
+                depth += texts[i] == "["
+                depth -= texts[i] == "]"
+                i += 1
+                if depth == 0:
+                    break
+            predicate = _rewrite_predicate(tokens[start:i])
+            if predicate is None:
+                return None
+            out.extend(predicate)
+        if i < len(tokens) and texts[i] in ("/", "//"):
+            return None  # raw-content has no element children to step into
+    return join_tokens(out)
+
+
+def _branch_start(texts: List[str], at: int) -> bool:
+    """Whether the // at position at begins a top-level union branch"""
+    if at > 0 and texts[at - 1] == ".":
+        at -= 1
+    return at == 0 or texts[at - 1] == "|"
+
+
+def _rewrite_predicate(tokens):
+    texts = [t for _, t in tokens]
+    out = []
+    i = 0
+    while i < len(tokens):
+        if texts[i] == "contains" and texts[i + 1:i + 2] == ["("]:
+            if texts[i + 2:i + 4] == [".", ","] and tokens[i + 4][0] == "literal" and texts[i + 5] == ")":
+                out.extend([("name", "pp:raw-contains"), ("op", "("), tokens[i + 4], ("op", ")")])
+                i += 6
+                continue
+            if texts[i + 2:i + 6] == ["text", "(", ")", ","] and tokens[i + 6][0] == "literal" \
+                    and texts[i + 7] == ")":
+                out.extend([("name", "pp:raw-contains"), ("op", "("), tokens[i + 6], ("op", ")")])
+                i += 8
+                continue
+        if tokens[i][0] == "number" or texts[i] == "." or (texts[i] == "text" and texts[i + 1:i + 2] == ["("]) or tokens[i][0] == "name" \
+                and texts[i] not in ("and", "or", "not", "contains") and texts[i + 1:i + 2] != ["("]:
+            # Any other read of the text, or a step below raw-content
+            return None
+        out.append(tokens[i])
+        i += 1
+    return out
@@ -0,0 +1,248 @@
+"""
+Single-pass evaluation of a policy's rules with one XSLT stylesheet
+
+The XPath backend runs each rule as its own traversal of the email XML,
+so a policy with dozens of //tag[...] rules walks a large HTML part
+dozens of times. compile_plan() turns a list of rules into one stylesheet
+that visits every element once: rules of the form //name[predicates] (or
+.//name[...]) become tests in a template for that element name, and
+libxslt dispatches each element straight to the rules that can match it.
+Every other expression is evaluated once into a variable by the same
+stylesheet.
+
+The stylesheet cannot reach files or the network (XSLTAccessControl
+DENY_ALL), and only rules limited to XPath 1.0 core functions and the pp:
+extension functions are put in it; the rest stay with the XPath backend
+(XsltPlan.fallback).
+
+Output matches are copies rather than nodes of the evaluated tree: enough
+to count and describe them, and the part each one lies in is reported so
+encrypt actions can still target the matched parts.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from lxml import etree as ET
+
+from .xpath_analysis import XPathSyntaxError, analyze, join_tokens
+from .xpath_functions import EXTENSIONS, FUNCTION_NS
+
+XSL_NS = "http://www.w3.org/1999/XSL/Transform"
+EXSL_NS = "http://exslt.org/common"
+_XSL = f"{{{XSL_NS}}}"
+
+# Below this many rules the per-rule XPath loop is as fast
+MIN_RULES = 8
+
+CORE_FUNCTIONS = frozenset({
+    "last", "position", "count", "id", "local-name", "namespace-uri", "name",
+    "string", "concat", "starts-with", "contains", "substring-before", "substring-after",
+    "substring", "string-length", "normalize-space", "translate",
+    "boolean", "not", "true", "false", "lang",
+    "number", "sum", "floor", "ceiling", "round",
+})
+PP_FUNCTIONS = frozenset(f"pp:{name}" for _, name in EXTENSIONS)
+
+# Position under /email/body of the part holding the context node, or -1
+_PART_INDEX = ("count(ancestor-or-self::*[parent::body[parent::email[not(parent::*)]]]"
+               "/preceding-sibling::*)")
+_IN_PART = "ancestor-or-self::*[parent::body[parent::email[not(parent::*)]]]"
+
+
+class XsltPlan:
+    """
+    A compiled stylesheet for a list of rules
+
+    rules: the rules the stylesheet evaluates
+    fallback: rules it cannot take, to evaluate with XPath as before
+    """
+
+    def __init__(self, stylesheet: Optional[ET.XSLT], rules: List[Dict[str, Any]],
+                 fallback: List[Dict[str, Any]], walked: int):
+        self.stylesheet = stylesheet
+        self.rules = rules
+        self.fallback = fallback
+        self.walked = walked
+
+    def evaluate(self, xml) -> Tuple[Dict[str, Any], Dict[str, Optional[List[int]]]]:
+        """
+        Run every rule of the plan in one transformation
+
+        Returns:
+            (rule index -> matches, for matching rules: a list of match
+             copies, or the value for rules returning a boolean, number or
+             string; rule index -> positions under /email/body of the
+             matched parts, None when a match lies outside every part)
+        """
+        hits: Dict[str, Any] = {}
+        parts: Dict[str, Optional[List[int]]] = {}
+        if self.stylesheet is None:
+            return hits, parts
+        result = self.stylesheet(xml)
+        for out in result.getroot():
+            index = out.get("r")
+            if out.tag == "s":
+                value = _scalar(out.get("t"), out.text or "")
+                if value:
+                    hits[index] = value
+                continue
+            hits.setdefault(index, []).append(_match(out))
+            part = out.get("p")
+            if part is not None:
+                known = parts.setdefault(index, [])
+                if part == "-1" or known is None:
+                    parts[index] = None
+                elif int(part) not in known:
+                    known.append(int(part))
+        return hits, parts
+
+
+def _scalar(object_type: str, text: str):
+    if object_type == "boolean":
+        return text == "true"
+    if object_type == "number":
+        try:
+            return float(text)
+        except ValueError:
+            return float("nan")
+    return text
+
+
+def _match(out):
+    """The copied node a match element holds, or its string value"""
+    if out.get("k") == "e" and len(out):
+        return out[0]
+    return out.text or ""
+
+
+def eligible(expr: str) -> bool:
+    """Whether an expression can go into a stylesheet"""
+    try:
+        info = analyze(expr)
+    except XPathSyntaxError:
+        return False
+    if "$" in (text for _, text in info.tokens):
+        return False
+    if not info.functions <= CORE_FUNCTIONS | PP_FUNCTIONS:
+        return False
+    names = info.element_names | info.attribute_names
+    return not any(":" in name for name in names)
+
+
+def _walk_step(expr: str) -> Optional[Tuple[str, str, bool]]:
+    """
+    (name, predicates, from the root element) for //name[...] and .//name[...]
+
+    Only when no predicate depends on position, since a self:: test sees
+    a different context position than the descendant axis did.
+    """
+    info = analyze(expr)
+    tokens = info.tokens
+    texts = [t for _, t in tokens]
+    relative = texts[:1] == ["."]
+    i = 1 if relative else 0
+    if texts[i:i + 1] != ["//"] or i + 1 >= len(texts):
+        return None
+    name = texts[i + 1]
+    if not (tokens[i + 1][0] == "name" or name == "*"):
+        return None
+    if i + 2 < len(texts) and texts[i + 2] in ("(", "::"):
+        return None
+    if info.positional_predicate or info.functions & {"position", "last"}:
+        return None
+    # Only predicates may follow the name test
+    depth = 0
+    for text in texts[i + 2:]:
+        if depth == 0 and text != "[":
+            return None
+        if text == "[":
+            depth += 1
+        elif text == "]":
+            depth -= 1
+    return name, join_tokens(tokens[i + 2:]), relative
+
+
+def _output(parent, rule: Dict[str, Any], copy: bool, select: str = "."):
+    """Emit one <m> per node of select (the context node by default)"""
+    for_each = ET.SubElement(parent, f"{_XSL}for-each", select=select)
+    choose = ET.SubElement(for_each, f"{_XSL}choose")
+    when = ET.SubElement(choose, f"{_XSL}when", test="self::*")
+    _match_element(when, rule, "e", copy)
+    otherwise = ET.SubElement(choose, f"{_XSL}otherwise")
+    _match_element(otherwise, rule, "v", True)
+
+
+def _match_element(parent, rule: Dict[str, Any], kind: str, copy: bool):
+    m = ET.SubElement(parent, "m", r=rule['index'], k=kind)
+    if rule['action'] == 'encrypt':
+        choose = ET.SubElement(m, f"{_XSL}choose")
+        when = ET.SubElement(choose, f"{_XSL}when", test=_IN_PART)
+        ET.SubElement(when, f"{_XSL}attribute", name="p").append(
+            ET.Element(f"{_XSL}value-of", select=_PART_INDEX))
+        otherwise = ET.SubElement(choose, f"{_XSL}otherwise")
+        ET.SubElement(otherwise, f"{_XSL}attribute", name="p").text = "-1"
+    if not copy:
+        return
+    if kind == "e":
+        # The element with its tail text, as the XPath backend describes it
+        ET.SubElement(m, f"{_XSL}copy-of", select=". | following-sibling::node()[1][self::text()]")
+    else:
+        ET.SubElement(m, f"{_XSL}value-of", select=".")
+
+
+def compile_plan(rules: List[Dict[str, Any]], describe_all: bool = False) -> XsltPlan:
+    """
+    One stylesheet for rules (dicts as built by PolicyEnforcer._load_policy)
+
+    Matches are copied for strip rules, whose descriptions are reported,
+    and for every rule with describe_all; otherwise only counted.
+    """
+    taken, fallback = [], []
+    for rule in rules:
+        (taken if eligible(rule['expr']) else fallback).append(rule)
+    if not taken:
+        return XsltPlan(None, [], fallback, 0)
+
+    root = ET.Element(f"{_XSL}stylesheet", version="1.0",
+                      nsmap={"xsl": XSL_NS, "exsl": EXSL_NS, "pp": FUNCTION_NS})
+    root.set("extension-element-prefixes", "exsl")
+    root.set("exclude-result-prefixes", "exsl pp")
+    top = ET.SubElement(root, f"{_XSL}template", match="/")
+    matches = ET.SubElement(top, "matches")
+    # Rule expressions are evaluated with the root element as context
+    context = ET.SubElement(matches, f"{_XSL}for-each", select="*")
+
+    walked: Dict[str, List[Tuple[Dict[str, Any], str]]] = {}
+    for rule in taken:
+        copy = describe_all or rule['action'] == 'strip'
+        step = _walk_step(rule['expr'])
+        if step is not None:
+            name, predicates, relative = step
+            test = f"self::node(){predicates}"
+            if relative and name in ("*", "email"):
+                test += "[parent::*]"  # .// does not select the context node itself
+            walked.setdefault(name, []).append((rule, test, copy))
+            continue
+        var = f"v{rule['index']}"
+        ET.SubElement(context, f"{_XSL}variable", name=var, select=rule['expr'])
+        choose = ET.SubElement(context, f"{_XSL}choose")
+        when = ET.SubElement(choose, f"{_XSL}when", test=f"exsl:object-type(${var}) = 'node-set'")
+        _output(when, rule, copy, select=f"${var}")
+        scalar = ET.SubElement(choose, f"{_XSL}when", test=f"${var}")
+        s = ET.SubElement(scalar, "s", r=rule['index'], t=f"{{exsl:object-type(${var})}}")
+        ET.SubElement(s, f"{_XSL}value-of", select=f"${var}")
+
+    walked_rules = sum(len(tests) for tests in walked.values())
+    if walked:
+        ET.SubElement(context, f"{_XSL}apply-templates", select="descendant-or-self::*", mode="walk")
+        wildcard = walked.pop("*", [])
+        for name, tests in list(walked.items()) + [("*", [])]:
+            template = ET.SubElement(root, f"{_XSL}template", match=name, mode="walk")
+            # An element goes to its own name's template only, so wildcard
+            # rules are tested in every template
+            for rule, test, copy in tests + wildcard:
+                condition = ET.SubElement(template, f"{_XSL}if", test=test)
+                _match_element(condition, rule, "e", copy)
+
+    stylesheet = ET.XSLT(root, access_control=ET.XSLTAccessControl.DENY_ALL, extensions=EXTENSIONS)
+    return XsltPlan(stylesheet, taken, fallback, walked_rules)
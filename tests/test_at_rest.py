@@ -0,0 +1,130 @@
+# tests/test_at_rest.py - stored messages and re-enforcement on policy updates
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import datetime
+
+import pytest
+
+from src.at_rest import AtRestStore
+from src.expiry import ExpiryScheduler
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.schema import validate_policy
+
+TRACKERS = ".//img[contains(@src, 'tracker.com')]"
+SECRET = ".//p[contains(., 'secret')]"
+
+
+def policy(*rules, policy_id=None, creator="legal@example.com", expires=None):
+    result = PrivacyPolicy(policy_id=policy_id, creator=creator, expires=expires)
+    for rule_id, xpath, action in rules:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id), scope="at-rest"))
+    return result.to_string()
+
+
+def message(body, policy_xml=None):
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "legal@example.com", "bob@example.com", "Report", body, policy_xml or policy())
+    return msg.as_bytes()
+
+
+@pytest.fixture
+def store(tmp_path):
+    result = AtRestStore(str(tmp_path / "store.db"), expiry=ExpiryScheduler())
+    yield result
+    result.close()
+
+
+def test_policy_id_is_written_and_valid():
+    xml = policy(("trackers", TRACKERS, "strip"), policy_id="legal-retention")
+    assert 'id="legal-retention"' in xml
+    assert AtRestStore.policy_key_for(xml) == "legal-retention"
+    assert validate_policy(xml) == []
+    assert AtRestStore.policy_key_for(policy(("trackers", TRACKERS, "strip"))) is None
+
+
+def test_update_migrates_messages_by_policy_id(store):
+    v1 = policy(("trackers", TRACKERS, "strip"), policy_id="legal")
+    store.store("m1", message('<p>secret</p><img src="https://tracker.com/p.gif"/>'), v1)
+    store.store("m2", message("<p>nothing here</p>"), v1)
+    assert [v['rule_id'] for v in store.verdicts("m1")] == ["trackers"]
+
+    v2 = policy(("trackers", TRACKERS, "warn"), ("secret", SECRET, "block"), policy_id="legal")
+    report = store.update_policy(v2)
+    assert report['messages'] == 2
+    assert store.current_policy("legal") == report['digest']
+    assert {v['rule_id']: v['action'] for v in store.verdicts("m1")} == {"trackers": "warn", "secret": "block"}
+    assert store.verdicts("m2") == []
+
+
+def test_creator_does_not_identify_a_policy(store):
+    # Two senders claim the same Creator; neither may rewrite the other's verdicts
+    own = policy(("secret", SECRET, "block"), creator="legal@example.com")
+    forged = policy(("nothing", ".//p[contains(., 'zzz')]", "warn"), creator="legal@example.com")
+    store.store("m1", message("<p>secret</p>", own), own)
+    store.store("m2", message("<p>secret</p>", forged), forged)
+
+    with pytest.raises(ValueError, match="policy_key"):
+        store.update_policy(forged)
+    assert store.current_policy("legal@example.com") is None
+    assert [v['rule_id'] for v in store.verdicts("m1")] == ["secret"]
+
+    # An explicit key still groups versions
+    store.update_policy(forged, policy_key="legal-team")
+    assert [v['rule_id'] for v in store.verdicts("m1")] == ["secret"]
+
+
+def test_policy_taken_from_the_message(store):
+    xml = policy(("secret", SECRET, "block"), policy_id="hr")
+    assert set(store.store("m1", message("<p>secret</p>", xml))) == {"secret"}
+    assert store.find(rule_id="secret") == ["m1"]
+    assert store.stats()['messages'] == 1
+
+
+
+
+
+
+def test_store_prints_nothing(store, capsys):
+    store.store("m1", message("<p>secret</p>", policy(("secret", SECRET, "block"), policy_id="hr")))
+    store.store("m2", b"From: a@example.com\r\nSubject: Hi\r\n\r\nHello\r\n")
+    assert capsys.readouterr().out == ""
+def test_malformed_policy_stores_the_message_unbound(store):
+    xml = policy(("secret", SECRET, "block"), policy_id="hr")
+    store.store("m1", message("<p>secret</p>", xml))
+    assert store.store("m1", message("<p>secret</p>"), policy_xml="<PrivacyPolicy") == {}
+    assert not store._db.in_transaction
+    assert store.find(rule_id="secret") == []
+    assert store.get_message("m1") is not None
+
+
+def test_failed_store_rolls_back(store, monkeypatch):
+    xml = policy(("secret", SECRET, "block"), policy_id="hr")
+    store.store("m1", message("<p>secret</p>", xml))
+
+    def fail(*args):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(store, "_evaluate", fail)
+    with pytest.raises(RuntimeError):
+        store.store("m1", message("<p>secret</p>", xml))
+    assert not store._db.in_transaction
+    assert store.find(rule_id="secret") == ["m1"]
+def test_expired_policy_unbinds_its_messages(tmp_path):
+    scheduler = ExpiryScheduler(clock=lambda: 0.0)
+    store = AtRestStore(str(tmp_path / "store.db"), expiry=scheduler)
+    try:
+        expires = datetime.datetime.now() + datetime.timedelta(hours=1)
+        xml = policy(("secret", SECRET, "block"), policy_id="hr", expires=expires)
+        store.store("m1", message("<p>secret</p>"), xml)
+        assert store.verdicts("m1")
+        scheduler.run_due(now=expires.timestamp() + 1)
+        assert store.verdicts("m1") == []
+
+        report = store.update_policy(policy(("secret", SECRET, "warn"), policy_id="hr"))
+        assert report['messages'] == 1
+        assert [v['action'] for v in store.verdicts("m1")] == ["warn"]
+    finally:
+        store.close()
@@ -0,0 +1,72 @@
+# tests/test_audit.py - batched audit log
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import sqlite3
+import threading
+
+import pytest
+
+from src.audit import AuditLog
+
+BLOCKED = {'actions_taken': ['block:no-trackers'], 'warnings': [],
+           'blocks': [{'rule': 'no-trackers', 'message': 'Trackers are not allowed'}]}
+
+
+def construct(*args, **kwargs):
+    """AuditLog(...) on another thread, so a hang fails the test instead of the run"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['log'] = AuditLog(*args, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive(), "AuditLog() hung"
+    return outcome
+
+
+def test_backend_open_error_is_raised(tmp_path):
+    outcome = construct(str(tmp_path / "missing" / "audit.db"))
+    assert isinstance(outcome.get('error'), sqlite3.OperationalError)
+
+
+def test_jsonl_open_error_is_raised(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    outcome = construct(str(blocker / "audit"), backend="jsonl")
+    assert isinstance(outcome.get('error'), OSError)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "jsonl"])
+def test_records_and_queries(tmp_path, backend):
+    with AuditLog(str(tmp_path / "audit"), backend=backend) as log:
+        log.record_fields("<1@x>", "alice@example.com", "hi", BLOCKED)
+        log.record_fields("<2@x>", "bob@example.com", "hi", None)
+        assert log.flush(5)
+        blocked = log.query(action="block")['records']
+        assert [(r['sender'], r['rule_id'], r['detail']) for r in blocked] == \
+            [("alice@example.com", "no-trackers", "Trackers are not allowed")]
+        assert [r['message_id'] for r in log.query(limit=1)['records']] == ["<2@x>"]
+
+
+def test_counters_are_exact_under_concurrent_record(tmp_path):
+    threads, per_thread = 8, 2000
+    with AuditLog(str(tmp_path / "audit.db"), max_queue=1000) as log:
+        def record():
+            for _ in range(per_thread):
+                log.record_fields(None, "alice@example.com", None, None)
+        workers = [threading.Thread(target=record) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert log.flush(10)
+        stats = log.stats()
+    assert stats['recorded'] + stats['dropped'] == threads * per_thread
+    assert stats['written'] == stats['recorded']
@@ -0,0 +1,90 @@
+# tests/test_budgets.py - per-message evaluation budgets
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import email
+
+import pytest
+
+from src import prefilter
+from src.budgets import BudgetExceeded, BudgetMetrics, EvaluationBudget
+from src.enforcer import PolicyEnforcer
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+CONFIDENTIAL = ".//p[contains(., 'confidential')]"
+
+
+def policy(action="block"):
+    result = PrivacyPolicy(creator="legal@example.com")
+    result.add_rule(Rule("confidential", Condition(xpath=CONFIDENTIAL), Action(action, "confidential")))
+    return result.to_string()
+
+
+def message(body):
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "legal@example.com", "bob@example.com", "Report", body, policy())
+    # Header only, so the policy part does not count against the budget
+    for part in list(msg.walk()):
+        if part.get_content_type() == MIMEPrivacyHandler.PRIVACY_MIME_TYPE:
+            msg.get_payload().remove(part)
+    return email.message_from_bytes(msg.as_bytes())
+
+
+def big_body(kb=100):
+    return "<p>" + "lorem &amp; ipsum " * (kb * 64) + "</p>"
+
+
+def test_meter_charges_each_part_once():
+    meter = EvaluationBudget(max_text_bytes=150).meter()
+    part = object()
+    meter.charge_part(part, 100)
+    meter.charge_part(part, 100)
+    assert meter.text_bytes == 100
+    with pytest.raises(BudgetExceeded) as error:
+        meter.charge_part(object(), 100)
+    assert error.value.kind == 'text_bytes'
+    # Every later check raises the same error
+    with pytest.raises(BudgetExceeded) as again:
+        meter.charge_part(part, 1)
+    assert again.value is error.value
+
+
+def test_oversized_part_trips_before_the_prefilter_decodes_it(monkeypatch):
+    unescaped = []
+    unescape = prefilter.html.unescape
+    monkeypatch.setattr(prefilter.html, "unescape", lambda text: unescaped.append(len(text)) or unescape(text))
+
+    enforcer = PolicyEnforcer(budget=EvaluationBudget(max_text_bytes=10_000, on_exceeded='closed'))
+    results = enforcer.enforce_policy(message(big_body()), policy())
+
+    assert results['budget_exceeded']['kind'] == 'text_bytes'
+    assert results['budget_exceeded']['stage'] == 'prefilter'
+    assert results['partial'] and results['skipped_rules'] == ['confidential']
+    assert [b['rule'] for b in results['blocks']] == ['budget']
+    assert not any(size > 10_000 for size in unescaped)
+
+
+def test_prefilter_and_xml_share_one_charge():
+    body = "<p>confidential</p>" + "<p>filler text</p>" * 300
+    payload = len(body.encode("utf-8"))
+    metrics = BudgetMetrics()
+    enforcer = PolicyEnforcer(budget=EvaluationBudget(max_text_bytes=payload * 3 // 2 + 2_000),
+                              budget_metrics=metrics)
+    results = enforcer.enforce_policy(message(body), policy())
+    assert 'budget_exceeded' not in results
+    assert [b['rule'] for b in results['blocks']] == ['confidential']
+    assert metrics.stats()['metered'] == 1 and metrics.stats()['trips_text_bytes'] == 0
+
+
+@pytest.mark.parametrize("prefilter_on", [True, False])
+def test_open_budget_keeps_partial_verdict(prefilter_on):
+    metrics = BudgetMetrics()
+    enforcer = PolicyEnforcer(prefilter=prefilter_on, budget_metrics=metrics,
+                              budget=EvaluationBudget(max_text_bytes=10_000))
+    results = enforcer.enforce_policy(message(big_body()), policy())
+    assert results['partial']
+    assert results['blocks'] == []
+    assert any(w['rule'] == 'budget' for w in results['warnings'] if isinstance(w, dict))
+    assert metrics.stats()['failed_open'] == 1
@@ -0,0 +1,90 @@
+# tests/test_bulk_send.py - campaign messages rendered from one skeleton
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import email
+import re
+import threading
+from email.header import decode_header, make_header
+
+import pytest
+
+from src.bulk_send import BulkSender, CampaignError, CampaignTemplate, Recipient
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+BARE_LF = re.compile(rb"(?<!\r)\n")
+
+
+def campaign_policy():
+    policy = PrivacyPolicy(creator="news@example.com")
+    policy.add_rule(Rule("no-trackers", Condition(xpath=".//img[contains(@src, 'tracker.com')]"),
+                         Action("strip", "Tracking pixels removed")))
+    return policy
+
+
+def html_part(msg):
+    return next(part for part in msg.walk() if part.get_content_type() == "text/html")
+
+
+@pytest.mark.parametrize("subject,body", [
+    ("Monthly news", "<p>Static body</p>"),
+    ("Héllo {{name}}, " + "a long subject that has to be folded " * 3, "<p>Dear {{name}}</p>" * 200),
+])
+def test_rendered_messages_use_crlf_only(subject, body):
+    template = CampaignTemplate("news@example.com", subject, body, campaign_policy())
+    data = template.render(Recipient("zoe@example.com", "Zoë"))
+    assert b"\r\n" in data
+    assert not BARE_LF.search(data)
+    assert b"\r\r" not in data
+
+
+def test_rendered_message_round_trips():
+    template = CampaignTemplate("news@example.com", "Héllo {{name}}", "<p>Dear {{name}} {{code}}</p>",
+                                campaign_policy())
+    msg = email.message_from_bytes(template.render(Recipient("zoe@example.com", "Zoë <b>", {"code": "42"})))
+    assert str(make_header(decode_header(msg["Subject"]))) == "Héllo Zoë <b>"
+    assert html_part(msg).get_payload(decode=True).decode("utf-8") == "<p>Dear Zoë &lt;b&gt; 42</p>"
+    validation = MIMEPrivacyHandler.validate_policy_integrity(msg)
+    assert validation["errors"] == [] and validation["policy_extractable"]
+    assert "no-trackers" in MIMEPrivacyHandler.extract_policy(msg)
+
+
+def test_recipient_values_are_checked():
+    template = CampaignTemplate("news@example.com", "Hello {{name}}", "<p>Hi</p>", campaign_policy())
+    with pytest.raises(CampaignError):
+        template.render(Recipient("zoe@example.com", "Zoë\r\nBcc: eve@example.com"))
+    with pytest.raises(CampaignError, match="field 'code'"):
+        CampaignTemplate("news@example.com", "Hi", "{{code}}", campaign_policy()).render(
+            Recipient("zoe@example.com"))
+
+
+class RecordingTransport:
+    def __init__(self, sent, lock):
+        self.sent = sent
+        self.lock = lock
+
+    def send(self, from_addr, to_addrs, data):
+        if to_addrs[0].startswith("bounce"):
+            raise OSError("mailbox unavailable")
+        with self.lock:
+            self.sent.append((to_addrs[0], data))
+
+    def close(self):
+        pass
+
+
+def test_bulk_sender_reports_each_recipient():
+    sent, lock = [], threading.Lock()
+    template = CampaignTemplate("news@example.com", "Hello {{name}}", "<p>Hi {{name}}</p>", campaign_policy())
+    recipients = [Recipient(f"user{n}@example.com", f"User {n}") for n in range(20)]
+    recipients.append(Recipient("bounce@example.com", "Bounce"))
+    report = BulkSender(lambda: RecordingTransport(sent, lock), workers=3).send(template, recipients)
+
+    assert report["sent"] == 20 and len(sent) == 20
+    assert report["failed"] == 1
+    assert report["errors"][0]["recipient"] == "bounce@example.com"
+    assert sorted(address for address, _ in sent) == sorted(r.address for r in recipients
+                                                            if r.address != "bounce@example.com")
+    assert all(not BARE_LF.search(data) for _, data in sent)
@@ -0,0 +1,79 @@
+# tests/test_cli.py - the python -m src command line
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+import subprocess
+
+import pytest
+
+from src.cli import TEMPLATES, main
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def write_message(tmp_path, body, name="message.eml"):
+    policy = PrivacyPolicy(creator="legal@example.com")
+    policy.add_rule(Rule("confidential", Condition(xpath=".//p[contains(., 'confidential')]"),
+                         Action("block", "confidential")))
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "legal@example.com", "bob@example.com", "Report", body, policy.to_string())
+    path = tmp_path / name
+    path.write_bytes(msg.as_bytes())
+    return str(path)
+
+
+def test_importing_the_cli_loads_no_library_modules():
+    code = ("import sys, src.cli; "
+            "print(sorted(m for m in sys.modules if m.startswith(('src.', 'lxml'))))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "['src.cli']"
+
+
+@pytest.mark.parametrize("template", sorted(TEMPLATES))
+def test_generated_policies_validate(tmp_path, capsys, template):
+    path = str(tmp_path / "policy.xml")
+    assert main(["generate", template, "--creator", "legal@example.com", "-o", path]) == 0
+    assert main(["-v", "validate", path]) == 0
+    assert capsys.readouterr().out.strip() == f"{path}: valid"
+
+
+def test_generate_bundle(capsys):
+    assert main(["generate", "strict", "--creator", "legal@example.com", "--bundle"]) == 0
+    bundle = json.loads(capsys.readouterr().out)
+    assert bundle["format"] == "pp-bundle" and bundle["rules"]
+
+
+def test_enforce_exit_status_and_json(tmp_path, capsys):
+    blocked = write_message(tmp_path, "<p>confidential</p>", "blocked.eml")
+    clean = write_message(tmp_path, "<p>hello</p>", "clean.eml")
+
+    assert main(["enforce", clean]) == 0
+    assert json.loads(capsys.readouterr().out)['blocks'] == []
+
+    assert main(["enforce", blocked, clean]) == 2
+    report = json.loads(capsys.readouterr().out)
+    assert [b['rule'] for b in report[blocked]['blocks']] == ['confidential']
+    assert report[clean]['blocks'] == []
+
+    assert main(["enforce", blocked, clean, "-o", str(tmp_path / "out.eml")]) == 2
+    assert "--output needs a single message" in capsys.readouterr().err
+
+
+def test_extract_and_scan(tmp_path, capsys):
+    path = write_message(tmp_path, '<p>hi</p><img src="https://pixel.tracker.com/o.gif"/>')
+    assert main(["extract", path]) == 0
+    assert "<PrivacyPolicy" in capsys.readouterr().out
+
+    assert main(["scan", "--trackers-only", path]) == 1
+    out = capsys.readouterr().out
+    assert out.strip() == f"{path}\timg@src\ttracker\thttps://pixel.tracker.com/o.gif"
+
+
+def test_missing_file_is_an_error(tmp_path, capsys):
+    assert main(["validate", str(tmp_path / "missing.xml")]) == 1
+    assert capsys.readouterr().err.startswith("error:")
@@ -0,0 +1,123 @@
+# tests/test_columnar.py - columnar enforcement results and their aggregates
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+
+import numpy as np
+import pytest
+
+from src.columnar import ResultCollector, ResultTable, format_summary, scan_messages
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+
+def collector():
+    result = ResultCollector()
+    result.append({'actions_taken': ['block:confidential', 'warn:confidential'],
+                   'blocks': [{'rule': 'confidential'}],
+                   'warnings': [{'rule': 'confidential', 'matches': 3}]},
+                  sender="Alice <ALICE@example.com>", size=1000, latency_ms=2.0, trackers=1)
+    result.append({'actions_taken': ['strip:trackers'], 'blocks': [],
+                   'stripped_elements': ['trackers:img', 'trackers:img']},
+                  sender="bob@example.com", size=20000, latency_ms=6.0, trackers=2)
+    result.append(None, sender="alice@example.com", size=500)
+    result.append({'actions_taken': ['block:confidential'], 'blocks': [{'rule': 'confidential'}], 'partial': True},
+                  sender="alice@example.com", size=3000, latency_ms=4.0)
+    return result
+
+
+def test_queries():
+    table = collector().table()
+    assert len(table) == 4
+    assert table.senders == ["alice@example.com", "bob@example.com"]
+    assert table.rule_match_rates() == {
+        'confidential': {'messages': 2, 'rate': 0.5, 'matches': 5},
+        'trackers': {'messages': 1, 'rate': 0.25, 'matches': 2},
+    }
+    assert table.rule_match_rates('strip') == {'trackers': {'messages': 1, 'rate': 0.25, 'matches': 2}}
+    assert table.rule_match_rates('encrypt') == {}
+    assert table.top_senders() == [("alice@example.com", 2)]
+    assert table.top_senders(action=None) == [("alice@example.com", 2), ("bob@example.com", 1)]
+    assert table.group_by('sender') == {"alice@example.com": 3, "bob@example.com": 1}
+    assert table.group_by('sender', 'size', 'sum') == {"alice@example.com": 4500.0, "bob@example.com": 20000.0}
+    assert table.group_by('blocked', 'latency_ms', 'mean', mask=table.messages['has_policy']) == {
+        False: 6.0, True: 3.0}
+    with pytest.raises(ValueError):
+        table.group_by('sender', agg='median')
+    with pytest.raises(ValueError):
+        table.group_by('sender', agg='sum')
+
+    assert table.summary() == {
+        'messages': 4, 'with_policy': 3, 'blocked': 2, 'partial': 1,
+        'actions': {'block': 2, 'warn': 1, 'strip': 1},
+        'trackers_mean': 0.75, 'messages_with_trackers': 2,
+    }
+    # The message without a policy is left out of the latencies
+    rows = table.latency_by_size(edges=(4096,))
+    assert [row['messages'] for row in rows] == [2, 1]
+    assert rows[0]['mean_ms'] == 3.0 and rows[1]['p50_ms'] == 6.0
+
+
+def test_columns_grow_past_their_capacity():
+    result = ResultCollector()
+    for n in range(2500):
+        result.append({'actions_taken': ['warn:r'], 'warnings': [{'rule': 'r', 'matches': 1}]},
+                      sender=f"s{n % 3}@example.com", size=n)
+    table = result.table()
+    assert len(table) == 2500 and len(table.hits['rule']) == 2500
+    assert table.messages['size'][-1] == 2499
+    assert table.rule_match_rates()['r'] == {'messages': 2500, 'rate': 1.0, 'matches': 2500}
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_load(tmp_path, mmap):
+    table = collector().table()
+    path = str(tmp_path / "scan.cols")
+    table.save(path)
+    loaded = ResultTable.load(path, mmap=mmap)
+    assert isinstance(loaded.messages['size'], np.memmap) == mmap
+    for name, array in table.messages.items():
+        assert np.array_equal(loaded.messages[name], array) and loaded.messages[name].dtype == array.dtype
+    for name, array in table.hits.items():
+        assert np.array_equal(loaded.hits[name], array)
+    assert loaded.summary() == table.summary()
+    assert loaded.rule_match_rates() == table.rule_match_rates()
+
+    manifest = os.path.join(path, "manifest.json")
+    with open(manifest, encoding="utf-8") as f:
+        data = json.load(f)
+    data['format_version'] = 0
+    with open(manifest, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError, match="unsupported format version"):
+        ResultTable.load(path)
+
+
+def raw_message(body, sender="legal@example.com"):
+    policy = PrivacyPolicy(creator=sender)
+    policy.add_rule(Rule("confidential", Condition(xpath=".//p[contains(., 'confidential')]"),
+                         Action("block", "confidential")))
+    return MIMEPrivacyHandler.create_email_with_policy(
+        sender, "bob@example.com", "Report", body, policy.to_string()).as_bytes()
+
+
+def test_scan_messages_and_summary(capsys):
+    corpus = [
+        raw_message("<p>confidential</p>"),
+        raw_message('<p>hi</p><img src="https://pixel.tracker.com/o.gif"/>', sender="news@example.com"),
+        b"From: plain@example.com\r\nSubject: hi\r\n\r\nno policy\r\n",
+    ]
+    table = scan_messages(corpus).table()
+    assert table.messages['has_policy'].tolist() == [True, True, False]
+    assert table.messages['blocked'].tolist() == [True, False, False]
+    assert table.messages['trackers'].tolist() == [0, 1, 0]
+    assert table.messages['size'].tolist() == [len(raw) for raw in corpus]
+    assert table.top_senders() == [("legal@example.com", 1)]
+    # One line per message would drown a corpus scan
+    assert capsys.readouterr().out == ""
+
+    text = format_summary(table)
+    assert text.startswith("messages 3  with policy 2  blocked 1  partial 0")
+    assert "confidential" in text and "legal@example.com" in text
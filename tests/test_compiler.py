@@ -0,0 +1,80 @@
+# tests/test_compiler.py - policy bundles and the literals they carry
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import base64
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from src.compiler import PolicyCompileError, compile_policy, dump_bundle, load_bundle
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+EXTENSION = os.path.join(os.path.dirname(__file__), '..', 'thunderbird-extension', 'background.js')
+
+
+def bundle_for(*xpaths, creator="legal@example.com"):
+    policy = PrivacyPolicy(creator=creator)
+    for n, xpath in enumerate(xpaths):
+        policy.add_rule(Rule(f"rule-{n}", Condition(xpath=xpath), Action("warn", f"rule {n}")))
+    return compile_policy(policy.to_string())
+
+
+def literals(xpath):
+    return bundle_for(xpath)["rules"][0]["literals"]
+
+
+def test_literals_come_from_decoded_text():
+    assert literals(".//img[contains(@src, 'tracker.com')]") == ["tracker.com"]
+
+
+@pytest.mark.parametrize("xpath", [
+    # 'true' is compared with an attribute value, not searched for in the text
+    ".//img[@tracker='true']",
+    # translate() maps are not text the message must contain
+    "contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'secret')",
+    # Either literal can satisfy the rule, so neither is required
+    ".//p[contains(., 'alpha') or contains(., 'beta')]",
+])
+def test_literals_never_rule_out_matching_messages(xpath):
+    assert literals(xpath) == []
+
+
+def test_load_bundle_rejects_tampered_digest():
+    bundle = bundle_for(".//img[contains(@src, 'tracker.com')]")
+    assert load_bundle(dump_bundle(bundle))["digest"] == bundle["digest"]
+
+    bundle["rules"][0]["action"]["type"] = "strip"
+    with pytest.raises(PolicyCompileError, match="digest"):
+        load_bundle(dump_bundle(bundle))
+    assert load_bundle(dump_bundle(bundle), verify=False)["rules"][0]["action"]["type"] == "strip"
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_extension_recomputes_the_digest():
+    bundle = bundle_for(".//p[contains(., 'naïve \"quoted\" \\ text')]", creator="Zoë <zoe@example.com>")
+    tampered = json.loads(dump_bundle(bundle))
+    tampered["rules"][0]["action"]["type"] = "block"
+
+    def encode(b):
+        return base64.b64encode(dump_bundle(b).encode("utf-8")).decode("ascii")
+
+    script = f"""
+        globalThis.browser = {{runtime: {{onMessage: {{addListener() {{}}}}}}}};
+        globalThis.setTimeout = () => 0;
+        const source = require('fs').readFileSync({json.dumps(EXTENSION)}, 'utf8');
+        new Function(source + `
+            (async () => {{
+                const good = await loadPolicyBundle({json.dumps(encode(bundle))}, {json.dumps(bundle['digest'])});
+                const forged = await loadPolicyBundle({json.dumps(encode(tampered))}, {json.dumps(bundle['digest'])});
+                const header = await loadPolicyBundle({json.dumps(encode(bundle))}, "sha256:00");
+                console.log(JSON.stringify([good && good.digest, forged, header]));
+            }})();
+        `)();
+    """
+    result = subprocess.run(["node", "-e", script], capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == [bundle["digest"], None, None]
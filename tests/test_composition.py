@@ -0,0 +1,116 @@
+# tests/test_composition.py - merging sender, organization and user policies
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import datetime
+
+import pytest
+
+from src.composition import PolicyComposer
+from src.email_client import PrivacyAwareEmailClient
+from src.expiry import ExpiryScheduler, PolicyExpired
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+TRACKERS = ".//img[contains(@src, 'tracker.com')]"
+
+
+def policy(creator, *rules, **kwargs):
+    result = PrivacyPolicy(creator=creator, **kwargs)
+    for rule_id, xpath, action, priority in rules:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id), priority=priority))
+    return result.to_string()
+
+
+def actions(plan):
+    return {rule.id: rule.action for rule in plan.rules}
+
+
+def test_equivalent_rules_merge_by_priority_then_strictness():
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "strip", 1))
+    user = policy("user@example.com", ("user-trackers", TRACKERS, "block", 1))
+    plan = PolicyComposer().compose(org, user)
+    assert actions(plan) == {"user-trackers": "block"}
+    assert plan.duplicates == 1
+    assert plan.conflicts[0].overridden == [(0, "org-trackers", "strip")]
+
+
+def test_sender_priority_cannot_weaken_trusted_rules():
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "block", 1))
+    sender = policy("mallory@example.net", ("allow-trackers", TRACKERS, "allow", 1000))
+    plan = PolicyComposer().compose(org, sender=sender)
+    assert actions(plan) == {"org-trackers": "block"}
+    assert plan.rules[0].priority == 1
+
+
+def test_sender_may_make_rules_stricter():
+    user = policy("user@example.com", ("user-trackers", TRACKERS, "warn", 5))
+    sender = policy("alice@example.net", ("sender-trackers", TRACKERS, "strip", 1))
+    plan = PolicyComposer().compose(user, sender=sender)
+    assert actions(plan) == {"sender-trackers": "strip"}
+    assert plan.rules[0].priority == 5
+
+
+def test_sender_only_rules_are_kept():
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "strip", 1))
+    sender = policy("alice@example.net", ("no-forward", "//header[@name='X-Forwarded']", "warn", 3))
+    plan = PolicyComposer().compose(org, sender=sender)
+    assert actions(plan) == {"org-trackers": "strip", "no-forward": "warn"}
+
+
+def test_sender_input_is_part_of_the_cache_key():
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "strip", 1))
+    other = policy("user@example.com", ("user-trackers", TRACKERS, "allow", 9))
+    composer = PolicyComposer()
+    as_sender = composer.compose(org, sender=other)
+    as_trusted = composer.compose(org, other)
+    assert actions(as_sender) == {"org-trackers": "strip"}
+    assert actions(as_trusted) == {"user-trackers": "allow"}
+    assert composer.stats()['misses'] == 2
+
+
+def test_client_composes_message_policy_as_sender():
+    user = policy("bob@example.com", ("user-trackers", TRACKERS, "block", 1))
+    sender = policy("mallory@example.net", ("allow-trackers", TRACKERS, "allow", 1000))
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "mallory@example.net", "bob@example.com", "hello",
+        '<p>hi</p><img src="https://tracker.com/p.gif"/>', sender)
+    client = PrivacyAwareEmailClient(composer=PolicyComposer(), user_policy=user)
+    result = client.receive_email(msg.as_bytes())
+    assert result['policy_source'] == 'user+message'
+    assert [block['rule'] for block in result['enforcement_results']['blocks']] == ['user-trackers']
+
+
+def test_expired_input_is_left_out():
+    past = datetime.datetime(2020, 1, 1)
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "block", 1))
+    sender = policy("alice@example.net", ("forward", "//header[@name='X-Forwarded']", "warn", 1), expires=past)
+    plan = PolicyComposer().compose(org, sender=sender)
+    assert actions(plan) == {"org-trackers": "block"}
+    assert "Expires" not in plan.policy_xml
+
+
+def test_input_expiring_later_drops_only_its_rules():
+    clock = [datetime.datetime(2030, 1, 1).timestamp()]
+    scheduler = ExpiryScheduler(clock=lambda: clock[0])
+    composer = PolicyComposer(expiry=scheduler)
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "block", 1))
+    user = policy("user@example.com", ("user-forward", "//header[@name='X-Forwarded']", "warn", 1),
+                  expires=datetime.datetime(2030, 6, 1))
+    assert set(actions(composer.compose(org, user))) == {"org-trackers", "user-forward"}
+    assert len(scheduler) == 1
+    clock[0] = datetime.datetime(2030, 7, 1).timestamp()
+    # Lookups do not read the clock: the input lapses when its callback runs
+    assert set(actions(composer.compose(org, user))) == {"org-trackers", "user-forward"}
+    assert scheduler.run_due() == 1
+    assert composer.stats()['plans'] == 0
+    assert set(actions(composer.compose(org, user))) == {"org-trackers"}
+
+
+def test_every_input_expired_raises():
+    past = datetime.datetime(2020, 1, 1)
+    org = policy("org@example.com", ("org-trackers", TRACKERS, "block", 1), expires=past)
+    user = policy("user@example.com", ("user-trackers", TRACKERS, "warn", 1), expires=past)
+    with pytest.raises(PolicyExpired):
+        PolicyComposer().compose(org, user)
@@ -0,0 +1,94 @@
+# tests/test_daemon.py - the long-running enforcement daemon
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from src.daemon import EnforcementDaemon, WorkerPool, enforce_via_http, enforce_via_socket, handle_message
+from src.enforcer import PolicyEnforcer
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.routing import PoolBusy
+
+
+def raw_message(body="<p>confidential</p>", policy_xml=None):
+    if policy_xml is None:
+        policy = PrivacyPolicy(creator="legal@example.com")
+        policy.add_rule(Rule("confidential", Condition(xpath=".//p[contains(., 'confidential')]"),
+                             Action("block", "confidential")))
+        policy_xml = policy.to_string()
+    return MIMEPrivacyHandler.create_email_with_policy(
+        "legal@example.com", "bob@example.com", "Report", body, policy_xml).as_bytes()
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    result = EnforcementDaemon(socket_path=str(tmp_path / "enforcer.sock"), http_address=("127.0.0.1", 0),
+                               workers=2)
+    result.start()
+    yield result
+    result.stop()
+
+
+def test_http_and_socket_return_the_same_verdict(daemon):
+    url = "http://%s:%d" % daemon.http_address
+    over_http = enforce_via_http(url, raw_message())
+    over_socket = enforce_via_socket(daemon.socket_path, raw_message())
+    for verdict in (over_http, over_socket):
+        assert verdict['success'] and verdict['policy_found'] and verdict['policy_valid']
+        assert [b['rule'] for b in verdict['enforcement_results']['blocks']] == ['confidential']
+
+    with urllib.request.urlopen(url + "/health", timeout=10) as response:
+        assert json.loads(response.read())['status'] == 'ok'
+    with urllib.request.urlopen(url + "/metrics", timeout=10) as response:
+        metrics = json.loads(response.read())
+    assert metrics['requests'] == 2 and metrics['policies_found'] == 2
+    assert metrics['tracker_domains'] > 0
+
+
+def test_message_without_policy(daemon):
+    raw = b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Hi\r\n\r\nHello\r\n"
+    verdict = enforce_via_socket(daemon.socket_path, raw)
+    assert verdict['success'] and not verdict['policy_found']
+    assert verdict['enforcement_results'] is None
+
+
+
+
+def test_handle_message_prints_nothing(capsys):
+    enforcer = PolicyEnforcer()
+    plain = b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Hi\r\n\r\nHello\r\n"
+    for raw in (raw_message(), plain):
+        handle_message(raw, enforcer, lambda policy_xml: ())
+    assert capsys.readouterr().out == ""
+def test_invalid_policy_is_only_enforced_unless_required(tmp_path):
+    invalid = raw_message(policy_xml='<PrivacyPolicy xmlns="urn:email:privacy:1.0" version="1.0"/>')
+    for require_valid, enforced in ((False, True), (True, False)):
+        daemon = EnforcementDaemon(http_address=None, workers=1, require_valid_policy=require_valid)
+        try:
+            status, verdict = daemon.enforce(invalid)
+        finally:
+            daemon.stop()
+        assert status == 200 and verdict['policy_valid'] is False and verdict['validation_errors']
+        assert (verdict['enforcement_results'] is not None) == enforced
+
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+    pool = WorkerPool(lambda payload: release.wait(10), workers=1, max_queue=1)
+    try:
+        running = pool.submit("running")
+        # The worker may not have taken the first item yet
+        futures = [running]
+        with pytest.raises(PoolBusy):
+            for _ in range(3):
+                futures.append(pool.submit("queued"))
+    finally:
+        release.set()
+        pool.shutdown()
+    assert all(future.result(timeout=10) for future in futures)
@@ -0,0 +1,83 @@
+# tests/test_directory.py - default policies by sender address and domain
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import datetime
+import json
+
+from src.directory import PolicyDirectory
+from src.email_client import PrivacyAwareEmailClient
+from src.expiry import ExpiryScheduler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+
+def policy(rule_id, action="warn", expires=None):
+    result = PrivacyPolicy(creator=f"{rule_id}@example.com", expires=expires)
+    result.add_rule(Rule(rule_id, Condition(xpath=".//p[contains(., 'confidential')]"), Action(action, rule_id)))
+    return result.to_string()
+
+
+def write_index(tmp_path, entries):
+    for name in entries.values():
+        (tmp_path / name).write_text(policy(name.split(".")[0]), encoding="utf-8")
+    index = tmp_path / "index.json"
+    index.write_text(json.dumps({"entries": entries}), encoding="utf-8")
+    return str(index)
+
+
+def rule_of(match):
+    return match.bundle["rules"][0]["id"] if match else None
+
+
+def test_most_specific_entry_wins(tmp_path):
+    directory = PolicyDirectory(write_index(tmp_path, {
+        "ceo@company.com": "ceo.xml",
+        "*.hr.company.com": "hr.xml",
+        "company.com": "default.xml",
+    }), expiry=ExpiryScheduler())
+    assert len(directory) == 3
+    assert rule_of(directory.lookup("CEO@Company.com")) == "ceo"
+    assert rule_of(directory.lookup("Alice <alice@eu.hr.company.com>")) == "hr"
+    assert rule_of(directory.lookup("bob@hr.company.com")) == "hr"
+    assert rule_of(directory.lookup("carol@sales.company.com")) == "default"
+    assert directory.lookup("dave@notcompany.com") is None
+    assert directory.lookup("not-an-address") is None
+
+
+def test_reload_swaps_entries_and_keeps_old_ones_on_error(tmp_path):
+    index = write_index(tmp_path, {"company.com": "default.xml"})
+    directory = PolicyDirectory(index, expiry=ExpiryScheduler())
+    assert not directory.reload()
+
+    write_index(tmp_path, {"company.com": "other.xml"})
+    os.utime(index, ns=(0, os.stat(index).st_mtime_ns + 10**9))
+    assert directory.reload()
+    assert rule_of(directory.lookup("alice@company.com")) == "other"
+
+    (tmp_path / "index.json").write_text("{not json", encoding="utf-8")
+    os.utime(index, ns=(0, os.stat(index).st_mtime_ns + 10**9))
+    assert not directory.reload()
+    assert rule_of(directory.lookup("alice@company.com")) == "other"
+
+
+def test_expired_policy_stops_applying():
+    scheduler = ExpiryScheduler(clock=lambda: 0.0)
+    expires = datetime.datetime.now() + datetime.timedelta(hours=1)
+    directory = PolicyDirectory(expiry=scheduler)
+    directory.add("company.com", policy_xml=policy("timed", expires=expires))
+    assert rule_of(directory.lookup("alice@company.com")) == "timed"
+    assert directory.stats()['expiring_policies'] == 1
+    scheduler.run_due(now=expires.timestamp() + 1)
+    assert directory.lookup("alice@company.com") is None
+
+
+def test_client_falls_back_to_the_directory_default():
+    directory = PolicyDirectory(expiry=ExpiryScheduler())
+    directory.add("company.com", policy_xml=policy("default", action="block"))
+    client = PrivacyAwareEmailClient(policy_directory=directory)
+    raw = (b"From: alice@company.com\r\nTo: bob@example.com\r\nSubject: Q3\r\n"
+           b"Content-Type: text/html\r\n\r\n<p>confidential</p>\r\n")
+    result = client.receive_email(raw)
+    assert result['policy_source'] == 'directory'
+    assert [b['rule'] for b in result['enforcement_results']['blocks']] == ['default']
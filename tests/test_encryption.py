@@ -0,0 +1,114 @@
+# tests/test_encryption.py - chunked AES-GCM part encryption
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import email
+import io
+import tracemalloc
+from email.message import Message
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from src.encryption import (WRAPPED_KEY_HEADER, DecryptionError, Keyring, PartEncryptor,
+                            decrypt_stream, encrypt_stream, message_recipients)
+
+
+def build_message(**headers):
+    msg = MIMEMultipart()
+    for name, value in headers.items():
+        msg[name] = value
+    msg.attach(MIMEText("the quarterly numbers"))
+    return msg
+
+
+def decrypt(encryptor, msg, recipient):
+    # Through the wire format, as the recipient sees it
+    part = next(p for p in email.message_from_bytes(msg.as_bytes()).walk()
+                if p.get_content_subtype() == 'vnd.privacy-encrypted')
+    out = io.BytesIO()
+    encryptor.decrypt_part(part, recipient, out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("size", [0, 1, 100, 65536, 200000])
+def test_stream_round_trip(size):
+    key = os.urandom(32)
+    data = os.urandom(size)
+    sealed = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), sealed, key, chunk_size=4096)
+    out = io.BytesIO()
+    decrypt_stream(io.BytesIO(sealed.getvalue()), out, key)
+    assert out.getvalue() == data
+
+
+def test_truncation_is_detected():
+    key = os.urandom(32)
+    sealed = io.BytesIO()
+    encrypt_stream(io.BytesIO(os.urandom(10000)), sealed, key, chunk_size=4096)
+    with pytest.raises(DecryptionError):
+        decrypt_stream(io.BytesIO(sealed.getvalue()[:16 + 2 * (4096 + 16)]), io.BytesIO(), key)
+
+
+def test_bcc_addresses_are_not_wrapped_in_visible_headers():
+    msg = build_message(To="bob@example.com", Cc="carol@example.com", Bcc="dave@example.com")
+    assert message_recipients(msg) == ["bob@example.com", "carol@example.com"]
+    encryptor = PartEncryptor(Keyring.generate())
+    encryptor.encrypt_parts(msg, [msg.get_payload()[0]])
+    wrapped = msg.get_payload()[0].get_all(WRAPPED_KEY_HEADER)
+    assert [value.split(";")[0] for value in wrapped] == ["bob@example.com", "carol@example.com"]
+    assert b"dave@example.com" not in msg.get_payload()[0].as_bytes()
+
+
+def test_envelope_copies_give_bcc_recipients_their_own_key():
+    msg = build_message(To="bob@example.com", Bcc="dave@example.com, erin@example.com")
+    encryptor = PartEncryptor(Keyring.generate())
+    encryptor.encrypt_parts(msg, [msg.get_payload()[0]])
+    copies = encryptor.envelope_copies(msg)
+    assert [recipients for recipients, _ in copies] == \
+        [["bob@example.com"], ["dave@example.com"], ["erin@example.com"]]
+    for recipients, copy in copies:
+        raw = copy.as_bytes()
+        assert b"Bcc" not in raw
+        # No copy names a Bcc recipient other than its own
+        assert not any(other.encode() in raw for other in {"dave@example.com", "erin@example.com"} - set(recipients))
+        assert decrypt(encryptor, copy, recipients[0]) == b"the quarterly numbers"
+    with pytest.raises(DecryptionError):
+        decrypt(encryptor, copies[0][1], "dave@example.com")
+
+
+
+
+def test_parts_outside_the_message_are_not_encrypted():
+    msg = build_message(To="bob@example.com")
+    detached = MIMEText("not in the message")
+    encryptor = PartEncryptor(Keyring.generate())
+    calls = []
+    encrypt_part = encryptor.encrypt_part
+    encryptor.encrypt_part = lambda part, recipients: calls.append(part) or encrypt_part(part, recipients)
+    original = msg.get_payload()[0]
+    assert encryptor.encrypt_parts(msg, [detached, original]) == 1
+    assert len(calls) == 1 and calls[0] is original
+def test_encoding_is_spooled(tmp_path):
+    size = 8 * 1024 * 1024
+    path = tmp_path / "payload"
+    path.write_bytes(os.urandom(size))
+    part = Message()
+    part['Content-Type'] = 'application/octet-stream'
+    part.spooled_payload = str(path)
+    encryptor = PartEncryptor(Keyring.generate())
+    tracemalloc.start()
+    try:
+        encrypted = encryptor.encrypt_part(part, ["bob@example.com"])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    encoded = encrypted.get_payload()
+    # Only the payload string itself, about 4/3 of the plaintext
+    assert len(encoded) > size * 4 // 3
+    assert peak < len(encoded) + 2 * 1024 * 1024
+    out = io.BytesIO()
+    encryptor.decrypt_part(encrypted, "bob@example.com", out)
+    assert out.getvalue() == path.read_bytes()
@@ -0,0 +1,74 @@
+# tests/test_enforcer.py - staged policy enforcement
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import email
+
+import pytest
+
+from src.enforcer import PolicyEnforcer
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+
+MESSAGE = """\
+From: alice@example.com
+To: bob@example.com
+Subject: quarterly numbers
+MIME-Version: 1.0
+Content-Type: multipart/alternative; boundary="b"
+
+--b
+Content-Type: text/plain
+
+this is top secret
+--b
+Content-Type: text/html
+
+<html><body><p>this is <b>top secret</b></p><img src="https://tracker.com/p.gif" width="1"></body></html>
+--b--
+"""
+
+# Block rules whose verdict must not depend on how rules are staged
+BLOCK_RULES = [
+    "contains(., 'secret')",
+    "boolean(//text()[contains(., 'secret')])",
+    "string-length(.) > 10",
+    "string-length() > 10",
+    "contains(/email, 'secret')",
+    "//header[@name='Subject' and contains(., 'quarterly')]",
+    "//part[contains(., 'secret')]",
+    ".//p[contains(., 'secret')]",
+    "contains(., 'not in this message')",
+]
+
+
+def build_policy(*xpaths, action="block"):
+    policy = PrivacyPolicy(creator="alice@example.com")
+    for n, xpath in enumerate(xpaths):
+        policy.add_rule(Rule(f"rule-{n}", Condition(xpath=xpath), Action(action, f"rule {n}")))
+    return policy.to_string()
+
+
+@pytest.mark.parametrize("prefilter", [True, False])
+@pytest.mark.parametrize("xpath", BLOCK_RULES)
+def test_staged_verdict_matches_full_tree(xpath, prefilter):
+    policy_xml = build_policy(xpath)
+    enforcer = PolicyEnforcer(prefilter=prefilter)
+    _, rules = enforcer.policy_rules(policy_xml, 'at-use')
+    full_tree = enforcer.match_rules(email.message_from_string(MESSAGE), rules)
+
+    results = enforcer.enforce_policy(email.message_from_string(MESSAGE), policy_xml)
+    assert bool(results['blocks']) == bool(full_tree)
+
+
+def test_context_string_block_rule_fires():
+    results = PolicyEnforcer().enforce_policy(email.message_from_string(MESSAGE),
+                                              build_policy("contains(., 'secret')"))
+    assert [block['rule'] for block in results['blocks']] == ['rule-0']
+
+
+def test_early_exit_skips_later_stages():
+    policy_xml = build_policy("//header[@name='Subject']", ".//p[contains(., 'secret')]")
+    results = PolicyEnforcer().enforce_policy(email.message_from_string(MESSAGE), policy_xml)
+    assert results['terminated_at'] == 'header'
+    assert results['skipped_rules'] == ['rule-1']
@@ -0,0 +1,107 @@
+# tests/test_ingest.py - streaming ingestion and spooled parts
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import email
+import io
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from src.email_client import PrivacyAwareEmailClient
+from src.enforcer import PolicyEnforcer
+from src.ingest import ingest_stream
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.prefilter import LiteralPrefilter, spooled_windows
+
+BODY_SIZE = 1200 * 1024
+
+
+def build_message(body: str, *xpaths, subtype: str = 'plain') -> bytes:
+    policy = PrivacyPolicy(creator="alice@example.com")
+    for n, xpath in enumerate(xpaths):
+        policy.add_rule(Rule(f"rule-{n}", Condition(xpath=xpath), Action("block", f"rule {n}")))
+    msg = MIMEMultipart()
+    msg['From'] = "alice@example.com"
+    msg['To'] = "bob@example.com"
+    msg['Subject'] = "report"
+    msg.attach(MIMEText(body, subtype))
+    # In a header only: the policy part would hold the literals too
+    MIMEPrivacyHandler.attach_policy(msg, policy.to_string(), method="header")
+    return msg.as_bytes()
+
+
+def padding(size: int, tail: str) -> str:
+    line = "lorem ipsum dolor sit amet\n"
+    return line * ((size - len(tail)) // len(line)) + tail
+
+
+def blocked(result) -> list:
+    assert result['success'], result.get('error')
+    return [block['rule'] for block in result['enforcement_results']['blocks']]
+
+
+@pytest.mark.parametrize("xpath", [
+    "contains(., 'confidential')",
+    "//part[contains(content, 'confidential')]",
+])
+def test_literal_past_preview_blocks_like_receive_email(xpath):
+    raw = build_message(padding(BODY_SIZE, "confidential\n"), xpath)
+    client = PrivacyAwareEmailClient()
+    assert blocked(client.receive_email(raw)) == ['rule-0']
+    assert blocked(client.receive_stream(io.BytesIO(raw))) == ['rule-0']
+
+
+def test_literal_absent_from_spooled_part_passes():
+    raw = build_message(padding(BODY_SIZE, "nothing to see\n"), "//part[contains(content, 'confidential')]")
+    results = PrivacyAwareEmailClient().receive_stream(io.BytesIO(raw))['enforcement_results']
+    assert results['blocks'] == []
+
+
+def test_rule_without_literals_fails_closed():
+    # The document string value may join text across parts: no literal
+    # rules the rule out, so it cannot be decided on the preview
+    raw = build_message(padding(BODY_SIZE, "nothing to see\n"), "contains(., 'confidential')")
+    results = PrivacyAwareEmailClient().receive_stream(io.BytesIO(raw))['enforcement_results']
+    assert results['undecided_rules'] == ['rule-0']
+
+
+def test_literal_split_by_markup_in_spooled_html():
+    body = padding(BODY_SIZE, "<p>confi<b>dential</b></p>\n")
+    raw = build_message(body, ".//p[contains(., 'confidential')]", subtype='html')
+    results = PrivacyAwareEmailClient().receive_stream(io.BytesIO(raw))['enforcement_results']
+    assert results['undecided_rules'] == ['rule-0']
+
+
+def test_html_rules_do_not_read_plain_spooled_parts():
+    raw = build_message(padding(BODY_SIZE, "confidential\n"), ".//p[contains(., 'confidential')]")
+    results = PrivacyAwareEmailClient().receive_stream(io.BytesIO(raw))['enforcement_results']
+    assert results['blocks'] == []
+
+
+@pytest.mark.parametrize("window", [3, 7, 64])
+def test_spooled_windows_find_split_literals(tmp_path, window):
+    path = tmp_path / "part"
+    path.write_text("x" * 50 + "<i>Confi</i>dential &amp; t\u00e9l\u00e9phone", encoding="utf-8")
+    prefilter = LiteralPrefilter({'0': (frozenset({'confidential'}),), '1': (frozenset({'& télé'}),),
+                                  '2': (frozenset({'absent'}),)})
+    assert prefilter.present_in(spooled_windows(str(path), html_part=True, window=window)) \
+        >= {'confidential', '& télé'}
+    assert 'absent' not in prefilter.present_in(spooled_windows(str(path), window=window))
+
+
+def test_stream_matches_message_from_bytes():
+    msg = MIMEMultipart()
+    msg['Subject'] = "attachment"
+    msg.attach(MIMEText("hello"))
+    msg.attach(MIMEApplication(os.urandom(4096)))
+    raw = msg.as_bytes()
+    streamed, ingestor = ingest_stream(io.BytesIO(raw), chunk_size=97)
+    try:
+        assert streamed.as_bytes() == email.message_from_bytes(raw).as_bytes()
+    finally:
+        ingestor.cleanup()
@@ -0,0 +1,124 @@
+# tests/test_loadgen.py - open-loop load generation and reports
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+import mailbox
+import time
+from email import message_from_bytes
+
+import pytest
+
+from src.loadgen import (ClientTarget, LatencyHistogram, LoadTargetError, compare_reports,
+                         format_comparison, format_report, generate_corpus, read_corpus,
+                         read_report, run_load, write_report)
+
+
+def test_histogram_percentiles_within_precision():
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000.0)
+    for p, expected in ((50.0, 500), (90.0, 900), (99.0, 990)):
+        assert abs(histogram.percentile(p) - expected) <= expected / 2 ** histogram.sub_bucket_bits
+    assert histogram.percentile(100.0) == 1000.0
+    assert histogram.summary()['min'] == 1.0
+
+    other = LatencyHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    assert other.summary() == histogram.summary()
+    other.merge(histogram)
+    assert other.total == 2000 and other.percentile(50.0) == histogram.percentile(50.0)
+    with pytest.raises(ValueError):
+        other.merge(LatencyHistogram(sub_bucket_bits=4))
+    assert LatencyHistogram().percentile(99.0) == 0.0
+
+
+def shape(corpus):
+    """Sender and policy of each message; boundaries and timestamps differ between runs"""
+    messages = [message_from_bytes(raw) for raw in corpus]
+    return [(msg['From'], msg['X-Privacy-Policy'] is not None) for msg in messages]
+
+
+def test_generated_corpus_is_reproducible():
+    corpus = shape(generate_corpus(count=40, seed=3, html_kb=1))
+    assert corpus == shape(generate_corpus(count=40, seed=3, html_kb=1))
+    assert corpus != shape(generate_corpus(count=40, seed=4, html_kb=1))
+    assert 0 < sum(has_policy for _, has_policy in corpus) < len(corpus)
+
+
+def test_latency_includes_waiting_for_a_sender():
+    def slow(raw_email):
+        time.sleep(0.02)
+
+    report = run_load(slow, [b"x"], rate=500, count=10, concurrency=1)
+    assert report['sent'] == report['completed'] == 10
+    # Arrivals every 2 ms queue behind a 20 ms call: open-loop latency
+    # grows with the backlog while service time stays flat
+    assert report['latency_ms']['max'] > 150
+    assert report['service_ms']['max'] < report['latency_ms']['max'] / 2
+    assert report['peak_outstanding'] > 1
+
+
+def test_errors_and_drops_are_counted():
+    calls = []
+
+    def failing(raw_email):
+        calls.append(raw_email)
+        if len(calls) % 2:
+            raise LoadTargetError("blocked")
+        time.sleep(0.05)
+
+    report = run_load(failing, [b"a", b"b"], rate=1000, count=20, concurrency=2, max_outstanding=2)
+    assert report['dropped'] > 0
+    assert report['sent'] == 20 - report['dropped'] == len(calls)
+    assert report['errors_by_type'] == {'LoadTargetError': report['errors']}
+    assert report['completed'] + report['errors'] == report['sent']
+
+    with pytest.raises(ValueError):
+        run_load(failing, [], rate=10, count=1)
+    with pytest.raises(ValueError):
+        run_load(failing, [b"a"], rate=10)
+
+
+def test_client_target_enforces_the_corpus():
+    target = ClientTarget()
+    report = run_load(target, generate_corpus(count=4, html_kb=1), rate=100, count=8, concurrency=2, warmup=2)
+    assert report['target'] == "client"
+    assert report['completed'] == 8 and report['errors'] == 0
+
+
+def test_reports_round_trip_and_compare(tmp_path):
+    base = run_load(lambda raw: None, [b"x"], rate=200, count=20, label="base")
+    slower = run_load(lambda raw: time.sleep(0.005), [b"x"], rate=200, count=20, label="new")
+    path = str(tmp_path / "base.json")
+    write_report(base, path)
+    assert read_report(path) == base
+
+    rows = {row['metric']: row for row in compare_reports(read_report(path), slower)}
+    assert rows['service_ms.p50']['change'] > 0
+    assert rows['errors']['change'] == 0.0
+    assert "service_ms.p50" in format_comparison(rows.values())
+    assert format_report(base).startswith("target function  rate 200/s")
+
+    base['report_version'] = 0
+    write_report(base, path)
+    with pytest.raises(ValueError, match="unsupported report version"):
+        read_report(path)
+
+
+def test_read_corpus_sources(tmp_path):
+    messages = generate_corpus(count=3, html_kb=1)
+    box = mailbox.mbox(str(tmp_path / "traffic.mbox"))
+    for raw in messages:
+        box.add(raw)
+    box.close()
+    directory = tmp_path / "eml"
+    directory.mkdir()
+    for n, raw in enumerate(messages):
+        (directory / f"{n}.eml").write_bytes(raw)
+    (directory / "notes.txt").write_text("not a message")
+
+    assert len(read_corpus(mbox=str(tmp_path / "traffic.mbox"))) == 3
+    assert read_corpus(directory=str(directory)) == messages
+    assert len(read_corpus(directory=str(directory), generate=2)) == 5
+    assert len(read_corpus(generate=2)) == 2
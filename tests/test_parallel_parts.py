@@ -0,0 +1,93 @@
+# tests/test_parallel_parts.py - building and evaluating parts on the part pool
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import copy
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+from lxml import etree as ET
+
+from src.enforcer import PolicyEnforcer
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.verdict_cache import PartVerdictCache
+
+RULES = [
+    ("trackers", ".//img[contains(@src, 'tracker.com')]", "strip"),
+    ("confidential", ".//p[contains(., 'confidential')]", "warn"),
+    ("raw", ".//raw-content[contains(., 'pixel.gif')]", "warn"),
+    ("many-parts", "//body[count(html-part) > 3]", "warn"),
+]
+
+
+def policy():
+    result = PrivacyPolicy(creator="news@example.com")
+    for rule_id, xpath, action in RULES:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id)))
+    return result.to_string()
+
+
+def digest(parts=12):
+    msg = MIMEMultipart('mixed')
+    msg['From'] = "news@example.com"
+    msg['To'] = "bob@example.com"
+    msg['Subject'] = "Digest"
+    for n in range(parts):
+        body = f"<div><p>Story {n}</p>"
+        if n % 3 == 0:
+            body += '<img src="https://tracker.com/pixel.gif"/>'
+        if n % 4 == 1:
+            body += "<p>confidential</p>"
+        msg.attach(MIMEText(body + "</div>", 'html'))
+    msg.attach(MIMEText("plain text part", 'plain'))
+    return msg
+
+
+def verdict(enforcer):
+    results = enforcer.enforce_policy(digest(), policy())
+    results.pop('processed_email', None)
+    return results
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+@pytest.mark.parametrize("cached", [False, True])
+def test_pool_gives_the_serial_verdict(workers, cached):
+    serial = verdict(PolicyEnforcer(prefilter=False))
+    enforcer = PolicyEnforcer(part_workers=workers, prefilter=False,
+                              verdict_cache=PartVerdictCache() if cached else None)
+    try:
+        assert verdict(enforcer) == serial
+        # Again with the part verdicts cached, when there is a cache
+        assert verdict(enforcer) == serial
+    finally:
+        enforcer.close()
+
+
+def test_xml_is_built_in_mime_order_on_pool_threads(monkeypatch):
+    enforcer = PolicyEnforcer(part_workers=4)
+    threads = set()
+    build = enforcer._build_part_element
+
+    def recording_build(part, *args):
+        threads.add(threading.current_thread().name)
+        return build(part, *args)
+
+    monkeypatch.setattr(enforcer, "_build_part_element", recording_build)
+    try:
+        root, xml_parts = enforcer._build_email_xml(digest())
+    finally:
+        enforcer.close()
+    stories = [p.text for p in root.iter("p") if p.text.startswith("Story")]
+    assert stories == [f"Story {n}" for n in range(12)]
+    assert len(xml_parts) == 13
+    assert all(name.startswith("enforce-part") for name in threads)
+
+
+def test_small_messages_stay_on_the_calling_thread():
+    enforcer = PolicyEnforcer(part_workers=4)
+    msg = MIMEText("<p>confidential</p>", 'html')
+    enforcer.enforce_policy(msg, policy())
+    assert enforcer._part_pool is None
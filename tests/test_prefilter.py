@@ -0,0 +1,124 @@
+# tests/test_prefilter.py - skipping rules a message cannot match
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import copy
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from src.enforcer import PolicyEnforcer
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.prefilter import LiteralPrefilter, message_texts, spooled_windows, xpath_requirement
+
+
+@pytest.mark.parametrize("expr,requirement", [
+    (".//img[contains(@src, 'tracker.com')]", [{'tracker.com'}]),
+    (".//a[contains(@href, 'ads.example') or contains(@href, 'promo.example')]", [{'ads.example', 'promo.example'}]),
+    ("//header[@name='Received']", [{'Received'}]),
+    (".//raw-content[pp:raw-contains('pixel.gif')]", [{'pixel.gif'}]),
+    # Too short to rule anything out
+    (".//p[contains(., 'ab')]", []),
+    # Text spanning parts, computed attributes and negation give no clause
+    ("//body[contains(., 'secret')]", []),
+    ("//img[@tracker='true']", []),
+    ("not(.//p[contains(., 'secret')])", []),
+    ("//p[", []),
+])
+def test_xpath_requirement(expr, requirement):
+    assert [set(clause) for clause in xpath_requirement(expr)] == requirement
+
+
+def test_live_keys():
+    prefilter = LiteralPrefilter({
+        "tracker": (frozenset({"tracker.com"}),),
+        "both": (frozenset({"secret"}), frozenset({"budget", "salary"})),
+        "spaced": (frozenset({"top secret"}),),
+        "always": (),
+    })
+    assert prefilter
+    assert prefilter.live(["nothing to see"]) == {"always"}
+    assert prefilter.live(["A SECRET", "the Salary\nreview", "TOP\n  secret"]) == {"always", "both", "spaced"}
+    assert prefilter.live(["secret only"]) == {"always"}
+    assert prefilter.live(["x"], keys=["tracker"], present={"tracker.com"}) == {"tracker"}
+    assert not LiteralPrefilter({"always": ()})
+
+
+def test_message_texts_hold_decoded_and_unmarked_text():
+    msg = MIMEMultipart()
+    msg['Subject'] = "Report"
+    msg.attach(MIMEText("<p>top secr<b>et</b> &amp; salary</p>", 'html', 'utf-8'))  # base64 on the wire
+    texts = message_texts(msg, lambda part: part.get_payload(decode=True))
+    assert "Subject" in texts and "text/html" in texts
+    assert "top secret & salary" in texts
+    prefilter = LiteralPrefilter({"r": (frozenset({"top secret"}),), "s": (frozenset({"& salary"}),)})
+    assert prefilter.live(texts) == {"r", "s"}
+
+
+def test_spooled_windows_find_literals_across_window_ends(tmp_path):
+    path = tmp_path / "part.html"
+    path.write_bytes(b"x" * 10 + b"pixel.gif <img src='a'/> tracker&amp;com")
+    windows = list(spooled_windows(str(path), html_part=True, window=12))
+    assert len(windows) > 2
+    prefilter = LiteralPrefilter({"pixel": (frozenset({"pixel.gif"}),), "amp": (frozenset({"tracker&com"}),),
+                                  "missing": (frozenset({"absent"}),)})
+    assert prefilter.present_in(spooled_windows(str(path), html_part=True, window=12)) == {"pixel.gif", "tracker&com"}
+
+
+RULES = [
+    ("trackers", ".//img[contains(@src, 'tracker.com')]", "strip"),
+    ("confidential", ".//p[contains(., 'confidential')]", "block"),
+    ("ads", ".//a[contains(@href, 'ads.example')]", "warn"),
+    ("received", "//header[@name='Received']", "warn"),
+]
+
+
+def policy():
+    result = PrivacyPolicy(creator="news@example.com")
+    for rule_id, xpath, action in RULES:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id)))
+    return result.to_string()
+
+
+def corpus():
+    bodies = [
+        "<p>hello</p>",
+        "<p>confi<b>dential</b></p>",
+        '<img src="https://TRACKER.com/o.gif"/><a href="https://ads.example/1">ad</a>',
+        "<p>confidential</p>",
+        "<p>&#99;onfidential</p>",
+    ]
+    messages = []
+    for n, body in enumerate(bodies):
+        msg = MIMEText(body, 'html', 'utf-8' if n % 2 else 'us-ascii')
+        msg['From'] = "news@example.com"
+        msg['To'] = "bob@example.com"
+        msg['Subject'] = f"Message {n}"
+        messages.append(msg)
+    return messages
+
+
+def verdicts(enforcer):
+    results = []
+    for msg in corpus():
+        result = enforcer.enforce_policy(copy.deepcopy(msg), policy())
+        result.pop('processed_email', None)
+        # Rules ruled out by the prefilter are not reported as skipped
+        result.pop('skipped_rules', None)
+        results.append(result)
+    return results
+
+
+def test_prefilter_keeps_verdicts_and_skips_xml():
+    enforcer = PolicyEnforcer()
+    on = verdicts(enforcer)
+    assert on == verdicts(PolicyEnforcer(prefilter=False))
+    assert [[b['rule'] for b in r['blocks']] for r in on] == [[], ['confidential'], [], ['confidential'], ['confidential']]
+    stats = enforcer.prefilter_stats()
+    assert stats['messages'] == 5
+    # Only the first message contains none of the literals
+    assert stats['xml_skipped'] == 1
+    assert stats['rules_skipped'] > 0
+    assert PolicyEnforcer(prefilter=False).prefilter_stats() == {'messages': 0, 'rules_skipped': 0, 'xml_skipped': 0}
@@ -0,0 +1,129 @@
+# tests/test_relay.py - in-transit enforcement in the streaming SMTP relay
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import base64
+import email
+import smtplib
+import threading
+
+import pytest
+
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.relay import SMTPRelay, SMTPSink, _AsyncSMTPServer
+
+
+def policy(*rules, scope="in-transit"):
+    result = PrivacyPolicy(creator="legal@example.com")
+    for rule_id, xpath, action in rules:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id), scope=scope))
+    return result.to_string()
+
+
+def raw_message(policy_xml, extra_headers=(), body="Hello\r\n"):
+    headers = ["From: alice@example.com", "To: bob@example.com", "Subject: Report", *extra_headers]
+    if policy_xml:
+        headers.append("X-Privacy-Policy: " + base64.b64encode(policy_xml.encode("utf-8")).decode("ascii"))
+    return ("\r\n".join(headers) + "\r\n\r\n" + body).encode("utf-8")
+
+
+@pytest.fixture
+def relay():
+    sink = SMTPSink()
+    sink_port = sink.start_background()
+    server = SMTPRelay(next_hop=("127.0.0.1", sink_port), port=0)
+    server.start_background()
+    yield server, sink
+    server.stop_background()
+    sink.stop_background()
+
+
+def send(server, data):
+    with smtplib.SMTP("127.0.0.1", server.port, timeout=10) as smtp:
+        return smtp.sendmail("alice@example.com", ["bob@example.com"], data)
+
+
+def forwarded(sink):
+    assert len(sink.messages) == 1
+    return email.message_from_bytes(sink.messages[0]['data'])
+
+
+def test_handle_data_is_abstract():
+    with pytest.raises(TypeError):
+        _AsyncSMTPServer()
+
+
+def test_block_rule_refuses_the_message(relay):
+    server, sink = relay
+    xml = policy(("no-secret", "//header[@name='X-Secret']", "block"))
+    with pytest.raises(smtplib.SMTPDataError) as error:
+        send(server, raw_message(xml, ["X-Secret: 1"]))
+    assert error.value.smtp_code == 550
+    assert sink.messages == []
+    assert server.stats['blocked'] == 1
+
+
+def test_strip_warn_and_deferred_rules(relay):
+    server, sink = relay
+    xml = policy(
+        ("strip-trace", "//header[@name='X-Internal-Trace']", "strip"),
+        ("warn-subject", "//header[@name='Subject'][contains(., 'Report')]", "warn"),
+        ("body-rule", ".//p[contains(., 'secret')]", "block"),
+    )
+    send(server, raw_message(xml, ["X-Internal-Trace: host-17"], body="Line one\r\n.dotted\r\n"))
+    msg = forwarded(sink)
+    assert msg["X-Internal-Trace"] is None
+    assert msg["X-Privacy-Warning"] == "warn-subject: warn-subject"
+    assert msg["X-Privacy-Deferred"] == "body-rule"
+    assert msg["X-Privacy-Relay"] == "enforced; matched=2; stripped=1"
+    assert msg.get_payload() == "Line one\r\n.dotted\r\n"
+
+
+@pytest.mark.parametrize("scope", [None, "at-use"])
+def test_only_in_transit_rules_are_applied(relay, scope):
+    server, sink = relay
+    xml = policy(("no-secret", "//header[@name='X-Secret']", "block"), scope=scope or "in-transit")
+    if scope is None:
+        xml = xml.replace('<Scope phase="in-transit"/>', '')
+    send(server, raw_message(xml, ["X-Secret: 1"]))
+    assert forwarded(sink)["X-Privacy-Relay"] == "enforced; matched=0; stripped=0"
+
+
+def test_message_without_header_policy_is_forwarded_untouched(relay):
+    server, sink = relay
+    data = raw_message(None, ["X-Secret: 1"])
+    send(server, data)
+    assert sink.messages[0]['data'] == data
+
+
+def test_policy_is_evaluated_off_the_event_loop(relay):
+    server, sink = relay
+    threads = []
+    decide = server.decide
+
+    def recording_decide(header_lines):
+        threads.append(threading.current_thread())
+        return decide(header_lines)
+
+    server.decide = recording_decide
+    send(server, raw_message(policy(("w", "//header[@name='Subject']", "warn"))))
+    assert threads and threads[0] is not server._thread
+    assert forwarded(sink)["X-Privacy-Warning"] == "w: w"
+
+
+@pytest.mark.parametrize("through_relay", [False, True])
+def test_overlong_line_is_refused_and_the_session_continues(relay, through_relay):
+    server, sink = relay
+    target = server if through_relay else sink
+    long_line = raw_message(None, body="x" * 100 * 1024 + "\r\n")
+    with smtplib.SMTP("127.0.0.1", target.port, timeout=10) as smtp:
+        with pytest.raises(smtplib.SMTPDataError) as error:
+            smtp.sendmail("alice@example.com", ["bob@example.com"], long_line)
+        assert error.value.smtp_code == 552
+        code, _ = smtp.docmd("NOOP " + "y" * 100 * 1024)
+        assert code == 500
+        smtp.sendmail("alice@example.com", ["bob@example.com"], raw_message(None))
+    assert forwarded(sink)['Subject'] == "Report"
+    if through_relay:
+        assert server.stats['rejected'] == 1 and server.stats['relayed'] == 1
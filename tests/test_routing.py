@@ -0,0 +1,90 @@
+# tests/test_routing.py - policy-affinity dispatch to worker processes
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import threading
+import time
+
+import pytest
+
+from src.routing import AffinityDispatcher, HashRing, WorkerCrashed
+
+
+def _handle(payload: bytes):
+    key, _, command = payload.partition(b":")
+    if command == b"crash":
+        os._exit(3)
+    if command.startswith(b"sleep"):
+        time.sleep(float(command[5:]))
+    return (os.getpid(), payload)
+
+
+def handler_factory():
+    return _handle
+
+
+def _key(payload: bytes) -> str:
+    return payload.partition(b":")[0].decode()
+
+
+@pytest.fixture
+def dispatcher():
+    pool = AffinityDispatcher(handler_factory, workers=2, key=_key, start_method="spawn")
+    yield pool
+    pool.shutdown()
+
+
+def keys_on_different_workers(pool):
+    first = pool._ring.node_for("a")
+    other = next(f"k{n}" for n in range(1000) if pool._ring.node_for(f"k{n}") != first)
+    return "a", other
+
+
+def test_same_policy_goes_to_the_same_worker(dispatcher):
+    pids = {dispatcher.submit(f"p1:{n}".encode()).result(30)[0] for n in range(10)}
+    assert len(pids) == 1
+
+
+def test_crash_is_reaped_under_steady_traffic(dispatcher):
+    crash_key, busy_key = keys_on_different_workers(dispatcher)
+    # Warm both workers up, so the traffic below answers steadily
+    dispatcher.submit(f"{crash_key}:0".encode()).result(30)
+    dispatcher.submit(f"{busy_key}:0".encode()).result(30)
+
+    stop = threading.Event()
+
+    def traffic():
+        while not stop.is_set():
+            dispatcher.submit(f"{busy_key}:sleep0.02".encode()).result(30)
+
+    thread = threading.Thread(target=traffic)
+    thread.start()
+    try:
+        crashed = dispatcher.submit(f"{crash_key}:crash".encode())
+        with pytest.raises(WorkerCrashed):
+            crashed.result(5)
+    finally:
+        stop.set()
+        thread.join()
+    assert dispatcher.stats()['crashed'] == 1
+    # Replaced: the crashed policy is served again
+    assert dispatcher.submit(f"{crash_key}:1".encode()).result(30)[1] == f"{crash_key}:1".encode()
+
+
+def test_removed_worker_is_not_counted_as_crashed(dispatcher):
+    dispatcher.remove_worker()
+    assert dispatcher.submit(b"p1:0").result(30)[1] == b"p1:0"
+    time.sleep(1.5)
+    stats = dispatcher.stats()
+    assert stats['crashed'] == 0
+    assert len(stats['workers']) == 1
+    assert not dispatcher._retired
+
+
+def test_hash_ring_moves_few_keys():
+    ring = HashRing(range(4))
+    before = {f"policy-{n}": ring.node_for(f"policy-{n}") for n in range(1000)}
+    ring.add(4)
+    moved = sum(1 for key, node in before.items() if ring.node_for(key) != node)
+    assert moved < 400
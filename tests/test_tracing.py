@@ -0,0 +1,82 @@
+# tests/test_tracing.py - sampled per-message tracing
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src import tracing
+from src.email_client import PrivacyAwareEmailClient
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.tracing import Tracer, span
+
+
+def raw_message():
+    policy = PrivacyPolicy(creator="legal@example.com")
+    policy.add_rule(Rule("confidential", Condition(xpath=".//p[contains(., 'confidential')]"),
+                         Action("warn", "confidential")))
+    return MIMEPrivacyHandler.create_email_with_policy(
+        "legal@example.com", "bob@example.com", "Report", "<p>confidential</p>", policy.to_string()).as_bytes()
+
+
+def test_untraced_spans_are_no_ops():
+    assert span("anything", n=1) is tracing.NULL_SPAN
+    tracer = Tracer()
+    with tracer.trace("message") as trace:
+        assert trace is None
+        assert span("inner") is tracing.NULL_SPAN
+    assert tracer.traces() == []
+
+
+def test_spans_nest_and_cross_threads_when_bound():
+    tracer = Tracer()
+    with tracer.trace("message", force=True, id="m1") as trace:
+        with span("outer") as outer:
+            outer.set(result=3)
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="worker") as pool:
+                pool.submit(tracing.bind(lambda: span("on-worker").__enter__().__exit__(None, None, None))).result()
+                pool.submit(lambda: span("lost").__enter__()).result()
+        with pytest.raises(ValueError):
+            with span("failing"):
+                raise ValueError("boom")
+        # Nested trace() calls join the trace in progress
+        with tracer.trace("nested", force=True) as nested:
+            assert nested is trace
+
+    names = [event["name"] for event in trace.events]
+    assert names == ["on-worker", "outer", "failing", "message"]
+    events = {event["name"]: event for event in trace.events}
+    assert events["outer"]["args"] == {"result": 3}
+    assert events["failing"]["args"] == {"error": "ValueError"}
+    assert events["on-worker"]["tid"] != events["outer"]["tid"]
+    assert set(trace.threads.values()) >= {"MainThread"} and len(trace.threads) == 2
+    assert tracer.traces() == [trace]
+
+
+def test_min_duration_drops_fast_traces():
+    kept = []
+    tracer = Tracer(min_duration_ms=60_000, on_trace=kept.append)
+    with tracer.trace("fast", force=True):
+        pass
+    assert tracer.traces() == [] and kept == []
+
+
+def test_client_trace_exports_chrome_events(tmp_path):
+    tracer = Tracer(sample_rate=1.0)
+    client = PrivacyAwareEmailClient(tracer=tracer)
+    client.receive_email(raw_message())
+    (trace,) = tracer.traces()
+    names = {event["name"] for event in trace.events}
+    assert {"receive_email", "parse", "extract_policy", "load_policy", "stage:content", "rule"} <= names
+
+    path = tmp_path / "trace.json"
+    tracer.export(str(path))
+    data = json.loads(path.read_text())
+    complete = [e for e in data["traceEvents"] if e["ph"] == "X"]
+    assert len(complete) == len(trace.events)
+    assert all(e["pid"] == 1 and e["dur"] >= 0 for e in complete)
+    assert any(e["ph"] == "M" and e["name"] == "process_name" for e in data["traceEvents"])
@@ -0,0 +1,98 @@
+# tests/test_trackers.py - URL extraction and tracker classification
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+
+import pytest
+
+from src.enforcer import PolicyEnforcer
+from src.generator import PolicyGenerator
+from src.mime_handler import MIMEPrivacyHandler
+from src.trackers import DomainSuffixTrie, TrackerClassifier, extract_urls, normalize_host
+
+
+def test_suffix_trie_matches_subdomains_only_on_label_boundaries():
+    trie = DomainSuffixTrie()
+    assert trie.add("tracker.com")
+    assert not trie.add("TRACKER.com.")
+    trie.add("mail.example.org")
+    assert len(trie) == 2
+    assert trie.longest_match("pixel.eu.tracker.com") == ("tracker.com", True)
+    assert "nottracker.com" not in trie
+    assert "example.org" not in trie
+    assert trie.remove("tracker.com") and not trie.remove("tracker.com")
+    assert "pixel.tracker.com" not in trie
+
+
+@pytest.mark.parametrize("url,host", [
+    ("https://Pixel.Tracker.COM./a.gif", "pixel.tracker.com"),
+    ("//cdn.example.com/x", "cdn.example.com"),
+    ("https://bücher.example/p", "xn--bcher-kva.example"),
+    ("mailto:bob@example.com", None),
+    ("/relative/path", None),
+])
+def test_normalize_host(url, host):
+    assert normalize_host(url) == host
+
+
+def test_extract_urls_from_attributes_srcset_and_css():
+    html = """
+        <img src="https://t.example/p.gif" width="1" height="1px">
+        <img srcset="https://a.example/1x.png 1x, https://b.example/2x.png 2x" style="display:none">
+        <a href='https://shop.example/buy' title="x > y">Buy</a>
+        <div style="background: url('https://bg.example/b.png')"></div>
+        <style>@import "https://css.example/s.css"; p { background: url(https://css.example/p.png) }</style>
+    """
+    refs = {ref.url: ref for ref in extract_urls(html)}
+    assert set(refs) == {
+        "https://t.example/p.gif", "https://a.example/1x.png", "https://b.example/2x.png",
+        "https://shop.example/buy", "https://bg.example/b.png",
+        "https://css.example/s.css", "https://css.example/p.png",
+    }
+    assert refs["https://t.example/p.gif"].pixel and not refs["https://t.example/p.gif"].hidden
+    assert refs["https://a.example/1x.png"].hidden
+    assert refs["https://shop.example/buy"].tag == "a"
+    assert refs["https://bg.example/b.png"].attr == "style"
+
+
+@pytest.mark.parametrize("html", [
+    "<a" * 8000, "<a '" * 8000, '<a x="' * 8000, "url(" * 8000, '<p style="' + "url(" * 8000 + '">',
+])
+def test_extract_urls_is_linear_on_unclosed_markup(html):
+    start = time.perf_counter()
+    refs = extract_urls(html + '<img src="https://t.example/p.gif">')
+    # Rescanning to the end for each unclosed "<" took seconds here
+    assert time.perf_counter() - start < 0.5
+    assert refs[-1].url == "https://t.example/p.gif"
+
+
+def test_blocklist_formats_and_fingerprint(tmp_path):
+    path = tmp_path / "blocklist.txt"
+    path.write_text("# comment\n! adblock comment\n0.0.0.0 ads.example\n||beacon.example^\nplain.example\n"
+                    "not-a-domain\nexample.com/path\n")
+    classifier = TrackerClassifier.from_file(str(path))
+    assert len(classifier.trie) == 3
+    assert classifier.is_tracker_host("x.beacon.example")
+    assert not classifier.is_tracker_host("example.com")
+
+    reordered = TrackerClassifier(domains=["plain.example", "beacon.example", "ads.example"])
+    assert reordered.fingerprint == classifier.fingerprint
+    reordered.add_domains(["new.example"])
+    assert reordered.fingerprint != classifier.fingerprint
+    assert reordered.is_tracker_host("a.new.example")
+
+
+def test_blocklist_policy_acts_on_classified_urls():
+    body = ('<p>Hi</p><img src="https://pixel.tracker.com/o.gif"/>'
+            '<img src="https://cdn.example.com/spacer.gif" width="1" height="1"/>'
+            '<a href="https://www.doubleclick.net/click">offer</a>')
+    policy_xml = PolicyGenerator.tracker_blocklist_policy("privacy@example.com").to_string()
+    msg = MIMEPrivacyHandler.create_email_with_policy(
+        "news@example.com", "bob@example.com", "News", body, policy_xml)
+
+    results = PolicyEnforcer().enforce_policy(msg, policy_xml)
+    actions = set(results['actions_taken'])
+    assert {"strip:strip-tracker-urls-1", "strip:strip-pixels-2"} <= actions
+    assert any(w['rule'] == "warn-tracker-links-3" for w in results['warnings'] if isinstance(w, dict))
@@ -0,0 +1,94 @@
+# tests/test_verdict_cache.py - per-part verdicts cached by content hash
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from src.enforcer import PolicyEnforcer
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.trackers import TrackerClassifier
+from src.verdict_cache import PartVerdictCache
+
+
+def test_lru_bounds_and_stats():
+    cache = PartVerdictCache(max_entries=2)
+    cache.put("p", "a", {"0": ["<img/>"]})
+    cache.put("p", "b", {})
+    assert cache.get("p", "a") == {"0": ["<img/>"]}
+    cache.put("p", "c", {})
+    # b was the least recently used
+    assert cache.get("p", "b") is None
+    assert len(cache) == 2
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    small = PartVerdictCache(max_bytes=200)
+    small.put("p", "big", {"0": ["x" * 500]})
+    assert small.get("p", "big") is None
+
+
+def test_sqlite_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "verdicts.db")
+    cache = PartVerdictCache(db_path=path)
+    cache.put("p", "a", {"1": ["<p>secret</p>"]})
+    cache.close()
+
+    reopened = PartVerdictCache(db_path=path)
+    assert reopened.get("p", "a") == {"1": ["<p>secret</p>"]}
+    assert reopened.stats()['disk_hits'] == 1
+    reopened.clear()
+    assert reopened.get("p", "a") is None
+    reopened.close()
+
+
+def policy():
+    result = PrivacyPolicy(creator="news@example.com")
+    for rule_id, xpath, action in [
+        ("trackers", ".//url[@tracker='true']", "warn"),
+        ("confidential", ".//p[contains(., 'confidential')]", "block"),
+        ("received", "//header[@name='Received']", "warn"),
+        ("many-parts", "//body[count(html-part) > 2]", "warn"),
+    ]:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id)))
+    return result.to_string()
+
+
+def newsletter(subject):
+    msg = MIMEMultipart('mixed')
+    msg['From'] = "news@example.com"
+    msg['To'] = "bob@example.com"
+    msg['Subject'] = subject
+    msg.attach(MIMEText('<p>Weekly news <img src="https://ads.example.org/o.gif"/></p>', 'html'))
+    msg.attach(MIMEText("<p>confidential</p>", 'html'))
+    msg.attach(MIMEText("<p>footer</p>", 'html'))
+    return msg
+
+
+# One policy text: its Created timestamp is part of the digest
+POLICY = policy()
+
+
+def verdict(enforcer, subject="Weekly"):
+    results = enforcer.enforce_policy(newsletter(subject), POLICY)
+    results.pop('processed_email', None)
+    return results
+
+
+def test_cached_parts_give_the_uncached_verdict():
+    reference = verdict(PolicyEnforcer())
+    cache = PartVerdictCache()
+    enforcer = PolicyEnforcer(verdict_cache=cache)
+    assert verdict(enforcer) == reference
+    assert cache.stats()['misses'] == 3
+    # Same parts under another subject: every part comes from the cache
+    assert verdict(enforcer, "Another week") == verdict(PolicyEnforcer(), "Another week")
+    assert cache.stats()['hits'] == 3
+
+
+def test_blocklist_changes_invalidate_cached_verdicts():
+    classifier = TrackerClassifier(domains=["tracker.com"])
+    enforcer = PolicyEnforcer(classifier=classifier, verdict_cache=PartVerdictCache())
+    assert 'trackers' not in [w['rule'] for w in verdict(enforcer)['warnings'] if isinstance(w, dict)]
+    classifier.add_domains(["ads.example.org"])
+    assert 'trackers' in [w['rule'] for w in verdict(enforcer)['warnings'] if isinstance(w, dict)]
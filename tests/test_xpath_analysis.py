@@ -0,0 +1,53 @@
+# tests/test_xpath_analysis.py - rule locality and stage classification
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+from src.xpath_analysis import rule_locality, rule_stage
+
+# Expressions that read the document string value, i.e. the whole message
+MESSAGE_READS = [
+    "contains(., 'secret')",
+    "boolean(//text()[contains(.,'secret')])",
+    "string-length(.) > 10",
+    "string-length() > 10",
+    "normalize-space() = 'x'",
+    "contains(/email, 'x')",
+    "//email[contains(., 'x')]",
+    "//node()[. = 'x']",
+    "self::node()[contains(., 'x')]",
+]
+
+HEADER_READS = [
+    "//header[@name='Received']",
+    "count(//header) > 50",
+    "//header[@name='From' and contains(., 'spam')]",
+    "//header/text()[contains(., 'x')]",
+    "//headers[contains(., 'x')]",
+    "//header[string-length() > 100]",
+    "/email/headers/header[. = 'x']",
+]
+
+
+@pytest.mark.parametrize("expr", MESSAGE_READS)
+def test_context_string_reads_are_content(expr):
+    assert rule_locality(expr) == "message"
+    assert rule_stage(expr) == "content"
+
+
+@pytest.mark.parametrize("expr", HEADER_READS)
+def test_header_reads_stay_header(expr):
+    assert rule_locality(expr) == "header"
+    assert rule_stage(expr) == "header"
+
+
+def test_part_rules():
+    assert rule_locality("//part[contains(content-type, 'pdf')]") == "part"
+    assert rule_locality(".//img[contains(@src, 'tracker.com')]") == "part"
+    assert rule_locality("//body[count(html-part) > 3]") == "message"
+    assert rule_locality("(//img)[1]") == "message"
+    assert rule_stage("//part[contains(content-type, 'pdf')]") == "structure"
+    assert rule_stage("//part[contains(., 'x')]") == "content"
+    assert rule_stage(".//img[@width='1']") == "content"
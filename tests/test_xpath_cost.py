@@ -0,0 +1,108 @@
+# tests/test_xpath_cost.py - XPath cost estimates, rewrites and the cost ceiling
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+from src.compiler import PolicyCostError, compile_policy
+from src.enforcer import PolicyEnforcer
+from src.mime_handler import MIMEPrivacyHandler
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.xpath_analysis import cost_degree, estimate_cost, optimize_xpath
+
+
+@pytest.mark.parametrize("expr,cost_class", [
+    ("/email/headers/header", "bounded"),
+    ("//header[@name='From']", "linear"),
+    (".//img[contains(@src, 'tracker.com')]", "linear"),
+    (".//div[.//span]", "quadratic"),
+    ("//a[following::a]", "quadratic"),
+    ("//*[contains(., 'x')]", "quadratic"),
+    ("//*[.//*[.//*]]", "cubic"),
+])
+def test_estimate_cost(expr, cost_class):
+    assert estimate_cost(expr).cost_class == cost_class
+
+
+def test_unknown_cost_class():
+    with pytest.raises(ValueError, match="Unknown cost class"):
+        cost_degree("exponential")
+    with pytest.raises(ValueError):
+        PolicyEnforcer(max_rule_cost="exponential")
+
+
+def test_rewrites_anchor_and_hoist():
+    assert optimize_xpath("//url[@tracker='true']") == (
+        "/email/body/html-part/urls/url[@tracker='true']", ["anchored //url to /email/body/html-part/urls/url"])
+    # HTML has body and header elements of its own
+    assert optimize_xpath("//header[@name='From']") == ("//header[@name='From']", [])
+    assert optimize_xpath("//body[p]")[1] == []
+    rewritten, applied = optimize_xpath("//p[contains(., 'secret')]//b")
+    assert rewritten.startswith("/self::node()[contains(.,'secret')]")
+    assert applied == ["hoisted 'secret' into a document-level check"]
+    # Nothing is hoisted past or, not() or a union
+    assert optimize_xpath("//p[contains(., 'a') or .//b]")[1] == []
+
+
+def message(body):
+    policy = PrivacyPolicy(creator="x@example.com")
+    return MIMEPrivacyHandler.create_email_with_policy(
+        "x@example.com", "bob@example.com", "Report", body, policy.to_string())
+
+
+@pytest.mark.parametrize("expr", [
+    "//header[@name='Subject']",
+    "//p[contains(., 'secret')]//b",
+    "//*[contains(., 'secret')]",
+    ".//div[.//span[contains(., 'secret')]]",
+    "//url | //header[@name='To']",
+    "//raw-content[contains(., 'secret')]",
+    "//body[p]",
+])
+@pytest.mark.parametrize("body", [
+    "<div><p>a secret <b>bold</b></p><span>secret</span><header>look-alike</header></div>",
+    "<div><p>nothing <b>here</b></p></div>",
+    "<html><body><p>a secret</p></body></html>",
+])
+def test_rewrites_select_the_same_nodes(expr, body):
+    root, _ = PolicyEnforcer()._build_email_xml(message(body))
+    rewritten, _ = optimize_xpath(expr)
+    assert root.xpath(rewritten) == root.xpath(expr)
+
+
+@pytest.mark.parametrize("expr", ["//body[p]", "//header[p]", "//body[contains(., 'secret')]", "//url"])
+def test_optimized_rules_give_the_unoptimized_verdict(expr):
+    policy = PrivacyPolicy(creator="x@example.com")
+    policy.add_rule(Rule("r", Condition(xpath=expr), Action("block", "r")))
+    policy_xml = policy.to_string()
+    for body in ("<html><body><p>a secret</p></body></html>", "<header><p>look-alike</p></header>",
+                 "<div>nothing</div>"):
+        verdicts = []
+        for optimize in (False, True):
+            result = PolicyEnforcer(optimize=optimize).enforce_policy(message(body), policy_xml)
+            verdicts.append([b['rule'] for b in result['blocks']])
+        assert verdicts[0] == verdicts[1], body
+
+
+def cost_policy():
+    policy = PrivacyPolicy(creator="x@example.com")
+    policy.add_rule(Rule("cheap", Condition(xpath=".//p[contains(., 'secret')]"), Action("warn", "cheap")))
+    policy.add_rule(Rule("nested", Condition(xpath="//*[.//*[.//*]]"), Action("block", "nested")))
+    return policy.to_string()
+
+
+def test_ceiling_skips_or_rejects_expensive_rules():
+    msg = message("<div><p>secret</p></div>")
+    skipped = PolicyEnforcer(max_rule_cost="quadratic").enforce_policy(msg, cost_policy())
+    assert [w['rule'] for w in skipped['warnings']] == ['nested', 'cheap']
+    assert skipped['blocks'] == []
+
+    rejected = PolicyEnforcer(max_rule_cost="quadratic", cost_action='reject').enforce_policy(msg, cost_policy())
+    assert rejected['warnings'] == ["Policy rejected: XPath cost ceiling exceeded"]
+    assert "nested" in rejected['cost_errors'][0]
+
+    with pytest.raises(PolicyCostError) as error:
+        compile_policy(cost_policy(), max_cost="quadratic")
+    assert len(error.value.errors) == 1
+    assert compile_policy(cost_policy(), max_cost="cubic")["rules"]
@@ -0,0 +1,62 @@
+# tests/test_xpath_functions.py - pp: extension functions
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+
+import pytest
+from lxml import etree as ET
+
+from src.xpath_functions import (MessageSources, check_pattern, compile_xpath, pattern_errors,
+                                 rewrite_raw_content, sources)
+
+# Catastrophic for a backtracking engine on a long run of 'a' with no match
+REDOS_PATTERNS = [r"(\w+\s?)+$", r"(a|a)*$", r"((a+))+$", r"(.*a){20}$", r"(a+)+b"]
+
+
+def evaluate(expr, *texts):
+    tree = ET.fromstring("<email><headers/><body>" + "<part/>" * len(texts) + "</body></email>")
+    parts = list(texts)
+    with sources(MessageSources(None, parts, lambda text: text.encode('utf-8'))):
+        return compile_xpath(expr)(tree)
+
+
+@pytest.mark.parametrize("pattern", REDOS_PATTERNS)
+def test_backtracking_patterns_run_in_linear_time(pattern):
+    assert check_pattern(pattern) is None
+    start = time.perf_counter()
+    evaluate(f"pp:raw-matches('{pattern}')", "a" * 50000 + "!")
+    assert time.perf_counter() - start < 1.0
+
+
+def test_raw_matches_flags():
+    assert evaluate("pp:raw-matches('TRACKER\\.com', 'i')", "see tracker.com/p.gif")
+    assert not evaluate("pp:raw-matches('TRACKER\\.com')", "see tracker.com/p.gif")
+    assert evaluate("pp:raw-matches('^b$', 'm')", "a\nb\nc")
+    assert evaluate("pp:raw-matches('a.b', 's')", "a\nb")
+    assert evaluate("pp:raw-matches('tracker \\. com  # host', 'x')", "tracker.com")
+
+
+@pytest.mark.parametrize("pattern, problem", [
+    (r"(a)\1", "invalid pattern"),
+    (r"(?<=a)b", "invalid pattern"),
+    ("a" * 300, "pattern longer than"),
+])
+def test_refused_patterns(pattern, problem):
+    assert check_pattern(pattern).startswith(problem)
+    assert pattern_errors(f"pp:raw-matches('{pattern}')")
+
+
+def test_unknown_flags():
+    assert "unknown flags" in check_pattern("a", "q")
+
+
+def test_raw_contains_reads_all_parts_from_the_root():
+    assert evaluate("pp:raw-contains('pixel')", "first", "a pixel")
+    assert not evaluate("pp:raw-contains('pixel')", "first", "second")
+
+
+def test_rewrite_raw_content():
+    assert rewrite_raw_content(".//raw-content[contains(., 'pixel.gif')]") == \
+        ".//html-part[pp:raw-contains('pixel.gif')]"
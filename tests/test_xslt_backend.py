@@ -0,0 +1,108 @@
+# tests/test_xslt_backend.py - single-pass XSLT evaluation of a policy's rules
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from src import xslt_backend
+from src.enforcer import PolicyEnforcer
+from src.policy import Action, Condition, PrivacyPolicy, Rule
+from src.xslt_backend import compile_plan, eligible
+
+RULES = [
+    ("pixel", ".//img[@width = '1' and @height = '1']", "strip"),
+    ("trackers", "//img[contains(@src, 'tracker.com')]", "strip"),
+    ("ads", ".//a[contains(@href, 'ads.example')]", "warn"),
+    ("confidential", ".//p[contains(., 'confidential')]", "block"),
+    ("banner", ".//div[@class = 'banner']", "strip"),
+    ("scripts", "//script", "strip"),
+    ("forms", ".//form[@action]", "warn"),
+    ("any-banner", "//*[@class = 'banner']", "warn"),
+    ("subject", "/email/headers/header[@name='Subject'][contains(., 'Weekly')]", "warn"),
+    ("raw", ".//raw-content[pp:raw-contains('pixel.gif')]", "warn"),
+    ("second-link", "(//a)[2]", "warn"),
+    ("french", ".//p[@xml:lang = 'fr']", "warn"),
+]
+
+
+def policy(rules=RULES):
+    result = PrivacyPolicy(creator="news@example.com")
+    for rule_id, xpath, action in rules:
+        result.add_rule(Rule(rule_id, Condition(xpath=xpath), Action(action, rule_id)))
+    return result.to_string()
+
+
+def newsletter():
+    msg = MIMEMultipart('mixed')
+    msg['From'] = "news@example.com"
+    msg['To'] = "bob@example.com"
+    msg['Subject'] = "Weekly newsletter"
+    msg.attach(MIMEText(
+        '<div class="banner"><a href="https://ads.example/1">ad</a><a href="https://news.example.com">news</a></div>'
+        '<img src="https://tracker.com/pixel.gif" width="1" height="1"/><script>track()</script>', 'html'))
+    msg.attach(MIMEText('<p xml:lang="fr">confidential</p><form action="/subscribe"/>', 'html'))
+    msg.attach(MIMEText("plain text part", 'plain'))
+    return msg
+
+
+def verdict(enforcer, policy_xml):
+    results = enforcer.enforce_policy(newsletter(), policy_xml)
+    results.pop('processed_email', None)
+    return results
+
+
+def test_eligible_expressions():
+    assert eligible(".//img[contains(@src, 'tracker.com')]")
+    assert eligible(".//raw-content[pp:raw-contains('x')]")
+    assert not eligible(".//p[@xml:lang = 'fr']")
+    assert not eligible("//p[$secret]")
+    assert not eligible("//p[lower-case(.) = 'x']")
+
+
+def test_plan_walks_elements_and_falls_back():
+    _, rules = PolicyEnforcer()._load_policy(policy())
+    plan = compile_plan(rules)
+    assert [r['id'] for r in plan.fallback] == ['french']
+    assert len(plan.rules) == len(RULES) - 1
+    # //name[...] and .//name[...] rules are tests in per-element templates;
+    # the optimizer has already rewritten confidential and raw into other forms
+    assert plan.walked == 7
+    assert compile_plan([r for r in rules if r['id'] == 'french']).stylesheet is None
+
+
+@pytest.mark.parametrize("backend", ["xslt", "auto"])
+def test_backends_give_the_xpath_verdict(backend):
+    policy_xml = policy()
+    reference = verdict(PolicyEnforcer(backend='xpath'), policy_xml)
+    assert [b['rule'] for b in reference['blocks']] == ['confidential']
+    assert {w['rule'] for w in reference['warnings']} >= {'ads', 'forms', 'subject', 'raw', 'second-link', 'french'}
+    assert verdict(PolicyEnforcer(backend=backend), policy_xml) == reference
+
+
+def test_auto_uses_xslt_from_min_rules(monkeypatch):
+    calls = []
+    compile_ = xslt_backend.compile_plan
+    monkeypatch.setattr(xslt_backend, "compile_plan", lambda *args: calls.append(args) or compile_(*args))
+    enforcer = PolicyEnforcer(backend='auto')
+    enforcer.enforce_policy(newsletter(), policy(RULES[:xslt_backend.MIN_RULES - 1]))
+    assert calls == []
+    enforcer.enforce_policy(newsletter(), policy(RULES[:xslt_backend.MIN_RULES]))
+    assert calls
+
+
+def test_set_backend_per_policy():
+    enforcer = PolicyEnforcer(backend='xpath')
+    policy_xml = policy()
+    reference = verdict(enforcer, policy_xml)
+    enforcer.set_backend(policy_xml, 'xslt')
+    assert verdict(enforcer, policy_xml) == reference
+    assert enforcer._plans
+    enforcer.set_backend(policy_xml, None)
+    with pytest.raises(ValueError):
+        enforcer.set_backend(policy_xml, 'xquery')
+    with pytest.raises(ValueError):
+        PolicyEnforcer(backend='xquery')
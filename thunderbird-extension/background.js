@@ -127,17 +127,109 @@ function getCurrentSettings() {
     return {...DEFAULT_SETTINGS};
 }
 
+// ==================== COMPILED POLICY BUNDLES ====================
+
+// Compiled bundles (X-Privacy-Policy-Bundle) keyed by the bundle itself, so
+// a policy shared by many messages is decoded once. Not by the digest
+// header: the sender supplies it, and could pair a cached digest with
+// another bundle or policy.
+const BUNDLE_FORMAT = "pp-bundle";
+const BUNDLE_VERSION = 1;
+const MAX_CACHED_BUNDLES = 64;
+const bundleCache = new Map();
+
+// The JSON compiler._digest hashes: sorted keys, no whitespace
+function canonicalJSON(value) {
+    if (Array.isArray(value)) {
+        return "[" + value.map(canonicalJSON).join(",") + "]";
+    }
+    if (value !== null && typeof value === "object") {
+        return "{" + Object.keys(value).sort()
+            .map(key => JSON.stringify(key) + ":" + canonicalJSON(value[key]))
+            .join(",") + "}";
+    }
+    return JSON.stringify(value);
+}
+
+async function computeBundleDigest(bundle) {
+    const body = {...bundle};
+    delete body.digest;
+    const hash = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(canonicalJSON(body)));
+    return "sha256:" + Array.from(new Uint8Array(hash), b => b.toString(16).padStart(2, "0")).join("");
+}
+
+async function loadPolicyBundle(bundleData, bundleDigest) {
+    if (!bundleData) return null;
+    if (bundleCache.has(bundleData)) {
+        const cached = bundleCache.get(bundleData);
+        if (bundleDigest && bundleDigest !== cached.digest) {
+            console.log("Policy bundle digest mismatch, falling back to XML");
+            return null;
+        }
+        // Refresh recency
+        bundleCache.delete(bundleData);
+        bundleCache.set(bundleData, cached);
+        return cached;
+    }
+    
+    try {
+        const bytes = Uint8Array.from(atob(bundleData), c => c.charCodeAt(0));
+        const bundle = JSON.parse(new TextDecoder().decode(bytes));
+        if (bundle.format !== BUNDLE_FORMAT || bundle.v !== BUNDLE_VERSION) {
+            console.log("Unsupported policy bundle, falling back to XML");
+            return null;
+        }
+        // Recomputed, never taken from the bundle or the header
+        const digest = await computeBundleDigest(bundle);
+        if (bundle.digest !== digest || (bundleDigest && bundleDigest !== digest)) {
+            console.log("Policy bundle digest mismatch, falling back to XML");
+            return null;
+        }
+        
+        // Rules arrive sorted by priority with conditions already normalized
+        const policy = {
+            creator: bundle.policy.creator || 'unknown',
+            digest: bundle.digest,
+            rules: bundle.rules.map(rule => ({
+                id: rule.id,
+                description: rule.description || 'No description',
+                priority: rule.priority,
+                scope: rule.scope,
+                condition: rule.cond,
+                literals: rule.literals,
+                action: {
+                    type: rule.action.type,
+                    message: rule.action.message || 'Action applied'
+                }
+            }))
+        };
+        
+        bundleCache.set(bundleData, policy);
+        if (bundleCache.size > MAX_CACHED_BUNDLES) {
+            bundleCache.delete(bundleCache.keys().next().value);
+        }
+        return policy;
+    } catch (error) {
+        console.error("Policy bundle error:", error);
+        return null;
+    }
+}
+
 // // This is the core algorithm that processes privacy policies
-async function processPrivacyPolicy(message, policyData) {
+async function processPrivacyPolicy(message, policyData, bundleData, bundleDigest) {
     const actionsTaken = [];
     
     try {
-        // Decode base64 policy
-        const decodedPolicy = atob(policyData);
-        console.log("Processing privacy policy:", decodedPolicy.substring(0, 200) + "...");
-        
-        // Parse XML policy (simplified - in real implementation you'd use DOMParser)
-        const policy = parsePolicyXML(decodedPolicy);
+        // Prefer the compiled bundle; only parse XML when there is none
+        let policy = await loadPolicyBundle(bundleData, bundleDigest);
+        if (!policy) {
+            // Decode base64 policy
+            const decodedPolicy = atob(policyData);
+            console.log("Processing privacy policy:", decodedPolicy.substring(0, 200) + "...");
+            
+            // Parse XML policy (simplified - in real implementation you'd use DOMParser)
+            policy = parsePolicyXML(decodedPolicy);
+        }
         
         // Apply policy rules
         if (policy && policy.rules) {
@@ -270,6 +362,15 @@ const TEST_EMAILS = [
         from: "hr@company.com",
         hasPolicy: true,
         policy: "PFByaXZhY3lQb2xpY3k+PG1ldGFkYXRhPjxjcmVhdG9yPmhyQGNvbXBhbnkuY29tPC9jcmVhdG9yPjwvbWV0YWRhdGE+PHJ1bGVzPjxydWxlIGlkPSJuby1mb3J3YXJkIj48ZGVzY3JpcHRpb24+V2FybiBhYm91dCBmb3J3YXJkaW5nPC9kZXNjcmlwdGlvbj48YWN0aW9uIHR5cGU9Indhcm4iIG1lc3NhZ2U9IkRvIG5vdCBmb3J3YXJkIHRoaXMgZW1haWwiLz48L3J1bGU+PC9ydWxlcz48L1ByaXZhY3lQb2xpY3k+"
+    },
+    {
+        subject: "Quarterly Update",
+        from: "legal@company.com",
+        hasPolicy: true,
+        policy: "PFByaXZhY3lQb2xpY3kgeG1sbnM9InVybjplbWFpbDpwcml2YWN5OjEuMCIgdmVyc2lvbj0iMS4wIj4KICA8TWV0YWRhdGE+CiAgICA8Q3JlYXRvcj5sZWdhbEBjb21wYW55LmNvbTwvQ3JlYXRvcj4KICAgIDxDcmVhdGVkPjIwMjYtMTAtMTlUMDQ6MzU6NTYuMTE5MDU2PC9DcmVhdGVkPgogIDwvTWV0YWRhdGE+CiAgPFJ1bGVzPgogICAgPFJ1bGUgaWQ9Im5vLXRyYWNrZXJzIiBwcmlvcml0eT0iMSI+CiAgICAgIDxDb25kaXRpb24+CiAgICAgICAgPFhQYXRoPi4vL2ltZ1tjb250YWlucyhAc3JjLCAndHJhY2tlci5jb20nKV08L1hQYXRoPgogICAgICA8L0NvbmRpdGlvbj4KICAgICAgPEFjdGlvbiB0eXBlPSJzdHJpcCIgbWVzc2FnZT0iVHJhY2tpbmcgcGl4ZWxzIHJlbW92ZWQiLz4KICAgICAgPFNjb3BlIHBoYXNlPSJhdC11c2UiLz4KICAgIDwvUnVsZT4KICA8L1J1bGVzPgo8L1ByaXZhY3lQb2xpY3k+Cg==",
+        // Compiled by compiler.compile_policy, as attach_policy(bundle=True) sends it
+        bundle: "eyJmb3JtYXQiOiJwcC1idW5kbGUiLCJ2IjoxLCJwb2xpY3kiOnsidmVyc2lvbiI6IjEuMCIsImNyZWF0b3IiOiJsZWdhbEBjb21wYW55LmNvbSIsImNyZWF0ZWQiOiIyMDI2LTEwLTE5VDA0OjM1OjU2LjExOTA1NiIsImV4cGlyZXMiOm51bGx9LCJydWxlcyI6W3siaWQiOiJuby10cmFja2VycyIsInByaW9yaXR5IjoxLCJzY29wZSI6ImF0LXVzZSIsImxvY2FsaXR5IjoicGFydCIsImRlc2NyaXB0aW9uIjpudWxsLCJhY3Rpb24iOnsidHlwZSI6InN0cmlwIiwibWVzc2FnZSI6IlRyYWNraW5nIHBpeGVscyByZW1vdmVkIn0sImNvbmQiOnsieHBhdGgiOiIuLy9pbWdbY29udGFpbnMoQHNyYywndHJhY2tlci5jb20nKV0ifSwibGl0ZXJhbHMiOlsidHJhY2tlci5jb20iXX1dLCJkaWdlc3QiOiJzaGEyNTY6MWNlNGRlMDk4ODY5MWM0MDc4MzY1NGQzYjFhZWM5YzcxNTIzNWIyNTA0Y2JiODdkMzdiODRjNWQ3YzVjYWNhOCJ9",
+        bundleDigest: "sha256:1ce4de0988691c40783654d3b1aec9c715235b2504cbb87d37b84c5d7c5caca8"
     }
 ];
 
@@ -292,7 +393,9 @@ function simulateEmailDetection() {
                 
                 processPrivacyPolicy(
                     { subject: email.subject, from: email.from },
-                    email.policy
+                    email.policy,
+                    email.bundle,
+                    email.bundleDigest
                 );
             }
         }, index * 2000);